@@ -10,9 +10,20 @@ from cactus.setup.cactus_setupTest import TestCase as setupTest
 from cactus.blast.blastTest import TestCase as blastTest
 from cactus.blast.cactus_coverageTest import TestCase as coverageTest
 from cactus.blast.trimSequencesTest import TestCase as trimSequencesTest
+from cactus.blast.binaryAlignmentsTest import TestCase as binaryAlignmentsTest
+from cactus.blast.cigarIndexTest import TestCase as cigarIndexTest
+from cactus.blast.cigarBatchTest import TestCase as cigarBatchTest
 from cactus.blast.mappingQualityRescoringAndFilteringTest import TestCase as mappingQualityTest
 from cactus.pipeline.cactus_workflowTest import TestCase as workflowTest
 from cactus.pipeline.cactus_evolverTest import TestCase as evolverTest
+from cactus.pipeline.ktserverClientTest import TestCase as ktserverClientTest
+from cactus.pipeline.ktserverSizingTest import TestCase as ktserverSizingTest
+from cactus.pipeline.ktserverSnapshotTest import TestCase as ktserverSnapshotTest
+from cactus.pipeline.ktserverHandoffTest import TestCase as ktserverHandoffTest
+from cactus.pipeline.ktserverDeltaTest import TestCase as ktserverDeltaTest
+from cactus.pipeline.ktserverShardsTest import TestCase as ktserverShardsTest
+from cactus.pipeline.ktserverBenchmarkTest import TestCase as ktserverBenchmarkTest
+from cactus.pipeline.lmdbSnapshotTest import TestCase as lmdbSnapshotTest
 from cactus.bar.cactus_barTest import TestCase as barTest
 from cactus.phylogeny.cactus_phylogenyTest import TestCase as phylogenyTest
 from cactus.faces.cactus_fillAdjacenciesTest import TestCase as adjacenciesTest
@@ -24,6 +35,13 @@ from cactus.normalisation.cactus_normalisationTest import TestCase as normalisat
 from cactus.progressive.allTests import allSuites as progressiveSuite
 from cactus.shared.commonTest import TestCase as commonTest
 from cactus.shared.experimentWrapperTest import TestCase as experimentWrapperTest
+from cactus.shared.twoBitTest import TestCase as twoBitTest
+from cactus.shared.fastaIOTest import TestCase as fastaIOTest
+from cactus.shared.metricsTest import TestCase as metricsTest
+from cactus.shared.resourceModelTest import TestCase as resourceModelTest
+from cactus.shared.fileConcatTest import TestCase as fileConcatTest
+from cactus.shared.fileStoreIOTest import TestCase as fileStoreIOTest
+from cactus.shared.nodeCacheTest import TestCase as nodeCacheTest
 from cactus.faces.cactus_fillAdjacenciesTest import TestCase as fillAdjacenciesTest
 from cactus.preprocessor.allTests import allSuites as preprocessorTest
 from cactus.preprocessor.lastzRepeatMasking.cactus_lastzRepeatMaskTest import TestCase as lastzRepeatMaskTest
@@ -47,9 +65,19 @@ def getSuite():
                      halTest,
                      coverageTest,
                      trimSequencesTest,
+                     binaryAlignmentsTest,
+                     cigarIndexTest,
+                     cigarBatchTest,
                      experimentWrapperTest,
                      fillAdjacenciesTest,
-                     commonTest]] + [progressiveSuite()]
+                     commonTest,
+                     twoBitTest,
+                     fastaIOTest,
+                     metricsTest, resourceModelTest, fileConcatTest,
+                     fileStoreIOTest, nodeCacheTest, ktserverClientTest,
+                     ktserverSizingTest, ktserverSnapshotTest,
+                     ktserverHandoffTest, ktserverDeltaTest, ktserverShardsTest,
+                     ktserverBenchmarkTest, lmdbSnapshotTest]] + [progressiveSuite()]
 
     combinedTests = unittest.TestSuite()
     # CI needs to be able to subset tests because they can take over
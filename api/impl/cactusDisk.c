@@ -16,6 +16,199 @@
 #define CACTUS_DISK_BUCKET_NUMBER 65536
 #define CACTUS_DISK_PARAMETER_KEY -100000
 #define CACTUS_DISK_SEQUENCE_CHUNK_SIZE 500
+#define CACTUS_DISK_SHARDS_TAG "<st_kv_database_shards"
+#define CACTUS_DISK_CONF_START "<st_kv_database_conf"
+#define CACTUS_DISK_CONF_END "</st_kv_database_conf>"
+
+/*
+ * Functions for sharding the records across several databases.
+ */
+
+static int64_t getShardIndex(CactusDisk *cactusDisk, Name key) {
+    int64_t shardNumber = stList_length(cactusDisk->shards);
+    if (shardNumber == 1 || key <= 0) {
+        //The parameters and unique ID buckets, which have negative keys, and the top flower.
+        return 0;
+    }
+    if (cactusDisk->shardByRange) {
+        //Names are handed out in blocks from ranges of the keys, so records made together mostly share a shard.
+        int64_t shard = (key - 1) / (INT64_MAX / shardNumber);
+        return shard < shardNumber ? shard : shardNumber - 1;
+    }
+    //The MurmurHash3 finaliser, so that the records of a flower are spread across the shards.
+    uint64_t hash = (uint64_t) key;
+    hash ^= hash >> 33;
+    hash *= 0xff51afd7ed558ccdULL;
+    hash ^= hash >> 33;
+    hash *= 0xc4ceb9fe1a85ec53ULL;
+    hash ^= hash >> 33;
+    return hash % shardNumber;
+}
+
+static stKVDatabase *getShard(CactusDisk *cactusDisk, Name key) {
+    return stList_get(cactusDisk->shards, getShardIndex(cactusDisk, key));
+}
+
+/*
+ * Functions on the records, which are kept in an embedded database or in the shards.
+ */
+
+static stList *constructShardRequests(CactusDisk *cactusDisk) {
+    stList *shardRequests = stList_construct3(0, (void (*)(void *)) stList_destruct);
+    if (cactusDisk->lmdb != NULL) {
+        stList_append(shardRequests, stList_construct3(0, (void (*)(void *)) cactusLmdbRequest_destruct));
+        return shardRequests;
+    }
+    for (int64_t i = 0; i < stList_length(cactusDisk->shards); i++) {
+        stList_append(shardRequests, stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct));
+    }
+    return shardRequests;
+}
+
+static void addShardRequest(CactusDisk *cactusDisk, stList *shardRequests, Name key, void *value, int64_t size,
+        bool update) {
+    if (cactusDisk->lmdb != NULL) {
+        stList_append(stList_get(shardRequests, 0), cactusLmdbRequest_construct(key, value, size, update));
+    } else {
+        stList_append(stList_get(shardRequests, getShardIndex(cactusDisk, key)),
+                      update ? stKVDatabaseBulkRequest_constructUpdateRequest(key, value, size)
+                             : stKVDatabaseBulkRequest_constructInsertRequest(key, value, size));
+    }
+}
+
+static int64_t shardRequestsLength(stList *shardRequests) {
+    int64_t length = 0;
+    for (int64_t i = 0; i < stList_length(shardRequests); i++) {
+        length += stList_length(stList_get(shardRequests, i));
+    }
+    return length;
+}
+
+static void bulkSetRecords(CactusDisk *cactusDisk, stList *shardRequests) {
+    if (cactusDisk->lmdb != NULL) {
+        cactusLmdb_setRecords(cactusDisk->lmdb, stList_get(shardRequests, 0));
+        return;
+    }
+    for (int64_t i = 0; i < stList_length(shardRequests); i++) {
+        stList *requests = stList_get(shardRequests, i);
+        if (stList_length(requests) > 0) {
+            stKVDatabase_bulkSetRecords(stList_get(cactusDisk->shards, i), requests);
+        }
+    }
+}
+
+static void getShardRecords(stKVDatabase *database, stList *keys, stList *records, int64_t *recordSizes,
+        int64_t *shardIndices, int64_t shardIndex) {
+    /*
+     * Gets the records of the given keys from the database, putting copies of them in the
+     * places of records whose shard index is shardIndex (or every place, if shardIndices is NULL).
+     */
+    stList *results = stKVDatabase_bulkGetRecords(database, keys);
+    assert(stList_length(results) == stList_length(keys));
+    for (int64_t i = 0, j = 0; i < stList_length(records); i++) {
+        if (shardIndices == NULL || shardIndices[i] == shardIndex) {
+            int64_t recordSize;
+            void *record = stKVDatabaseBulkResult_getRecord(stList_get(results, j++), &recordSize);
+            assert(record != NULL);
+            void *recordCopy = st_malloc(recordSize > 0 ? recordSize : 1);
+            memcpy(recordCopy, record, recordSize);
+            stList_set(records, i, recordCopy);
+            recordSizes[i] = recordSize;
+        }
+    }
+    stList_destruct(results);
+}
+
+static stList *bulkGetRecords(CactusDisk *cactusDisk, stList *keys, int64_t *recordSizes) {
+    /*
+     * Gets the records of the given keys, in their order, putting their sizes in recordSizes.
+     */
+    if (cactusDisk->lmdb != NULL) {
+        return cactusLmdb_getRecords(cactusDisk->lmdb, keys, recordSizes);
+    }
+    stList *records = stList_construct3(stList_length(keys), free);
+    int64_t shardNumber = stList_length(cactusDisk->shards);
+    if (shardNumber == 1) {
+        getShardRecords(cactusDisk->database, keys, records, recordSizes, NULL, 0);
+        return records;
+    }
+    /*
+     * Gets the records from each shard, then puts them back in the order of the keys.
+     */
+    int64_t *shardIndices = st_malloc(sizeof(int64_t) * stList_length(keys));
+    stList *shardKeys = stList_construct3(0, (void (*)(void *)) stList_destruct);
+    for (int64_t i = 0; i < shardNumber; i++) {
+        stList_append(shardKeys, stList_construct());
+    }
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t *key = stList_get(keys, i);
+        shardIndices[i] = getShardIndex(cactusDisk, *key);
+        stList_append(stList_get(shardKeys, shardIndices[i]), key);
+    }
+    for (int64_t i = 0; i < shardNumber; i++) {
+        if (stList_length(stList_get(shardKeys, i)) > 0) {
+            getShardRecords(stList_get(cactusDisk->shards, i), stList_get(shardKeys, i), records, recordSizes,
+                            shardIndices, i);
+        }
+    }
+    stList_destruct(shardKeys);
+    free(shardIndices);
+    return records;
+}
+
+static void bulkRemoveRecords(CactusDisk *cactusDisk, stList *keys) {
+    if (cactusDisk->lmdb != NULL) {
+        cactusLmdb_removeRecords(cactusDisk->lmdb, keys);
+        return;
+    }
+    stList *shardKeys = stList_construct3(0, (void (*)(void *)) stList_destruct);
+    for (int64_t i = 0; i < stList_length(cactusDisk->shards); i++) {
+        stList_append(shardKeys, stList_construct());
+    }
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        stIntTuple *key = stList_get(keys, i);
+        stList_append(stList_get(shardKeys, getShardIndex(cactusDisk, stIntTuple_get(key, 0))), key);
+    }
+    for (int64_t i = 0; i < stList_length(shardKeys); i++) {
+        if (stList_length(stList_get(shardKeys, i)) > 0) {
+            stKVDatabase_bulkRemoveRecords(stList_get(cactusDisk->shards, i), stList_get(shardKeys, i));
+        }
+    }
+    stList_destruct(shardKeys);
+}
+
+static void *getDatabaseRecord(CactusDisk *cactusDisk, Name key, int64_t *recordSize) {
+    if (cactusDisk->lmdb != NULL) {
+        return cactusLmdb_getRecord(cactusDisk->lmdb, key, recordSize);
+    }
+    return stKVDatabase_getRecord2(getShard(cactusDisk, key), key, recordSize);
+}
+
+static bool databaseContainsRecord(CactusDisk *cactusDisk, Name key) {
+    if (cactusDisk->lmdb != NULL) {
+        return cactusLmdb_containsRecord(cactusDisk->lmdb, key);
+    }
+    return stKVDatabase_containsRecord(getShard(cactusDisk, key), key);
+}
+
+/*
+ * The unique ID buckets are always kept by the first shard.
+ */
+
+static void databaseInsertInt64(CactusDisk *cactusDisk, Name key, int64_t value) {
+    if (cactusDisk->lmdb != NULL) {
+        cactusLmdb_insertInt64(cactusDisk->lmdb, key, value);
+    } else {
+        stKVDatabase_insertInt64(cactusDisk->database, key, value);
+    }
+}
+
+static int64_t databaseIncrementInt64(CactusDisk *cactusDisk, Name key, int64_t increment) {
+    if (cactusDisk->lmdb != NULL) {
+        return cactusLmdb_incrementInt64(cactusDisk->lmdb, key, increment);
+    }
+    return stKVDatabase_incrementInt64(cactusDisk->database, key, increment);
+}
 
 /*
  * Functions on meta sequences.
@@ -42,18 +235,18 @@ Name cactusDisk_addString(CactusDisk *cactusDisk, const char *string) {
     int64_t stringSize = strlen(string);
     int64_t intervalSize = ceil((double) stringSize / CACTUS_DISK_SEQUENCE_CHUNK_SIZE);
     Name name = cactusDisk_getUniqueIDInterval(cactusDisk, intervalSize);
-    stList *insertRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    stList *insertRequests = constructShardRequests(cactusDisk);
     for (int64_t i = 0; i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize; i++) {
         int64_t j =
             (i + 1) * CACTUS_DISK_SEQUENCE_CHUNK_SIZE < stringSize ?
             CACTUS_DISK_SEQUENCE_CHUNK_SIZE : stringSize - i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE;
         char *subString = stString_getSubString(string, i * CACTUS_DISK_SEQUENCE_CHUNK_SIZE, j);
-        stList_append(insertRequests, stKVDatabaseBulkRequest_constructInsertRequest(name + i, subString, j + 1));
+        addShardRequest(cactusDisk, insertRequests, name + i, subString, j + 1, false);
         free(subString);
     }
     stTry
     {
-        stKVDatabase_bulkSetRecords(cactusDisk->database, insertRequests);
+        bulkSetRecords(cactusDisk, insertRequests);
     }
     stCatch(except)
     {
@@ -161,9 +354,10 @@ static void cacheSubstringsFromDB(CactusDisk *cactusDisk, stList *substrings) {
         return;
     }
     stList *records = NULL;
+    int64_t *recordSizes = st_malloc(sizeof(int64_t) * stList_length(getRequests));
     stTry
     {
-        records = stKVDatabase_bulkGetRecords(cactusDisk->database, getRequests);
+        records = bulkGetRecords(cactusDisk, getRequests, recordSizes);
     }
     stCatch(except)
     {
@@ -174,17 +368,15 @@ static void cacheSubstringsFromDB(CactusDisk *cactusDisk, stList *substrings) {
     assert(records != NULL);
     assert(stList_length(records) == stList_length(getRequests));
     stList_destruct(getRequests);
-    stListIterator *recordsIt = stList_getIterator(records);
+    int64_t recordIndex = 0;
     for (int64_t i = 0; i < stList_length(substrings); i++) {
         Substring *substring = stList_get(substrings, i);
         int64_t intervalSize = (substring->length + substring->start - 1) / CACTUS_DISK_SEQUENCE_CHUNK_SIZE
             - substring->start / CACTUS_DISK_SEQUENCE_CHUNK_SIZE + 1;
         stList *strings = stList_construct();
         while (intervalSize-- > 0) {
-            int64_t recordSize;
-            stKVDatabaseBulkResult *result = stList_getNext(recordsIt);
-            assert(result != NULL);
-            char *string = stKVDatabaseBulkResult_getRecord(result, &recordSize);
+            int64_t recordSize = recordSizes[recordIndex];
+            char *string = stList_get(records, recordIndex++);
             assert(string != NULL);
             assert(strlen(string) == recordSize - 1);
             stList_append(strings, string);
@@ -198,8 +390,8 @@ static void cacheSubstringsFromDB(CactusDisk *cactusDisk, stList *substrings) {
         free(joinedString);
         stList_destruct(strings);
     }
-    assert(stList_getNext(recordsIt) == NULL);
-    stList_destructIterator(recordsIt);
+    assert(recordIndex == stList_length(records));
+    free(recordSizes);
     stList_destruct(records);
 }
 
@@ -421,9 +613,10 @@ static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *typ
         return stList_construct3(0, NULL);
     }
     stList *records = NULL;
+    int64_t *recordSizes = st_malloc(sizeof(int64_t) * stList_length(objectNames));
     stTry
         {
-            records = stKVDatabase_bulkGetRecords(cactusDisk->database, objectNames);
+            records = bulkGetRecords(cactusDisk, objectNames, recordSizes);
         }
         stCatch(except)
             {
@@ -433,19 +626,17 @@ static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *typ
     ;
     assert(records != NULL);
     assert(stList_length(objectNames) == stList_length(records));
-    stList_setDestructor(records, free);
     for (int64_t i = 0; i < stList_length(objectNames); i++) {
         Name objectName = *((int64_t *) stList_get(objectNames, i));
         int64_t recordSize;
         void *record;
-        stKVDatabaseBulkResult *result = stList_get(records, i);
-        assert(result != NULL);
+        void *compressedRecord = stList_get(records, i);
+        assert(compressedRecord != NULL);
         if (cactusDisk->cache == NULL
             || !stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX)) {
-            record = stKVDatabaseBulkResult_getRecord(result, &recordSize);
+            recordSize = recordSizes[i];
             assert(recordSize >= 0);
-            assert(record != NULL);
-            record = decompress(record, &recordSize);
+            record = decompress(compressedRecord, &recordSize);
             if (cactusDisk->cache != NULL) {
                 stCache_setRecord(cactusDisk->cache, objectName, 0, recordSize, record);
             }
@@ -454,9 +645,10 @@ static stList *getRecords(CactusDisk *cactusDisk, stList *objectNames, char *typ
             assert(recordSize >= 0);
             assert(record != NULL);
         }
-        stKVDatabaseBulkResult_destruct(result);
+        free(compressedRecord);
         stList_set(records, i, record);
     }
+    free(recordSizes);
     return records;
 }
 
@@ -469,7 +661,7 @@ static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type, int6
     } else {
         stTry
             {
-                cA = stKVDatabase_getRecord2(cactusDisk->database, objectName, &recordSize);
+                cA = getDatabaseRecord(cactusDisk, objectName, &recordSize);
             }
             stCatch(except)
                 {
@@ -499,23 +691,31 @@ static void *getRecord(CactusDisk *cactusDisk, Name objectName, char *type, int6
 static bool containsRecord(CactusDisk *cactusDisk, Name objectName) {
     return (cactusDisk->cache != NULL
             && stCache_containsRecord(cactusDisk->cache, objectName, 0, INT64_MAX))
-        || stKVDatabase_containsRecord(cactusDisk->database, objectName);
+        || databaseContainsRecord(cactusDisk, objectName);
 }
 
-static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool create, bool cache) {
+static CactusDisk *cactusDisk_constructPrivate(stList *confs, CactusLmdb *lmdb, bool shardByRange, bool create,
+        bool cache) {
     CactusDisk *cactusDisk = st_calloc(1, sizeof(CactusDisk));
+    stKVDatabaseConf *conf = lmdb == NULL ? stList_get(confs, 0) : NULL;
 
     //construct lists of in memory objects
     cactusDisk->metaSequences = stSortedSet_construct3(cactusDisk_constructMetaSequencesP, NULL);
     cactusDisk->flowers = stSortedSet_construct3(cactusDisk_constructFlowersP, NULL);
     cactusDisk->flowerNamesMarkedForDeletion = stSortedSet_construct3((int (*)(const void *, const void *)) strcmp,
             free);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
 
     cactusDisk->eventTree = NULL;
 
-    //Now open the database
-    cactusDisk->database = stKVDatabase_construct(conf, create);
+    //Now open the database, and any other shards, unless the records are kept in an embedded database
+    cactusDisk->lmdb = lmdb;
+    cactusDisk->shards = stList_construct3(0, (void (*)(void *)) stKVDatabase_destruct);
+    for (int64_t i = 0; i < stList_length(confs); i++) {
+        stList_append(cactusDisk->shards, stKVDatabase_construct(stList_get(confs, i), create));
+    }
+    cactusDisk->database = lmdb == NULL ? stList_get(cactusDisk->shards, 0) : NULL;
+    cactusDisk->shardByRange = shardByRange;
+    cactusDisk->updateRequests = constructShardRequests(cactusDisk);
     if (cache) {
         // 10MB for general DB responses
         cactusDisk->cache = stCache_construct2(10000000);
@@ -547,7 +747,53 @@ static CactusDisk *cactusDisk_constructPrivate(stKVDatabaseConf *conf, bool crea
 }
 
 CactusDisk *cactusDisk_construct(stKVDatabaseConf *conf, bool create, bool cache) {
-    return cactusDisk_constructPrivate(conf, create, cache);
+    stList *confs = stList_construct();
+    stList_append(confs, conf);
+    CactusDisk *cactusDisk = cactusDisk_constructPrivate(confs, NULL, false, create, cache);
+    stList_destruct(confs);
+    return cactusDisk;
+}
+
+CactusDisk *cactusDisk_constructFromString(const char *confString, bool create, bool cache) {
+    stList *confs = stList_construct3(0, (void (*)(void *)) stKVDatabaseConf_destruct);
+    CactusLmdb *lmdb = NULL;
+    bool shardByRange = false;
+    if (strncmp(confString, CACTUS_DISK_SHARDS_TAG, strlen(CACTUS_DISK_SHARDS_TAG)) == 0) {
+        const char *tagEnd = strchr(confString, '>');
+        if (tagEnd == NULL) {
+            stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The sharded database conf string is improperly formatted: %s",
+                    confString);
+        }
+        char *tag = stString_getSubString(confString, 0, tagEnd - confString);
+        shardByRange = strstr(tag, "partition=\"range\"") != NULL;
+        free(tag);
+        const char *start = tagEnd;
+        while ((start = strstr(start, CACTUS_DISK_CONF_START)) != NULL) {
+            const char *end = strstr(start, CACTUS_DISK_CONF_END);
+            if (end == NULL) {
+                stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The sharded database conf string is improperly formatted: %s",
+                        confString);
+            }
+            end += strlen(CACTUS_DISK_CONF_END);
+            char *shardConfString = stString_getSubString(start, 0, end - start);
+            if (cactusLmdb_isConfString(shardConfString)) {
+                stThrowNew(CACTUS_DISK_EXCEPTION_ID, "An embedded LMDB database can't be sharded: %s", confString);
+            }
+            stList_append(confs, stKVDatabaseConf_constructFromString(shardConfString));
+            free(shardConfString);
+            start = end;
+        }
+        if (stList_length(confs) == 0) {
+            stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The sharded database conf string has no shards: %s", confString);
+        }
+    } else if (cactusLmdb_isConfString(confString)) {
+        lmdb = cactusLmdb_construct(confString, create);
+    } else {
+        stList_append(confs, stKVDatabaseConf_constructFromString(confString));
+    }
+    CactusDisk *cactusDisk = cactusDisk_constructPrivate(confs, lmdb, shardByRange, create, cache);
+    stList_destruct(confs);
+    return cactusDisk;
 }
 
 void cactusDisk_destruct(CactusDisk *cactusDisk) {
@@ -566,8 +812,11 @@ void cactusDisk_destruct(CactusDisk *cactusDisk) {
     }
     stSortedSet_destruct(cactusDisk->metaSequences);
 
-    //close DB
-    stKVDatabase_destruct(cactusDisk->database);
+    //close DB, and any other shards
+    stList_destruct(cactusDisk->shards);
+    if (cactusDisk->lmdb != NULL) {
+        cactusLmdb_destruct(cactusDisk->lmdb);
+    }
 
     if (cactusDisk->cache != NULL) {
         stCache_destruct(cactusDisk->cache);
@@ -594,13 +843,13 @@ void cactusDisk_addUpdateRequest(CactusDisk *cactusDisk, Flower *flower) {
         int64_t recordSize2;
         void *vA2 = getRecord(cactusDisk, flower_getName(flower), "flower", &recordSize2);
         if (!stCache_recordsIdentical(vA, recordSize, vA2, recordSize2)) { //Only rewrite if we actually did something
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructUpdateRequest(flower_getName(flower), compressed, compressedSize));
+            addShardRequest(cactusDisk, cactusDisk->updateRequests, flower_getName(flower), compressed,
+                    compressedSize, true);
         }
         free(vA2);
     } else {
-        stList_append(cactusDisk->updateRequests,
-                stKVDatabaseBulkRequest_constructInsertRequest(flower_getName(flower), compressed, compressedSize));
+        addShardRequest(cactusDisk, cactusDisk->updateRequests, flower_getName(flower), compressed,
+                compressedSize, false);
     }
     free(vA);
     free(compressed);
@@ -614,15 +863,8 @@ void cactusDisk_forceParameterUpdate(CactusDisk *cactusDisk, bool keyAlreadyExis
                                                       &recordSize);
     //Compression
     cactusDiskParameters = compress(cactusDiskParameters, &recordSize);
-    if (keyAlreadyExists) {
-        stList_append(cactusDisk->updateRequests,
-                      stKVDatabaseBulkRequest_constructUpdateRequest(CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
-                                                                     recordSize));
-    } else {
-        stList_append(cactusDisk->updateRequests,
-                      stKVDatabaseBulkRequest_constructInsertRequest(CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
-                                                                     recordSize));
-    }
+    addShardRequest(cactusDisk, cactusDisk->updateRequests, CACTUS_DISK_PARAMETER_KEY, cactusDiskParameters,
+                    recordSize, keyAlreadyExists);
     free(cactusDiskParameters);
 }
 
@@ -649,7 +891,7 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     while ((nameString = stSortedSet_getNext(it)) != NULL) {
         Name name = cactusMisc_stringToName(nameString);
         if (containsRecord(cactusDisk, name)) {
-            stList_append(cactusDisk->updateRequests, stKVDatabaseBulkRequest_constructUpdateRequest(name, &name, 0)); //We set it to null in the first atomic operation.
+            addShardRequest(cactusDisk, cactusDisk->updateRequests, name, &name, 0, true); //We set it to null in the first atomic operation.
             stList_append(removeRequests, stIntTuple_construct1(name));
         }
     }
@@ -667,13 +909,8 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
                         &recordSize);
         //Compression
         vA = compress(vA, &recordSize);
-        if (!containsRecord(cactusDisk, metaSequence_getName(metaSequence))) {
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructInsertRequest(metaSequence_getName(metaSequence), vA, recordSize));
-        } else {
-            stList_append(cactusDisk->updateRequests,
-                    stKVDatabaseBulkRequest_constructUpdateRequest(metaSequence_getName(metaSequence), vA, recordSize));
-        }
+        addShardRequest(cactusDisk, cactusDisk->updateRequests, metaSequence_getName(metaSequence), vA, recordSize,
+                containsRecord(cactusDisk, metaSequence_getName(metaSequence)));
         free(vA);
     }
     stSortedSet_destructIterator(it);
@@ -686,13 +923,13 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
 
     st_logDebug("Checked if need to write the initial parameters\n");
 
-    if (stList_length(cactusDisk->updateRequests) > 0) {
-        st_logDebug("Going to write %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
+    int64_t updateNumber = shardRequestsLength(cactusDisk->updateRequests);
+    if (updateNumber > 0) {
+        st_logDebug("Going to write %" PRIi64 " updates\n", updateNumber);
         stTry
             {
-                st_logDebug("Writing %" PRIi64 " updates\n", stList_length(cactusDisk->updateRequests));
-                assert(stList_length(cactusDisk->updateRequests) > 0);
-                stKVDatabase_bulkSetRecords(cactusDisk->database, cactusDisk->updateRequests);
+                st_logDebug("Writing %" PRIi64 " updates\n", updateNumber);
+                bulkSetRecords(cactusDisk, cactusDisk->updateRequests);
             }
             stCatch(except)
                 {
@@ -707,7 +944,7 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     if (stList_length(removeRequests) > 0) {
         stTry
             {
-                stKVDatabase_bulkRemoveRecords(cactusDisk->database, removeRequests);
+                bulkRemoveRecords(cactusDisk, removeRequests);
             }
             stCatch(except)
                 {
@@ -720,7 +957,7 @@ void cactusDisk_write(CactusDisk *cactusDisk) {
     st_logDebug("Now removed flowers we don't need\n");
 
     stList_destruct(cactusDisk->updateRequests);
-    cactusDisk->updateRequests = stList_construct3(0, (void (*)(void *)) stKVDatabaseBulkRequest_destruct);
+    cactusDisk->updateRequests = constructShardRequests(cactusDisk);
     stList_destruct(removeRequests);
 
     st_logDebug("Finished writing to the database\n");
@@ -836,8 +1073,8 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 assert(minimumValue >= 1);
                 assert(maximumValue <= INT64_MAX);
                 assert(minimumValue < maximumValue);
-                if (stKVDatabase_containsRecord(cactusDisk->database, keyName)) {
-                    cactusDisk->maxUniqueNumber = stKVDatabase_incrementInt64(cactusDisk->database, keyName,
+                if (databaseContainsRecord(cactusDisk, keyName)) {
+                    cactusDisk->maxUniqueNumber = databaseIncrementInt64(cactusDisk, keyName,
                             intervalSize);
                     cactusDisk->uniqueNumber = cactusDisk->maxUniqueNumber - intervalSize;
                     if (cactusDisk->uniqueNumber <= 0 || cactusDisk->uniqueNumber < minimumValue
@@ -851,7 +1088,7 @@ void cactusDisk_getBlockOfUniqueIDs(CactusDisk *cactusDisk, int64_t intervalSize
                 } else {
                     stTry
                         {
-                            stKVDatabase_insertInt64(cactusDisk->database, keyName, minimumValue);
+                            databaseInsertInt64(cactusDisk, keyName, minimumValue);
                         }
                         stCatch(except)
                             {
@@ -0,0 +1,325 @@
+/*
+ * Released under the MIT license, see LICENSE.txt
+ */
+
+#include "cactusGlobalsPrivate.h"
+#include <errno.h>
+#ifdef HAVE_LMDB
+#include <lmdb.h>
+#endif
+
+#define CACTUS_LMDB_DEFAULT_MAP_SIZE (INT64_C(1) << 40)
+
+const char *CACTUS_LMDB_TYPE = "lmdb";
+
+/*
+ * Gets the value of an attribute of the conf string, or NULL if it hasn't got it.
+ */
+static char *getConfAttribute(const char *confString, const char *attribute) {
+    char *pattern = stString_print(" %s=\"", attribute);
+    const char *start = strstr(confString, pattern);
+    char *value = NULL;
+    if (start != NULL) {
+        start += strlen(pattern);
+        const char *end = strchr(start, '"');
+        if (end != NULL) {
+            value = stString_getSubString(start, 0, end - start);
+        }
+    }
+    free(pattern);
+    return value;
+}
+
+bool cactusLmdb_isConfString(const char *confString) {
+    char *type = getConfAttribute(confString, "type");
+    bool isLmdb = type != NULL && strcmp(type, CACTUS_LMDB_TYPE) == 0;
+    free(type);
+    return isLmdb;
+}
+
+CactusLmdbRequest *cactusLmdbRequest_construct(int64_t key, const void *value, int64_t size, bool update) {
+    CactusLmdbRequest *request = st_malloc(sizeof(CactusLmdbRequest));
+    request->key = key;
+    request->value = st_malloc(size > 0 ? size : 1);
+    memcpy(request->value, value, size);
+    request->size = size;
+    request->update = update;
+    return request;
+}
+
+void cactusLmdbRequest_destruct(CactusLmdbRequest *request) {
+    free(request->value);
+    free(request);
+}
+
+#ifdef HAVE_LMDB
+
+struct _cactusLmdb {
+    MDB_env *env;
+    MDB_dbi dbi;
+    char *databaseDir;
+};
+
+static void throwLmdbError(int rc, const char *operation, CactusLmdb *database) {
+    stThrowNew(CACTUS_DISK_EXCEPTION_ID, "LMDB failed to %s in %s: %s", operation,
+               database->databaseDir, mdb_strerror(rc));
+}
+
+/*
+ * Frees a partly constructed database, closing its environment if it was
+ * created, then throws the error that stopped its construction.
+ */
+static void throwConstructionError(int rc, const char *operation, CactusLmdb *database) {
+    char message[1024];
+    snprintf(message, sizeof(message), "LMDB failed to %s in %s: %s", operation,
+             database->databaseDir, mdb_strerror(rc));
+    if (database->env != NULL) {
+        mdb_env_close(database->env);
+    }
+    free(database->databaseDir);
+    free(database);
+    stThrowNew(CACTUS_DISK_EXCEPTION_ID, "%s", message);
+}
+
+static MDB_txn *beginTransaction(CactusLmdb *database, bool readOnly) {
+    MDB_txn *txn;
+    int rc = mdb_txn_begin(database->env, NULL, readOnly ? MDB_RDONLY : 0, &txn);
+    if (rc != 0) {
+        throwLmdbError(rc, "begin a transaction", database);
+    }
+    return txn;
+}
+
+static void commitTransaction(CactusLmdb *database, MDB_txn *txn) {
+    int rc = mdb_txn_commit(txn);
+    if (rc != 0) {
+        throwLmdbError(rc, "commit a transaction", database);
+    }
+}
+
+static void setKey(MDB_val *mdbKey, int64_t *key) {
+    mdbKey->mv_size = sizeof(int64_t);
+    mdbKey->mv_data = key;
+}
+
+CactusLmdb *cactusLmdb_construct(const char *confString, bool create) {
+    CactusLmdb *database = st_calloc(1, sizeof(CactusLmdb));
+    database->databaseDir = getConfAttribute(confString, "database_dir");
+    if (database->databaseDir == NULL) {
+        free(database);
+        stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The LMDB conf string has no database_dir: %s", confString);
+    }
+    int64_t mapSize = CACTUS_LMDB_DEFAULT_MAP_SIZE;
+    char *mapSizeString = getConfAttribute(confString, "map_size");
+    if (mapSizeString != NULL) {
+        mapSize = atoll(mapSizeString);
+        free(mapSizeString);
+    }
+    if (create && mkdir(database->databaseDir, 0777) != 0 && errno != EEXIST) {
+        throwConstructionError(errno, "create the directory", database);
+    }
+    int rc;
+    if ((rc = mdb_env_create(&database->env)) != 0) {
+        throwConstructionError(rc, "create the environment", database);
+    }
+    if ((rc = mdb_env_set_mapsize(database->env, mapSize)) != 0
+            //MDB_NOTLS ties read transactions to the transaction rather than the thread.
+            //An environment must not be used after a fork: a forked child has to open
+            //the database again rather than use its parent's.
+            || (rc = mdb_env_open(database->env, database->databaseDir, MDB_NOTLS, 0664)) != 0) {
+        throwConstructionError(rc, "open the environment", database);
+    }
+    //Clear the reader slots of any processes that died while reading.
+    int deadReaders;
+    mdb_reader_check(database->env, &deadReaders);
+    MDB_txn *txn;
+    if ((rc = mdb_txn_begin(database->env, NULL, 0, &txn)) != 0) {
+        throwConstructionError(rc, "begin a transaction", database);
+    }
+    if ((rc = mdb_dbi_open(txn, NULL, MDB_INTEGERKEY, &database->dbi)) != 0) {
+        mdb_txn_abort(txn);
+        throwConstructionError(rc, "open the database", database);
+    }
+    if ((rc = mdb_txn_commit(txn)) != 0) {
+        throwConstructionError(rc, "commit a transaction", database);
+    }
+    return database;
+}
+
+void cactusLmdb_destruct(CactusLmdb *database) {
+    mdb_env_close(database->env);
+    free(database->databaseDir);
+    free(database);
+}
+
+bool cactusLmdb_containsRecord(CactusLmdb *database, int64_t key) {
+    MDB_txn *txn = beginTransaction(database, true);
+    MDB_val mdbKey, mdbValue;
+    setKey(&mdbKey, &key);
+    int rc = mdb_get(txn, database->dbi, &mdbKey, &mdbValue);
+    mdb_txn_abort(txn);
+    if (rc != 0 && rc != MDB_NOTFOUND) {
+        throwLmdbError(rc, "get a record", database);
+    }
+    return rc == 0;
+}
+
+static void *copyValue(MDB_val *mdbValue, int64_t *recordSize) {
+    void *record = st_malloc(mdbValue->mv_size > 0 ? mdbValue->mv_size : 1);
+    memcpy(record, mdbValue->mv_data, mdbValue->mv_size);
+    if (recordSize != NULL) {
+        *recordSize = mdbValue->mv_size;
+    }
+    return record;
+}
+
+void *cactusLmdb_getRecord(CactusLmdb *database, int64_t key, int64_t *recordSize) {
+    MDB_txn *txn = beginTransaction(database, true);
+    MDB_val mdbKey, mdbValue;
+    setKey(&mdbKey, &key);
+    int rc = mdb_get(txn, database->dbi, &mdbKey, &mdbValue);
+    //The value is only valid in the transaction, so is copied before it ends.
+    void *record = rc == 0 ? copyValue(&mdbValue, recordSize) : NULL;
+    mdb_txn_abort(txn);
+    if (rc != 0 && rc != MDB_NOTFOUND) {
+        throwLmdbError(rc, "get a record", database);
+    }
+    return record;
+}
+
+stList *cactusLmdb_getRecords(CactusLmdb *database, stList *keys, int64_t *recordSizes) {
+    stList *records = stList_construct3(0, free);
+    MDB_txn *txn = beginTransaction(database, true);
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t key = *((int64_t *) stList_get(keys, i));
+        MDB_val mdbKey, mdbValue;
+        setKey(&mdbKey, &key);
+        int rc = mdb_get(txn, database->dbi, &mdbKey, &mdbValue);
+        if (rc != 0) {
+            mdb_txn_abort(txn);
+            stList_destruct(records);
+            if (rc == MDB_NOTFOUND) {
+                stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The LMDB database in %s has no record %" PRIi64,
+                           database->databaseDir, key);
+            }
+            throwLmdbError(rc, "get a record", database);
+        }
+        stList_append(records, copyValue(&mdbValue, &recordSizes[i]));
+    }
+    mdb_txn_abort(txn);
+    return records;
+}
+
+void cactusLmdb_setRecords(CactusLmdb *database, stList *requests) {
+    MDB_txn *txn = beginTransaction(database, false);
+    for (int64_t i = 0; i < stList_length(requests); i++) {
+        CactusLmdbRequest *request = stList_get(requests, i);
+        MDB_val mdbKey, mdbValue;
+        setKey(&mdbKey, &request->key);
+        mdbValue.mv_size = request->size;
+        mdbValue.mv_data = request->value;
+        int rc = mdb_put(txn, database->dbi, &mdbKey, &mdbValue, request->update ? 0 : MDB_NOOVERWRITE);
+        if (rc != 0) {
+            mdb_txn_abort(txn);
+            if (rc == MDB_KEYEXIST) {
+                stThrowNew(CACTUS_DISK_EXCEPTION_ID, "Tried to insert record %" PRIi64
+                           " into the LMDB database in %s, but it already exists", request->key,
+                           database->databaseDir);
+            }
+            throwLmdbError(rc, "set a record", database);
+        }
+    }
+    commitTransaction(database, txn);
+}
+
+void cactusLmdb_removeRecords(CactusLmdb *database, stList *keys) {
+    MDB_txn *txn = beginTransaction(database, false);
+    for (int64_t i = 0; i < stList_length(keys); i++) {
+        int64_t key = stIntTuple_get(stList_get(keys, i), 0);
+        MDB_val mdbKey;
+        setKey(&mdbKey, &key);
+        int rc = mdb_del(txn, database->dbi, &mdbKey, NULL);
+        if (rc != 0 && rc != MDB_NOTFOUND) {
+            mdb_txn_abort(txn);
+            throwLmdbError(rc, "remove a record", database);
+        }
+    }
+    commitTransaction(database, txn);
+}
+
+void cactusLmdb_insertInt64(CactusLmdb *database, int64_t key, int64_t value) {
+    CactusLmdbRequest request = { key, &value, sizeof(int64_t), false };
+    stList *requests = stList_construct();
+    stList_append(requests, &request);
+    cactusLmdb_setRecords(database, requests);
+    stList_destruct(requests);
+}
+
+int64_t cactusLmdb_incrementInt64(CactusLmdb *database, int64_t key, int64_t increment) {
+    //Write transactions are serialised across the processes, so nothing changes the record between the get and the put.
+    MDB_txn *txn = beginTransaction(database, false);
+    MDB_val mdbKey, mdbValue;
+    setKey(&mdbKey, &key);
+    int rc = mdb_get(txn, database->dbi, &mdbKey, &mdbValue);
+    if (rc != 0 || mdbValue.mv_size != sizeof(int64_t)) {
+        mdb_txn_abort(txn);
+        if (rc == 0 || rc == MDB_NOTFOUND) {
+            stThrowNew(CACTUS_DISK_EXCEPTION_ID, "The LMDB database in %s has no integer record %" PRIi64,
+                       database->databaseDir, key);
+        }
+        throwLmdbError(rc, "get a record", database);
+    }
+    int64_t value;
+    memcpy(&value, mdbValue.mv_data, sizeof(int64_t));
+    value += increment;
+    mdbValue.mv_size = sizeof(int64_t);
+    mdbValue.mv_data = &value;
+    if ((rc = mdb_put(txn, database->dbi, &mdbKey, &mdbValue, 0)) != 0) {
+        mdb_txn_abort(txn);
+        throwLmdbError(rc, "set a record", database);
+    }
+    commitTransaction(database, txn);
+    return value;
+}
+
+#else
+
+CactusLmdb *cactusLmdb_construct(const char *confString, bool create) {
+    stThrowNew(CACTUS_DISK_EXCEPTION_ID,
+               "Cactus was built without LMDB support, so can't open the database: %s", confString);
+    return NULL;
+}
+
+/*
+ * None of these can be reached, as no database can be constructed.
+ */
+
+void cactusLmdb_destruct(CactusLmdb *database) {
+}
+
+bool cactusLmdb_containsRecord(CactusLmdb *database, int64_t key) {
+    return false;
+}
+
+void *cactusLmdb_getRecord(CactusLmdb *database, int64_t key, int64_t *recordSize) {
+    return NULL;
+}
+
+stList *cactusLmdb_getRecords(CactusLmdb *database, stList *keys, int64_t *recordSizes) {
+    return NULL;
+}
+
+void cactusLmdb_setRecords(CactusLmdb *database, stList *requests) {
+}
+
+void cactusLmdb_removeRecords(CactusLmdb *database, stList *keys) {
+}
+
+void cactusLmdb_insertInt64(CactusLmdb *database, int64_t key, int64_t value) {
+}
+
+int64_t cactusLmdb_incrementInt64(CactusLmdb *database, int64_t key, int64_t increment) {
+    return 0;
+}
+
+#endif
@@ -0,0 +1,98 @@
+/*
+ * Released under the MIT license, see LICENSE.txt
+ */
+
+#ifndef CACTUS_DISK_LMDB_H_
+#define CACTUS_DISK_LMDB_H_
+
+#include "cactusGlobals.h"
+
+/*
+ * An embedded database for the records of a cactus disk, kept in an LMDB
+ * environment in a local directory. It is opened by each process using the
+ * cactus disk, rather than served, and LMDB's locking lets any number of
+ * processes on the machine read and write it at once.
+ *
+ * Cactus must be built with HAVE_LMDB defined and linked with liblmdb for
+ * it to be available, otherwise constructing one throws an exception.
+ */
+
+typedef struct _cactusLmdb CactusLmdb;
+
+/*
+ * A request to set a record, as an insert, which fails if the record
+ * already exists, or an update.
+ */
+typedef struct _cactusLmdbRequest {
+    int64_t key;
+    void *value;
+    int64_t size;
+    bool update;
+} CactusLmdbRequest;
+
+/*
+ * The type attribute of the st_kv_database_conf element of an LMDB
+ * database.
+ */
+extern const char *CACTUS_LMDB_TYPE;
+
+/*
+ * Returns non-zero if the given st_kv_database_conf string is for an
+ * LMDB database.
+ */
+bool cactusLmdb_isConfString(const char *confString);
+
+/*
+ * Opens the database given by an st_kv_database_conf string of the form
+ * <st_kv_database_conf type="lmdb"><lmdb database_dir="..." map_size="..."/></st_kv_database_conf>,
+ * creating its directory if create is non-zero. The map size, which
+ * bounds how large the database can grow, is optional.
+ */
+CactusLmdb *cactusLmdb_construct(const char *confString, bool create);
+
+void cactusLmdb_destruct(CactusLmdb *database);
+
+/*
+ * Constructs a request, copying the value.
+ */
+CactusLmdbRequest *cactusLmdbRequest_construct(int64_t key, const void *value, int64_t size, bool update);
+
+void cactusLmdbRequest_destruct(CactusLmdbRequest *request);
+
+bool cactusLmdb_containsRecord(CactusLmdb *database, int64_t key);
+
+/*
+ * Returns a copy of the record, or NULL if there is none.
+ */
+void *cactusLmdb_getRecord(CactusLmdb *database, int64_t key, int64_t *recordSize);
+
+/*
+ * Returns copies of the records with the given keys (a list of int64_t
+ * pointers), in their order, all read from the same snapshot of the
+ * database. Their sizes are put in recordSizes.
+ */
+stList *cactusLmdb_getRecords(CactusLmdb *database, stList *keys, int64_t *recordSizes);
+
+/*
+ * Carries out the given list of requests in a single transaction, so
+ * either all of them or none are made.
+ */
+void cactusLmdb_setRecords(CactusLmdb *database, stList *requests);
+
+/*
+ * Removes the records with the given keys (a list of stIntTuples) in a
+ * single transaction.
+ */
+void cactusLmdb_removeRecords(CactusLmdb *database, stList *keys);
+
+/*
+ * Inserts an integer record, failing if the record already exists.
+ */
+void cactusLmdb_insertInt64(CactusLmdb *database, int64_t key, int64_t value);
+
+/*
+ * Adds the increment to an integer record, returning its new value.
+ */
+int64_t cactusLmdb_incrementInt64(CactusLmdb *database, int64_t key, int64_t increment);
+
+#endif
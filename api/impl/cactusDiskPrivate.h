@@ -11,10 +11,13 @@
 
 struct _cactusDisk {
     stKVDatabase *database;
+    stList *shards; //The databases the records are sharded across, the first being database.
+    bool shardByRange;
+    CactusLmdb *lmdb; //The embedded database, if the records are kept in one rather than in the shards.
     stSortedSet *metaSequences;
     stSortedSet *flowers;
     stSortedSet *flowerNamesMarkedForDeletion;
-    stList *updateRequests;
+    stList *updateRequests; //A list of bulk requests for each shard.
     stCache *cache;
     stCache *stringCache;
     EventTree *eventTree;
@@ -48,6 +48,7 @@
 #include "cactusMetaSequencePrivate.h"
 #include "cactusFlower.h"
 #include "cactusDisk.h"
+#include "cactusDiskLmdb.h"
 #include "cactusDiskPrivate.h"
 #include "cactusMisc.h"
 #include "cactusFlowerPrivate.h"
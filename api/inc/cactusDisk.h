@@ -30,6 +30,18 @@ extern const char *CACTUS_DISK_EXCEPTION_ID;
  */
 CactusDisk *cactusDisk_construct(stKVDatabaseConf *conf, bool create, bool cache);
 
+/*
+ * As cactusDisk_construct, but from the conf string of the database. This
+ * may be the string of a single database conf, or an st_kv_database_shards
+ * element holding several, across which the records are then sharded: by
+ * a hash of their names, or by ranges of names if its partition attribute
+ * is "range". The disk's parameters and unique ID counters are kept in the
+ * first. It may also be the conf of an embedded LMDB database, of type
+ * "lmdb", which each process opens itself rather than reaching it through
+ * a server (see cactusDiskLmdb.h).
+ */
+CactusDisk *cactusDisk_constructFromString(const char *confString, bool create, bool cache);
+
 /*
  * Destructs the cactus disk and all open flowers and sequences, and
  * then disconnects from the cactus DB.
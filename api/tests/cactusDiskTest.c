@@ -5,6 +5,8 @@
  */
 
 #include "cactusGlobalsPrivate.h"
+#include <unistd.h>
+#include <sys/wait.h>
 
 static CactusDisk *cactusDisk = NULL;
 static stKVDatabaseConf *conf = NULL;
@@ -134,6 +136,124 @@ void testCactusDisk_getUniqueID_UniqueIntervals(CuTest* testCase) {
     cactusDiskTestTeardown();
 }
 
+static void testCactusDisk_sharded(CuTest* testCase, const char *partition) {
+    int64_t i = system("rm -rf temporaryCactusDiskShard0 temporaryCactusDiskShard1 temporaryCactusDiskShard2");
+    exitOnFailure(i, "Tried to delete the temporary KV database shards\n");
+    char *confString = stString_print("<st_kv_database_shards partition=\"%s\">"
+            "<st_kv_database_conf type=\"tokyo_cabinet\"><tokyo_cabinet database_dir=\"temporaryCactusDiskShard0\" /></st_kv_database_conf>"
+            "<st_kv_database_conf type=\"tokyo_cabinet\"><tokyo_cabinet database_dir=\"temporaryCactusDiskShard1\" /></st_kv_database_conf>"
+            "<st_kv_database_conf type=\"tokyo_cabinet\"><tokyo_cabinet database_dir=\"temporaryCactusDiskShard2\" /></st_kv_database_conf>"
+            "</st_kv_database_shards>", partition);
+    CactusDisk *shardedDisk = cactusDisk_constructFromString(confString, true, true);
+    CuAssertIntEquals(testCase, 3, stList_length(shardedDisk->shards));
+    stList *names = stList_construct3(0, free);
+    for (int64_t j = 0; j < 100; j++) {
+        Flower *flower = flower_construct(shardedDisk);
+        int64_t *name = st_malloc(sizeof(int64_t));
+        name[0] = flower_getName(flower);
+        stList_append(names, name);
+    }
+    MetaSequence *metaSequence = metaSequence_construct(1, 10, "ACTGACTGAG", "FOO", 10, shardedDisk);
+    Name metaSequenceName = metaSequence_getName(metaSequence);
+    cactusDisk_write(shardedDisk);
+    cactusDisk_destruct(shardedDisk);
+    //Reopen the shards, and check every record is found in the shard it was written to.
+    shardedDisk = cactusDisk_constructFromString(confString, false, true);
+    stList *flowers = cactusDisk_getFlowers(shardedDisk, names);
+    CuAssertIntEquals(testCase, 100, stList_length(flowers));
+    for (int64_t j = 0; j < stList_length(names); j++) {
+        CuAssertTrue(testCase, flower_getName(stList_get(flowers, j)) == *(int64_t *) stList_get(names, j));
+    }
+    metaSequence = cactusDisk_getMetaSequence(shardedDisk, metaSequenceName);
+    CuAssertTrue(testCase, metaSequence != NULL);
+    char *string = metaSequence_getString(metaSequence, 1, 10, 1);
+    CuAssertStrEquals(testCase, "ACTGACTGAG", string);
+    free(string);
+    stList_destruct(flowers);
+    stList_destruct(names);
+    cactusDisk_destruct(shardedDisk);
+    free(confString);
+    i = system("rm -rf temporaryCactusDiskShard0 temporaryCactusDiskShard1 temporaryCactusDiskShard2");
+    exitOnFailure(i, "Tried to delete the temporary KV database shards\n");
+}
+
+void testCactusDisk_shardedByHash(CuTest* testCase) {
+    testCactusDisk_sharded(testCase, "hash");
+}
+
+void testCactusDisk_shardedByRange(CuTest* testCase) {
+    testCactusDisk_sharded(testCase, "range");
+}
+
+#ifdef HAVE_LMDB
+void testCactusDisk_lmdb(CuTest* testCase) {
+    int64_t i = system("rm -rf temporaryCactusDiskLmdb");
+    exitOnFailure(i, "Tried to delete the temporary LMDB database\n");
+    const char *confString = "<st_kv_database_conf type=\"lmdb\"><lmdb database_dir=\"temporaryCactusDiskLmdb\" "
+            "map_size=\"1073741824\" /></st_kv_database_conf>";
+    CactusDisk *lmdbDisk = cactusDisk_constructFromString(confString, true, true);
+    CuAssertTrue(testCase, lmdbDisk->lmdb != NULL);
+    MetaSequence *metaSequence = metaSequence_construct(1, 10, "ACTGACTGAG", "FOO", 10, lmdbDisk);
+    Name metaSequenceName = metaSequence_getName(metaSequence);
+    cactusDisk_write(lmdbDisk);
+    cactusDisk_destruct(lmdbDisk);
+    //Several processes add flowers to the disk at once, each opening it itself.
+    int pipeFds[2];
+    CuAssertIntEquals(testCase, 0, pipe(pipeFds));
+    for (int64_t j = 0; j < 4; j++) {
+        if (fork() == 0) {
+            CactusDisk *childDisk = cactusDisk_constructFromString(confString, false, true);
+            for (int64_t k = 0; k < 25; k++) {
+                Name name = flower_getName(flower_construct(childDisk));
+                if (write(pipeFds[1], &name, sizeof(Name)) != sizeof(Name)) {
+                    _exit(1);
+                }
+            }
+            cactusDisk_write(childDisk);
+            cactusDisk_destruct(childDisk);
+            _exit(0);
+        }
+    }
+    close(pipeFds[1]);
+    for (int64_t j = 0; j < 4; j++) {
+        int status;
+        wait(&status);
+        CuAssertTrue(testCase, WIFEXITED(status) && WEXITSTATUS(status) == 0);
+    }
+    stList *names = stList_construct3(0, free);
+    stSortedSet *uniqueNames = stSortedSet_construct3((int (*)(const void *, const void *)) stIntTuple_cmpFn,
+            (void (*)(void *)) stIntTuple_destruct);
+    Name name;
+    while (read(pipeFds[0], &name, sizeof(Name)) == sizeof(Name)) {
+        int64_t *namePtr = st_malloc(sizeof(int64_t));
+        namePtr[0] = name;
+        stList_append(names, namePtr);
+        stSortedSet_insert(uniqueNames, stIntTuple_construct1(name));
+    }
+    close(pipeFds[0]);
+    CuAssertIntEquals(testCase, 100, stList_length(names));
+    CuAssertIntEquals(testCase, 100, stSortedSet_size(uniqueNames));
+    //Check every record written by the processes is found.
+    lmdbDisk = cactusDisk_constructFromString(confString, false, true);
+    stList *flowers = cactusDisk_getFlowers(lmdbDisk, names);
+    CuAssertIntEquals(testCase, 100, stList_length(flowers));
+    for (int64_t j = 0; j < stList_length(names); j++) {
+        CuAssertTrue(testCase, flower_getName(stList_get(flowers, j)) == *(int64_t *) stList_get(names, j));
+    }
+    metaSequence = cactusDisk_getMetaSequence(lmdbDisk, metaSequenceName);
+    CuAssertTrue(testCase, metaSequence != NULL);
+    char *string = metaSequence_getString(metaSequence, 1, 10, 1);
+    CuAssertStrEquals(testCase, "ACTGACTGAG", string);
+    free(string);
+    stList_destruct(flowers);
+    stSortedSet_destruct(uniqueNames);
+    stList_destruct(names);
+    cactusDisk_destruct(lmdbDisk);
+    i = system("rm -rf temporaryCactusDiskLmdb");
+    exitOnFailure(i, "Tried to delete the temporary LMDB database\n");
+}
+#endif
+
 CuSuite* cactusDiskTestSuite(void) {
     CuSuite* suite = CuSuiteNew();
     SUITE_ADD_TEST(suite, testCactusDisk_write);
@@ -143,5 +263,10 @@ CuSuite* cactusDiskTestSuite(void) {
     SUITE_ADD_TEST(suite, testCactusDisk_getUniqueID_Unique);
     SUITE_ADD_TEST(suite, testCactusDisk_getUniqueID_UniqueIntervals);
     SUITE_ADD_TEST(suite, testCactusDisk_constructAndDestruct);
+    SUITE_ADD_TEST(suite, testCactusDisk_shardedByHash);
+    SUITE_ADD_TEST(suite, testCactusDisk_shardedByRange);
+#ifdef HAVE_LMDB
+    SUITE_ADD_TEST(suite, testCactusDisk_lmdb);
+#endif
     return suite;
 }
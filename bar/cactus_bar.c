@@ -276,8 +276,7 @@ int main(int argc, char *argv[]) {
     /*
      * Load the flowerdisk
      */
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true); //We precache the sequences
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true); //We precache the sequences
     st_logInfo("Set up the flower disk\n");
 
     /*
@@ -440,7 +439,6 @@ int main(int argc, char *argv[]) {
 
     stateMachine_destruct(sM);
     cactusDisk_destruct(cactusDisk);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
     //destructCactusCoreInputParameters(cCIP);
     free(cactusDiskDatabaseString);
     if (listOfEndAlignmentFiles != NULL) {
@@ -29,8 +29,7 @@ int main(int argc, char *argv[]) {
 	Flower *flower;
 	assert(argc == 7);
 	st_setLogLevelFromString(argv[1]);
-	stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
-	cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+	cactusDisk = cactusDisk_constructFromString(argv[2], false, true);
 	st_logInfo("Set up the flower disk\n");
 	flower = cactusDisk_getFlower(cactusDisk, cactusMisc_stringToName(argv[3]));
 	assert(flower != NULL);
@@ -48,7 +47,6 @@ int main(int argc, char *argv[]) {
 	finishChunkingSequences();
 	st_logInfo("Written the sequences from the flower into a file");
 	cactusDisk_destruct(cactusDisk);
-	stKVDatabaseConf_destruct(kvDatabaseConf);
 
 	return 0;
 }
@@ -44,7 +44,6 @@ int main(int argc, char *argv[])
 {
     char *cactusDiskString = NULL;
     CactusDisk *cactusDisk;
-    stKVDatabaseConf *kvDatabaseConf;
     stHash *headerToName;
     stList *flowers;
     Flower_EndIterator *endIt;
@@ -81,8 +80,7 @@ int main(int argc, char *argv[])
     if (cactusDiskString == NULL) {
         st_errAbort("--cactusDisk option must be provided");
     }
-    kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskString, false, true);
     flowers = flowerWriter_parseFlowersFromStdin(cactusDisk);
     assert(stList_length(flowers) == 1);
     Flower *flower = stList_get(flowers, 0);
@@ -13,7 +13,6 @@ static void usage(void)
 int main(int argc, char *argv[])
 {
     char *cactusDiskString = NULL;
-    stKVDatabaseConf *kvDatabaseConf;
     CactusDisk *cactusDisk;
     Flower *flower;
     Flower_SequenceIterator *flowerIt;
@@ -35,8 +34,7 @@ int main(int argc, char *argv[])
     if (cactusDiskString == NULL) {
         st_errAbort("--cactusDisk option must be provided");
     }
-    kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskString, false, true);
     // Get top-level flower.
     flower = cactusDisk_getFlower(cactusDisk, 0);
     flowerIt = flower_getSequenceIterator(flower);
@@ -280,7 +280,6 @@ int main(int argc, char *argv[]) {
      * Script for adding alignments to cactus tree.
      */
     int64_t startTime;
-    stKVDatabaseConf *kvDatabaseConf;
     CactusDisk *cactusDisk;
     int key, k;
 
@@ -743,8 +742,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     ///////////////////////////////////////////////////////////////////////////
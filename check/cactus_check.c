@@ -267,8 +267,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     stList *flowers = flowerWriter_parseFlowersFromStdin(cactusDisk);
@@ -293,7 +292,6 @@ int main(int argc, char *argv[]) {
     return 0; //Exit without clean up is quicker, enable cleanup when doing memory leak detection.
 
     stList_destruct(flowers);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
 
     return 0;
 }
@@ -107,10 +107,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(
-            cactusDiskDatabaseString);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
 
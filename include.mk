@@ -11,5 +11,11 @@ include ${sonLibRootPath}/include.mk
 dataSetsPath=/Users/benedictpaten/Dropbox/Documents/work/myPapers/genomeCactusPaper/dataSets
 
 cflags += -I ${sonLibPath}
+
+#To build the cactus disk with the embedded LMDB database backend, set
+#lmdbIncl to e.g. "-I/usr/include -DHAVE_LMDB=1" and lmdbLib to e.g. "-L/usr/lib -llmdb"
+cflags += ${lmdbIncl}
+dblibs += ${lmdbLib}
+
 basicLibs = ${sonLibPath}/sonLib.a ${sonLibPath}/cuTest.a ${dblibs}
 basicLibsDependencies = ${sonLibPath}/sonLib.a ${sonLibPath}/cuTest.a 
@@ -666,8 +666,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     //////////////////////////////////////////////
@@ -892,7 +891,6 @@ int main(int argc, char *argv[]) {
 
     //Destruct stuff
     startTime = time(NULL);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
     if(logLevelString != NULL) {
         free(logLevelString);
     }
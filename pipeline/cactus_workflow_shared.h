@@ -20,9 +20,7 @@ void parseArgs(int argc, char *argv[]) {
     st_setLogLevelFromString(argv[1]);
     st_logDebug("Set up logging\n");
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(argv[2]);
-    cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
+    cactusDisk = cactusDisk_constructFromString(argv[2], false, true);
     st_logDebug("Set up the flower disk\n");
 
     int64_t i = sscanf(argv[3], "%" PRId64 "", &minFlowerSize);
@@ -7,9 +7,8 @@
 import os
 from optparse import OptionParser
 
-from sonLib.bioio import fastaRead
-from sonLib.bioio import fastaWrite
-from sonLib.bioio import getTempFile
+from cactus.shared.fastaIO import sequenceLengths
+from cactus.shared.fastaIO import transformFasta
 
 
 # for every sequence, determine if its contained in the file
@@ -18,10 +17,10 @@ from sonLib.bioio import getTempFile
 # assumption: sequences with same name are contiguous (which is true for 
 # cactus_batchChunk output, which this is tailored for)
 # **only bother if names seem to be in chunk format (None returned otherwise)
-def containedSequences(inputFile):
+def containedSequences(inputName):
     lookup = dict()
     prev = ""
-    for header, seq in fastaRead(inputFile):
+    for header, seqLength in sequenceLengths(inputName):
         if '|1|' not in header:
             assert len(lookup) == 0
             return None
@@ -34,15 +33,15 @@ def containedSequences(inputFile):
                 return None
             if int(offset) == 0:
                 assert lookup.has_key(name) == False
-                lookup[name] = (len(seq), False)
+                lookup[name] = (seqLength, False)
             elif lookup.has_key(name) == True:
-                lookup[name] = (max(lookup[name][0], int(offset) + len(seq)), lookup[name][1])
+                lookup[name] = (max(lookup[name][0], int(offset) + seqLength), lookup[name][1])
             if name != prev and lookup.has_key(prev):
                 lookup[prev] = (lookup[prev][0], True)
             prev = name
     return lookup
 
-def tooShort(header, seq, options, contTable):
+def tooShort(header, seqLength, options, contTable):
     isTooShort = False
     if contTable is not None:
         key = header[:header.find('|1|')]
@@ -50,7 +49,7 @@ def tooShort(header, seq, options, contTable):
             length, flag = contTable[key]
             isTooShort = flag and length < options.length
     else:
-        isTooShort = len(seq) < options.length
+        isTooShort = seqLength < options.length
 
     return isTooShort
     
@@ -79,19 +78,13 @@ def main():
         return 1
     
     inputName = args[0]
-    inputFile = open(inputName, "r")
     outputName = args[1]
-    outputFile = open(outputName, "w")
-  
-    contTable = containedSequences(inputFile)
-    inputFile.seek(0)
-  
-    for header, seq in fastaRead(inputFile):
-        if tooShort(header, seq, options, contTable) == False:
-            fastaWrite(outputFile, header, seq)
-      
-    outputFile.close()
-    inputFile.close()  
+
+    contTable = containedSequences(inputName)
+
+    # Kept records are copied through as they are, without rewrapping
+    transformFasta(inputName, outputName,
+                   keepFn=lambda record: not tooShort(record.header, record.length(), options, contTable))
     return 0
 
 if __name__ == '__main__':
@@ -6,9 +6,7 @@
 import os
 from optparse import OptionParser
 
-from sonLib.bioio import fastaRead
-from sonLib.bioio import fastaWrite
-from sonLib.bioio import getTempFile
+from cactus.shared.fastaIO import transformFasta
 
 def fixHeader(header):
     return "".join([ i for i in header if str.isalnum(i) ])
@@ -30,15 +28,9 @@ def main():
         return 1
     
     inputName = args[0]
-    inputFile = open(inputName, "r")
     outputName = args[1]
-    outputFile = open(outputName, "w")
-     
-    for header, seq in fastaRead(inputFile):
-        fastaWrite(outputFile, fixHeader(header), seq)
-            
-    outputFile.close()
-    inputFile.close()
+
+    transformFasta(inputName, outputName, headerFn=fixHeader)
     return 0
     
 if __name__ == '__main__':
@@ -101,14 +101,12 @@ int main(int argc, char *argv[]) {
     st_logInfo("referenceEventString = %s\n", referenceEventString);
     st_logInfo("bottomUpPhase = %i\n", bottomUpPhase);
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     stKVDatabase *sequenceDatabase = NULL;
     if (secondaryDatabaseString != NULL) {
-        kvDatabaseConf = stKVDatabaseConf_constructFromString(secondaryDatabaseString);
+        stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(secondaryDatabaseString);
         sequenceDatabase = stKVDatabase_construct(kvDatabaseConf, 0);
         stKVDatabaseConf_destruct(kvDatabaseConf);
     }
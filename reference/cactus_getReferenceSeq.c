@@ -161,9 +161,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = stKVDatabaseConf_constructFromString(
-            cactusDiskDatabaseString);
-    CactusDisk *cactusDisk = cactusDisk_construct(kvDatabaseConf, false, true);
+    CactusDisk *cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, false, true);
     st_logInfo("Set up the flower disk\n");
 
     ///////////////////////////////////////////////////////////////////////////
@@ -208,7 +206,6 @@ int main(int argc, char *argv[]) {
 
     return 0; //Exit without clean up is quicker, enable cleanup when doing memory leak detection.
 
-    stKVDatabaseConf_destruct(kvDatabaseConf);
 
     return 0;
 }
@@ -30,6 +30,18 @@ setup(
         # Someone uploaded an old version of sonLib to pyPI, so we have to use this name
         'actualSonLib'],
 
+    extras_require={
+        # Lets the binary alignment readers hand out numpy arrays
+        'numpy': ['numpy'],
+        # Multithreaded zstd compression of DB snapshots in the job store
+        'zstd': ['zstandard'],
+        # The LMDB store of cactus_db_benchmark
+        'lmdb': ['lmdb']},
+
     entry_points={
         'console_scripts': ['cactus = cactus.progressive.cactus_progressive:main',
-                            'cactus_preprocess = cactus.preprocessor.cactus_preprocessor:main']},)
+                            'cactus_preprocess = cactus.preprocessor.cactus_preprocessor:main',
+                            'cactus_metrics_report = cactus.shared.metrics:main',
+                            'cactus_fit_resources = cactus.shared.resourceModel:main',
+                            'cactus_db_sizing = cactus.pipeline.ktserverSizing:main',
+                            'cactus_db_benchmark = cactus.pipeline.ktserverBenchmark:main']},)
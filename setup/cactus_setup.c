@@ -275,14 +275,7 @@ int main(int argc, char *argv[]) {
     //Load the database
     //////////////////////////////////////////////
 
-    stKVDatabaseConf *kvDatabaseConf = kvDatabaseConf = stKVDatabaseConf_constructFromString(cactusDiskDatabaseString);
-    if (stKVDatabaseConf_getType(kvDatabaseConf) == stKVDatabaseTypeTokyoCabinet || stKVDatabaseConf_getType(kvDatabaseConf)
-            == stKVDatabaseTypeKyotoTycoon) {
-        assert(stKVDatabaseConf_getDir(kvDatabaseConf) != NULL);
-        cactusDisk = cactusDisk_construct(kvDatabaseConf, true, true);
-    } else {
-        cactusDisk = cactusDisk_construct(kvDatabaseConf, true, true);
-    }
+    cactusDisk = cactusDisk_constructFromString(cactusDiskDatabaseString, true, true);
     st_logInfo("Set up the flower disk\n");
 
     //////////////////////////////////////////////
@@ -399,7 +392,6 @@ int main(int argc, char *argv[]) {
 
     stSet_destruct(outgroupNameSet);
     stTree_destruct(tree);
-    stKVDatabaseConf_destruct(kvDatabaseConf);
 
     return 0;
 }
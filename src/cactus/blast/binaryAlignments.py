@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""A columnar binary container for pairwise alignments.
+
+Alignments are held as a struct of arrays rather than one object per
+alignment: sequence IDs, starts, ends, strands and scores are fixed width
+arrays, and the operations of all the alignments are stored run-length
+encoded (as the type/length pairs of the CIGAR string) in two further
+arrays, indexed by the opStart column. Contig 1 is the first sequence
+named on a CIGAR line, as in the C code.
+
+On disk a file is laid out as:
+
+    magic ("CACTUSBA"), version (uint32)
+    block*
+    names table
+    block index
+    footer: names table offset (uint64), block index offset (uint64), magic
+
+Each block holds up to blockSize alignments: a header with the number of
+alignments and operations, then each column written out raw in
+little-endian byte order. The block index gives the file offset, first
+alignment number, alignment count and operation count of every block, so
+readers can seek straight to any block.
+
+Conversion to and from CIGAR is lossless, including the way the scores
+are written (as long as they are plain decimals).
+"""
+import os
+import sys
+import struct
+from array import array
+from argparse import ArgumentParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "CACTUSBA"
+VERSION = 1
+DEFAULT_BLOCK_SIZE = 65536
+
+# The encodings used for the columns, as (name, array typecode, numpy dtype)
+RECORD_COLUMNS = [("contig1", "L", "<u8"), ("start1", "l", "<i8"), ("end1", "l", "<i8"), ("strand1", "b", "i1"),
+                  ("contig2", "L", "<u8"), ("start2", "l", "<i8"), ("end2", "l", "<i8"), ("strand2", "b", "i1"),
+                  ("score", "d", "<f8"), ("scoreDigits", "b", "i1"), ("opStart", "L", "<u8")]
+OP_COLUMNS = [("opType", "c", "S1"), ("opLength", "L", "<u8")]
+
+# scoreDigits value for scores written as integers with no decimal point
+INTEGER_SCORE = -1
+# scoreDigits value for scores that have to be written with repr()
+REPR_SCORE = -2
+
+_blockHeader = struct.Struct("<QQ")
+_indexEntry = struct.Struct("<QQQQ")
+_footer = struct.Struct("<QQ8s")
+
+for _typecode in "Ll":
+    if array(_typecode).itemsize != 8:
+        raise RuntimeError("The binary alignment format needs 64 bit longs")
+
+def _toLittleEndian(columnArray):
+    if sys.byteorder == "little" or columnArray.itemsize == 1:
+        return columnArray
+    swapped = array(columnArray.typecode, columnArray)
+    swapped.byteswap()
+    return swapped
+
+def getScoreDigits(scoreString):
+    """Get the scoreDigits value that will reproduce the given score string.
+    """
+    if "e" in scoreString or "E" in scoreString or scoreString.lower() in ("nan", "inf", "-inf"):
+        return REPR_SCORE
+    if "." not in scoreString:
+        return INTEGER_SCORE
+    digits = len(scoreString) - scoreString.index(".") - 1
+    if digits > 127:
+        return REPR_SCORE
+    return digits
+
+def formatScore(score, digits):
+    if digits == INTEGER_SCORE:
+        return "%i" % score
+    if digits == REPR_SCORE:
+        return repr(score)
+    return "%.*f" % (digits, score)
+
+class AlignmentColumns(object):
+    """A batch of alignments in struct of arrays form.
+
+    Contig IDs index into the names list, which may be shared with other
+    batches of the same file.
+    """
+    def __init__(self, names=None):
+        self.names = names if names is not None else []
+        self.nameIds = dict((name, i) for i, name in enumerate(self.names))
+        for name, typecode, dtype in RECORD_COLUMNS + OP_COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.contig1)
+
+    def getNameId(self, name):
+        nameId = self.nameIds.get(name)
+        if nameId is None:
+            nameId = len(self.names)
+            self.names.append(name)
+            self.nameIds[name] = nameId
+        return nameId
+
+    def appendCigarLine(self, line):
+        """Add the alignment given by a CIGAR line.
+        """
+        tokens = line.split()
+        if len(tokens) < 10 or tokens[0] != "cigar:" or len(tokens) % 2 != 0:
+            raise RuntimeError("Malformed cigar line: %s" % line)
+        self.opStart.append(len(self.opType))
+        self.contig1.append(self.getNameId(tokens[1]))
+        self.start1.append(int(tokens[2]))
+        self.end1.append(int(tokens[3]))
+        self.strand1.append(1 if tokens[4] == "+" else 0)
+        self.contig2.append(self.getNameId(tokens[5]))
+        self.start2.append(int(tokens[6]))
+        self.end2.append(int(tokens[7]))
+        self.strand2.append(1 if tokens[8] == "+" else 0)
+        self.score.append(float(tokens[9]))
+        self.scoreDigits.append(getScoreDigits(tokens[9]))
+        for i in xrange(10, len(tokens), 2):
+            if tokens[i] not in ("M", "I", "D"):
+                raise RuntimeError("Only M, I and D operations are supported in cigar lines")
+            self.opType.append(tokens[i])
+            self.opLength.append(int(tokens[i + 1]))
+
+    def opEnd(self, i):
+        return self.opStart[i + 1] if i + 1 < len(self.opStart) else len(self.opType)
+
+    def cigarLine(self, i):
+        """Get the CIGAR line (without a newline) for the ith alignment.
+        """
+        fields = ["cigar:",
+                  self.names[self.contig1[i]], str(self.start1[i]), str(self.end1[i]), "+" if self.strand1[i] else "-",
+                  self.names[self.contig2[i]], str(self.start2[i]), str(self.end2[i]), "+" if self.strand2[i] else "-",
+                  formatScore(self.score[i], self.scoreDigits[i])]
+        for j in xrange(self.opStart[i], self.opEnd(i)):
+            fields.append(self.opType[j])
+            fields.append(str(self.opLength[j]))
+        return " ".join(fields)
+
+    def writeCigar(self, fileHandle):
+        from cactus.blast.cigarBatch import writeCigarBatch
+        writeCigarBatch(self, fileHandle)
+
+    def toNumpy(self):
+        """Get the columns as a dict of numpy arrays, with the opStart column
+        relative to the start of this batch. The arrays share memory with
+        the columns where the byte order allows it.
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is needed to read alignments as numpy arrays")
+        columns = {}
+        for name, typecode, dtype in RECORD_COLUMNS + OP_COLUMNS:
+            columns[name] = numpy.frombuffer(_toLittleEndian(getattr(self, name)), dtype=dtype)
+        return columns
+
+class BinaryAlignmentWriter(object):
+    """Writes batches of alignments to a binary alignment file.
+    """
+    def __init__(self, path):
+        self.fileHandle = open(path, "wb")
+        self.fileHandle.write(MAGIC)
+        self.fileHandle.write(struct.pack("<I", VERSION))
+        self.names = []
+        self.nameIds = {}
+        self.index = []
+        self.alignmentCount = 0
+
+    def _remapNames(self, columns):
+        """Get the batch's contig IDs in terms of this file's names table.
+        """
+        if columns.names is self.names:
+            # The batch added its new names straight to our table
+            for i in xrange(len(self.nameIds), len(self.names)):
+                self.nameIds[self.names[i]] = i
+            return columns.contig1, columns.contig2
+        mapping = []
+        for name in columns.names:
+            if name not in self.nameIds:
+                self.nameIds[name] = len(self.names)
+                self.names.append(name)
+            mapping.append(self.nameIds[name])
+        return (array("L", [mapping[i] for i in columns.contig1]),
+                array("L", [mapping[i] for i in columns.contig2]))
+
+    def write(self, columns):
+        if len(columns) == 0:
+            return
+        contig1, contig2 = self._remapNames(columns)
+        opBase = columns.opStart[0]
+        self.index.append((self.fileHandle.tell(), self.alignmentCount,
+                           len(columns), len(columns.opType) - opBase))
+        self.fileHandle.write(_blockHeader.pack(len(columns), len(columns.opType) - opBase))
+        for name, typecode, dtype in RECORD_COLUMNS:
+            column = getattr(columns, name)
+            if name == "contig1":
+                column = contig1
+            elif name == "contig2":
+                column = contig2
+            elif name == "opStart" and opBase != 0:
+                column = array("L", [opStart - opBase for opStart in column])
+            _toLittleEndian(column).tofile(self.fileHandle)
+        columns.opType[opBase:].tofile(self.fileHandle)
+        _toLittleEndian(columns.opLength[opBase:]).tofile(self.fileHandle)
+        self.alignmentCount += len(columns)
+
+    def close(self):
+        namesOffset = self.fileHandle.tell()
+        self.fileHandle.write(struct.pack("<Q", len(self.names)))
+        for name in self.names:
+            self.fileHandle.write(struct.pack("<I", len(name)))
+            self.fileHandle.write(name)
+        indexOffset = self.fileHandle.tell()
+        self.fileHandle.write(struct.pack("<Q", len(self.index)))
+        for entry in self.index:
+            self.fileHandle.write(_indexEntry.pack(*entry))
+        self.fileHandle.write(_footer.pack(namesOffset, indexOffset, MAGIC))
+        self.fileHandle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+class BinaryAlignmentReader(object):
+    """Reads a binary alignment file a block at a time.
+    """
+    def __init__(self, path):
+        self.fileHandle = open(path, "rb")
+        if self.fileHandle.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError("%s is not a binary alignment file" % path)
+        version = struct.unpack("<I", self.fileHandle.read(4))[0]
+        if version != VERSION:
+            raise RuntimeError("Unsupported binary alignment file version %i" % version)
+        self.fileHandle.seek(-_footer.size, os.SEEK_END)
+        namesOffset, indexOffset, magic = _footer.unpack(self.fileHandle.read(_footer.size))
+        if magic != MAGIC:
+            raise RuntimeError("Binary alignment file %s is truncated" % path)
+
+        self.fileHandle.seek(namesOffset)
+        self.names = []
+        for i in xrange(struct.unpack("<Q", self.fileHandle.read(8))[0]):
+            nameLength = struct.unpack("<I", self.fileHandle.read(4))[0]
+            self.names.append(self.fileHandle.read(nameLength))
+
+        self.fileHandle.seek(indexOffset)
+        blockCount = struct.unpack("<Q", self.fileHandle.read(8))[0]
+        self.index = [_indexEntry.unpack(self.fileHandle.read(_indexEntry.size)) for i in xrange(blockCount)]
+
+    def __len__(self):
+        return sum(entry[2] for entry in self.index)
+
+    def readBlock(self, blockNumber):
+        """Get the given block as an AlignmentColumns object.
+        """
+        offset, firstAlignment, alignmentCount, opCount = self.index[blockNumber]
+        self.fileHandle.seek(offset + _blockHeader.size)
+        columns = AlignmentColumns(self.names)
+        for name, typecode, dtype in RECORD_COLUMNS:
+            self._readColumn(getattr(columns, name), alignmentCount)
+        self._readColumn(columns.opType, opCount)
+        self._readColumn(columns.opLength, opCount)
+        return columns
+
+    def _readColumn(self, column, count):
+        column.fromfile(self.fileHandle, count)
+        if sys.byteorder != "little" and column.itemsize > 1:
+            column.byteswap()
+
+    def blocks(self):
+        for blockNumber in xrange(len(self.index)):
+            yield self.readBlock(blockNumber)
+
+    def numpyBlocks(self):
+        """Yields each block as a dict of numpy arrays (see AlignmentColumns.toNumpy).
+        """
+        for columns in self.blocks():
+            yield columns.toNumpy()
+
+    def close(self):
+        self.fileHandle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+def cigarToBinary(cigarPath, binaryPath, blockSize=DEFAULT_BLOCK_SIZE):
+    """Convert a CIGAR file to the binary format.
+    """
+    from cactus.blast.cigarBatch import parseCigarLines
+    with open(cigarPath) as cigarFile, BinaryAlignmentWriter(binaryPath) as writer:
+        lines = []
+        for line in cigarFile:
+            if not line.startswith("cigar:"):
+                continue
+            lines.append(line)
+            if len(lines) == blockSize:
+                writer.write(parseCigarLines(lines, writer.names))
+                lines = []
+        writer.write(parseCigarLines(lines, writer.names))
+
+def binaryToCigar(binaryPath, cigarPath):
+    """Convert a binary alignment file back to CIGAR.
+    """
+    with BinaryAlignmentReader(binaryPath) as reader, open(cigarPath, "w") as cigarFile:
+        for columns in reader.blocks():
+            columns.writeCigar(cigarFile)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("inputFile")
+    parser.add_argument("outputFile")
+    parser.add_argument("--toCigar", action="store_true",
+                        help="Convert from binary back to CIGAR rather than from CIGAR to binary")
+    parser.add_argument("--blockSize", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Number of alignments per block")
+    opts = parser.parse_args()
+    if opts.toCigar:
+        binaryToCigar(opts.inputFile, opts.outputFile)
+    else:
+        cigarToBinary(opts.inputFile, opts.outputFile, blockSize=opts.blockSize)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import unittest
+import os
+from textwrap import dedent
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.blast.binaryAlignments import cigarToBinary, binaryToCigar
+from cactus.blast.binaryAlignments import BinaryAlignmentReader, AlignmentColumns
+from cactus.blast.binaryAlignments import numpy
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.cigarPath = getTempFile()
+        open(self.cigarPath, 'w').write(dedent('''\
+        cigar: seq1 0 10 + seq2 20 10 - 30 M 10
+        cigar: seq2 5 9 + seq1 0 5 + 3.500000 M 2 I 1 M 2 D 1
+        cigar: seq3 0 1 + seq1 100 101 + 1.5 M 1
+        cigar: seq1 1 2 - seq3 0 1 + 2.0 M 1
+        cigar: seq4 7 10 + seq4 3 0 - 0 M 3
+        '''))
+        self.tempFiles = [self.cigarPath]
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    @silentOnSuccess
+    def testCigarRoundTrip(self):
+        for blockSize in [1, 2, 1000]:
+            binaryPath = self.getTempFile()
+            cigarToBinary(self.cigarPath, binaryPath, blockSize=blockSize)
+            cigarPath = self.getTempFile()
+            binaryToCigar(binaryPath, cigarPath)
+            self.assertEquals(open(cigarPath).read(), open(self.cigarPath).read())
+
+    @silentOnSuccess
+    def testBlocks(self):
+        binaryPath = self.getTempFile()
+        cigarToBinary(self.cigarPath, binaryPath, blockSize=2)
+        with BinaryAlignmentReader(binaryPath) as reader:
+            self.assertEquals(len(reader), 5)
+            self.assertEquals(reader.names, ["seq1", "seq2", "seq3", "seq4"])
+            self.assertEquals([len(columns) for columns in reader.blocks()], [2, 2, 1])
+            columns = reader.readBlock(1)
+            self.assertEquals(list(columns.start2), [100, 0])
+            self.assertEquals(list(columns.strand1), [1, 0])
+            self.assertEquals(columns.cigarLine(0), "cigar: seq3 0 1 + seq1 100 101 + 1.5 M 1")
+
+    @silentOnSuccess
+    def testOperations(self):
+        columns = AlignmentColumns()
+        columns.appendCigarLine("cigar: a 0 3 + b 0 4 + 1 M 2 I 1 D 1")
+        columns.appendCigarLine("cigar: a 3 4 + b 4 5 + 1 M 1")
+        self.assertEquals(list(columns.opStart), [0, 3])
+        self.assertEquals(columns.opType.tostring(), "MIDM")
+        self.assertEquals(list(columns.opLength), [2, 1, 1, 1])
+        self.assertRaises(RuntimeError, columns.appendCigarLine, "cigar: a 0 3 + b 0 4 + 1 M")
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    @silentOnSuccess
+    def testNumpyBlocks(self):
+        binaryPath = self.getTempFile()
+        cigarToBinary(self.cigarPath, binaryPath)
+        with BinaryAlignmentReader(binaryPath) as reader:
+            columns = list(reader.numpyBlocks())[0]
+        self.assertEquals(list(columns["end1"] - columns["start1"]), [10, 4, 1, 1, 3])
+        self.assertEquals(list(columns["opLength"][columns["opType"] == "M"]), [10, 2, 2, 1, 1, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,20 +8,39 @@ sequences. Uses the toil framework to parallelise the blasts.
 """
 import os
 import shutil
+import tempfile
 from toil.lib.bioio import logger
 from toil.lib.bioio import system
 
-from sonLib.bioio import catFiles, nameValue, popenCatch, getTempDirectory
+from sonLib.bioio import nameValue, popenCatch, getTempDirectory
 
 from cactus.shared.common import RoundedJob
 from cactus.shared.common import cactus_call
 from cactus.shared.common import runLastz, runSelfLastz
 from cactus.shared.common import runCactusRealign, runCactusSelfRealign
 from cactus.shared.common import runGetChunks
-from cactus.shared.common import readGlobalFileWithoutCache
 from cactus.shared.common import ChildTreeJob
 from cactus.blast.upconvertCoordinates import upconvertCoords
 from cactus.blast.trimSequences import trimSequences
+from cactus.shared.twoBit import fastaToTwoBit, twoBitToFasta
+from cactus.blast.cigarIndex import buildCigarIndex, extractAlignments
+from cactus.shared.resourceModel import getResourceModel
+from cactus.shared.fileConcat import concatenateFiles, concatenateStreams
+from cactus.shared.fileStoreIO import ParallelFileIO
+from cactus.shared import nodeCache
+
+def fittedResources(job, features, sizingFeature, memory, disk):
+    """Get the memory and disk for a blast job, from the fitted model of its
+    class if there is one and otherwise the given defaults. Records the
+    feature the resources depend on, so the model can be refitted.
+    """
+    job.sizingFeatures = features
+    job.sizingFeature = sizingFeature
+    fittedModel = getResourceModel(job.__class__.__name__)
+    if fittedModel is not None:
+        memory = fittedModel.memory(features) or memory
+        disk = fittedModel.disk(features) or disk
+    return memory, disk
 
 class BlastOptions(object):
     def __init__(self, chunkSize=10000000, overlapSize=10000, 
@@ -40,7 +59,9 @@ class BlastOptions(object):
                  # default because it's needed for the tests (which
                  # don't use realign.)
                  trimOutgroupFlanking=2000,
-                 keepParalogs=False):
+                 keepParalogs=False,
+                 twoBit=False,
+                 indexAlignments=False):
         """Class defining options for blast
         """
         self.chunkSize = chunkSize
@@ -62,6 +83,11 @@ class BlastOptions(object):
         self.trimOutgroupDepth = trimOutgroupDepth
         self.trimOutgroupFlanking = trimOutgroupFlanking
         self.keepParalogs = keepParalogs
+        # Ship the chunks to the lastz jobs in 2bit rather than fasta format
+        self.twoBit = twoBit
+        # Index the alignments against each outgroup, so the coverage of
+        # each ingroup only reads the alignments touching it
+        self.indexAlignments = indexAlignments
 
 class BlastSequencesAllAgainstAll(RoundedJob):
     """Take a set of sequences, chunks them up and blasts them.
@@ -78,11 +104,14 @@ class BlastSequencesAllAgainstAll(RoundedJob):
         self.blastOptions.roundsOfCoordinateConversion = 1
 
     def run(self, fileStore):
-        sequenceFiles1 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs1]
-        chunks = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize = self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
-        assert len(chunks) > 0
-        logger.info("Broken up the sequence files into individual 'chunk' files")
-        chunkIDs = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks]
+        with ParallelFileIO(fileStore) as fileIO:
+            sequenceFiles1 = fileIO.readGlobalFiles(self.sequenceFileIDs1)
+            chunks = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize = self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
+            assert len(chunks) > 0
+            logger.info("Broken up the sequence files into individual 'chunk' files")
+            # Each chunk is uploaded while the next is packed
+            chunkIDs = [write.get() for write in [fileIO.writeBehind(packChunk(chunk, self.blastOptions), cleanup=True)
+                                                  for chunk in chunks]]
 
         diagonalResultsID = self.addChild(MakeSelfBlasts(self.blastOptions, chunkIDs)).rv()
         offDiagonalResultsID = self.addChild(MakeOffDiagonalBlasts(self.blastOptions, chunkIDs)).rv()
@@ -128,8 +157,9 @@ class MakeOffDiagonalBlasts(ChildTreeJob):
 
 class BlastSequencesAgainstEachOther(ChildTreeJob):
     """Take two sets of sequences, chunks them up and blasts one set against the other.
+    If buildIndex is set, returns the alignments and a CIGAR index of them.
     """
-    def __init__(self, sequenceFileIDs1, sequenceFileIDs2, blastOptions):
+    def __init__(self, sequenceFileIDs1, sequenceFileIDs2, blastOptions, buildIndex=False):
         disk = 3*(sum([seqID.size for seqID in sequenceFileIDs1]) + sum([seqID.size for seqID in sequenceFileIDs2]))
         cores = 1
         memory = blastOptions.memory
@@ -139,14 +169,20 @@ class BlastSequencesAgainstEachOther(ChildTreeJob):
         self.sequenceFileIDs2 = sequenceFileIDs2
         self.blastOptions = blastOptions
         self.blastOptions.roundsOfCoordinateConversion = 1
+        self.buildIndex = buildIndex
 
     def run(self, fileStore):
-        sequenceFiles1 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs1]
-        sequenceFiles2 = [fileStore.readGlobalFile(fileID) for fileID in self.sequenceFileIDs2]
-        chunks1 = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
-        chunks2 = runGetChunks(sequenceFiles=sequenceFiles2, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
-        chunkIDs1 = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks1]
-        chunkIDs2 = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in chunks2]
+        with ParallelFileIO(fileStore) as fileIO:
+            sequenceFiles1 = fileIO.prefetch(self.sequenceFileIDs1)
+            sequenceFiles2 = fileIO.readGlobalFiles(self.sequenceFileIDs2)
+            sequenceFiles1 = [read.get() for read in sequenceFiles1]
+            chunks1 = runGetChunks(sequenceFiles=sequenceFiles1, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
+            chunks2 = runGetChunks(sequenceFiles=sequenceFiles2, chunksDir=getTempDirectory(rootDir=fileStore.getLocalTempDir()), chunkSize=self.blastOptions.chunkSize, overlapSize=self.blastOptions.overlapSize)
+            # Each chunk is uploaded while the next is packed
+            chunkWrites1 = [fileIO.writeBehind(packChunk(chunk, self.blastOptions), cleanup=True) for chunk in chunks1]
+            chunkWrites2 = [fileIO.writeBehind(packChunk(chunk, self.blastOptions), cleanup=True) for chunk in chunks2]
+            chunkIDs1 = [write.get() for write in chunkWrites1]
+            chunkIDs2 = [write.get() for write in chunkWrites2]
         resultsIDs = []
         #Make the list of blast jobs.
         for chunkID1 in chunkIDs1:
@@ -156,7 +192,7 @@ class BlastSequencesAgainstEachOther(ChildTreeJob):
                 resultsIDs.append(self.addChild(RunBlast(self.blastOptions, chunkID1, chunkID2)).rv())
         logger.info("Made the list of blasts")
         #Set up the job to collate all the results
-        return self.addFollowOn(CollateBlasts(self.blastOptions, resultsIDs)).rv()
+        return self.addFollowOn(CollateBlasts(self.blastOptions, resultsIDs, buildIndex=self.buildIndex)).rv()
 
 class BlastIngroupsAndOutgroups(RoundedJob):
     """Blast ingroup sequences against each other, and against the given
@@ -228,10 +264,15 @@ class BlastFirstOutgroup(RoundedJob):
     def run(self, fileStore):
         logger.info("Blasting ingroup sequences to outgroup %s",
                     self.outgroupNames[self.outgroupNumber - 1])
-        alignmentsID = self.addChild(BlastSequencesAgainstEachOther(
+        blastJob = self.addChild(BlastSequencesAgainstEachOther(
             self.sequenceIDs,
             [self.outgroupSequenceIDs[0]],
-            self.blastOptions)).rv()
+            self.blastOptions,
+            buildIndex=self.blastOptions.indexAlignments))
+        if self.blastOptions.indexAlignments:
+            alignmentsID, alignmentsIndexID = blastJob.rv(0), blastJob.rv(1)
+        else:
+            alignmentsID, alignmentsIndexID = blastJob.rv(), None
         trimRecurseJob = self.addFollowOn(TrimAndRecurseOnOutgroups(
             ingroupNames=self.ingroupNames,
             untrimmedSequenceIDs=self.untrimmedSequenceIDs,
@@ -240,6 +281,7 @@ class BlastFirstOutgroup(RoundedJob):
             outgroupSequenceIDs=self.outgroupSequenceIDs,
             outgroupFragmentIDs=self.outgroupFragmentIDs,
             mostRecentResultsID=alignmentsID,
+            mostRecentResultsIndexID=alignmentsIndexID,
             outgroupResultsID=self.outgroupResultsID,
             blastOptions=self.blastOptions,
             outgroupNumber=self.outgroupNumber,
@@ -253,7 +295,8 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
     def __init__(self, ingroupNames, untrimmedSequenceIDs, sequenceIDs,
                  outgroupNames, outgroupSequenceIDs, outgroupFragmentIDs,
                  mostRecentResultsID, outgroupResultsID,
-                 blastOptions, outgroupNumber, ingroupCoverageIDs):
+                 blastOptions, outgroupNumber, ingroupCoverageIDs,
+                 mostRecentResultsIndexID=None):
         super(TrimAndRecurseOnOutgroups, self).__init__(preemptable=True)
         self.ingroupNames = ingroupNames
         self.untrimmedSequenceIDs = untrimmedSequenceIDs
@@ -262,6 +305,7 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
         self.outgroupSequenceIDs = outgroupSequenceIDs
         self.outgroupFragmentIDs = outgroupFragmentIDs
         self.mostRecentResultsID = mostRecentResultsID
+        self.mostRecentResultsIndexID = mostRecentResultsIndexID
         self.outgroupResultsID = outgroupResultsID
         self.blastOptions = blastOptions
         self.outgroupNumber = outgroupNumber
@@ -271,34 +315,46 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
         # Trim outgroup, convert outgroup coordinates, and add to
         # outgroup fragments dir
 
-        outgroupSequenceFiles = [fileStore.readGlobalFile(fileID) for fileID in self.outgroupSequenceIDs]
-        mostRecentResultsFile = fileStore.readGlobalFile(self.mostRecentResultsID)
-        trimmedOutgroup = fileStore.getLocalTempFile()
-        outgroupCoverage = fileStore.getLocalTempFile()
-        calculateCoverage(outgroupSequenceFiles[0],
-                          mostRecentResultsFile, outgroupCoverage)
-        # The windowSize and threshold are fixed at 1: anything more
-        # and we will run into problems with alignments that aren't
-        # covered in a matching trimmed sequence.
-        trimSequences(outgroupSequenceFiles[0], outgroupCoverage,
-                      trimmedOutgroup, flanking=self.blastOptions.trimOutgroupFlanking,
-                      windowSize=1, threshold=1)
-        outgroupConvertedResultsFile = fileStore.getLocalTempFile()
-        with open(outgroupConvertedResultsFile, 'w') as f:
-            upconvertCoords(cigarPath=mostRecentResultsFile,
-                            fastaPath=trimmedOutgroup,
-                            contigNum=1,
-                            outputFile=f)
-
-        self.outgroupFragmentIDs.append(fileStore.writeGlobalFile(trimmedOutgroup))
-        sequenceFiles = [fileStore.readGlobalFile(path) for path in self.sequenceIDs]
-        untrimmedSequenceFiles = [fileStore.readGlobalFile(path) for path in self.untrimmedSequenceIDs]
+        # Only the first outgroup is used here. The ingroups aren't needed
+        # until it has been trimmed, so they download in the meantime.
+        with ParallelFileIO(fileStore) as fileIO:
+            outgroupSequenceRead, mostRecentResultsRead = fileIO.prefetch([self.outgroupSequenceIDs[0],
+                                                                           self.mostRecentResultsID])
+            mostRecentResultsIndex = None
+            if self.mostRecentResultsIndexID is not None:
+                mostRecentResultsIndex = fileIO.prefetch([self.mostRecentResultsIndexID])[0]
+            sequenceReads = fileIO.prefetch(self.sequenceIDs)
+            untrimmedSequenceReads = fileIO.prefetch(self.untrimmedSequenceIDs)
+            outgroupSequenceFiles = [outgroupSequenceRead.get()]
+            mostRecentResultsFile = mostRecentResultsRead.get()
+            if mostRecentResultsIndex is not None:
+                mostRecentResultsIndex = mostRecentResultsIndex.get()
+            trimmedOutgroup = fileStore.getLocalTempFile()
+            outgroupCoverage = fileStore.getLocalTempFile()
+            calculateCoverage(outgroupSequenceFiles[0],
+                              mostRecentResultsFile, outgroupCoverage)
+            # The windowSize and threshold are fixed at 1: anything more
+            # and we will run into problems with alignments that aren't
+            # covered in a matching trimmed sequence.
+            trimSequences(outgroupSequenceFiles[0], outgroupCoverage,
+                          trimmedOutgroup, flanking=self.blastOptions.trimOutgroupFlanking,
+                          windowSize=1, threshold=1)
+            outgroupConvertedResultsFile = fileStore.getLocalTempFile()
+            with open(outgroupConvertedResultsFile, 'w') as f:
+                upconvertCoords(cigarPath=mostRecentResultsFile,
+                                fastaPath=trimmedOutgroup,
+                                contigNum=1,
+                                outputFile=f)
+
+            self.outgroupFragmentIDs.append(fileStore.writeGlobalFile(trimmedOutgroup))
+            sequenceFiles = [read.get() for read in sequenceReads]
+            untrimmedSequenceFiles = [read.get() for read in untrimmedSequenceReads]
 
         # Report coverage of the latest outgroup on the trimmed ingroups.
         for trimmedIngroupSequence, ingroupSequence, ingroupName in zip(sequenceFiles, untrimmedSequenceFiles, self.ingroupNames):
             tmpIngroupCoverage = fileStore.getLocalTempFile()
             calculateCoverage(trimmedIngroupSequence, mostRecentResultsFile,
-                              tmpIngroupCoverage)
+                              tmpIngroupCoverage, cigarIndex=mostRecentResultsIndex)
             fileStore.logToMaster("Coverage on %s from outgroup #%d, %s: %s%% (current ingroup length %d, untrimmed length %d). Outgroup trimmed to %d bp from %d" % (ingroupName, self.outgroupNumber, self.outgroupNames[self.outgroupNumber - 1], percentCoverage(trimmedIngroupSequence, tmpIngroupCoverage), sequenceLength(trimmedIngroupSequence), sequenceLength(ingroupSequence), sequenceLength(trimmedOutgroup), sequenceLength(outgroupSequenceFiles[0])))
 
         # Convert the alignments' ingroup coordinates.
@@ -318,9 +374,7 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
             outgroupResultsFile = fileStore.readGlobalFile(self.outgroupResultsID, mutable=True)
         else:
             outgroupResultsFile = fileStore.getLocalTempFile()
-        with open(ingroupConvertedResultsFile) as results:
-            with open(outgroupResultsFile, 'a') as output:
-                output.write(results.read())
+        concatenateFiles([ingroupConvertedResultsFile], outgroupResultsFile, append=True)
 
         self.outgroupResultsID = fileStore.writeGlobalFile(outgroupResultsFile)
 
@@ -373,6 +427,24 @@ class TrimAndRecurseOnOutgroups(RoundedJob):
             # Finally, put the ingroups and outgroups results together
             return (self.outgroupResultsID, self.outgroupFragmentIDs, self.ingroupCoverageIDs)
 
+def packChunk(chunk, blastOptions):
+    """Converts a fasta chunk to 2bit if the options ask for it, returning
+    the path of the file to write to the job store.
+    """
+    if not blastOptions.twoBit:
+        return chunk
+    twoBitChunk = chunk + ".2bit"
+    fastaToTwoBit(chunk, twoBitChunk)
+    return twoBitChunk
+
+def unpackChunk(chunk, blastOptions, tempFile):
+    """Gets a fasta version of a chunk for the tools that can't read 2bit.
+    """
+    if not blastOptions.twoBit:
+        return chunk
+    twoBitToFasta(chunk, tempFile)
+    return tempFile
+
 def compressFastaFile(fileName):
     """Compress a fasta file.
     """
@@ -389,8 +461,10 @@ class RunSelfBlast(RoundedJob):
     """Runs blast as a job.
     """
     def __init__(self, blastOptions, seqFileID):
-        disk = 3*seqFileID.size
-        memory = 3*seqFileID.size
+        # A 2bit chunk is about a quarter of the size of the sequence it holds
+        seqSize = seqFileID.size * (4 if blastOptions.twoBit else 1)
+        memory, disk = fittedResources(self, {'sequenceSize': seqSize}, 'sequenceSize',
+                                       3*seqSize, 3*seqSize)
         
         super(RunSelfBlast, self).__init__(memory=memory, disk=disk, preemptable=True)
         self.blastOptions = blastOptions
@@ -402,6 +476,7 @@ class RunSelfBlast(RoundedJob):
         runSelfLastz(seqFile, blastResultsFile, lastzArguments=self.blastOptions.lastzArguments)
         if self.blastOptions.realign:
             realignResultsFile = fileStore.getLocalTempFile()
+            seqFile = unpackChunk(seqFile, self.blastOptions, fileStore.getLocalTempFile())
             runCactusSelfRealign(seqFile, inputAlignmentsFile=blastResultsFile,
                                  outputAlignmentsFile=realignResultsFile,
                                  realignArguments=self.blastOptions.realignArguments)
@@ -422,8 +497,9 @@ class RunBlast(RoundedJob):
     """
     def __init__(self, blastOptions, seqFileID1, seqFileID2):
         if hasattr(seqFileID1, "size") and hasattr(seqFileID2, "size"):
-            disk = 2*(seqFileID1.size + seqFileID2.size)
-            memory = 2*(seqFileID1.size + seqFileID2.size)
+            seqSize = (seqFileID1.size + seqFileID2.size) * (4 if blastOptions.twoBit else 1)
+            memory, disk = fittedResources(self, {'sequenceSize': seqSize}, 'sequenceSize',
+                                           2*seqSize, 2*seqSize)
         else:
             disk = None
             memory = None
@@ -433,8 +509,9 @@ class RunBlast(RoundedJob):
         self.seqFileID2 = seqFileID2
     
     def run(self, fileStore):
-        seqFile1 = fileStore.readGlobalFile(self.seqFileID1)
-        seqFile2 = fileStore.readGlobalFile(self.seqFileID2)
+        # Each chunk is compared against many others, often on the same node
+        seqFile1 = nodeCache.readGlobalFile(fileStore, self.seqFileID1)
+        seqFile2 = nodeCache.readGlobalFile(fileStore, self.seqFileID2)
         if self.blastOptions.compressFiles:
             seqFile1 = decompressFastaFile(seqFile1, fileStore.getLocalTempFile())
             seqFile2 = decompressFastaFile(seqFile2, fileStore.getLocalTempFile())
@@ -443,6 +520,8 @@ class RunBlast(RoundedJob):
         runLastz(seqFile1, seqFile2, blastResultsFile, lastzArguments = self.blastOptions.lastzArguments)
         if self.blastOptions.realign:
             realignResultsFile = fileStore.getLocalTempFile()
+            seqFile1 = unpackChunk(seqFile1, self.blastOptions, fileStore.getLocalTempFile())
+            seqFile2 = unpackChunk(seqFile2, self.blastOptions, fileStore.getLocalTempFile())
             runCactusRealign(seqFile1, seqFile2, inputAlignmentsFile=blastResultsFile,
                              outputAlignmentsFile=realignResultsFile,
                              realignArguments=self.blastOptions.realignArguments)
@@ -457,32 +536,42 @@ class RunBlast(RoundedJob):
         return fileStore.writeGlobalFile(resultsFile)
 
 class CollateBlasts(RoundedJob):
-    def __init__(self, blastOptions, resultsFileIDs):
+    def __init__(self, blastOptions, resultsFileIDs, buildIndex=False):
         super(CollateBlasts, self).__init__(preemptable=True)
         self.blastOptions = blastOptions
         self.resultsFileIDs = resultsFileIDs
+        self.buildIndex = buildIndex
 
     def run(self, fileStore):
-        return self.addFollowOn(CollateBlasts2(self.blastOptions, self.resultsFileIDs)).rv()
+        return self.addFollowOn(CollateBlasts2(self.blastOptions, self.resultsFileIDs, buildIndex=self.buildIndex)).rv()
 
 class CollateBlasts2(RoundedJob):
-    """Collates all the blasts into a single alignments file.
+    """Collates all the blasts into a single alignments file. If buildIndex
+    is set, also returns the ID of a CIGAR index of the collated file.
     """
-    def __init__(self, blastOptions, resultsFileIDs):
-        disk = 8*sum([alignmentID.size for alignmentID in resultsFileIDs])
-        memory = blastOptions.memory
+    def __init__(self, blastOptions, resultsFileIDs, buildIndex=False):
+        alignmentsSize = sum([alignmentID.size for alignmentID in resultsFileIDs])
+        memory, disk = fittedResources(self, {'alignmentsSize': alignmentsSize}, 'alignmentsSize',
+                                       blastOptions.memory, 8*alignmentsSize)
         super(CollateBlasts2, self).__init__(memory=memory, disk=disk, preemptable=True)
         self.resultsFileIDs = resultsFileIDs
+        self.buildIndex = buildIndex
     
     def run(self, fileStore):
         logger.info("Results IDs: %s" % self.resultsFileIDs)
-        resultsFiles = [readGlobalFileWithoutCache(fileStore, fileID) for fileID in self.resultsFileIDs]
         collatedResultsFile = fileStore.getLocalTempFile()
-        catFiles(resultsFiles, collatedResultsFile)
+        # Read straight from the job store, without local copies of the
+        # results files
+        concatenateStreams((fileStore.readGlobalFileStream(fileID) for fileID in self.resultsFileIDs),
+                           collatedResultsFile)
         logger.info("Collated the alignments to the file: %s",  collatedResultsFile)
         collatedResultsID = fileStore.writeGlobalFile(collatedResultsFile)
         for resultsFileID in self.resultsFileIDs:
             fileStore.deleteGlobalFile(resultsFileID)
+        if self.buildIndex:
+            indexFile = fileStore.getLocalTempFile()
+            buildCigarIndex(collatedResultsFile, indexFile)
+            return collatedResultsID, fileStore.writeGlobalFile(indexFile)
         return collatedResultsID
 
 def sequenceLength(sequenceFile):
@@ -505,16 +594,36 @@ def percentCoverage(sequenceFile, coverageFile):
         return 0
     return 100*float(coverage)/sequenceLen
 
-def calculateCoverage(sequenceFile, cigarFile, outputFile, fromGenome=None, depthById=False, work_dir=None):
+def sequenceNames(sequenceFile):
+    """Get the names (first word of the headers) of the sequences in a fasta file."""
+    return [line[1:].split()[0] for line in open(sequenceFile) if line.startswith(">") and line[1:].strip() != ""]
+
+def calculateCoverage(sequenceFile, cigarFile, outputFile, fromGenome=None, depthById=False, work_dir=None,
+                      cigarIndex=None):
     logger.info("Calculating coverage of cigar file %s on %s, writing to %s" % (
         cigarFile, sequenceFile, outputFile))
-    args = [sequenceFile, cigarFile]
-    if fromGenome is not None:
-        args += ["--from", fromGenome]
-    if depthById:
-        args += ["--depthById"]
-    cactus_call(outfile=outputFile, work_dir=work_dir,
-                parameters=["cactus_coverage"] + args)
+    indexedCigarFile = None
+    if cigarIndex is not None:
+        # Only the alignments touching the sequences can contribute. The
+        # slice goes beside the output, in the job's temp dir, rather than
+        # beside the (possibly shared) input.
+        fd, indexedCigarFile = tempfile.mkstemp(suffix=".slice",
+                                                dir=work_dir or os.path.dirname(os.path.abspath(outputFile)))
+        os.close(fd)
+    try:
+        if indexedCigarFile is not None:
+            extractAlignments(cigarFile, cigarIndex, sequenceNames(sequenceFile), indexedCigarFile)
+            cigarFile = indexedCigarFile
+        args = [sequenceFile, cigarFile]
+        if fromGenome is not None:
+            args += ["--from", fromGenome]
+        if depthById:
+            args += ["--depthById"]
+        cactus_call(outfile=outputFile, work_dir=work_dir,
+                    parameters=["cactus_coverage"] + args)
+    finally:
+        if indexedCigarFile is not None:
+            os.remove(indexedCigarFile)
 
 def subtractBed(bed1, bed2, destBed):
     """Subtract two non-bed12 beds"""
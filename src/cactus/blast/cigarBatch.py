@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Batch parsing and writing of CIGAR files.
+
+Rather than building a PairwiseAlignment object (and an AlignmentOperation
+object per operation) for every line, as sonLib's cigarRead does, files
+are read in large blocks and each block is parsed column by column into
+the struct of arrays form used by the binary alignment format
+(cactus.blast.binaryAlignments.AlignmentColumns), from which numpy arrays
+can be taken without copying. The writer goes the other way a batch at a
+time. Where numpy is installed it is used to convert the numeric columns.
+
+Running this module as a script benchmarks the batch parser and writer
+against cigarRead and cigarWrite.
+"""
+import os
+import time
+import random
+from itertools import chain
+from argparse import ArgumentParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cactus.blast.binaryAlignments import AlignmentColumns, getScoreDigits, formatScore
+
+DEFAULT_BLOCK_BYTES = 1 << 24
+
+def _extendColumn(column, strings, typeFn):
+    """Convert a list of strings to numbers and add them to an array.
+    """
+    if numpy is None or len(strings) == 0:
+        column.fromlist(map(typeFn, strings))
+    else:
+        # numpy's parser is several times faster than calling int/float on each string
+        dtype = numpy.float64 if typeFn == float else numpy.int64
+        column.fromstring(numpy.fromstring(" ".join(strings), dtype=dtype, sep=" ").tostring())
+
+def parseCigarLines(lines, names=None):
+    """Parse a list of lines into an AlignmentColumns object, skipping any
+    that aren't CIGAR lines. New sequence names are added to names, if
+    given, so it can be shared between batches.
+    """
+    columns = AlignmentColumns(names)
+    tokens = [line.split() for line in lines if line.startswith("cigar:")]
+    opStart = 0
+    opStarts = []
+    for lineTokens in tokens:
+        if len(lineTokens) < 10 or len(lineTokens) % 2 != 0:
+            raise RuntimeError("Malformed cigar line: %s" % " ".join(lineTokens))
+        opStarts.append(opStart)
+        opStart += (len(lineTokens) - 10) / 2
+    getNameId = columns.getNameId
+    columns.contig1.fromlist([getNameId(t[1]) for t in tokens])
+    _extendColumn(columns.start1, [t[2] for t in tokens], int)
+    _extendColumn(columns.end1, [t[3] for t in tokens], int)
+    columns.strand1.fromlist([int(t[4] == "+") for t in tokens])
+    columns.contig2.fromlist([getNameId(t[5]) for t in tokens])
+    _extendColumn(columns.start2, [t[6] for t in tokens], int)
+    _extendColumn(columns.end2, [t[7] for t in tokens], int)
+    columns.strand2.fromlist([int(t[8] == "+") for t in tokens])
+    scores = [t[9] for t in tokens]
+    _extendColumn(columns.score, scores, float)
+    columns.scoreDigits.fromlist(map(getScoreDigits, scores))
+
+    columns.opStart.fromlist(opStarts)
+    opTokens = list(chain.from_iterable(t[10:] for t in tokens))
+    opTypes = "".join(opTokens[0::2])
+    if opTypes.translate(None, "MID") != "":
+        raise RuntimeError("Only M, I and D operations are supported in cigar lines")
+    columns.opType.fromstring(opTypes)
+    _extendColumn(columns.opLength, opTokens[1::2], int)
+    return columns
+
+def readCigarBatches(fileHandle, blockBytes=DEFAULT_BLOCK_BYTES, names=None):
+    """Yields AlignmentColumns batches holding the alignments of a CIGAR
+    file, reading about blockBytes at a time. The batches share a names
+    list.
+    """
+    if names is None:
+        names = []
+    remainder = ""
+    while True:
+        block = fileHandle.read(blockBytes)
+        if block == "":
+            break
+        block = remainder + block
+        lastNewline = block.rfind("\n")
+        if lastNewline == -1:
+            remainder = block
+            continue
+        remainder = block[lastNewline + 1:]
+        columns = parseCigarLines(block[:lastNewline].split("\n"), names)
+        if len(columns) > 0:
+            yield columns
+    if remainder != "":
+        columns = parseCigarLines([remainder], names)
+        if len(columns) > 0:
+            yield columns
+
+def formatCigarLines(columns):
+    """Get the CIGAR lines (without newlines) of a batch of alignments.
+    """
+    names = columns.names
+    strands = ("-", "+")
+    opStrings = [" %s %i" % op for op in zip(columns.opType, columns.opLength)]
+    opEnds = list(columns.opStart[1:]) + [len(opStrings)]
+    return ["cigar: %s %i %i %s %s %i %i %s %s%s" % (names[contig1], start1, end1, strands[strand1],
+                                                   names[contig2], start2, end2, strands[strand2],
+                                                   formatScore(score, digits),
+                                                   "".join(opStrings[opStart:opEnd]))
+            for contig1, start1, end1, strand1, contig2, start2, end2, strand2, score, digits, opStart, opEnd in
+            zip(columns.contig1, columns.start1, columns.end1, columns.strand1,
+                columns.contig2, columns.start2, columns.end2, columns.strand2,
+                columns.score, columns.scoreDigits, columns.opStart, opEnds)]
+
+def writeCigarBatch(columns, fileHandle):
+    """Write a batch of alignments to a file handle as CIGAR lines.
+    """
+    if len(columns) > 0:
+        fileHandle.write("\n".join(formatCigarLines(columns)))
+        fileHandle.write("\n")
+
+def makeRandomCigarFile(path, alignments, contigs=100, maxOps=20):
+    with open(path, 'w') as fileHandle:
+        for i in xrange(alignments):
+            ops = [(random.choice("MID"), random.randint(1, 1000)) for j in xrange(random.randint(1, maxOps))]
+            # Insertions only consume the first sequence, deletions the second
+            length1 = sum(length for opType, length in ops if opType != "D")
+            length2 = sum(length for opType, length in ops if opType != "I")
+            start1 = random.randint(0, 10000000)
+            start2 = random.randint(0, 10000000)
+            fileHandle.write("cigar: seq%i %i %i + seq%i %i %i - %i %s\n" % (random.randint(0, contigs), start1, start1 + length1,
+                                                                            random.randint(0, contigs), start2 + length2, start2,
+                                                                            random.randint(0, 100000),
+                                                                            " ".join("%s %i" % op for op in ops)))
+
+def benchmark(cigarPath, repeats=3):
+    """Time reading and writing the CIGAR file with the batch functions and
+    with sonLib, returning a dict of rates in MB/s.
+    """
+    size = os.path.getsize(cigarPath) / 1000000.0
+    nullFile = open(os.devnull, 'w')
+    def rate(fn):
+        best = min(timeIt(fn) for i in xrange(repeats))
+        return size / best if best > 0 else float("inf")
+    def timeIt(fn):
+        start = time.time()
+        fn()
+        return time.time() - start
+    def batchRead():
+        with open(cigarPath) as fileHandle:
+            for columns in readCigarBatches(fileHandle):
+                pass
+    with open(cigarPath) as fileHandle:
+        batches = list(readCigarBatches(fileHandle))
+    def batchWrite():
+        for columns in batches:
+            writeCigarBatch(columns, nullFile)
+    rates = { "batchRead": rate(batchRead), "batchWrite": rate(batchWrite) }
+    try:
+        from sonLib.bioio import cigarRead, cigarWrite
+    except ImportError:
+        return rates
+    def sonLibRead():
+        with open(cigarPath) as fileHandle:
+            for alignment in cigarRead(fileHandle):
+                pass
+    with open(cigarPath) as fileHandle:
+        alignments = list(cigarRead(fileHandle))
+    def sonLibWrite():
+        for alignment in alignments:
+            cigarWrite(nullFile, alignment, False)
+    rates["cigarRead"] = rate(sonLibRead)
+    rates["cigarWrite"] = rate(sonLibWrite)
+    return rates
+
+def main():
+    parser = ArgumentParser(description="Benchmark the batch CIGAR parser and writer against "
+                            "sonLib's cigarRead and cigarWrite")
+    parser.add_argument("cigarFiles", nargs="*", help="CIGAR files to benchmark on, "
+                        "a random file is used if none are given")
+    parser.add_argument("--randomAlignments", type=int, default=100000,
+                        help="Number of alignments in the random file")
+    parser.add_argument("--repeats", type=int, default=3)
+    opts = parser.parse_args()
+    cigarFiles = opts.cigarFiles
+    if len(cigarFiles) == 0:
+        randomCigarPath = os.path.abspath("randomAlignments.cigar")
+        makeRandomCigarFile(randomCigarPath, opts.randomAlignments)
+        cigarFiles = [randomCigarPath]
+    for cigarPath in cigarFiles:
+        rates = benchmark(cigarPath, opts.repeats)
+        print "%s (%.1f MB):" % (cigarPath, os.path.getsize(cigarPath) / 1000000.0)
+        for name in sorted(rates.keys()):
+            print "\t%s\t%.1f MB/s" % (name, rates[name])
+    if len(opts.cigarFiles) == 0:
+        os.remove(randomCigarPath)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import random
+from StringIO import StringIO
+from textwrap import dedent
+
+from sonLib.bioio import getTempFile
+from sonLib.bioio import cigarRead, PairwiseAlignment
+from cactus.shared.test import silentOnSuccess
+from cactus.blast.cigarBatch import readCigarBatches, writeCigarBatch, parseCigarLines
+from cactus.blast.cigarBatch import makeRandomCigarFile
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.cigarPath = getTempFile()
+
+    def tearDown(self):
+        os.remove(self.cigarPath)
+
+    @silentOnSuccess
+    def testRoundTrip(self):
+        cigar = dedent('''\
+        cigar: seq1 0 10 + seq2 20 10 - 30 M 10
+        cigar: seq2 5 9 + seq1 0 5 + 3.500000 M 2 I 1 M 2 D 1
+        cigar: seq3 0 1 + seq1 100 101 + 1.5 M 1
+        ''')
+        # Small blocks so that lines are split across reads
+        for blockBytes in [1, 7, 100, 100000]:
+            output = StringIO()
+            for batch in readCigarBatches(StringIO(cigar), blockBytes=blockBytes):
+                writeCigarBatch(batch, output)
+            self.assertEquals(output.getvalue(), cigar)
+        # A missing final newline
+        output = StringIO()
+        for batch in readCigarBatches(StringIO(cigar.strip())):
+            writeCigarBatch(batch, output)
+        self.assertEquals(output.getvalue(), cigar)
+
+    @silentOnSuccess
+    def testMalformedLines(self):
+        self.assertRaises(RuntimeError, parseCigarLines, ["cigar: a 0 1 + b 0 1 + 1 M"])
+        self.assertRaises(RuntimeError, parseCigarLines, ["cigar: a 0 1 + b 0 1 + 1 X 1 0.5"])
+        self.assertEquals(len(parseCigarLines(["# comment", "", "cigar: a 0 1 + b 0 1 + 1 M 1"])), 1)
+
+    @silentOnSuccess
+    def testAgreesWithCigarRead(self):
+        random.seed(1)
+        makeRandomCigarFile(self.cigarPath, 1000)
+        with open(self.cigarPath) as fileHandle:
+            alignments = list(cigarRead(fileHandle))
+        opTypes = { PairwiseAlignment.PAIRWISE_MATCH: "M",
+                    PairwiseAlignment.PAIRWISE_INDEL_X: "D",
+                    PairwiseAlignment.PAIRWISE_INDEL_Y: "I" }
+        i = 0
+        with open(self.cigarPath) as fileHandle:
+            for batch in readCigarBatches(fileHandle, blockBytes=10000):
+                for j in xrange(len(batch)):
+                    # sonLib's contig 1 is the second sequence on the line
+                    alignment = alignments[i]
+                    self.assertEquals(batch.names[batch.contig1[j]], alignment.contig2)
+                    self.assertEquals(batch.start1[j], alignment.start2)
+                    self.assertEquals(batch.end1[j], alignment.end2)
+                    self.assertEquals(bool(batch.strand1[j]), alignment.strand2)
+                    self.assertEquals(batch.names[batch.contig2[j]], alignment.contig1)
+                    self.assertEquals(batch.start2[j], alignment.start1)
+                    self.assertEquals(batch.end2[j], alignment.end1)
+                    self.assertEquals(bool(batch.strand2[j]), alignment.strand1)
+                    self.assertEquals(batch.score[j], alignment.score)
+                    self.assertEquals([(batch.opType[k], batch.opLength[k]) for k in xrange(batch.opStart[j], batch.opEnd(j))],
+                                      [(opTypes[op.type], op.length) for op in alignment.operationList])
+                    i += 1
+        self.assertEquals(i, len(alignments))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""A sidecar index for CIGAR files, so that the alignments touching a given
+sequence or interval can be read without scanning the whole file.
+
+The index maps (sequence, bin) to the byte ranges of the CIGAR lines whose
+interval on that sequence starts in the bin. Both sequences of every
+alignment are indexed. Runs of consecutive lines falling in the same bin
+are merged into a single byte range, so a sorted or partly sorted file
+gives a small index. Each sequence also records the longest alignment
+interval seen on it, which bounds how far to the left of a query interval
+an overlapping alignment can start.
+"""
+import struct
+from argparse import ArgumentParser
+
+MAGIC = "CACTUSCI"
+DEFAULT_BIN_SIZE = 100000
+
+_header = struct.Struct("<8sQQ")
+_contigHeader = struct.Struct("<IQQ")
+_binHeader = struct.Struct("<QQ")
+_range = struct.Struct("<QQ")
+
+def _alignmentIntervals(line):
+    """Get (contig, start, end) for both sides of a CIGAR line, with
+    start < end whatever the strand.
+    """
+    tokens = line.split(None, 9)
+    start1, end1 = int(tokens[2]), int(tokens[3])
+    start2, end2 = int(tokens[6]), int(tokens[7])
+    return ((tokens[1], min(start1, end1), max(start1, end1)),
+            (tokens[5], min(start2, end2), max(start2, end2)))
+
+def mergeRanges(ranges):
+    """Sort and merge a list of (start, end) byte ranges.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+class CigarIndex(object):
+    """The index of a CIGAR file, which is either built from the file or
+    loaded from an index file.
+    """
+    def __init__(self, binSize=DEFAULT_BIN_SIZE):
+        self.binSize = binSize
+        # contig -> bin -> list of (start, end) byte ranges
+        self.bins = {}
+        # contig -> length of the longest alignment interval on it
+        self.maxSpans = {}
+
+    def _add(self, contig, start, end, lineStart, lineEnd):
+        bins = self.bins.get(contig)
+        if bins is None:
+            bins = self.bins[contig] = {}
+            self.maxSpans[contig] = 0
+        self.maxSpans[contig] = max(self.maxSpans[contig], end - start)
+        ranges = bins.setdefault(start / self.binSize, [])
+        if ranges and ranges[-1][1] == lineStart:
+            ranges[-1] = (ranges[-1][0], lineEnd)
+        else:
+            ranges.append((lineStart, lineEnd))
+
+    @staticmethod
+    def build(cigarPath, binSize=DEFAULT_BIN_SIZE):
+        index = CigarIndex(binSize)
+        offset = 0
+        with open(cigarPath, 'rb') as cigarFile:
+            for line in cigarFile:
+                lineEnd = offset + len(line)
+                if line.startswith("cigar:"):
+                    interval1, interval2 = _alignmentIntervals(line)
+                    index._add(interval1[0], interval1[1], interval1[2], offset, lineEnd)
+                    if interval2[0] != interval1[0] or interval2[1] / binSize != interval1[1] / binSize:
+                        index._add(interval2[0], interval2[1], interval2[2], offset, lineEnd)
+                    else:
+                        index.maxSpans[interval1[0]] = max(index.maxSpans[interval1[0]], interval2[2] - interval2[1])
+                offset = lineEnd
+        return index
+
+    def write(self, indexPath):
+        with open(indexPath, 'wb') as indexFile:
+            indexFile.write(_header.pack(MAGIC, self.binSize, len(self.bins)))
+            for contig, bins in self.bins.iteritems():
+                indexFile.write(_contigHeader.pack(len(contig), self.maxSpans[contig], len(bins)))
+                indexFile.write(contig)
+                for binNumber, ranges in bins.iteritems():
+                    indexFile.write(_binHeader.pack(binNumber, len(ranges)))
+                    for byteRange in ranges:
+                        indexFile.write(_range.pack(*byteRange))
+
+    @staticmethod
+    def load(indexPath):
+        with open(indexPath, 'rb') as indexFile:
+            data = indexFile.read()
+        magic, binSize, contigCount = _header.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise RuntimeError("%s is not a CIGAR index" % indexPath)
+        index = CigarIndex(binSize)
+        position = _header.size
+        for i in xrange(contigCount):
+            nameLength, maxSpan, binCount = _contigHeader.unpack_from(data, position)
+            position += _contigHeader.size
+            contig = data[position:position + nameLength]
+            position += nameLength
+            index.maxSpans[contig] = maxSpan
+            bins = index.bins[contig] = {}
+            for j in xrange(binCount):
+                binNumber, rangeCount = _binHeader.unpack_from(data, position)
+                position += _binHeader.size
+                bins[binNumber] = [_range.unpack_from(data, position + k*_range.size) for k in xrange(rangeCount)]
+                position += rangeCount*_range.size
+        return index
+
+    def contigs(self):
+        return self.bins.keys()
+
+    def query(self, contig, start=None, end=None):
+        """Get the merged byte ranges holding every alignment that touches
+        the given sequence, or the interval [start, end) of it if given.
+        A missing start or end leaves that side of the interval open. The
+        ranges may also hold some alignments that don't.
+        """
+        bins = self.bins.get(contig, {})
+        if start is None and end is None:
+            return mergeRanges([byteRange for ranges in bins.itervalues() for byteRange in ranges])
+        firstBin = 0
+        if start is not None:
+            firstBin = max(0, start - self.maxSpans.get(contig, 0)) / self.binSize
+        lastBin = None
+        if end is not None:
+            lastBin = (end - 1) / self.binSize
+        ranges = []
+        for binNumber, binRanges in bins.iteritems():
+            if firstBin <= binNumber and (lastBin is None or binNumber <= lastBin):
+                ranges.extend(binRanges)
+        return mergeRanges(ranges)
+
+    def fetch(self, cigarFile, contig, start=None, end=None):
+        """Yields the CIGAR lines of the (open) CIGAR file that touch the given
+        sequence, or the interval [start, end) of it, in file order. A
+        missing start or end leaves that side of the interval open.
+        """
+        for line in self._readRanges(cigarFile, self.query(contig, start, end)):
+            for lineContig, lineStart, lineEnd in _alignmentIntervals(line):
+                if lineContig == contig and (start is None or lineEnd > start) \
+                        and (end is None or lineStart < end):
+                    yield line
+                    break
+
+    def fetchContigs(self, cigarFile, contigs):
+        """Yields the CIGAR lines of the (open) CIGAR file that touch any of
+        the given sequences, each once and in file order.
+        """
+        ranges = []
+        for contig in contigs:
+            ranges.extend(self.query(contig))
+        for line in self._readRanges(cigarFile, mergeRanges(ranges)):
+            yield line
+
+    def _readRanges(self, cigarFile, ranges):
+        for start, end in ranges:
+            cigarFile.seek(start)
+            for line in cigarFile.read(end - start).splitlines(True):
+                if line.startswith("cigar:"):
+                    yield line
+
+def buildCigarIndex(cigarPath, indexPath, binSize=DEFAULT_BIN_SIZE):
+    """Index a CIGAR file, writing the index to indexPath.
+    """
+    CigarIndex.build(cigarPath, binSize).write(indexPath)
+
+def extractAlignments(cigarPath, indexPath, contigs, outputPath):
+    """Write the alignments of a CIGAR file that touch any of the given
+    sequences to outputPath.
+    """
+    index = CigarIndex.load(indexPath)
+    with open(cigarPath, 'rb') as cigarFile, open(outputPath, 'w') as outputFile:
+        for line in index.fetchContigs(cigarFile, contigs):
+            outputFile.write(line)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("cigarFile")
+    parser.add_argument("indexFile")
+    parser.add_argument("--binSize", type=int, default=DEFAULT_BIN_SIZE)
+    parser.add_argument("--query", help="Print the alignments touching this "
+                        "sequence (or sequence:start-end interval) using an existing index")
+    opts = parser.parse_args()
+    if opts.query is None:
+        buildCigarIndex(opts.cigarFile, opts.indexFile, opts.binSize)
+    else:
+        contig, start, end = opts.query, None, None
+        if ":" in opts.query:
+            contig, interval = opts.query.rsplit(":", 1)
+            start, end = [int(i) for i in interval.split("-")]
+        index = CigarIndex.load(opts.indexFile)
+        with open(opts.cigarFile, 'rb') as cigarFile:
+            for line in index.fetch(cigarFile, contig, start, end):
+                print line,
+
+if __name__ == '__main__':
+    main()
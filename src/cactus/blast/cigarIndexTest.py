@@ -0,0 +1,97 @@
+import unittest
+import os
+import random
+from textwrap import dedent
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.blast.cigarIndex import CigarIndex, buildCigarIndex, extractAlignments
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.cigarPath = getTempFile()
+        open(self.cigarPath, 'w').write(dedent('''\
+        cigar: seq1 0 10 + seq2 20 10 - 30 M 10
+        cigar: seq2 5 9 + seq1 100 105 + 3 M 2 I 1 M 2 D 1
+        # A comment
+        cigar: seq3 0 1 + seq1 250 251 + 1 M 1
+        cigar: seq1 1000 900 - seq3 0 100 + 2 M 100
+        '''))
+        self.tempFiles = [self.cigarPath]
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    def fetch(self, index, contig, start=None, end=None):
+        with open(self.cigarPath, 'rb') as cigarFile:
+            return [line.split()[1:4] for line in index.fetch(cigarFile, contig, start, end)]
+
+    @silentOnSuccess
+    def testQueries(self):
+        indexPath = self.getTempFile()
+        buildCigarIndex(self.cigarPath, indexPath, binSize=100)
+        index = CigarIndex.load(indexPath)
+        self.assertEquals(sorted(index.contigs()), ["seq1", "seq2", "seq3"])
+        self.assertEquals(self.fetch(index, "seq1"), [["seq1", "0", "10"], ["seq2", "5", "9"],
+                                                      ["seq3", "0", "1"], ["seq1", "1000", "900"]])
+        self.assertEquals(self.fetch(index, "seq2"), [["seq1", "0", "10"], ["seq2", "5", "9"]])
+        self.assertEquals(self.fetch(index, "seq4"), [])
+        # Intervals are half open
+        self.assertEquals(self.fetch(index, "seq1", 10, 250), [["seq2", "5", "9"]])
+        self.assertEquals(self.fetch(index, "seq1", 9, 101), [["seq1", "0", "10"], ["seq2", "5", "9"]])
+        # An alignment starting several bins to the left of the query
+        self.assertEquals(self.fetch(index, "seq1", 950, 951), [["seq1", "1000", "900"]])
+        self.assertEquals(self.fetch(index, "seq3", 50, 60), [["seq1", "1000", "900"]])
+        # A missing end or start leaves the interval open on that side
+        self.assertEquals(self.fetch(index, "seq1", 250), [["seq3", "0", "1"], ["seq1", "1000", "900"]])
+        self.assertEquals(self.fetch(index, "seq1", 251), [["seq1", "1000", "900"]])
+        self.assertEquals(self.fetch(index, "seq1", None, 10), [["seq1", "0", "10"]])
+        self.assertEquals(index.query("seq1", 250), index.query("seq1", 250, 10**9))
+
+    @silentOnSuccess
+    def testRandomQueries(self):
+        random.seed(1)
+        lines = []
+        for i in xrange(500):
+            contigs = [random.choice(["a", "b", "c"]) for j in xrange(2)]
+            starts = [random.randint(0, 10000) for j in xrange(2)]
+            lengths = [random.randint(1, 2000) for j in xrange(2)]
+            lines.append("cigar: %s %i %i + %s %i %i + 1 M 1\n" % (contigs[0], starts[0], starts[0] + lengths[0],
+                                                                    contigs[1], starts[1], starts[1] + lengths[1]))
+        open(self.cigarPath, 'w').write("".join(lines))
+        index = CigarIndex.build(self.cigarPath, binSize=500)
+        for i in xrange(100):
+            contig = random.choice(["a", "b", "c"])
+            start = random.randint(0, 12000)
+            end = start + random.randint(1, 1000)
+            expected = []
+            for line in lines:
+                tokens = line.split()
+                if (tokens[1] == contig and int(tokens[2]) < end and int(tokens[3]) > start) or \
+                   (tokens[5] == contig and int(tokens[6]) < end and int(tokens[7]) > start):
+                    expected.append(line.split()[1:4])
+            self.assertEquals(self.fetch(index, contig, start, end), expected)
+
+    @silentOnSuccess
+    def testExtractAlignments(self):
+        indexPath = self.getTempFile()
+        buildCigarIndex(self.cigarPath, indexPath)
+        outputPath = self.getTempFile()
+        extractAlignments(self.cigarPath, indexPath, ["seq2", "seq3"], outputPath)
+        self.assertEquals(open(outputPath).read(), dedent('''\
+        cigar: seq1 0 10 + seq2 20 10 - 30 M 10
+        cigar: seq2 5 9 + seq1 100 105 + 3 M 2 I 1 M 2 D 1
+        cigar: seq3 0 1 + seq1 250 251 + 1 M 1
+        cigar: seq1 1000 900 - seq3 0 100 + 2 M 100
+        '''))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 from collections import defaultdict
 from operator import itemgetter
 
+from cactus.shared.fastaIO import FastaFile, writeSubsequences
+
 def windowFilter(windowSize, threshold, blockDict, seqLengths):
     if windowSize == 1 and threshold == 1:
         # Don't need to do expensive window-filtering
@@ -88,16 +90,9 @@ def getSeparateBedBlocks(bedFile, depth=1):
 def getSeqLengths(fastaFile):
     """Get a dict which maps header -> sequence size."""
     ret = defaultdict(int)
-    chr = ""
-    for line in fastaFile:
-        line = line.strip()
-        if len(line) == 0:
-            # Blank line
-            continue
-        if line[0] == '>':
-            chr = line.split()[0][1:]
-        else:
-            ret[chr] += len(line)
+    with FastaFile(fastaFile) as fasta:
+        for record in fasta.records():
+            ret[record.name()] += record.length()
     return ret
 
 def complementBlocks(blocksDict, seqLengths):
@@ -117,34 +112,16 @@ def complementBlocks(blocksDict, seqLengths):
             ret[chr].append((0, len))
     return ret
 
-def printTrimmedSeq(header, seq, blocks, outFile):
-    for block in blocks:
-        outFile.write(">%s|%d\n" % (header, block[0]))
-        outFile.write(seq[block[0]:block[1]])
-        outFile.write("\n")
-
 def printTrimmedFasta(fastaFile, toTrim, outFile):
-    header = None
-    seq = None
-    for line in fastaFile:
-        line = line.strip()
-        if len(line) == 0:
-            # Blank line
-            continue
-        if line[0] == '>':
-            if seq is not None:
-                printTrimmedSeq(header, seq, toTrim[header], outFile)
-            seq = ""
-            header = line[1:].split()[0]
-            continue
-        seq += line
-    if seq is not None:
-        printTrimmedSeq(header, seq, toTrim[header], outFile)
+    with FastaFile(fastaFile) as fasta:
+        for record in fasta.records():
+            header = record.name()
+            writeSubsequences(record, toTrim[header], outFile,
+                              lambda start: "%s|%d" % (header, start))
 
 def trimSequences(fastaPath, bedPath, outputPathOrFile, flanking=0, minSize=0,
                   windowSize=10, threshold=0.8, depth=1, complement=False):
-    fastaFile = open(fastaPath)
-    seqLengths = getSeqLengths(fastaFile)
+    seqLengths = getSeqLengths(fastaPath)
     with open(bedPath) as bedFile:
         toTrim = windowFilter(windowSize, threshold,
                               getSeparateBedBlocks(bedFile, depth), seqLengths)
@@ -160,11 +137,10 @@ def trimSequences(fastaPath, bedPath, outputPathOrFile, flanking=0, minSize=0,
                           v))
                   for k, v in toTrim.items())
 
-    fastaFile.seek(0)
     try:
         outputPathOrFile.write('')
         outputFile = outputPathOrFile
     except:
         # Not a file
         outputFile = open(outputPathOrFile, 'w')
-    printTrimmedFasta(fastaFile, toTrim, outputFile)
+    printTrimmedFasta(fastaPath, toTrim, outputFile)
@@ -3,7 +3,8 @@ from argparse import ArgumentParser
 from collections import defaultdict
 import sys
 import os
-from sonLib.bioio import cigarRead, cigarWrite, getTempFile, system
+import subprocess32
+from cactus.blast.cigarBatch import readCigarBatches, writeCigarBatch
 
 def getSequenceRanges(fa):
     """Get dict of (untrimmed header) -> [(start, non-inclusive end)] mappings
@@ -54,11 +55,13 @@ def validateRanges(seqRanges):
                 assert start < range2[0]
 
 def sortCigarByContigAndPos(cigarPath, contigNum):
+    """Start sorting the alignments by contig and position, returning the
+    sort process, which writes them to its stdout."""
     contigNameKey = 2 if contigNum == 1 else 6
     startPosKey = 3 if contigNum == 1 else 7
-    tempFile = getTempFile()
-    system("sort -k %d,%d -k %d,%dn %s > %s" % (contigNameKey, contigNameKey, startPosKey, startPosKey, cigarPath, tempFile))
-    return tempFile
+    return subprocess32.Popen(["sort", "-k", "%d,%d" % (contigNameKey, contigNameKey),
+                               "-k", "%d,%dn" % (startPosKey, startPosKey), cigarPath],
+                              stdout=subprocess32.PIPE, bufsize=-1)
 
 def upconvertCoords(cigarPath, fastaPath, contigNum, outputFile):
     """Convert the coordinates of the given alignment, so that the
@@ -67,18 +70,25 @@ def upconvertCoords(cigarPath, fastaPath, contigNum, outputFile):
     with open(fastaPath) as f:
         seqRanges = getSequenceRanges(f)
     validateRanges(seqRanges)
-    sortedCigarPath = sortCigarByContigAndPos(cigarPath, contigNum)
-    sortedCigarFile = open(sortedCigarPath)
+    # The sorted alignments are read straight from sort, rather than
+    # through a temporary file
+    sortProcess = sortCigarByContigAndPos(cigarPath, contigNum)
+    sortedCigarFile = sortProcess.stdout
 
     currentContig = None
     currentRangeIdx = None
     currentRange = None
-    for alignment in cigarRead(sortedCigarFile):
-        # contig1 and contig2 are reversed in python api!!
-        contig = alignment.contig2 if contigNum == 1 else alignment.contig1
-        minPos = min(alignment.start2, alignment.end2) if contigNum == 1 else min(alignment.start1, alignment.end1)
-        maxPos = max(alignment.start2, alignment.end2) if contigNum == 1 else max(alignment.start1, alignment.end1)
-        if contig in seqRanges:
+    for alignments in readCigarBatches(sortedCigarFile):
+        # The contig being converted is the first on the line for contigNum 1
+        contigs = alignments.contig1 if contigNum == 1 else alignments.contig2
+        starts = alignments.start1 if contigNum == 1 else alignments.start2
+        ends = alignments.end1 if contigNum == 1 else alignments.end2
+        for i in xrange(len(alignments)):
+            contig = alignments.names[contigs[i]]
+            minPos = min(starts[i], ends[i])
+            maxPos = max(starts[i], ends[i])
+            if contig not in seqRanges:
+                continue
             if contig != currentContig:
                 currentContig = contig
                 currentRangeIdx = 0
@@ -93,18 +103,15 @@ def upconvertCoords(cigarPath, fastaPath, contigNum, outputFile):
                                        (contig,
                                         minPos,
                                         maxPos))
-                if contigNum == 1:
-                    alignment.start2 -= currentRange[0]
-                    alignment.end2 -= currentRange[0]
-                    alignment.contig2 = contig + ("|%d" % currentRange[0])
-                else:
-                    alignment.start1 -= currentRange[0]
-                    alignment.end1 -= currentRange[0]
-                    alignment.contig1 = contig + ("|%d" % currentRange[0])
+                starts[i] -= currentRange[0]
+                ends[i] -= currentRange[0]
+                contigs[i] = alignments.getNameId(contig + ("|%d" % currentRange[0]))
             else:
                 raise RuntimeError("No trimmed sequence containing alignment "
                                    "on %s:%d-%d" % (contig,
                                                     minPos,
                                                     maxPos))
-        cigarWrite(outputFile, alignment, False)
-    os.remove(sortedCigarPath)
+        writeCigarBatch(alignments, outputFile)
+    sortedCigarFile.close()
+    if sortProcess.wait() != 0:
+        raise RuntimeError("Sorting the alignments in %s failed" % cigarPath)
@@ -27,7 +27,7 @@ from toil.lib.bioio import getTempFile
 from toil.lib.bioio import logger
 from toil.lib.bioio import setLoggingFromOptions
 from toil.lib.bioio import system
-from sonLib.bioio import catFiles
+from cactus.shared.common import catFiles
 from sonLib.bioio import getLogLevelString
 
 from toil.job import Job
@@ -41,7 +41,7 @@ from cactus.shared.common import runCactusSetup
 from cactus.shared.common import runCactusCaf
 from cactus.shared.common import runCactusGetFlowers
 from cactus.shared.common import runCactusExtendFlowers
-from cactus.shared.common import runCactusSplitFlowersBySecondaryGrouping
+from cactus.shared.common import iterFlowerGroups
 from cactus.shared.common import encodeFlowerNames
 from cactus.shared.common import decodeFirstFlowerName
 from cactus.shared.common import runCactusConvertAlignmentToCactus
@@ -60,6 +60,9 @@ from cactus.shared.common import runConvertAlignmentsToInternalNames
 from cactus.shared.common import runStripUniqueIDs
 from cactus.shared.common import RoundedJob
 from cactus.shared.common import readGlobalFileWithoutCache
+from cactus.shared.fastaIO import transformFasta
+from cactus.shared.resourceModel import getResourceModel
+from cactus.shared.fileStoreIO import readGlobalFiles
 
 from cactus.blast.blast import BlastIngroupsAndOutgroups
 from cactus.blast.blast import BlastOptions
@@ -71,7 +74,13 @@ from cactus.shared.experimentWrapper import ExperimentWrapper
 from cactus.shared.experimentWrapper import DbElemWrapper
 from cactus.shared.configWrapper import ConfigWrapper
 from cactus.pipeline.ktserverToil import KtServerService
-from cactus.pipeline.ktserverControl import stopKtserver
+from cactus.pipeline.ktserverControl import stopKtserver, clearKtserver
+from cactus.pipeline.ktserverSizing import KtserverSizing
+from cactus.pipeline.ktserverSnapshot import waitForSnapshot, exportPlainSnapshot
+from cactus.pipeline.lmdbSnapshot import saveLmdbSnapshot, restoreLmdbSnapshot
+from cactus.pipeline.ktserverHandoff import getHandoffDir
+from cactus.pipeline.ktserverShards import getShardCount, getShardSnapshotIDs, makeShardedConfString, \
+    getShardConfStrings
 
 ############################################################
 ############################################################
@@ -108,14 +117,25 @@ class CactusJob(RoundedJob):
 
         memory = None
         cores = None
-        if hasattr(self, 'memoryPoly'):
+        disk = None
+        fittedModel = getResourceModel(self.__class__.__name__)
+        if fittedModel is not None:
+            # A model fitted to the metrics of earlier runs replaces the
+            # static polynomial
+            self.sizingFeature = fittedModel.feature
+            self.sizingFeatures = self.resourceFeatures()
+            memory = fittedModel.memory(self.sizingFeatures)
+            disk = fittedModel.disk(self.sizingFeatures)
+        if memory is None and hasattr(self, 'memoryPoly'):
             # Memory should be determined by a polynomial fit on the
             # input size
             memory = self.evaluateResourcePoly(self.memoryPoly)
-            if hasattr(self, 'memoryCap'):
-                memory = int(min(memory, self.memoryCap))
+            # Record what the memory depends on, so it can be refitted
+            self.sizingFeature = getattr(self, 'feature', 'totalSequenceSize')
+            self.sizingFeatures = self.resourceFeatures()
+        if memory is not None and hasattr(self, 'memoryCap'):
+            memory = int(min(memory, self.memoryCap))
 
-        disk = None
         if memory is None and overlarge:
             memory = self.getOptionalJobAttrib("overlargeMemory", typeFn=int,
                                                default=getOptionalAttrib(self.constantsNode, "defaultOverlargeMemory", int, default=sys.maxint))
@@ -129,11 +149,16 @@ class CactusJob(RoundedJob):
         RoundedJob.__init__(self, memory=memory, cores=cores, disk=disk,
                             checkpoint=checkpoint, preemptable=preemptable)
 
-    def evaluateResourcePoly(self, poly):
-        """Evaluate a polynomial based on the total sequence size."""
+    def resourceFeatures(self):
+        """Get the features resource usage is modelled on."""
         features = {'totalSequenceSize': self.cactusWorkflowArguments.totalSequenceSize}
         if hasattr(self, 'featuresFn'):
             features.update(self.featuresFn())
+        return features
+
+    def evaluateResourcePoly(self, poly):
+        """Evaluate a polynomial based on the total sequence size."""
+        features = self.resourceFeatures()
         if hasattr(self, 'feature'):
             x = features[self.feature]
         else:
@@ -174,7 +199,14 @@ class CactusPhasesJob(CactusJob):
         CactusJob.__init__(self, phaseNode=phaseNode, constantsNode=constantsNode, overlarge=False,
                            checkpoint=checkpoint, preemptable=preemptable)
 
-    def makeRecursiveChildJob(self, job, launchSecondaryKtForRecursiveJob=False):
+    def getKtserverSizing(self, shards=1):
+        """Size a DB, or one of its shards, for this problem from its sequence
+        and alignments."""
+        alignmentsID = getattr(self.cactusWorkflowArguments, 'alignmentsID', None)
+        return KtserverSizing(self.cactusWorkflowArguments.totalSequenceSize or 0,
+                              getattr(alignmentsID, 'size', None) or 0, shards=shards)
+
+    def makeRecursiveChildJob(self, job):
         newChild = job(phaseNode=extractNode(self.phaseNode), 
                        constantsNode=extractNode(self.constantsNode),
                        cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString, 
@@ -182,30 +214,20 @@ class CactusPhasesJob(CactusJob):
                        flowerSizes=[self.cactusWorkflowArguments.totalSequenceSize],
                        overlarge=True,
                        cactusWorkflowArguments=self.cactusWorkflowArguments)
-
-        if launchSecondaryKtForRecursiveJob and ExperimentWrapper(self.cactusWorkflowArguments.experimentNode).getDbType() == "kyoto_tycoon":
-            cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
-            memory = max(2500000000, self.evaluateResourcePoly([4.10201882, 2.01324291e+08]))
-            cpu = cw.getKtserverCpu(default=0.1)
-            dbElem = ExperimentWrapper(self.cactusWorkflowArguments.scratchDbElemNode)
-            dbString = self.addService(KtServerService(dbElem=dbElem, isSecondary=True, memory=memory, cores=cpu)).rv(0)
-            newChild.phaseNode.attrib["secondaryDatabaseString"] = dbString
-            return self.addChild(newChild).rv()
-        else:
-            return self.addChild(newChild).rv()
+        return self.addChild(newChild).rv()
 
     def makeFollowOnPhaseJob(self, job, phaseName):
         return self.addFollowOn(job(cactusWorkflowArguments=self.cactusWorkflowArguments, phaseName=phaseName, 
                                     topFlowerName=self.topFlowerName, halID=self.halID, fastaID=self.fastaID)).rv()
 
-    def runPhase(self, recursiveJob, nextPhaseJob, nextPhaseName, doRecursion=True, launchSecondaryKtForRecursiveJob=False):
+    def runPhase(self, recursiveJob, nextPhaseJob, nextPhaseName, doRecursion=True):
         """
         Adds a recursive child job and then a follow-on phase job. Returns the result of the follow-on
         phase job.
         """
         logger.info("Starting %s phase job at %s seconds (recursing = %i)" % (self.phaseNode.tag, time.time(), doRecursion))
         if doRecursion:
-            self.makeRecursiveChildJob(recursiveJob, launchSecondaryKtForRecursiveJob)
+            self.makeRecursiveChildJob(recursiveJob)
         return self.makeFollowOnPhaseJob(job=nextPhaseJob, phaseName=nextPhaseName)
 
     def makeFollowOnCheckpointJob(self, checkpointConstructor, phaseName, ktServerDump=None):
@@ -220,12 +242,16 @@ class CactusPhasesJob(CactusJob):
         return len(self.cactusWorkflowArguments.configNode.findall(self.phaseNode.tag))
 
     def setupSecondaryDatabase(self):
-        """Setup the secondary database
+        """Setup the secondary database. The server pooled by StartSecondaryDB
+        is cleared of anything left by an earlier phase, or by an earlier
+        attempt at this one.
         """
         confXML = ET.fromstring(self.cactusWorkflowArguments.secondaryDatabaseString)
         dbElem = DbElemWrapper(confXML)
         if dbElem.getDbType() != "kyoto_tycoon":
             runCactusSecondaryDatabase(self.cactusWorkflowArguments.secondaryDatabaseString, create=True)
+        else:
+            clearKtserver(dbElem)
 
     def cleanupSecondaryDatabase(self):
         """Cleanup the secondary database
@@ -234,6 +260,8 @@ class CactusPhasesJob(CactusJob):
         dbElem = DbElemWrapper(confXML)
         if dbElem.getDbType() != "kyoto_tycoon":
             runCactusSecondaryDatabase(self.cactusWorkflowArguments.secondaryDatabaseString, create=False)
+        else:
+            clearKtserver(dbElem)
 
 class CactusCheckpointJob(CactusPhasesJob):
     """Special "checkpoint" phase job, launching and restoring the primary Cactus DB.
@@ -272,23 +300,99 @@ class StartPrimaryDB(CactusPhasesJob):
     def run(self, fileStore):
         cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
 
-        if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon":
-            memory = max(2500000000, self.evaluateResourcePoly([4.10201882, 2.01324291e+08]))
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon" and getShardCount() > 1:
+            return self.startShards()
+        elif self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon":
+            sizing = self.getKtserverSizing()
             cores = cw.getKtserverCpu(default=0.1)
             dbElem = ExperimentWrapper(self.cactusWorkflowArguments.experimentNode)
             service = self.addService(KtServerService(dbElem=dbElem,
                                                       existingSnapshotID=self.ktServerDump,
                                                       isSecondary=False,
-                                                      memory=memory, cores=cores))
+                                                      memory=sizing.getMemory(), cores=cores,
+                                                      phase=self.phaseName, sizing=sizing))
             dbString = service.rv(0)
             snapshotID = service.rv(1)
+            snapshotDoneID = service.rv(2)
             self.nextJob.cactusWorkflowArguments.cactusDiskDatabaseString = dbString
             # TODO: This part needs to be cleaned up
             self.nextJob.cactusWorkflowArguments.snapshotID = snapshotID
+            self.nextJob.cactusWorkflowArguments.snapshotDoneID = snapshotDoneID
             return self.addChild(self.nextJob).rv()
         else:
+            if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "lmdb":
+                # Undo anything left by an earlier attempt at this checkpoint
+                restoreLmdbSnapshot(fileStore, self.cactusWorkflowArguments.experimentWrapper.getDbDir(),
+                                    self.ktServerDump)
             return self.addFollowOn(self.nextJob).rv()
 
+    def startShards(self):
+        """Launch a server for each shard of the DB (see ktserverShards),
+        running the next job once they have all started."""
+        cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
+        shards = getShardCount()
+        sizing = self.getKtserverSizing(shards=shards)
+        cores = cw.getKtserverCpu(default=0.1)
+        services = []
+        for snapshotID in getShardSnapshotIDs(self.ktServerDump, shards):
+            dbElem = ExperimentWrapper(copy.deepcopy(self.cactusWorkflowArguments.experimentNode))
+            services.append(self.addService(KtServerService(dbElem=dbElem,
+                                                            existingSnapshotID=snapshotID,
+                                                            isSecondary=False,
+                                                            memory=sizing.getMemory(), cores=cores,
+                                                            phase=self.phaseName, sizing=sizing)))
+        return self.addChild(RouteShards(self.nextJob,
+                                         dbStrings=[service.rv(0) for service in services],
+                                         snapshotIDs=[service.rv(1) for service in services],
+                                         snapshotDoneIDs=[service.rv(2) for service in services])).rv()
+
+class StartSecondaryDB(CactusPhasesJob):
+    """Launches the secondary, scratch DB shared by the reference and HAL
+    phases of a subproblem, which stays up until the next job and all its
+    successors have finished. Each phase clears it before and after using
+    it, so the phases don't see each other's records.
+    """
+    def __init__(self, nextJob, *args, **kwargs):
+        self.nextJob = nextJob
+        kwargs['checkpoint'] = True
+        kwargs['preemptable'] = False
+        super(StartSecondaryDB, self).__init__(*args, **kwargs)
+
+    def usesSecondaryDB(self):
+        configNode = self.cactusWorkflowArguments.configNode
+        return getOptionalAttrib(findRequiredNode(configNode, "reference"), "buildReference", bool, False) or \
+            getOptionalAttrib(findRequiredNode(configNode, "hal"), "buildHal", bool, False)
+
+    def run(self, fileStore):
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "kyoto_tycoon" and self.usesSecondaryDB():
+            cw = ConfigWrapper(self.cactusWorkflowArguments.configNode)
+            sizing = self.getKtserverSizing()
+            cores = cw.getKtserverCpu(default=0.1)
+            dbElem = ExperimentWrapper(self.cactusWorkflowArguments.scratchDbElemNode)
+            service = self.addService(KtServerService(dbElem=dbElem, isSecondary=True,
+                                                      memory=sizing.getMemory(), cores=cores,
+                                                      phase=self.phaseName, sizing=sizing))
+            self.nextJob.cactusWorkflowArguments.secondaryDatabaseString = service.rv(0)
+            return self.addChild(self.nextJob).rv()
+        else:
+            return self.addFollowOn(self.nextJob).rv()
+
+class RouteShards(Job):
+    """Gives the next job the conf string of a sharded primary DB, which
+    can only be made once the servers of its shards have started."""
+    def __init__(self, nextJob, dbStrings, snapshotIDs, snapshotDoneIDs):
+        Job.__init__(self, cores=0.1, memory=100000000, preemptable=False)
+        self.nextJob = nextJob
+        self.dbStrings = dbStrings
+        self.snapshotIDs = snapshotIDs
+        self.snapshotDoneIDs = snapshotDoneIDs
+
+    def run(self, fileStore):
+        self.nextJob.cactusWorkflowArguments.cactusDiskDatabaseString = makeShardedConfString(self.dbStrings)
+        self.nextJob.cactusWorkflowArguments.snapshotID = self.snapshotIDs
+        self.nextJob.cactusWorkflowArguments.snapshotDoneID = self.snapshotDoneIDs
+        return self.addChild(self.nextJob).rv()
+
 class SavePrimaryDB(CactusPhasesJob):
     """Saves the DB to a file and clears the DB."""
     def __init__(self, *args, **kwargs):
@@ -298,22 +402,44 @@ class SavePrimaryDB(CactusPhasesJob):
         stats = runCactusFlowerStats(cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString,
                                      flowerName=0)
         fileStore.logToMaster("At end of %s phase, got stats %s" % (self.phaseName, stats))
-        dbElem = DbElemWrapper(ET.fromstring(self.cactusWorkflowArguments.cactusDiskDatabaseString))
-        # Send the terminate message
-        stopKtserver(dbElem)
-        # Wait for the file to appear in the right place. This may take a while
-        while True:
-            with fileStore.readGlobalFileStream(self.cactusWorkflowArguments.snapshotID) as f:
-                if f.read(1) != '':
-                    # The file is no longer empty
-                    break
-            time.sleep(10)
-        # We have the file now
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "lmdb":
+            # The DB is kept on disk between checkpoints, but copied so
+            # that a rerun of the next checkpoint can start from the copy
+            snapshotID = saveLmdbSnapshot(fileStore, self.cactusWorkflowArguments.experimentWrapper.getDbDir())
+            intermediateResultsUrl = getattr(self.cactusWorkflowArguments, 'intermediateResultsUrl', None)
+            if intermediateResultsUrl is not None:
+                fileStore.exportFile(snapshotID, intermediateResultsUrl + "-dump-" + self.phaseName)
+            return snapshotID
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() != "kyoto_tycoon":
+            # The DB is kept on disk between checkpoints rather than served
+            return None
+        # Send the terminate message to the server of each shard, handing
+        # them off to the next checkpoint if that's enabled
+        for confString in getShardConfStrings(self.cactusWorkflowArguments.cactusDiskDatabaseString):
+            stopKtserver(DbElemWrapper(ET.fromstring(confString)), handoff=getHandoffDir() is not None)
+        # The snapshot is exported as the server shuts down, which Toil
+        # waits for before running the jobs that follow the checkpoint, so
+        # it only has to be waited for here to export it now.
         intermediateResultsUrl = getattr(self.cactusWorkflowArguments, 'intermediateResultsUrl', None)
         if intermediateResultsUrl is not None:
-            # The user requested to keep the DB dumps in a separate place. Export it there.
+            snapshotID = self.cactusWorkflowArguments.snapshotID
+            snapshotDoneID = getattr(self.cactusWorkflowArguments, 'snapshotDoneID', None)
+            if isinstance(snapshotID, list):
+                for shardDoneID in snapshotDoneID:
+                    waitForSnapshot(fileStore.jobStore, shardDoneID)
+            elif snapshotDoneID is not None:
+                waitForSnapshot(fileStore.jobStore, snapshotDoneID)
+            else:
+                # Started before the snapshot was published
+                waitForSnapshot(fileStore.jobStore, snapshotID)
+            # The user requested to keep the DB dumps in a separate place. Export it there,
+            # as the server wrote it.
             url = intermediateResultsUrl + "-dump-" + self.phaseName
-            fileStore.exportFile(self.cactusWorkflowArguments.snapshotID, url)
+            if isinstance(snapshotID, list):
+                for i, shardSnapshotID in enumerate(snapshotID):
+                    exportPlainSnapshot(fileStore, shardSnapshotID, "%s-shard%i" % (url, i))
+            else:
+                exportPlainSnapshot(fileStore, snapshotID, url)
         return self.cactusWorkflowArguments.snapshotID
 
 class CactusRecursionJob(CactusJob):
@@ -375,8 +501,11 @@ class CactusRecursionJob(CactusJob):
         if phaseNode == None:
             phaseNode = self.phaseNode
         
-        logger.info("Make wrapper jobs: There are %i flowers" % len(flowersAndSizes))
+        # flowersAndSizes may be streamed from the tool finding them, so
+        # children are added as they come
+        numFlowers = 0
         for overlarge, flowerNames, flowerSizes in flowersAndSizes:
+            numFlowers += 1
             if overlarge: #Make sure large flowers are on their own, in their own job
                 flowerStatsString = runCactusFlowerStats(cactusDiskDatabaseString=self.cactusDiskDatabaseString,
                                                          flowerName=decodeFirstFlowerName(flowerNames))
@@ -398,6 +527,7 @@ class CactusRecursionJob(CactusJob):
                                   flowerSizes=flowerSizes,
                                   overlarge=False,
                                   cactusWorkflowArguments=self.cactusWorkflowArguments)).rv()
+        logger.info("Made wrapper jobs: There were %i flowers" % numFlowers)
 
     def makeRecursiveJobs(self, fileStore=None, job=None, phaseNode=None):
         """Make a set of child jobs for a given set of parent flowers.
@@ -438,7 +568,7 @@ class CactusRecursionJob(CactusJob):
     def makeWrapperJobs(self, job, overlargeJob=None, phaseNode=None):
         """Takes the list of flowers for a recursive job and splits them up to fit the given wrapper job(s).
         """
-        splitFlowerNames = runCactusSplitFlowersBySecondaryGrouping(self.flowerNames)
+        splitFlowerNames = iterFlowerGroups(self.flowerNames)
         # We've split the flower names up into groups, but now we need
         # to put the flower sizes in so that they correspond with
         # their flower.
@@ -470,19 +600,13 @@ def prependUniqueIDs(fas, outputDir):
     (prepend rather than append since trimmed outgroups have a start
     token appended, which complicates removal slightly)
     """
-    uniqueID = 0
     ret = []
-    for fa in fas:
+    for uniqueID, fa in enumerate(fas):
         outPath = os.path.join(outputDir, os.path.basename(fa))
-        out = open(outPath, 'w')
-        for line in open(fa):
-            if len(line) > 0 and line[0] == '>':
-                header = "id=%d|%s" % (uniqueID, line[1:-1])
-                out.write(">%s\n" % header)
-            else:
-                out.write(line)
+        prefix = "id=%d|" % uniqueID
+        # The sequences have already been through the preprocessor's checks
+        transformFasta(fa, outPath, headerFn=lambda header: prefix + header, validate=False)
         ret.append(outPath)
-        uniqueID += 1
     return ret
 
 def setupDivergenceArgs(cactusWorkflowArguments):
@@ -552,7 +676,9 @@ class CactusTrimmingBlastPhase(CactusPhasesJob):
                          trimWindowSize=self.getOptionalPhaseAttrib("trimWindowSize", int, 10),
                          trimOutgroupFlanking=self.getOptionalPhaseAttrib("trimOutgroupFlanking", int, 100),
                          trimOutgroupDepth=self.getOptionalPhaseAttrib("trimOutgroupDepth", int, 1),
-                         keepParalogs=self.getOptionalPhaseAttrib("keepParalogs", bool, False)),
+                         keepParalogs=self.getOptionalPhaseAttrib("keepParalogs", bool, False),
+                         twoBit=getOptionalAttrib(cafNode, "twoBit", bool, False),
+                         indexAlignments=getOptionalAttrib(cafNode, "indexAlignments", bool, False)),
             map(itemgetter(0), ingroupItems), map(itemgetter(1), ingroupItems),
             map(itemgetter(0), outgroupItems), map(itemgetter(1), outgroupItems)))
         
@@ -621,19 +747,22 @@ class CactusSetupPhase(CactusPhasesJob):
         sequenceIDs = []
         tree = self.cactusWorkflowArguments.experimentWrapper.getTree()
         sequenceNames = []
-        firstLines = []
         for node in tree.postOrderTraversal():
             if tree.isLeaf(node):
-                seqID = self.cactusWorkflowArguments.experimentWrapper.seqIDMap[tree.getName(node)]
-                sequenceIDs.append(seqID)
-                seq = fileStore.readGlobalFile(seqID)
+                sequenceIDs.append(self.cactusWorkflowArguments.experimentWrapper.seqIDMap[tree.getName(node)])
                 sequenceNames.append(tree.getName(node))
-                with open(seq, 'r') as fh:
-                    firstLines.append(fh.readline())
 
-        sequences = [fileStore.readGlobalFile(fileID) for fileID in sequenceIDs]
+        sequences = readGlobalFiles(fileStore, sequenceIDs)
+        firstLines = []
+        for seq in sequences:
+            with open(seq, 'r') as fh:
+                firstLines.append(fh.readline())
         logger.info("Sequences in cactus setup: %s" % sequenceNames)
         logger.info("Sequences in cactus setup filenames: %s" % firstLines)
+        if self.cactusWorkflowArguments.experimentWrapper.getDbType() == "lmdb":
+            # The embedded DB isn't restarted with the job, so clear anything
+            # an earlier attempt wrote to it
+            restoreLmdbSnapshot(fileStore, self.cactusWorkflowArguments.experimentWrapper.getDbDir(), None)
         messages = runCactusSetup(cactusDiskDatabaseString=self.cactusWorkflowArguments.cactusDiskDatabaseString, 
                        sequences=sequences,
                        newickTreeString=self.cactusWorkflowArguments.speciesTree, 
@@ -816,7 +945,15 @@ class CactusBarCheckpoint(CactusCheckpointJob):
     """Load the DB, run the BAR, AVG, and normalization phases, save the DB, then run the reference checkpoint."""
     def run(self, fileStore):
         ktServerDump = self.runPhaseWithPrimaryDB(CactusBarPhase).rv()
-        return self.makeFollowOnCheckpointJob(CactusReferenceCheckpoint, "reference", ktServerDump=ktServerDump)
+        # The secondary DB is pooled for the reference and HAL checkpoints
+        referenceCheckpoint = CactusReferenceCheckpoint(phaseName="reference", ktServerDump=ktServerDump,
+                                                        cactusWorkflowArguments=self.cactusWorkflowArguments,
+                                                        topFlowerName=self.topFlowerName,
+                                                        halID=self.halID, fastaID=self.fastaID)
+        return self.addFollowOn(StartSecondaryDB(referenceCheckpoint,
+                                                 cactusWorkflowArguments=self.cactusWorkflowArguments,
+                                                 phaseName="reference",
+                                                 topFlowerName=self.topFlowerName)).rv()
 
 class CactusBarPhase(CactusPhasesJob):
     """Runs bar algorithm."""
@@ -832,8 +969,9 @@ class CactusBarRecursion(CactusRecursionJob):
         self.makeExtendingJobs(fileStore=fileStore,
                                job=CactusBarWrapper, overlargeJob=CactusBarWrapperLarge)
 
-def runBarForJob(self, fileStore=None, features=None, calculateWhichEndsToComputeSeparately=False, endAlignmentsToPrecomputeOutputFile=None, precomputedAlignments=None):
+def runBarForJob(self, fileStore=None, features=None, calculateWhichEndsToComputeSeparately=False, endAlignmentsToPrecomputeOutputFile=None, precomputedAlignments=None, streamOutput=False):
     return runCactusBar(jobName=self.__class__.__name__,
+                 streamOutput=streamOutput,
                  fileStore=fileStore,
                  features=features,
                  cactusDiskDatabaseString=self.cactusDiskDatabaseString,
@@ -868,7 +1006,7 @@ class CactusBarWrapper(CactusRecursionJob):
     memoryPoly = [2.81473430e-01, 2.96245523e+09]
 
     def run(self, fileStore):
-        messages = runBarForJob(self, features=self.featuresFn(), fileStore=fileStore)
+        messages = runBarForJob(self, features=self.featuresFn(), fileStore=fileStore, streamOutput=True)
         for message in messages:
             fileStore.logToMaster(message)
 
@@ -885,8 +1023,10 @@ class CactusBarWrapperLarge(CactusRecursionJob):
         endsToAlign = []
         endSizes = []
         precomputedAlignmentIDs = []
+        # Children are added for the very large ends as cactus_bar reports them
         for line in runBarForJob(self, features=self.featuresFn(),
-                                 fileStore=fileStore, calculateWhichEndsToComputeSeparately=True):
+                                 fileStore=fileStore, calculateWhichEndsToComputeSeparately=True,
+                                 streamOutput=True):
             endToAlign, sequencesInEndAlignment, basesInEndAlignment = line.split()
             sequencesInEndAlignment = int(sequencesInEndAlignment)
             basesInEndAlignment = int(basesInEndAlignment)
@@ -1076,8 +1216,7 @@ class CactusReferencePhase(CactusPhasesJob):
         self.phaseNode.attrib["experimentPath"] = self.cactusWorkflowArguments.experimentFile
         self.phaseNode.attrib["secondaryDatabaseString"] = self.cactusWorkflowArguments.secondaryDatabaseString
         return self.runPhase(CactusReferenceRecursion, CactusSetReferenceCoordinatesDownPhase, "reference", 
-                             doRecursion=self.getOptionalPhaseAttrib("buildReference", bool, False),
-                             launchSecondaryKtForRecursiveJob=True)
+                             doRecursion=self.getOptionalPhaseAttrib("buildReference", bool, False))
 
 class CactusReferenceRecursion(CactusRecursionJob):
     """This job creates the wrappers to run the reference problem algorithm, the follow on job then recurses down.
@@ -1263,7 +1402,7 @@ class CactusHalGeneratorPhase2(CactusPhasesJob):
             self.phaseNode.attrib["secondaryDatabaseString"] = self.cactusWorkflowArguments.secondaryDatabaseString
             self.phaseNode.attrib["outputFile"] = "1"
 
-            self.halID = self.makeRecursiveChildJob(CactusHalGeneratorRecursion, launchSecondaryKtForRecursiveJob=True)
+            self.halID = self.makeRecursiveChildJob(CactusHalGeneratorRecursion)
 
         return self.makeFollowOnPhaseJob(CactusHalGeneratorPhase3, "hal")
 
@@ -1381,6 +1520,15 @@ class CactusWorkflowArguments:
         #Secondary, scratch DB
         secondaryConf = copy.deepcopy(self.experimentNode.find("cactus_disk").find("st_kv_database_conf"))
         secondaryElem = DbElemWrapper(secondaryConf)
+        if secondaryElem.getDbType() == "lmdb":
+            # The secondary DB is opened by binaries that only know the
+            # stKVDatabase backends, so is kept in a Tokyo Cabinet DB beside
+            # the embedded primary DB
+            secondaryConf = ET.Element("st_kv_database_conf", type="tokyo_cabinet")
+            ET.SubElement(secondaryConf, "tokyo_cabinet")
+            secondaryDir = secondaryElem.getDbDir() + "-secondary"
+            secondaryElem = DbElemWrapper(secondaryConf)
+            secondaryElem.setDbDir(secondaryDir)
         self.secondaryDatabaseString = secondaryElem.getConfString()
 
         #The config node
@@ -1412,7 +1560,8 @@ def addCactusWorkflowOptions(parser):
                       default=False)
     parser.add_argument("--intermediateResultsUrl",
                         help="URL prefix to save intermediate results like DB dumps to (e.g. "
-                        "prefix-dump-caf, prefix-dump-avg, etc.)", default=None)
+                        "prefix-dump-caf, prefix-dump-avg, etc.). The dumps are the server's "
+                        "own snapshot files", default=None)
 
 class RunCactusPreprocessorThenCactusSetup(RoundedJob):
     def __init__(self, options, cactusWorkflowArguments):
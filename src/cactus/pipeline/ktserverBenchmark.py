@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Measures the throughput and latency of cactus DBs under load on one
+machine, so that server tuning options, shard counts and backends can be
+compared.
+
+Each configuration is benchmarked in turn, in a Toil workflow whose jobs
+run one after another. Kyoto Tycoon DBs are started through
+KtServerService, as cactus starts them, one server for each shard, and
+records are routed to the shards as cactusDisk routes them. LMDB DBs are
+opened by each process from a local directory, which needs the lmdb Python
+module. The ktserver is run as cactus runs its binaries, so set
+CACTUS_BINARIES_MODE=local to benchmark a locally built one.
+
+The DB is first loaded by the writer processes, each inserting blocks of
+records with names handed out as cactus hands them out. Then for the
+given duration the readers get, and the writers update, records picked at
+random. Record sizes are drawn from a log-normal distribution, as most
+cactus records are a few hundred bytes but a few large flowers are much
+larger. The workload is seeded, so runs of it can be compared.
+
+This replaces dbTest, whose load test was written for jobTree.
+"""
+
+import os
+import math
+import json
+import random
+import struct
+import traceback
+import xml.etree.ElementTree as ET
+from argparse import ArgumentParser
+from multiprocessing import Process, Queue, Event
+from time import time
+
+from toil.job import Job
+from toil.common import Toil
+from toil.lib.humanize import human2bytes
+
+from cactus.shared.experimentWrapper import DbElemWrapper
+from cactus.pipeline.ktserverToil import KtServerService
+from cactus.pipeline.ktserverControl import getClient
+from cactus.pipeline.ktserverShards import getShardIndex, HASH_PARTITION, PARTITIONS, INT64_MAX
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+BACKENDS = ("kyoto_tycoon", "lmdb")
+
+# The number of buckets cactus hands out blocks of names from
+NAME_BUCKETS = 65536
+
+# As cactusDiskLmdb defaults to
+DEFAULT_LMDB_MAP_SIZE = 2**40
+
+OPERATIONS = ("insert", "get", "update")
+
+class LatencyHistogram(object):
+    """Counts of latencies in buckets whose bounds double, the first
+    holding those under a microsecond and the last everything over about
+    half an hour."""
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0.0
+        self.maximum = 0.0
+
+    @staticmethod
+    def getBucket(seconds):
+        microseconds = seconds * 1e6
+        if microseconds < 1:
+            return 0
+        return min(int(math.log(microseconds, 2)) + 1, LatencyHistogram.BUCKETS - 1)
+
+    @staticmethod
+    def getUpperBound(bucket):
+        """The latency, in seconds, that the bucket holds those under."""
+        return 2**bucket / 1e6
+
+    def add(self, seconds):
+        self.counts[self.getBucket(seconds)] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        return self.total / self.count() if self.count() > 0 else 0.0
+
+    def percentile(self, fraction):
+        """An upper bound on the latency that the given fraction of the
+        operations were faster than."""
+        target = fraction * self.count()
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count > 0 and seen >= target:
+                return min(self.getUpperBound(bucket), self.maximum)
+        return self.maximum
+
+class RecordSizes(object):
+    """Draws record sizes from a log-normal distribution with the given
+    median, capped at maximum."""
+    def __init__(self, median, sigma, maximum, rng):
+        self.mu = math.log(median)
+        self.sigma = sigma
+        self.maximum = maximum
+        self.rng = rng
+
+    def next(self):
+        return max(1, min(int(self.rng.lognormvariate(self.mu, self.sigma)), self.maximum))
+
+def makeKeyBlocks(records, blockSize, rng):
+    """The names of the records, in blocks of consecutive names, each taken
+    from the next free names of a random bucket of the positive int64s, as
+    cactus hands out unique IDs."""
+    bucketSize = INT64_MAX // NAME_BUCKETS
+    nextNames = {}
+    blocks = []
+    for first in xrange(0, records, blockSize):
+        bucket = rng.randrange(NAME_BUCKETS)
+        start = nextNames.get(bucket, bucketSize * bucket + 1)
+        blocks.append(range(start, start + min(blockSize, records - first)))
+        nextNames[bucket] = blocks[-1][-1] + 1
+    return blocks
+
+def encodeKey(key):
+    """A record's key as cactusDisk stores it."""
+    return struct.pack("=q", key)
+
+class KtStore(object):
+    """Records held by ktservers, each the shard of the DB that cactusDisk
+    would route the record to."""
+    def __init__(self, confStrings, partition=HASH_PARTITION):
+        self.clients = [getClient(DbElemWrapper(ET.fromstring(confString))) for confString in confStrings]
+        self.partition = partition
+
+    def getClient(self, key):
+        return self.clients[getShardIndex(key, len(self.clients), self.partition)]
+
+    def get(self, key):
+        return self.getClient(key).get(encodeKey(key))
+
+    def set(self, key, value):
+        self.getClient(key).set(encodeKey(key), value)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+class LmdbStore(object):
+    """Records held in an LMDB environment, opened as cactusDiskLmdb opens
+    it, with each get and set in a transaction of its own."""
+    def __init__(self, databaseDir, mapSize=DEFAULT_LMDB_MAP_SIZE):
+        if lmdb is None:
+            raise RuntimeError("The lmdb module is needed to benchmark LMDB DBs")
+        self.env = lmdb.open(databaseDir, map_size=mapSize, lock=True)
+        self.db = self.env.open_db(integerkey=True)
+
+    def get(self, key):
+        with self.env.begin(db=self.db) as txn:
+            return txn.get(encodeKey(key))
+
+    def set(self, key, value):
+        with self.env.begin(db=self.db, write=True) as txn:
+            txn.put(encodeKey(key), value)
+
+    def close(self):
+        self.env.close()
+
+def openStore(location):
+    """Open the store given by a location: a list of the conf strings of
+    the shards of a Kyoto Tycoon DB and how they are partitioned, or the
+    directory of an LMDB DB."""
+    if isinstance(location, list):
+        return KtStore(*location)
+    return LmdbStore(location)
+
+class Workload(object):
+    """What the readers and writers do."""
+    def __init__(self, records=100000, blockSize=1000, readers=4, writers=4, duration=30,
+                 medianRecordSize=250, recordSizeSigma=1.5, maxRecordSize=1000000, seed=0):
+        self.records = records
+        self.blockSize = blockSize
+        self.readers = readers
+        self.writers = writers
+        self.duration = duration
+        self.medianRecordSize = medianRecordSize
+        self.recordSizeSigma = recordSizeSigma
+        self.maxRecordSize = maxRecordSize
+        self.seed = seed
+
+    def getRecordSizes(self, rng):
+        return RecordSizes(self.medianRecordSize, self.recordSizeSigma, self.maxRecordSize, rng)
+
+class Worker(Process):
+    """Inserts the given keys, or for the workload's duration gets or
+    updates random ones, sending a histogram of the latencies of its
+    operations back to the process that started it."""
+    def __init__(self, location, workload, operation, keys, seed, startEvent, results):
+        super(Worker, self).__init__()
+        self.location = location
+        self.workload = workload
+        self.operation = operation
+        self.keys = keys
+        self.seed = seed
+        self.startEvent = startEvent
+        self.results = results
+        self.daemon = True
+
+    def run(self):
+        try:
+            self.results.put((self.operation, self.tryRun()))
+        except BaseException:
+            self.results.put(("error", traceback.format_exc()))
+
+    def tryRun(self):
+        rng = random.Random(self.seed)
+        recordSizes = self.workload.getRecordSizes(rng)
+        # Records are sliced from random data, as cactus compresses its records
+        data = os.urandom(self.workload.maxRecordSize * 2)
+        def value():
+            offset = rng.randint(0, self.workload.maxRecordSize)
+            return data[offset:offset + recordSizes.next()]
+        histogram = LatencyHistogram()
+        store = openStore(self.location)
+        try:
+            self.startEvent.wait()
+            if self.operation == "insert":
+                for key in self.keys:
+                    record = value()
+                    start = time()
+                    store.set(key, record)
+                    histogram.add(time() - start)
+                return histogram
+            end = time() + self.workload.duration
+            while time() < end:
+                key = rng.choice(self.keys)
+                if self.operation == "get":
+                    start = time()
+                    record = store.get(key)
+                    histogram.add(time() - start)
+                    if record is None:
+                        raise RuntimeError("Record %i is missing from the DB" % key)
+                else:
+                    record = value()
+                    start = time()
+                    store.set(key, record)
+                    histogram.add(time() - start)
+            return histogram
+        finally:
+            store.close()
+
+def runWorkers(workers, results):
+    """Start the workers together, returning how long they took and a
+    histogram for each of their operations."""
+    startEvent = workers[0].startEvent
+    for worker in workers:
+        worker.start()
+    start = time()
+    startEvent.set()
+    histograms = {}
+    errors = []
+    for i in xrange(len(workers)):
+        operation, result = results.get()
+        if operation == "error":
+            errors.append(result)
+        elif operation in histograms:
+            histograms[operation].merge(result)
+        else:
+            histograms[operation] = result
+    seconds = time() - start
+    for worker in workers:
+        worker.join()
+    if len(errors) > 0:
+        raise RuntimeError("A benchmark worker failed: %s" % errors[0])
+    return seconds, histograms
+
+def runLoad(location, workload):
+    """Load the DB at the given location (see openStore), then run the
+    readers and writers of the workload against it. Returns a dict giving
+    the latency histogram and the rate of each operation."""
+    rng = random.Random(workload.seed)
+    blocks = makeKeyBlocks(workload.records, workload.blockSize, rng)
+    keys = [key for block in blocks for key in block]
+    # Each writer inserts whole blocks, as a cactus job fills in the
+    # records of the names it has been handed
+    results = Queue()
+    startEvent = Event()
+    loaders = [Worker(location, workload, "insert",
+                      [key for block in blocks[i::workload.writers] for key in block],
+                      rng.random(), startEvent, results) for i in xrange(workload.writers)]
+    loadSeconds, histograms = runWorkers(loaders, results)
+    startEvent = Event()
+    workers = [Worker(location, workload, "get", keys, rng.random(), startEvent, results)
+               for i in xrange(workload.readers)]
+    workers += [Worker(location, workload, "update", keys, rng.random(), startEvent, results)
+                for i in xrange(workload.writers)]
+    mixedSeconds, mixedHistograms = runWorkers(workers, results) if len(workers) > 0 else (0, {})
+    histograms.update(mixedHistograms)
+    result = {}
+    for operation, histogram in histograms.items():
+        seconds = loadSeconds if operation == "insert" else mixedSeconds
+        result[operation] = { "histogram": histogram,
+                              "rate": histogram.count() / seconds if seconds > 0 else 0.0 }
+    return result
+
+def getConfigName(config):
+    if config["backend"] == "lmdb":
+        return "lmdb"
+    return "kyoto_tycoon shards=%i tuning=%s" % (config["shards"], config["tuning"] or "default")
+
+def makeConfigs(backends, shardCounts, tunings):
+    """The configurations to compare. LMDB DBs are neither sharded nor
+    tuned, so are only benchmarked once."""
+    configs = []
+    for backend in backends:
+        if backend == "lmdb":
+            configs.append({ "backend": backend, "shards": 1, "tuning": None })
+            continue
+        for shards in shardCounts:
+            for tuning in tunings:
+                configs.append({ "backend": backend, "shards": shards, "tuning": tuning })
+    return configs
+
+def makeDbElem(config, serverOptions=None):
+    confElem = ET.Element("st_kv_database_conf", type=config["backend"])
+    ET.SubElement(confElem, config["backend"])
+    dbElem = DbElemWrapper(confElem)
+    if config["tuning"] is not None:
+        dbElem.setDbTuningOptions(config["tuning"])
+    if serverOptions is not None:
+        dbElem.setDbServerOptions(serverOptions)
+    return dbElem
+
+class BenchmarkJob(Job):
+    """Benchmarks each configuration in turn, returning their results."""
+    def __init__(self, configs, workload, partition=HASH_PARTITION, serverOptions=None,
+                 serverMemory=None, serverCores=None):
+        Job.__init__(self, cores=0.1, memory=100000000, preemptable=False)
+        self.configs = configs
+        self.workload = workload
+        self.partition = partition
+        self.serverOptions = serverOptions
+        self.serverMemory = serverMemory
+        self.serverCores = serverCores
+
+    def run(self, fileStore):
+        results = []
+        previous = None
+        for config in self.configs:
+            job = BenchmarkConfigJob(config, self.workload, self.partition, self.serverOptions,
+                                     self.serverMemory, self.serverCores)
+            # One after another, so the configurations don't compete for
+            # the machine
+            if previous is None:
+                self.addChild(job)
+            else:
+                previous.addFollowOn(job)
+            previous = job
+            results.append(job.rv())
+        return results
+
+class BenchmarkConfigJob(Job):
+    """Starts the DB of a configuration, then benchmarks it."""
+    def __init__(self, config, workload, partition, serverOptions, serverMemory, serverCores):
+        Job.__init__(self, cores=0.1, memory=100000000, preemptable=False)
+        self.config = config
+        self.workload = workload
+        self.partition = partition
+        self.serverOptions = serverOptions
+        self.serverMemory = serverMemory
+        self.serverCores = serverCores
+
+    def run(self, fileStore):
+        services = []
+        if self.config["backend"] == "kyoto_tycoon":
+            for i in xrange(self.config["shards"]):
+                services.append(self.addService(KtServerService(dbElem=makeDbElem(self.config, self.serverOptions),
+                                                                isSecondary=True, memory=self.serverMemory,
+                                                                cores=self.serverCores, phase="benchmark")))
+        return self.addChild(LoadJob(self.config, self.workload, self.partition, services)).rv()
+
+class LoadJob(Job):
+    """Runs the workload against the DB, given what its servers' start
+    methods returned, if it has any."""
+    def __init__(self, config, workload, partition, services):
+        Job.__init__(self, cores=1, memory=1000000000, preemptable=False)
+        self.config = config
+        self.workload = workload
+        self.partition = partition
+        self.services = services
+
+    def run(self, fileStore):
+        if self.config["backend"] == "lmdb":
+            # Made before the workers open it at once
+            location = os.path.join(fileStore.getLocalTempDir(), "lmdb")
+            os.mkdir(location)
+        else:
+            location = [[service[0] for service in self.services], self.partition]
+        return { "config": self.config, "operations": runLoad(location, self.workload) }
+
+def summarize(results):
+    """A row for each operation of each configuration's results."""
+    rows = []
+    for result in results:
+        for operation in OPERATIONS:
+            if operation not in result["operations"]:
+                continue
+            histogram = result["operations"][operation]["histogram"]
+            rows.append([getConfigName(result["config"]), operation, histogram.count(),
+                         result["operations"][operation]["rate"], 1000 * histogram.mean()] +
+                        [1000 * histogram.percentile(fraction) for fraction in (0.5, 0.9, 0.99)] +
+                        [1000 * histogram.maximum])
+    return rows
+
+def printReport(results, histograms=False):
+    print "\t".join(["config", "operation", "count", "opsPerSecond", "meanMs",
+                     "p50Ms", "p90Ms", "p99Ms", "maxMs"])
+    for row in summarize(results):
+        print "\t".join(row[:2] + [str(row[2]), "%.1f" % row[3]] + ["%.3f" % field for field in row[4:]])
+    if not histograms:
+        return
+    for result in results:
+        for operation in OPERATIONS:
+            if operation not in result["operations"]:
+                continue
+            print "\n%s %s" % (getConfigName(result["config"]), operation)
+            counts = result["operations"][operation]["histogram"].counts
+            for bucket, count in enumerate(counts):
+                if count > 0:
+                    print "<%ius\t%i" % (2**bucket, count)
+
+def writeResults(results, path):
+    """Write the results as JSON, to compare between runs."""
+    with open(path, 'w') as outputFile:
+        json.dump([{ "config": result["config"],
+                     "operations": dict((operation, { "rate": value["rate"],
+                                                      "mean": value["histogram"].mean(),
+                                                      "maximum": value["histogram"].maximum,
+                                                      "histogram": value["histogram"].counts })
+                                        for operation, value in result["operations"].items()) }
+                   for result in results], outputFile, indent=2, sort_keys=True)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    Job.Runner.addToilOptions(parser)
+    parser.add_argument("--backends", nargs="+", default=["kyoto_tycoon"], choices=BACKENDS)
+    parser.add_argument("--shards", nargs="+", type=int, default=[1],
+                        help="Numbers of servers to shard Kyoto Tycoon DBs across")
+    parser.add_argument("--shardPartition", default=HASH_PARTITION, choices=PARTITIONS)
+    parser.add_argument("--tuning", nargs="+", default=[None],
+                        help="ktserver tuning options to compare, e.g. '#opts=ls#bnum=30m'")
+    parser.add_argument("--serverOptions", default=None,
+                        help="ktserver options, e.g. '-ls -tout 200000 -th 64'")
+    parser.add_argument("--serverMemory", type=human2bytes, default="2G")
+    parser.add_argument("--serverCores", type=float, default=1)
+    parser.add_argument("--records", type=int, default=100000,
+                        help="Number of records to load")
+    parser.add_argument("--blockSize", type=int, default=1000,
+                        help="Number of consecutive names in each block of names")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to read and update records for")
+    parser.add_argument("--medianRecordSize", type=int, default=250)
+    parser.add_argument("--recordSizeSigma", type=float, default=1.5,
+                        help="The sigma of the log-normal distribution of record sizes")
+    parser.add_argument("--maxRecordSize", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--histograms", action="store_true",
+                        help="Print the latency histogram of each operation")
+    parser.add_argument("--output", default=None,
+                        help="Write the results to this JSON file")
+    options = parser.parse_args()
+    if options.writers < 1:
+        raise RuntimeError("At least one writer is needed to load the DB")
+    if "lmdb" in options.backends and lmdb is None:
+        raise RuntimeError("The lmdb module is needed to benchmark LMDB DBs")
+    workload = Workload(records=options.records, blockSize=options.blockSize,
+                        readers=options.readers, writers=options.writers,
+                        duration=options.duration, medianRecordSize=options.medianRecordSize,
+                        recordSizeSigma=options.recordSizeSigma,
+                        maxRecordSize=options.maxRecordSize, seed=options.seed)
+    configs = makeConfigs(options.backends, options.shards, options.tuning)
+    with Toil(options) as toil:
+        results = toil.start(BenchmarkJob(configs, workload, options.shardPartition,
+                                          options.serverOptions, options.serverMemory,
+                                          options.serverCores))
+    printReport(results, options.histograms)
+    if options.output is not None:
+        writeResults(results, options.output)
+
+if __name__ == '__main__':
+    main()
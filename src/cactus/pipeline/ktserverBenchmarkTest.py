@@ -0,0 +1,91 @@
+import random
+import unittest
+
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.ktserverClientTest import FakeKtServer
+from cactus.pipeline.ktserverShards import getShardIndex, RANGE_PARTITION
+from cactus.pipeline.ktserverBenchmark import LatencyHistogram, RecordSizes, Workload, \
+    makeKeyBlocks, makeConfigs, runLoad, summarize, encodeKey
+
+def confString(port):
+    return ('<st_kv_database_conf type="kyoto_tycoon"><kyoto_tycoon database_dir="x" '
+            'host="127.0.0.1" port="%i" /></st_kv_database_conf>' % port)
+
+class TestCase(unittest.TestCase):
+    @silentOnSuccess
+    def testLatencyHistogram(self):
+        histogram = LatencyHistogram()
+        for i in xrange(90):
+            histogram.add(0.0001)
+        for i in xrange(10):
+            histogram.add(0.01)
+        self.assertEquals(histogram.count(), 100)
+        self.assertAlmostEquals(histogram.mean(), 0.00109)
+        # Bounded by the doubling buckets the latencies fall in
+        self.assertTrue(0.0001 <= histogram.percentile(0.5) < 0.0002)
+        self.assertTrue(0.01 <= histogram.percentile(0.95) <= histogram.maximum)
+        other = LatencyHistogram()
+        other.add(1e-7)
+        other.add(1e6)
+        histogram.merge(other)
+        self.assertEquals(histogram.count(), 102)
+        self.assertEquals(histogram.counts[0], 1)
+        self.assertEquals(histogram.counts[-1], 1)
+        self.assertEquals(histogram.maximum, 1e6)
+        self.assertEquals(LatencyHistogram().percentile(0.99), 0.0)
+
+    @silentOnSuccess
+    def testRecordSizes(self):
+        recordSizes = RecordSizes(250, 1.5, 10000, random.Random(1))
+        sizes = sorted(recordSizes.next() for i in xrange(10000))
+        self.assertTrue(200 < sizes[5000] < 300)
+        self.assertTrue(sizes[0] >= 1)
+        self.assertEquals(sizes[-1], 10000)
+
+    @silentOnSuccess
+    def testKeyBlocks(self):
+        blocks = makeKeyBlocks(2500, 1000, random.Random(1))
+        self.assertEquals([len(block) for block in blocks], [1000, 1000, 500])
+        keys = [key for block in blocks for key in block]
+        self.assertEquals(len(set(keys)), 2500)
+        self.assertTrue(all(key > 0 for key in keys))
+        for block in blocks:
+            self.assertEquals(block, range(block[0], block[0] + len(block)))
+        # Reproducible from the seed
+        self.assertEquals(makeKeyBlocks(2500, 1000, random.Random(1)), blocks)
+
+    @silentOnSuccess
+    def testConfigs(self):
+        configs = makeConfigs(["kyoto_tycoon", "lmdb"], [1, 4], [None, "#bnum=1m"])
+        self.assertEquals(len(configs), 5)
+        self.assertEquals(configs[-1]["backend"], "lmdb")
+        self.assertEquals(set((config["shards"], config["tuning"]) for config in configs[:4]),
+                          set([(1, None), (1, "#bnum=1m"), (4, None), (4, "#bnum=1m")]))
+
+    @silentOnSuccess
+    def testRunLoad(self):
+        servers = [FakeKtServer(), FakeKtServer()]
+        try:
+            workload = Workload(records=100, blockSize=20, readers=2, writers=2, duration=0.5,
+                                medianRecordSize=100, maxRecordSize=1000, seed=3)
+            location = [[confString(server.server_address[1]) for server in servers], RANGE_PARTITION]
+            result = runLoad(location, workload)
+            self.assertEquals(result["insert"]["histogram"].count(), 100)
+            self.assertTrue(result["get"]["histogram"].count() > 0)
+            self.assertTrue(result["update"]["histogram"].count() > 0)
+            self.assertTrue(result["insert"]["rate"] > 0)
+            # Each record went to the shard cactusDisk would route it to
+            keys = [key for block in makeKeyBlocks(100, 20, random.Random(3)) for key in block]
+            self.assertEquals(sum(len(server.records) for server in servers), 100)
+            for key in keys:
+                self.assertTrue(encodeKey(key) in servers[getShardIndex(key, 2, RANGE_PARTITION)].records)
+            rows = summarize([{ "config": { "backend": "kyoto_tycoon", "shards": 2, "tuning": None },
+                                "operations": result }])
+            self.assertEquals([row[1] for row in rows], ["insert", "get", "update"])
+            self.assertEquals(rows[0][2], 100)
+        finally:
+            for server in servers:
+                server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+A small client for the HTTP RPC protocol of KyotoTycoon servers.
+
+Each procedure is a POST to /rpc/<procedure> whose body and reply are
+tab-separated name/value lines. Names and values are sent base64 encoded,
+and the reply says which encoding it uses in its content type. A status of
+450 means the procedure failed for a logical reason, such as a missing
+record; other statuses besides 200 are errors.
+
+The client keeps one connection open to the server, so checking a key is
+a single round trip rather than the start of a ktremotemgr process (and,
+in docker mode, a container).
+"""
+
+import socket
+import base64
+import quopri
+import urllib
+import httplib
+
+KT_LOGICAL_ERROR = 450
+
+class KtError(RuntimeError):
+    pass
+
+def encodeTsv(params):
+    return "".join("%s\t%s\n" % (base64.b64encode(name), base64.b64encode(value))
+                   for name, value in params)
+
+def decodeTsv(body, contentType):
+    """Parse a tab-separated reply into a dict, decoding its columns as the
+    content type says."""
+    decode = lambda s: s
+    for field in contentType.split(";"):
+        field = field.strip()
+        if field.startswith("colenc="):
+            encoding = field[len("colenc="):].upper()
+            if encoding == "B":
+                decode = base64.b64decode
+            elif encoding == "Q":
+                decode = quopri.decodestring
+            elif encoding == "U":
+                decode = urllib.unquote
+    result = {}
+    for line in body.split("\n"):
+        if "\t" not in line:
+            continue
+        name, value = line.split("\t", 1)
+        result[decode(name)] = decode(value)
+    return result
+
+class KtClient(object):
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+        return False
+
+    def _request(self, procedure, params):
+        body = encodeTsv(params)
+        headers = { "Content-Type": "text/tab-separated-values; colenc=B",
+                    "Content-Length": str(len(body)) }
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.connection.request("POST", "/rpc/" + procedure, body, headers)
+        response = self.connection.getresponse()
+        return response.status, decodeTsv(response.read(), response.getheader("content-type", ""))
+
+    def call(self, procedure, params=()):
+        """Call a procedure with a list of (name, value) parameters,
+        returning the status and the reply as a dict. A connection that the
+        server has dropped since the last call is reopened once.
+        """
+        try:
+            return self._request(procedure, params)
+        except (httplib.HTTPException, socket.error):
+            self.close()
+        return self._request(procedure, params)
+
+    def _check(self, procedure, status, reply):
+        if status != 200:
+            self.close()
+            raise KtError("KyotoTycoon %s on %s:%s failed with status %i: %s" %
+                          (procedure, self.host, self.port, status, reply.get("ERROR", "")))
+        return reply
+
+    def void(self):
+        """Do nothing, raising an error if the server isn't answering."""
+        status, reply = self.call("void")
+        self._check("void", status, reply)
+
+    def get(self, key):
+        """The value of key, or None if there is no such record."""
+        status, reply = self.call("get", [("key", key)])
+        if status == KT_LOGICAL_ERROR:
+            return None
+        return self._check("get", status, reply)["value"]
+
+    def set(self, key, value):
+        status, reply = self.call("set", [("key", key), ("value", value)])
+        self._check("set", status, reply)
+
+    def remove(self, key):
+        """Remove the record for key, returning False if there was none."""
+        status, reply = self.call("remove", [("key", key)])
+        if status == KT_LOGICAL_ERROR:
+            return False
+        self._check("remove", status, reply)
+        return True
+
+    def clear(self):
+        """Remove every record from the database."""
+        status, reply = self.call("clear")
+        self._check("clear", status, reply)
+
+    def status(self):
+        """The status of the database, such as its record count and size."""
+        status, reply = self.call("status")
+        return self._check("status", status, reply)
+
+    def report(self):
+        """The report of the server, such as its connection and operation
+        counts."""
+        status, reply = self.call("report")
+        return self._check("report", status, reply)
+
+    def playScript(self, name, params=None):
+        """Call the function name of the server's Lua script with the given
+        dict of inputs, returning its outputs. Servers built without Lua
+        answer with an error."""
+        status, reply = self.call("play_script", [("name", name)] +
+                                  [("_" + key, value) for key, value in (params or {}).items()])
+        reply = self._check("play_script " + name, status, reply)
+        return dict((key[1:], value) for key, value in reply.items() if key.startswith("_"))
+
+    def synchronize(self, hard=False, command=None):
+        """Synchronize the database with its file, running the server's
+        postprocessing command, if given, once it has done so."""
+        params = []
+        if hard:
+            params.append(("hard", ""))
+        if command is not None:
+            params.append(("command", command))
+        status, reply = self.call("synchronize", params)
+        self._check("synchronize", status, reply)
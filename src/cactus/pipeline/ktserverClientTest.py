@@ -0,0 +1,188 @@
+import os
+import time
+import urllib
+import unittest
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.ktserverClient import KtClient, KtError, decodeTsv
+from cactus.pipeline.ktserverControl import KtServerLog, KtServerMonitor, blockUntilKtserverIsRunning, \
+    blockUntilKtserverIsFinished, stopKtserver, clearKtserver, findFreePort, MAX_KTSERVER_PORT
+
+class FakeDbElem:
+    def __init__(self, port):
+        self.port = port
+
+    def getDbHost(self):
+        return '127.0.0.1'
+
+    def getDbPort(self):
+        return self.port
+
+class FakeKtHandler(BaseHTTPRequestHandler):
+    """Answers the RPC procedures the client uses from a dict, replying
+    URL-encoded to check that the client decodes what the reply says."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        procedure = self.path[len("/rpc/"):]
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        params = decodeTsv(body, self.headers["Content-Type"])
+        records = self.server.records
+        self.server.counts[procedure] = self.server.counts.get(procedure, 0) + 1
+        status, reply = 200, {}
+        if procedure == "void":
+            pass
+        elif procedure == "get":
+            if params["key"] in records:
+                reply["value"] = records[params["key"]]
+            else:
+                status, reply = 450, { "ERROR": "DB: 7: no record" }
+        elif procedure == "set":
+            records[params["key"]] = params["value"]
+        elif procedure == "remove":
+            if records.pop(params["key"], None) is None:
+                status, reply = 450, { "ERROR": "DB: 7: no record" }
+        elif procedure == "clear":
+            records.clear()
+        elif procedure == "status":
+            reply = { "count": str(len(records)), "size": str(sum(len(v) for v in records.values())) }
+        elif procedure == "play_script" and params["name"] == "echo":
+            reply = dict((k, v) for k, v in params.items() if k.startswith("_"))
+        elif procedure == "report":
+            reply = { "serv_conn_count": "1", "sys_ru_rss": "4096" }
+            reply.update(("cnt_" + op, str(count)) for op, count in self.server.counts.items())
+        else:
+            status, reply = 501, { "ERROR": "not implemented" }
+        replyBody = "".join("%s\t%s\n" % (urllib.quote(k), urllib.quote(v)) for k, v in reply.items())
+        self.send_response(status)
+        self.send_header("Content-Type", "text/tab-separated-values; colenc=U")
+        self.send_header("Content-Length", str(len(replyBody)))
+        self.end_headers()
+        self.wfile.write(replyBody)
+
+    def log_message(self, *args):
+        pass
+
+class FakeKtServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeKtHandler)
+        self.records = {}
+        self.counts = { "get": 0, "set": 0, "remove": 0, "misc": 0 }
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.server = FakeKtServer()
+        self.port = self.server.server_address[1]
+        self.logPath = getTempFile()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.stop()
+        os.remove(self.logPath)
+
+    @silentOnSuccess
+    def testClient(self):
+        with KtClient('127.0.0.1', self.port) as client:
+            client.void()
+            self.assertEquals(client.get("TERMINATE"), None)
+            client.set("TERMINATE", "1")
+            client.set("binary\tkey\n", "\0\1\2")
+            self.assertEquals(client.get("TERMINATE"), "1")
+            self.assertEquals(client.get("binary\tkey\n"), "\0\1\2")
+            self.assertEquals(client.status()["count"], "2")
+            self.assertEquals(client.report()["serv_conn_count"], "1")
+            self.assertTrue(client.remove("TERMINATE"))
+            self.assertFalse(client.remove("TERMINATE"))
+            self.assertRaises(KtError, client.synchronize)
+            self.assertEquals(client.playScript("echo", { "path": "a b" }), { "path": "a b" })
+            self.assertRaises(KtError, client.playScript, "snapshot")
+            # The connection is reopened after an error
+            self.assertEquals(client.get("TERMINATE"), None)
+
+    @silentOnSuccess
+    def testStopKtserver(self):
+        stopKtserver(FakeDbElem(self.port))
+        self.assertEquals(self.server.records, { "TERMINATE": "1" })
+
+    @silentOnSuccess
+    def testClearKtserver(self):
+        with KtClient('127.0.0.1', self.port) as client:
+            client.set("1", "a")
+            client.set("2", "b")
+        clearKtserver(FakeDbElem(self.port))
+        self.assertEquals(self.server.records, {})
+        # The server is still usable afterwards
+        with KtClient('127.0.0.1', self.port) as client:
+            client.set("1", "c")
+            self.assertEquals(client.get("1"), "c")
+
+    @silentOnSuccess
+    def testBlockUntilRunning(self):
+        # Found by probing, without waiting for the log
+        start = time.time()
+        self.assertTrue(blockUntilKtserverIsRunning(FakeDbElem(self.port), self.logPath, createTimeout=10))
+        self.assertTrue(time.time() - start < 5)
+        # A server that isn't answering times out
+        freePort = findFreePort()
+        self.assertTrue(freePort <= MAX_KTSERVER_PORT)
+        self.assertFalse(blockUntilKtserverIsRunning(FakeDbElem(freePort), self.logPath, createTimeout=0.5))
+        # An error in the log is failure
+        with open(self.logPath, 'w') as f:
+            f.write("2018-01-01T00:00:00 [ERROR] could not bind\n")
+        self.assertFalse(blockUntilKtserverIsRunning(FakeDbElem(freePort), self.logPath, createTimeout=10))
+
+    @silentOnSuccess
+    def testKtServerMonitor(self):
+        with KtClient('127.0.0.1', self.port) as client:
+            monitor = KtServerMonitor(client)
+            client.set("a", "ACGT")
+            first = monitor.sample()
+            self.assertEquals(first["type"], "dbStatus")
+            self.assertEquals(first["records"], 1)
+            self.assertEquals(first["size"], 4)
+            self.assertEquals(first["memory"], 4096)
+            self.assertEquals(first["connections"], 1)
+            self.assertTrue("getRate" not in first)
+            for i in xrange(10):
+                client.get("a")
+            time.sleep(0.1)
+            second = monitor.sample()
+            self.assertTrue(second["getRate"] > 0)
+            self.assertEquals(second["setRate"], 0)
+            self.assertTrue(second["latency"] >= 0)
+
+    @silentOnSuccess
+    def testKtServerLog(self):
+        os.remove(self.logPath)
+        log = KtServerLog(self.logPath)
+        self.assertFalse(log.running())
+        with open(self.logPath, 'w') as f:
+            f.write("[SYSTEM] starting the server\n[SYSTEM] listen")
+            f.flush()
+            # Only whole lines are looked at
+            self.assertFalse(log.running())
+            f.write("ing to :1978\n")
+            f.flush()
+            self.assertTrue(log.running())
+            self.assertFalse(log.failed())
+            self.assertRaises(RuntimeError, blockUntilKtserverIsFinished, self.logPath, timeout=0.1)
+            f.write("[SYSTEM] [FINISH]\n")
+        self.assertTrue(log.finished())
+        self.assertTrue(blockUntilKtserverIsFinished(self.logPath, timeout=1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,13 +10,24 @@ import socket
 import signal
 import sys
 import traceback
+import errno
+import uuid
+import shutil
+import httplib
 from contextlib import closing
 from glob import glob
-from multiprocessing import Process, Queue
-from time import sleep
+from multiprocessing import Process, Queue, Event
+from time import sleep, time
 
 from toil.lib.bioio import logger
-from cactus.shared.common import cactus_call
+from cactus.shared.common import cactus_call, prepareWorkDir
+from cactus.shared.metrics import metricsEnabled, writeRecord, setJobContext
+from cactus.pipeline.ktserverClient import KtClient, KtError
+from cactus.pipeline.ktserverSnapshot import getSnapshotCodec, getKtserverCompressionOptions, \
+    exportSnapshot, loadSnapshot, publishSnapshot, KTSS, KCSS
+from cactus.pipeline.ktserverDelta import deltaSnapshotsEnabled, SnapshotIndexer, writeIndex, readIndex
+from cactus.pipeline.ktserverHandoff import getHandoffDir, makeWorkDir, writeScript, getScriptPath, \
+    offerServer, claimServer, AdoptedProcess, HANDOFF_SIGNAL
 
 # For some reason ktserver believes there are only 32768 TCP ports.
 MAX_KTSERVER_PORT = 32767
@@ -24,56 +35,90 @@ MAX_KTSERVER_PORT = 32767
 # The name of the snapshot that KT outputs.
 KTSERVER_SNAPSHOT_NAME = "00000000.ktss"
 
-def runKtserver(dbElem, fileStore, existingSnapshotID=None, snapshotExportID=None):
+# How often the server process checks for the TERMINATE key. Checking is a
+# single request to the server, so it can be done often.
+TERMINATE_POLL_INTERVAL = 1
+
+# How often, in seconds, the server's status is sampled into the metrics
+# file, if there is one
+DB_METRICS_INTERVAL_ENV = "CACTUS_DB_METRICS_INTERVAL"
+DEFAULT_DB_METRICS_INTERVAL = 60
+
+def runKtserver(dbElem, fileStore, existingSnapshotID=None, snapshotExportID=None,
+                phase=None, dbRole=None, sizing=None, snapshotDoneID=None):
     """
     Run a KTServer. This function launches a separate python process that manages the server.
 
     Writing to the special key "TERMINATE" signals this thread to safely shut
     down the DB and save the results. After finishing, the data will
-    eventually be written to snapshotFile.
+    eventually be written to snapshotExportID, after which its ID is written to
+    snapshotDoneID, if given.
+
+    The phase and role ("primary" or "secondary") of the DB label its
+    samples in the metrics file. The server is tuned by sizing, a
+    KtserverSizing, unless the config gives its options.
+
+    If primary DBs are handed off between checkpoints (see
+    ktserverHandoff), a server offered to this DB is claimed rather than a
+    new one started from the snapshot, and a new server is started so that
+    it can be handed off in turn.
 
     Returns a tuple containing an updated version of the database config dbElem and the
     path to the log file.
     """
-    logPath = fileStore.getLocalTempFile()
-    dbElem.setDbHost(getHostName())
-
-    # Find a suitable port to run on.
-    try:
-        occupiedPorts = findOccupiedPorts()
-        unoccupiedPorts = set(xrange(1025,MAX_KTSERVER_PORT)) - occupiedPorts
-        port = random.choice(list(unoccupiedPorts))
-    except:
-        logger.warning("Can't find which ports are occupied--likely netstat is not installed."
-                       " Choosing a random port to start the DB on, good luck!")
-        port = random.randint(1025,MAX_KTSERVER_PORT)
-    dbElem.setDbPort(port)
-
-    process = ServerProcess(dbElem, logPath, fileStore, existingSnapshotID, snapshotExportID)
+    handoffDir = getHandoffDir() if dbRole == "primary" else None
+    offer = None
+    if handoffDir is not None and existingSnapshotID is not None:
+        offer = claimServer(handoffDir, existingSnapshotID, getHostName())
+    workDir = None
+    if offer is not None:
+        logger.info("Claimed the ktserver handed off on port %i" % offer["port"])
+        dbElem.setDbHost(offer["host"])
+        dbElem.setDbPort(offer["port"])
+        workDir, logPath = offer["workDir"], offer["logPath"]
+    else:
+        if handoffDir is not None:
+            # The server may outlive this job, and its temp dir
+            workDir = makeWorkDir(handoffDir)
+            logPath = os.path.join(workDir, "ktserver.log")
+            open(logPath, 'w').close()
+        else:
+            logPath = fileStore.getLocalTempFile()
+        dbElem.setDbHost(getHostName())
+        dbElem.setDbPort(findFreePort())
+
+    process = ServerProcess(dbElem, logPath, fileStore, existingSnapshotID, snapshotExportID,
+                            phase=phase, dbRole=dbRole, sizing=sizing, snapshotDoneID=snapshotDoneID,
+                            handoffDir=handoffDir, workDir=workDir, offer=offer)
     process.daemon = True
     process.start()
 
-    if not blockUntilKtserverIsRunning(logPath):
-        try:
-            with open(logPath) as f:
-                log = f.read()
-        except:
-            log = ''
-        raise RuntimeError("Unable to launch ktserver in time. Log: %s" % log)
+    if not blockUntilKtserverIsRunning(dbElem, logPath, process=process):
+        raise RuntimeError("Unable to launch ktserver in time. Log: %s" % KtServerLog(logPath).read())
+    # It isn't ready for the DB's users until its snapshot is loaded and
+    # the termination flag cleared
+    while not process.readyEvent.wait(1):
+        if not process.is_alive():
+            raise RuntimeError("Unable to launch ktserver. Log: %s" % KtServerLog(logPath).read())
 
     return process, dbElem, logPath
 
 class ServerProcess(Process):
     """Independent process that babysits the ktserver process.
 
-    Waits for the TERMINATE flag to be set, then kills the DB and
-    copies the final snapshot to snapshotExportID.
+    Waits for the TERMINATE flag to be set, or for stopEvent to be set by
+    the process that started it, then kills the DB and copies the final
+    snapshot to snapshotExportID. If the flag asks for a hand-off, the
+    server is offered to the next checkpoint instead of being killed once
+    its snapshot is exported.
     """
     exceptionMsg = Queue()
 
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
+        self.stopEvent = Event()
+        self.readyEvent = Event()
         super(ServerProcess, self).__init__()
 
     def run(self):
@@ -84,110 +129,314 @@ class ServerProcess(Process):
             self.exceptionMsg.put("".join(traceback.format_exception(*sys.exc_info())))
             raise
 
-    def tryRun(self, dbElem, logPath, fileStore, existingSnapshotID=None, snapshotExportID=None):
-        snapshotDir = os.path.join(fileStore.getLocalTempDir(), 'snapshot')
-        os.mkdir(snapshotDir)
+    def tryRun(self, dbElem, logPath, fileStore, existingSnapshotID=None, snapshotExportID=None,
+               phase=None, dbRole=None, sizing=None, snapshotDoneID=None,
+               handoffDir=None, workDir=None, offer=None):
+        # Servers that can be handed off have a work dir of their own, and
+        # are dumped through their script
+        scripted = workDir is not None
+        if workDir is None:
+            workDir = fileStore.getLocalTempDir()
+        snapshotDir = os.path.join(workDir, 'snapshot')
         snapshotPath = os.path.join(snapshotDir, KTSERVER_SNAPSHOT_NAME)
-        if existingSnapshotID is not None:
-            # Extract the existing snapshot to the snapshot
-            # directory so it will be automatically loaded
-            fileStore.readGlobalFile(existingSnapshotID, userPath=snapshotPath)
-        process = cactus_call(server=True, shell=False,
-                              parameters=getKtserverCommand(dbElem, logPath, snapshotDir),
-                              port=dbElem.getDbPort())
-
-        blockUntilKtserverIsRunning(logPath)
-        if existingSnapshotID is not None:
-            # Clear the termination flag from the snapshot
-            cactus_call(parameters=["ktremotemgr", "remove"] + getRemoteParams(dbElem) + ["TERMINATE"])
-
-        while True:
-            # Check for the termination signal
-            try:
-                cactus_call(parameters=["ktremotemgr", "get"] + getRemoteParams(dbElem) + ["TERMINATE"],
-                            swallowStdErr=True)
-            except:
-                # No terminate signal sent yet
-                pass
-            else:
-                # Terminate signal received
-                break
-            # Check that the DB is still alive
-            if process.poll() is not None or isKtServerFailed(logPath):
-                with open(logPath) as f:
-                    raise RuntimeError("KTServer failed. Log: %s" % f.read())
-            sleep(60)
-        process.send_signal(signal.SIGINT)
-        process.wait()
-        blockUntilKtserverIsFinished(logPath)
-        if snapshotExportID is not None:
+        loadPath = None
+        # The full snapshot that delta snapshots of this DB are made against,
+        # and its index, which is made in the background
+        base = None
+        baseID, indexer = None, None
+        indexPath = os.path.join(workDir, "base.index")
+        if offer is not None:
+            # Carry on with the server handed off by the last checkpoint
+            process = AdoptedProcess(offer["pid"])
+            scriptPath = getScriptPath(workDir)
+            serverWorkDir = offer["serverWorkDir"]
+            codec = None
+            if offer.get("baseID") is not None:
+                base = (offer["baseID"], readIndex(indexPath))
+        else:
+            os.mkdir(snapshotDir)
+            codec, snapshotFormat = getSnapshotCodec(), KTSS
+            if existingSnapshotID is not None:
+                loadPath = os.path.join(workDir, "loaded.snapshot")
+                basePath = os.path.join(workDir, "base.snapshot")
+                codec, snapshotFormat, baseID = loadSnapshot(fileStore.jobStore, existingSnapshotID,
+                                                             loadPath, basePath)
+                if deltaSnapshotsEnabled():
+                    indexer = SnapshotIndexer(basePath if os.path.exists(basePath) else loadPath)
+                    indexer.start()
+                if os.path.exists(basePath):
+                    os.remove(basePath)
+                if snapshotFormat == KTSS:
+                    # Move the existing snapshot to the snapshot
+                    # directory so it will be automatically loaded
+                    os.rename(loadPath, snapshotPath)
+                    loadPath = None
+            scriptPath = None
+            if scripted or snapshotFormat == KCSS:
+                scriptPath = writeScript(workDir)
+            # Servers dumped through their script only need background
+            # snapshots to load one of the server's own
+            useBackgroundSnapshots = scriptPath is None or os.path.exists(snapshotPath)
+            parameters = getKtserverCommand(dbElem, logPath, snapshotDir if useBackgroundSnapshots else None,
+                                            sizing, codec, scriptPath)
+            serverWorkDir = prepareWorkDir(None, parameters)[0]
+            process = cactus_call(server=True, shell=False, parameters=parameters,
+                                  port=dbElem.getDbPort())
+
+        log = KtServerLog(logPath)
+        handedOff = False
+        stopped = False
+        try:
+            if not blockUntilKtserverIsRunning(dbElem, logPath, process=process):
+                raise RuntimeError("KTServer failed to start. Log: %s" % log.read())
+            dumpPath = os.path.join(workDir, "dump.snapshot")
+            with getClient(dbElem) as client:
+                if scriptPath is not None and offer is None:
+                    try:
+                        client.playScript("check")
+                    except KtError as e:
+                        raise RuntimeError("ktserver is unable to run the script its snapshots are "
+                                           "loaded and dumped with, and may have been built without "
+                                           "Lua: %s" % e)
+                if loadPath is not None:
+                    client.playScript("load", { "path": getServerPath(loadPath, serverWorkDir) })
+                    os.remove(loadPath)
+                if existingSnapshotID is not None:
+                    # Clear the termination flag from the snapshot
+                    client.remove("TERMINATE")
+                self.readyEvent.set()
+
+                monitor = None
+                if metricsEnabled():
+                    # The sizing features let cactus_db_sizing check the estimates
+                    setJobContext(jobClass="KtServerService", phase=phase, dbRole=dbRole,
+                                  jobInstance=str(uuid.uuid4()),
+                                  jobFeatures=sizing.features if sizing is not None else None)
+                    monitor = KtServerMonitor(client)
+                    monitorInterval = float(os.environ.get(DB_METRICS_INTERVAL_ENV, DEFAULT_DB_METRICS_INTERVAL))
+                    nextSample = time()
+
+                while not self.stopEvent.wait(TERMINATE_POLL_INTERVAL):
+                    # Check that the DB is still alive
+                    if process.poll() is not None or log.failed():
+                        raise RuntimeError("KTServer failed. Log: %s" % log.read())
+                    # Check for the termination signal
+                    if client.get("TERMINATE") is not None:
+                        break
+                    if monitor is not None and time() >= nextSample:
+                        monitor.writeSample()
+                        nextSample += monitorInterval
+                if monitor is not None:
+                    # How the DB ended up
+                    monitor.writeSample()
+                # Set before the service is stopped, if at all
+                terminate = client.get("TERMINATE")
+                if scriptPath is not None and snapshotExportID is not None:
+                    # Dumped while the server is still running, so that it
+                    # can be handed off
+                    client.playScript("snapshot", { "path": getServerPath(dumpPath, serverWorkDir) })
+            if indexer is not None:
+                base = (baseID, indexer.getIndex())
+            if scriptPath is not None and snapshotExportID is not None:
+                nextBase = exportSnapshot(fileStore.jobStore, dumpPath, snapshotExportID,
+                                          getSnapshotCodec(uncompressed=True), KCSS, base)
+                os.remove(dumpPath)
+                if snapshotDoneID is not None:
+                    publishSnapshot(fileStore.jobStore, snapshotExportID, snapshotDoneID)
+                if terminate == HANDOFF_SIGNAL and handoffDir is not None:
+                    if nextBase is not None:
+                        writeIndex(nextBase[1], indexPath)
+                    offerServer(handoffDir, snapshotExportID,
+                                { "host": dbElem.getDbHost(), "port": dbElem.getDbPort(),
+                                  "pid": process.pid, "workDir": workDir, "logPath": logPath,
+                                  "serverWorkDir": serverWorkDir,
+                                  "baseID": nextBase[0] if nextBase is not None else None })
+                    handedOff = True
+                    return
+            process.send_signal(signal.SIGINT)
+            process.wait()
+            stopped = True
+            blockUntilKtserverIsFinished(logPath)
+        finally:
+            if not handedOff and not stopped:
+                # Don't leave the server running after a failure
+                process.send_signal(signal.SIGKILL)
+            if not handedOff and handoffDir is not None:
+                shutil.rmtree(workDir, ignore_errors=True)
+        if snapshotExportID is not None and scriptPath is None:
             if not os.path.exists(snapshotPath):
-                with open(logPath) as f:
-                    raise RuntimeError("KTServer did not leave a snapshot on termination,"
-                                       " but a snapshot was requested. Log: %s" % f.read())
+                raise RuntimeError("KTServer did not leave a snapshot on termination,"
+                                   " but a snapshot was requested. Log: %s" % log.read())
             if len(glob(os.path.join(snapshotDir, "*.ktss"))) != 1:
                 # More than one snapshot file. It's not clear what
                 # conditions trigger this--if any--but we
                 # don't support it right now.
-                with open(logPath) as f:
-                    raise RuntimeError("KTServer left more than one snapshot. Log: %s" % f.read())
+                raise RuntimeError("KTServer left more than one snapshot. Log: %s" % log.read())
 
             # Export the snapshot file to the file store
-            fileStore.jobStore.updateFile(snapshotExportID, snapshotPath)
+            exportSnapshot(fileStore.jobStore, snapshotPath, snapshotExportID, codec, base=base)
+            if snapshotDoneID is not None:
+                publishSnapshot(fileStore.jobStore, snapshotExportID, snapshotDoneID)
+
+class KtServerMonitor(object):
+    """Samples the status and report of a running server into records of
+    its record count, size, memory, connections, the rate of each type of
+    operation since the last sample and the latency of the status request.
+    """
+    OPERATIONS = ("get", "set", "remove", "misc")
+
+    def __init__(self, client):
+        self.client = client
+        self.lastTime = None
+        self.lastCounts = None
+
+    def sample(self):
+        start = time()
+        status = self.client.status()
+        latency = time() - start
+        report = self.client.report()
+        now = time()
+        record = { "type": "dbStatus", "latency": latency,
+                   "records": _intOrNone(status.get("count")),
+                   "size": _intOrNone(status.get("size")),
+                   "memory": _intOrNone(report.get("sys_ru_rss")),
+                   "connections": _intOrNone(report.get("serv_conn_count")) }
+        counts = dict((op, _intOrNone(report.get("cnt_" + op))) for op in self.OPERATIONS)
+        if self.lastTime is not None and now > self.lastTime:
+            for op in self.OPERATIONS:
+                if counts[op] is not None and self.lastCounts[op] is not None:
+                    record[op + "Rate"] = (counts[op] - self.lastCounts[op]) / (now - self.lastTime)
+        self.lastTime, self.lastCounts = now, counts
+        return record
+
+    def writeSample(self):
+        """Write a sample to the metrics file. A server too busy to answer
+        is logged rather than treated as failed."""
+        try:
+            writeRecord(self.sample())
+        except (socket.error, httplib.HTTPException, KtError) as e:
+            logger.warning("Unable to sample the ktserver status: %s" % e)
+
+def _intOrNone(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-def blockUntilKtserverIsRunning(logPath, createTimeout=1800):
-    """Check status until it's successful, an error is found, or we timeout.
+class KtServerLog(object):
+    """Follows a ktserver log, reading only what has been added to it since
+    it was last checked.
+    """
+    def __init__(self, logPath):
+        self.logPath = logPath
+        self.offset = 0
+        self.partialLine = ""
+        self.isRunning = False
+        self.isFailed = False
+        self.isFinished = False
+
+    def update(self):
+        try:
+            with open(self.logPath) as f:
+                f.seek(self.offset)
+                text = f.read()
+                self.offset = f.tell()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Not started yet
+            return
+        lines = (self.partialLine + text).split("\n")
+        self.partialLine = lines.pop()
+        for line in lines:
+            lowerLine = line.lower()
+            if "listening" in lowerLine:
+                self.isRunning = True
+            if "error" in lowerLine:
+                self.isFailed = True
+            if "[FINISH]" in line:
+                self.isFinished = True
+
+    def running(self):
+        self.update()
+        return self.isRunning
+
+    def failed(self):
+        self.update()
+        return self.isFailed
+
+    def finished(self):
+        self.update()
+        return self.isFinished
+
+    def read(self):
+        try:
+            with open(self.logPath) as f:
+                return f.read()
+        except IOError:
+            return ''
+
+def _backoff(timeout, initialStep=0.01, maxStep=1):
+    """Yield until the timeout has passed, sleeping between yields for a
+    step that starts small and doubles up to maxStep."""
+    end = time() + timeout
+    step = initialStep
+    while True:
+        yield
+        if time() >= end:
+            return
+        sleep(min(step, max(0, end - time())))
+        step = min(step * 2, maxStep)
+
+def _isAlive(process):
+    if hasattr(process, "poll"):
+        return process.poll() is None
+    return process.is_alive()
+
+def blockUntilKtserverIsRunning(dbElem, logPath, createTimeout=1800, process=None):
+    """Probe the server until it answers, an error is found in its log, the
+    process running it exits, or we timeout.
 
     Returns True if the ktserver is now running, False if something went wrong."""
-    success = False
-    for i in xrange(createTimeout):
-        if isKtServerFailed(logPath):
-            logger.critical('Error starting ktserver.')
-            success = False
-            break
-        if isKtServerRunning(logPath):
+    log = KtServerLog(logPath)
+    with getClient(dbElem, timeout=10) as client:
+        for _ in _backoff(createTimeout):
+            if log.failed() or (process is not None and not _isAlive(process)):
+                logger.critical('Error starting ktserver.')
+                return False
+            try:
+                client.void()
+            except (socket.error, httplib.HTTPException, KtError):
+                client.close()
+                continue
             logger.info('Ktserver running.')
-            success = True
-            break
-        sleep(1)
-    return success
+            return True
+    return False
 
-def blockUntilKtserverIsFinished(logPath, timeout=1800,
-                                 timeStep=10):
+def blockUntilKtserverIsFinished(logPath, timeout=1800):
     """Wait for the ktserver log to indicate that it shut down properly.
 
-    Returns True if the server shut down, False if the timeout expired."""
-    for i in xrange(0, timeout, timeStep):
-        with open(logPath) as f:
-            log = f.read()
-            if '[FINISH]' in log:
-                return True
-        sleep(timeStep)
+    Returns True if the server shut down, and raises an error if the timeout expired."""
+    log = KtServerLog(logPath)
+    for _ in _backoff(timeout):
+        if log.finished():
+            return True
     raise RuntimeError("Timeout reached while waiting for ktserver.")
 
 def isKtServerRunning(logPath):
     """Check if the server started running."""
-    success = False
-    with open(logPath) as f:
-        for line in f:
-            if line.lower().find("listening") >= 0:
-                success = True
-    return success
+    return KtServerLog(logPath).running()
 
 def isKtServerFailed(logPath):
     """Does the server log contain an error?"""
-    isFailed = False
-    with open(logPath) as f:
-        for line in f:
-            if line.lower().find("error") >= 0:
-                isFailed = True
-                break
-    return isFailed
-
-def getKtTuningOptions(dbElem):
+    return KtServerLog(logPath).failed()
+
+def getKtTuningOptions(dbElem, sizing=None):
     """Get the appropriate KTServer tuning parameters (bucket size, etc.)"""
-    # these are some hardcoded defaults.  should think about moving to config
+    # these are some hardcoded defaults, used if the DB hasn't been sized
     tuningOptions = "#opts=ls#bnum=30m#msiz=50g#ktopts=p"
+    if sizing is not None:
+        tuningOptions = sizing.getTuningOptions()
     # override default ktserver settings if they are present in the
     # experiment xml file. 
     if dbElem.getDbTuningOptions() is not None:
@@ -196,36 +445,59 @@ def getKtTuningOptions(dbElem):
         tuningOptions = dbElem.getDbCreateTuningOptions()
     return tuningOptions
 
-def getKtServerOptions(dbElem):
-    # these are some hardcoded defaults.  should think about moving to config
+def getKtServerOptions(dbElem, sizing=None):
+    # these are some hardcoded defaults, used if the DB hasn't been sized
     serverOptions = "-ls -tout 200000 -th 64"
+    if sizing is not None:
+        serverOptions = sizing.getServerOptions()
     if dbElem.getDbServerOptions() is not None:
         serverOptions = dbElem.getDbServerOptions()
     return serverOptions
 
-def getKtserverCommand(dbElem, logPath, snapshotDir):
-    """Get a ktserver command line with the proper options (in popen-type list format)."""
-    serverOptions = getKtServerOptions(dbElem)
-    tuning = getKtTuningOptions(dbElem)
+def getKtserverCommand(dbElem, logPath, snapshotDir, sizing=None, codec=None, scriptPath=None):
+    """Get a ktserver command line with the proper options (in popen-type list format).
+
+    The server compresses its snapshots itself unless they will be
+    compressed with codec on export. Without a snapshotDir, the server
+    takes no snapshots of its own, and with a scriptPath it runs that
+    Lua script."""
+    serverOptions = getKtServerOptions(dbElem, sizing)
+    tuning = getKtTuningOptions(dbElem, sizing)
     cmd = ["ktserver", "-port", str(dbElem.getDbPort())]
     cmd += serverOptions.split()
-    # Configure background snapshots, but set the interval between
-    # snapshots to ~ 10 days so it'll never trigger. We are only
-    # interested in the snapshot that the DB creates on termination.
-    cmd += ["-bgs", snapshotDir, "-bgsc", "lzo", "-bgsi", "1000000"]
+    if snapshotDir is not None:
+        # Configure background snapshots, but set the interval between
+        # snapshots to ~ 10 days so it'll never trigger. We are only
+        # interested in the snapshot that the DB creates on termination.
+        cmd += ["-bgs", snapshotDir, "-bgsi", "1000000"] + getKtserverCompressionOptions(codec)
+    if scriptPath is not None:
+        cmd += ["-scr", scriptPath]
     cmd += ["-log", logPath]
     cmd += [":" + tuning]
     return cmd
 
-def getRemoteParams(dbElem):
-    """Get parameters to supply to ktremotemgr to connect to the right DB."""
-    host = dbElem.getDbHost() or 'localhost'
-    return ['-port', str(dbElem.getDbPort()),
-            '-host', host]
-
-def stopKtserver(dbElem):
-    """Attempt to send the terminate signal to a ktserver."""
-    cactus_call(parameters=['ktremotemgr', 'set'] + getRemoteParams(dbElem) + ['TERMINATE', '1'])
+def getServerPath(path, serverWorkDir):
+    """The path to a file in the server's work dir as the server sees it,
+    which cactus_call mounts in the container it runs the server in."""
+    if os.environ.get("CACTUS_BINARIES_MODE", "docker") in ("docker", "singularity"):
+        return prepareWorkDir(serverWorkDir, [path])[1][0]
+    return path
+
+def getClient(dbElem, timeout=60):
+    """Get a client connected to the DB."""
+    return KtClient(dbElem.getDbHost() or 'localhost', dbElem.getDbPort(), timeout=timeout)
+
+def stopKtserver(dbElem, handoff=False):
+    """Attempt to send the terminate signal to a ktserver, asking for it to
+    be handed off to the next checkpoint if it can be."""
+    with getClient(dbElem) as client:
+        client.set('TERMINATE', HANDOFF_SIGNAL if handoff else '1')
+
+def clearKtserver(dbElem):
+    """Remove every record from a running ktserver, so that it can be reused
+    as scratch space."""
+    with getClient(dbElem) as client:
+        client.clear()
 
 def getHostName():
     if platform.system() == 'Darwin':
@@ -256,18 +528,21 @@ def getPublicIP():
         # to provide a default argument
         return '127.0.0.1'
 
-def findOccupiedPorts():
-    """Attempt to find all currently taken TCP ports.
-
-    Returns a set of ints, representing taken ports."""
-    netstatOutput = cactus_call(parameters=["netstat", "-tuplen"], check_output=True)
-    ports = set()
-    for line in netstatOutput.split("\n"):
-        fields = line.split()
-        if len(fields) != 9:
-            # Header or other garbage line
-            continue
-        port = int(fields[3].split(':')[-1])
-        ports.add(port)
-    logger.debug('Detected ports in use: %s' % repr(ports))
-    return ports
+def findFreePort(attempts=100):
+    """Find a TCP port that nothing is listening on by binding to it.
+
+    Binding to port 0 would let the OS choose, but it chooses from the
+    ephemeral range, which is above MAX_KTSERVER_PORT, so random ports
+    below that are tried instead."""
+    for i in xrange(attempts):
+        port = random.randint(1025, MAX_KTSERVER_PORT)
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+            try:
+                sock.bind(('', port))
+            except socket.error as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                continue
+        logger.debug('Found free port %i' % port)
+        return port
+    raise RuntimeError("Unable to find a free port after %i attempts" % attempts)
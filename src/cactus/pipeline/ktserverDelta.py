@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Delta snapshots of the cactus DB.
+
+A phase such as normalisation or reference changes only a fraction of the
+records of the DB, but each checkpoint exports a whole snapshot of it.
+When the CACTUS_DB_DELTA_SNAPSHOTS environment variable is set (cactus
+sets it from --dbDeltaSnapshots), a server started from a snapshot instead
+exports only what differs from the last full snapshot it descends from, its
+base. Restarting from a delta loads the base and applies the delta to it,
+so the I/O of a checkpoint follows the work done since the base rather
+than the size of the DB.
+
+Nothing outside the server sees which records change, so deltas are found
+in the snapshot files themselves, which hold the records in much the same
+order from one snapshot to the next. Both are cut into chunks at points
+chosen by their content, so that records added or removed only change the
+chunks around them, and the chunks of the new snapshot found in the base
+are recorded as copies of it. A delta holds a list of operations, each
+either copying a range of the base or giving bytes of its own.
+
+Deltas are always made against the base rather than the last delta, so
+restoring takes one delta at most. As the deltas grow with each phase,
+once one would carry more than CACTUS_DB_DELTA_COMPACTION of the new
+snapshot's bytes a full snapshot is exported instead, becoming the base of
+the deltas that follow.
+
+Deltas never leave the job store: the dumps exported to
+--intermediateResultsUrl are the full snapshots they make (see
+ktserverSnapshot.exportPlainSnapshot), since their bases are only named
+by job store IDs.
+"""
+
+import os
+import re
+import struct
+import hashlib
+import marshal
+import threading
+
+DELTA_SNAPSHOTS_ENV = "CACTUS_DB_DELTA_SNAPSHOTS"
+DELTA_COMPACTION_ENV = "CACTUS_DB_DELTA_COMPACTION"
+DEFAULT_DELTA_COMPACTION = 0.5
+
+# Chunks end after this pair of bytes, which in the compressed records of a
+# cactus DB turns up about every 64KiB. Chunks are kept to between
+# MIN_CHUNK and MAX_CHUNK bytes however often it turns up.
+ANCHOR = re.compile(re.escape("\x8f\x3c"))
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+READ_SIZE = 16 * 1024**2
+
+COPY = "C"
+LITERAL = "L"
+END = "E"
+_copyStruct = struct.Struct(">QI")
+_lengthStruct = struct.Struct(">I")
+
+def deltaSnapshotsEnabled():
+    return os.environ.get(DELTA_SNAPSHOTS_ENV) is not None
+
+def getDeltaCompaction():
+    return float(os.environ.get(DELTA_COMPACTION_ENV, DEFAULT_DELTA_COMPACTION))
+
+def iterChunks(inFile):
+    """Cut the rest of inFile into chunks at points chosen by its content,
+    yielding them in order."""
+    buf = ""
+    start = 0
+    eof = False
+    while True:
+        if not eof and len(buf) - start < MAX_CHUNK:
+            data = inFile.read(READ_SIZE)
+            eof = len(data) == 0
+            buf = buf[start:] + data
+            start = 0
+            continue
+        if start == len(buf):
+            return
+        match = ANCHOR.search(buf, start + MIN_CHUNK, start + MAX_CHUNK)
+        cut = match.end() if match is not None else min(start + MAX_CHUNK, len(buf))
+        yield buf[start:cut]
+        start = cut
+
+def _digest(chunk):
+    return hashlib.sha1(chunk).digest()
+
+def indexSnapshot(inFile):
+    """Index the chunks of a base snapshot by their digests, giving the
+    offset and length of each."""
+    index = {}
+    offset = 0
+    for chunk in iterChunks(inFile):
+        index.setdefault(_digest(chunk), (offset, len(chunk)))
+        offset += len(chunk)
+    return index
+
+def writeIndex(index, indexPath):
+    with open(indexPath, 'wb') as indexFile:
+        marshal.dump(index, indexFile)
+
+def readIndex(indexPath):
+    with open(indexPath, 'rb') as indexFile:
+        return marshal.load(indexFile)
+
+def makeDelta(snapshotPath, index, deltaPath):
+    """Write the operations that make the snapshot at snapshotPath from the
+    base with the given index to deltaPath. Returns the size of the
+    snapshot, the number of its bytes the delta gives itself and the index
+    of the snapshot, should it become a base.
+    """
+    size = 0
+    literalBytes = 0
+    snapshotIndex = {}
+    # Adjacent copies of the base are merged into one
+    copyStart, copyLength = None, 0
+    with open(snapshotPath, 'rb') as inFile, open(deltaPath, 'wb') as outFile:
+        for chunk in iterChunks(inFile):
+            digest = _digest(chunk)
+            snapshotIndex.setdefault(digest, (size, len(chunk)))
+            size += len(chunk)
+            if digest in index:
+                offset, length = index[digest]
+                if copyStart is not None and copyStart + copyLength == offset:
+                    copyLength += length
+                    continue
+                if copyStart is not None:
+                    outFile.write(COPY + _copyStruct.pack(copyStart, copyLength))
+                copyStart, copyLength = offset, length
+            else:
+                if copyStart is not None:
+                    outFile.write(COPY + _copyStruct.pack(copyStart, copyLength))
+                    copyStart, copyLength = None, 0
+                outFile.write(LITERAL + _lengthStruct.pack(len(chunk)))
+                outFile.write(chunk)
+                literalBytes += len(chunk)
+        if copyStart is not None:
+            outFile.write(COPY + _copyStruct.pack(copyStart, copyLength))
+        outFile.write(END)
+    return size, literalBytes, snapshotIndex
+
+def _readExactly(inFile, length):
+    data = inFile.read(length)
+    if len(data) != length:
+        raise RuntimeError("Delta snapshot is truncated")
+    return data
+
+def applyDelta(baseFile, deltaFile, outFile):
+    """Write the snapshot made by applying the operations read from
+    deltaFile to the base in baseFile, a file that can seek, to outFile."""
+    while True:
+        operation = _readExactly(deltaFile, 1)
+        if operation == END:
+            return
+        elif operation == COPY:
+            offset, length = _copyStruct.unpack(_readExactly(deltaFile, _copyStruct.size))
+            baseFile.seek(offset)
+            while length > 0:
+                data = _readExactly(baseFile, min(length, READ_SIZE))
+                outFile.write(data)
+                length -= len(data)
+        elif operation == LITERAL:
+            length, = _lengthStruct.unpack(_readExactly(deltaFile, _lengthStruct.size))
+            while length > 0:
+                data = _readExactly(deltaFile, min(length, READ_SIZE))
+                outFile.write(data)
+                length -= len(data)
+        else:
+            raise RuntimeError("Unknown delta snapshot operation %r" % operation)
+
+class SnapshotIndexer(threading.Thread):
+    """Indexes a base snapshot in the background, so that the server can
+    start while it does. It reads from a file object of its own, so the
+    snapshot may be renamed or removed meanwhile."""
+    def __init__(self, basePath):
+        super(SnapshotIndexer, self).__init__()
+        self.daemon = True
+        self.baseFile = open(basePath, 'rb')
+        self.index = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.index = indexSnapshot(self.baseFile)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.baseFile.close()
+
+    def getIndex(self):
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("Unable to index the base snapshot: %s" % self.error)
+        return self.index
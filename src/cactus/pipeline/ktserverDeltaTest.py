@@ -0,0 +1,90 @@
+import os
+import random
+import shutil
+import unittest
+from StringIO import StringIO
+
+from sonLib.bioio import getTempDirectory
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.ktserverDelta import iterChunks, indexSnapshot, makeDelta, applyDelta, \
+    writeIndex, readIndex, MIN_CHUNK, MAX_CHUNK
+
+def randomBytes(rng, length):
+    return ("%0*x" % (2 * length, rng.getrandbits(8 * length))).decode("hex")
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory(os.getcwd())
+        rng = random.Random(7)
+        # Stands in for a snapshot of compressed records
+        self.records = [randomBytes(rng, rng.randint(1000, 20000)) for i in xrange(300)]
+        self.base = "".join(self.records)
+        self.basePath = os.path.join(self.tempDir, "base")
+        with open(self.basePath, 'wb') as f:
+            f.write(self.base)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempDir)
+
+    def roundTrip(self, snapshot):
+        snapshotPath = os.path.join(self.tempDir, "snapshot")
+        deltaPath = os.path.join(self.tempDir, "delta")
+        with open(snapshotPath, 'wb') as f:
+            f.write(snapshot)
+        with open(self.basePath, 'rb') as f:
+            index = indexSnapshot(f)
+        size, literalBytes, snapshotIndex = makeDelta(snapshotPath, index, deltaPath)
+        self.assertEquals(size, len(snapshot))
+        output = StringIO()
+        with open(self.basePath, 'rb') as baseFile, open(deltaPath, 'rb') as deltaFile:
+            applyDelta(baseFile, deltaFile, output)
+        self.assertEquals(output.getvalue(), snapshot)
+        return literalBytes, os.path.getsize(deltaPath)
+
+    @silentOnSuccess
+    def testChunks(self):
+        chunks = list(iterChunks(StringIO(self.base)))
+        self.assertEquals("".join(chunks), self.base)
+        self.assertTrue(all(MIN_CHUNK <= len(chunk) <= MAX_CHUNK for chunk in chunks[:-1]))
+        self.assertEquals(list(iterChunks(StringIO(""))), [])
+
+    @silentOnSuccess
+    def testUnchanged(self):
+        literalBytes, deltaSize = self.roundTrip(self.base)
+        self.assertEquals(literalBytes, 0)
+        self.assertTrue(deltaSize < 100)
+
+    @silentOnSuccess
+    def testChangedRecords(self):
+        rng = random.Random(8)
+        records = list(self.records)
+        # A few records change, one is removed and a couple are added
+        for i in (10, 150, 151, 290):
+            records[i] = randomBytes(rng, len(records[i]))
+        del records[40]
+        records.insert(200, randomBytes(rng, 5000))
+        records.append(randomBytes(rng, 100))
+        snapshot = "".join(records)
+        literalBytes, deltaSize = self.roundTrip(snapshot)
+        # Only the chunks around the changes are carried
+        self.assertTrue(0 < literalBytes < len(snapshot) / 2)
+        self.assertTrue(deltaSize < literalBytes + 1000)
+
+    @silentOnSuccess
+    def testUnrelated(self):
+        snapshot = randomBytes(random.Random(9), 100000)
+        literalBytes, deltaSize = self.roundTrip(snapshot)
+        self.assertEquals(literalBytes, len(snapshot))
+
+    @silentOnSuccess
+    def testIndex(self):
+        with open(self.basePath, 'rb') as f:
+            index = indexSnapshot(f)
+        indexPath = os.path.join(self.tempDir, "index")
+        writeIndex(index, indexPath)
+        self.assertEquals(readIndex(indexPath), index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Hand-off of a running primary DB from one checkpoint to the next.
+
+Each checkpoint normally stops the primary ktserver, exports its snapshot
+and starts a new server from it, so that the next checkpoint pays for the
+snapshot to be downloaded and loaded before it can do anything. When the
+CACTUS_DB_HANDOFF_DIR environment variable is set (cactus sets it from
+--dbHandoffDir), primary servers are instead started in a work dir of
+their own under that node-local directory. At the end of a checkpoint
+(see SavePrimaryDB), the server dumps a snapshot through a Lua script
+while it keeps running, the snapshot is exported as usual so that the
+checkpoint can still be restarted from it, and the server is offered for
+hand-off in place of being stopped. If the next checkpoint's DB is
+started on the same node, it claims the offer and carries on with the
+running server, skipping the reload.
+
+An offer is a file named after the snapshot it was dumped to, since that
+is what the next checkpoint is given to start its DB from. Claiming it
+renames it, so each offer is claimed at most once. Offers left unclaimed
+for CACTUS_DB_HANDOFF_TIMEOUT seconds, as happens when the next checkpoint
+runs on another node, are claimed by a reaper process started with the
+offer, which stops the server.
+
+ktserver has no procedure that takes a snapshot on demand, so this needs
+a ktserver built with Lua. A script dump is in the database's own snapshot
+format rather than the server's, so servers handed off are loaded and
+dumped through the script throughout (see ktserverSnapshot).
+"""
+
+import os
+import sys
+import json
+import uuid
+import errno
+import shutil
+import signal
+import hashlib
+import tempfile
+import subprocess
+from time import sleep, time
+
+HANDOFF_DIR_ENV = "CACTUS_DB_HANDOFF_DIR"
+HANDOFF_TIMEOUT_ENV = "CACTUS_DB_HANDOFF_TIMEOUT"
+DEFAULT_HANDOFF_TIMEOUT = 600
+
+# The value of the TERMINATE key that asks for the server to be handed off
+# rather than stopped
+HANDOFF_SIGNAL = "handoff"
+
+SCRIPT_NAME = "cactus.lua"
+
+SCRIPT = """-- Written by cactus (see cactus.pipeline.ktserverHandoff)
+kt = __kyototycoon__
+db = kt.db
+
+function check(inmap, outmap)
+   return kt.RVSUCCESS
+end
+
+function snapshot(inmap, outmap)
+   if not inmap.path then
+      return kt.RVEINVALID
+   end
+   if not db:dump_snapshot(inmap.path) then
+      outmap.reason = tostring(db:error())
+      return kt.RVEINTERNAL
+   end
+   return kt.RVSUCCESS
+end
+
+function load(inmap, outmap)
+   if not inmap.path then
+      return kt.RVEINVALID
+   end
+   if not db:load_snapshot(inmap.path) then
+      outmap.reason = tostring(db:error())
+      return kt.RVEINTERNAL
+   end
+   return kt.RVSUCCESS
+end
+"""
+
+# How long a server that has been asked to stop gets before it is killed
+STOP_TIMEOUT = 1200
+
+def getHandoffDir():
+    """The directory servers are offered for hand-off in, or None if they
+    shouldn't be."""
+    return os.environ.get(HANDOFF_DIR_ENV)
+
+def getHandoffTimeout():
+    return float(os.environ.get(HANDOFF_TIMEOUT_ENV, DEFAULT_HANDOFF_TIMEOUT))
+
+def makeWorkDir(handoffDir):
+    """Make a work dir for a server that may outlive the job that started
+    it."""
+    try:
+        os.makedirs(handoffDir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return tempfile.mkdtemp(prefix="ktserver-", dir=handoffDir)
+
+def getScriptPath(workDir):
+    return os.path.join(workDir, SCRIPT_NAME)
+
+def writeScript(workDir):
+    """Write the script that loads and dumps snapshots to workDir, returning
+    its path."""
+    scriptPath = getScriptPath(workDir)
+    with open(scriptPath, 'w') as scriptFile:
+        scriptFile.write(SCRIPT)
+    return scriptPath
+
+def getOfferPath(handoffDir, snapshotID):
+    return os.path.join(handoffDir, hashlib.sha1(str(snapshotID)).hexdigest() + ".offer")
+
+def offerServer(handoffDir, snapshotID, offer, timeout=None):
+    """Offer the server described by the offer dict to the DB started from
+    snapshotID, starting a reaper to stop it if the offer isn't claimed in
+    time. The offer has the host, port, pid, workDir and logPath of the
+    server, and the dir cactus_call ran it in (serverWorkDir)."""
+    if timeout is None:
+        timeout = getHandoffTimeout()
+    offerPath = getOfferPath(handoffDir, snapshotID)
+    tempPath = "%s.tmp-%s" % (offerPath, uuid.uuid4())
+    with open(tempPath, 'w') as offerFile:
+        json.dump(offer, offerFile)
+    os.rename(tempPath, offerPath)
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen([sys.executable, "-m", "cactus.pipeline.ktserverHandoff",
+                          offerPath, str(timeout)],
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         close_fds=True, preexec_fn=os.setsid)
+    return offerPath
+
+def _claim(offerPath):
+    """Take the offer at offerPath, returning it, or None if it has already
+    been taken."""
+    claimedPath = "%s.claimed-%s" % (offerPath, uuid.uuid4())
+    try:
+        os.rename(offerPath, claimedPath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    try:
+        with open(claimedPath) as claimedFile:
+            return json.load(claimedFile)
+    finally:
+        os.remove(claimedPath)
+
+def claimServer(handoffDir, snapshotID, hostName):
+    """Claim the server offered to the DB started from snapshotID, if it is
+    running on this host, returning its offer or None."""
+    offerPath = getOfferPath(handoffDir, snapshotID)
+    try:
+        with open(offerPath) as offerFile:
+            offer = json.load(offerFile)
+    except (IOError, ValueError):
+        return None
+    if offer["host"] != hostName:
+        # The directory isn't local to the node
+        return None
+    offer = _claim(offerPath)
+    if offer is None:
+        return None
+    if not AdoptedProcess(offer["pid"]).isRunning():
+        shutil.rmtree(offer["workDir"], ignore_errors=True)
+        return None
+    return offer
+
+def stopServer(offer, timeout=STOP_TIMEOUT):
+    """Stop an offered server without taking a snapshot, and remove its work
+    dir."""
+    process = AdoptedProcess(offer["pid"])
+    process.send_signal(signal.SIGINT)
+    if not process.wait(timeout):
+        process.send_signal(signal.SIGKILL)
+    shutil.rmtree(offer["workDir"], ignore_errors=True)
+
+def reap(offerPath, timeout, pollInterval=5):
+    """Stop the offered server if its offer is still there after timeout
+    seconds."""
+    end = time() + timeout
+    while time() < end:
+        if not os.path.exists(offerPath):
+            return
+        sleep(min(pollInterval, max(0, end - time())))
+    offer = _claim(offerPath)
+    if offer is not None:
+        stopServer(offer)
+
+class AdoptedProcess(object):
+    """Looks after a server process that isn't a child of this one, with the
+    parts of the Popen interface ServerProcess uses."""
+    def __init__(self, pid):
+        self.pid = pid
+
+    def isRunning(self):
+        try:
+            os.kill(self.pid, 0)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return False
+            if e.errno != errno.EPERM:
+                raise
+        try:
+            with open("/proc/%i/stat" % self.pid) as statFile:
+                # A zombie whose parent hasn't reaped it yet is finished
+                return statFile.read().rsplit(")", 1)[-1].split()[0] != "Z"
+        except IOError:
+            return True
+
+    def poll(self):
+        return None if self.isRunning() else 0
+
+    def send_signal(self, sig):
+        try:
+            os.kill(self.pid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def wait(self, timeout=None):
+        """Wait for the process to finish, returning False if it didn't in
+        time."""
+        step = 0.01
+        end = None if timeout is None else time() + timeout
+        while self.isRunning():
+            if end is not None and time() >= end:
+                return False
+            sleep(step)
+            step = min(2 * step, 1)
+        return True
+
+def main():
+    reap(sys.argv[1], float(sys.argv[2]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import json
+import shutil
+import signal
+import unittest
+import subprocess
+
+from sonLib.bioio import getTempDirectory
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.ktserverHandoff import makeWorkDir, writeScript, getOfferPath, offerServer, \
+    claimServer, reap, AdoptedProcess
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory(os.getcwd())
+        self.handoffDir = os.path.join(self.tempDir, "handoff")
+        # Stands in for the server
+        self.server = subprocess.Popen(["sleep", "600"])
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+        shutil.rmtree(self.tempDir)
+
+    def makeOffer(self, host="10.0.0.1"):
+        workDir = makeWorkDir(self.handoffDir)
+        writeScript(workDir)
+        return { "host": host, "port": 1978, "pid": self.server.pid, "workDir": workDir,
+                 "logPath": os.path.join(workDir, "ktserver.log"), "serverWorkDir": workDir }
+
+    @silentOnSuccess
+    def testClaimServer(self):
+        offer = self.makeOffer()
+        self.assertEquals(claimServer(self.handoffDir, "snapshot1", "10.0.0.1"), None)
+        offerServer(self.handoffDir, "snapshot1", offer, timeout=600)
+        # Only on the node the server runs on
+        self.assertEquals(claimServer(self.handoffDir, "snapshot1", "10.0.0.2"), None)
+        self.assertEquals(claimServer(self.handoffDir, "snapshot1", "10.0.0.1"), offer)
+        # Only once
+        self.assertEquals(claimServer(self.handoffDir, "snapshot1", "10.0.0.1"), None)
+        self.assertEquals([name for name in os.listdir(self.handoffDir) if name.endswith(".offer")], [])
+        self.assertTrue(os.path.exists(offer["workDir"]))
+
+    @silentOnSuccess
+    def testClaimStoppedServer(self):
+        offer = self.makeOffer()
+        offerServer(self.handoffDir, "snapshot1", offer, timeout=600)
+        self.server.kill()
+        self.server.wait()
+        self.assertEquals(claimServer(self.handoffDir, "snapshot1", "10.0.0.1"), None)
+        self.assertFalse(os.path.exists(offer["workDir"]))
+
+    @silentOnSuccess
+    def testReap(self):
+        offer = self.makeOffer()
+        offerPath = getOfferPath(self.handoffDir, "snapshot1")
+        with open(offerPath, 'w') as offerFile:
+            json.dump(offer, offerFile)
+        reap(offerPath, 0.1)
+        self.assertFalse(os.path.exists(offerPath))
+        self.assertFalse(os.path.exists(offer["workDir"]))
+        self.assertFalse(AdoptedProcess(self.server.pid).isRunning())
+        self.assertEquals(self.server.wait(), -signal.SIGINT)
+
+    @silentOnSuccess
+    def testAdoptedProcess(self):
+        process = AdoptedProcess(self.server.pid)
+        self.assertEquals(process.poll(), None)
+        self.assertFalse(process.wait(0.1))
+        process.send_signal(signal.SIGTERM)
+        # Finished, although not yet reaped by its parent
+        self.assertTrue(process.wait(10))
+        self.assertEquals(process.poll(), 0)
+        self.server.wait()
+        process.send_signal(signal.SIGTERM)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Primary DBs sharded across several servers.
+
+A single ktserver holds the whole cactus disk of a subproblem, so its
+memory and its thread pool limit both the largest subproblem that can be
+aligned and how many bar and reference jobs can use the DB at once. When
+the CACTUS_DB_SHARDS environment variable is set to more than one (cactus
+sets it from --dbShards), each checkpoint instead starts that many primary
+servers, each holding a share of the records.
+
+The binaries are given a conf string that wraps the confs of the shards in
+an st_kv_database_shards element, from which cactusDisk routes each record
+to its shard (see cactusDisk_constructFromString). Records are partitioned
+by a hash of their names, or, if CACTUS_DB_SHARD_PARTITION is "range", by
+ranges of names, which keeps the records made by a job together. The
+disk's parameters and unique ID counters, whose keys are negative, and the
+top flower are kept by the first shard.
+
+Each shard is a server of its own, snapshotted, handed off and restored
+like an unsharded primary DB, so the dump of a sharded checkpoint is a
+list of snapshots, one for each shard. The number of shards can't change
+between the checkpoints of a run.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+SHARDS_ENV = "CACTUS_DB_SHARDS"
+PARTITION_ENV = "CACTUS_DB_SHARD_PARTITION"
+HASH_PARTITION = "hash"
+RANGE_PARTITION = "range"
+PARTITIONS = (HASH_PARTITION, RANGE_PARTITION)
+
+SHARDS_TAG = "st_kv_database_shards"
+
+INT64_MAX = 2**63 - 1
+_UINT64_MASK = 2**64 - 1
+
+def getShardCount():
+    """The number of servers each primary DB is sharded across."""
+    shards = int(os.environ.get(SHARDS_ENV, 1))
+    if shards < 1:
+        raise RuntimeError("The number of DB shards must be at least 1, not %i" % shards)
+    return shards
+
+def getShardPartition():
+    partition = os.environ.get(PARTITION_ENV, HASH_PARTITION)
+    if partition not in PARTITIONS:
+        raise RuntimeError("Unknown DB shard partition %s" % partition)
+    return partition
+
+def makeShardedConfString(confStrings, partition=None):
+    """Wrap the conf strings of the shards in one for the binaries. A
+    single shard is given as it is."""
+    if len(confStrings) == 1:
+        return confStrings[0]
+    if partition is None:
+        partition = getShardPartition()
+    shardsElem = ET.Element(SHARDS_TAG, partition=partition)
+    for confString in confStrings:
+        shardsElem.append(ET.fromstring(confString))
+    return ET.tostring(shardsElem)
+
+def isShardedConfString(confString):
+    return ET.fromstring(confString).tag == SHARDS_TAG
+
+def getShardConfStrings(confString):
+    """The conf strings of the shards of a DB."""
+    confElem = ET.fromstring(confString)
+    if confElem.tag != SHARDS_TAG:
+        return [confString]
+    return [ET.tostring(shardElem) for shardElem in confElem]
+
+def getShardSnapshotIDs(dump, shards):
+    """The snapshots to start the shards of a primary DB from, given the
+    dump of the last checkpoint: a snapshot, a list of one for each shard,
+    or None."""
+    if dump is None:
+        return [None] * shards
+    snapshotIDs = dump if isinstance(dump, list) else [dump]
+    if len(snapshotIDs) != shards:
+        raise RuntimeError("The DB was dumped in %i shards, so it can't be restored to %i" %
+                           (len(snapshotIDs), shards))
+    return snapshotIDs
+
+def getShardIndex(key, shards, partition=HASH_PARTITION):
+    """The shard holding the record with the given key, as cactusDisk
+    routes it."""
+    if shards == 1 or key <= 0:
+        return 0
+    if partition == RANGE_PARTITION:
+        return min((key - 1) // (INT64_MAX // shards), shards - 1)
+    # The MurmurHash3 finaliser
+    h = key & _UINT64_MASK
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _UINT64_MASK
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _UINT64_MASK
+    h ^= h >> 33
+    return int(h % shards)
@@ -0,0 +1,79 @@
+import os
+import random
+import unittest
+import xml.etree.ElementTree as ET
+
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.experimentWrapper import DbElemWrapper
+from cactus.pipeline.ktserverShards import makeShardedConfString, isShardedConfString, \
+    getShardConfStrings, getShardSnapshotIDs, getShardIndex, getShardCount, SHARDS_ENV, \
+    RANGE_PARTITION, INT64_MAX
+
+def confString(port):
+    return ('<st_kv_database_conf type="kyoto_tycoon"><kyoto_tycoon database_dir="x" '
+            'host="10.0.0.1" port="%i" /></st_kv_database_conf>' % port)
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.oldEnv = dict(os.environ)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+
+    @silentOnSuccess
+    def testConfStrings(self):
+        confStrings = [confString(port) for port in (1978, 1979, 1980)]
+        sharded = makeShardedConfString(confStrings, RANGE_PARTITION)
+        self.assertTrue(isShardedConfString(sharded))
+        self.assertEquals(ET.fromstring(sharded).attrib["partition"], RANGE_PARTITION)
+        shards = getShardConfStrings(sharded)
+        self.assertEquals([DbElemWrapper(ET.fromstring(shard)).getDbPort() for shard in shards],
+                          [1978, 1979, 1980])
+        # A single DB isn't wrapped
+        self.assertEquals(makeShardedConfString(confStrings[:1]), confStrings[0])
+        self.assertFalse(isShardedConfString(confStrings[0]))
+        self.assertEquals(getShardConfStrings(confStrings[0]), confStrings[:1])
+
+    @silentOnSuccess
+    def testSnapshotIDs(self):
+        self.assertEquals(getShardSnapshotIDs(None, 3), [None, None, None])
+        self.assertEquals(getShardSnapshotIDs(["a", "b"], 2), ["a", "b"])
+        self.assertEquals(getShardSnapshotIDs("a", 1), ["a"])
+        # The number of shards can't change between checkpoints
+        self.assertRaises(RuntimeError, getShardSnapshotIDs, "a", 2)
+        self.assertRaises(RuntimeError, getShardSnapshotIDs, ["a", "b"], 3)
+
+    @silentOnSuccess
+    def testShardCount(self):
+        self.assertEquals(getShardCount(), 1)
+        os.environ[SHARDS_ENV] = "4"
+        self.assertEquals(getShardCount(), 4)
+        os.environ[SHARDS_ENV] = "0"
+        self.assertRaises(RuntimeError, getShardCount)
+
+    @silentOnSuccess
+    def testShardIndex(self):
+        # The parameters, unique ID counters and top flower stay in the first shard
+        for key in (-100000, -1, 0):
+            self.assertEquals(getShardIndex(key, 4), 0)
+        # Names are handed out in blocks from random buckets of the keys
+        rng = random.Random(1)
+        bucketSize = INT64_MAX // 65536
+        keys = []
+        for i in xrange(100):
+            start = bucketSize * rng.randint(0, 65535) + 1
+            keys.extend(xrange(start, start + 100))
+        counts = [0] * 4
+        for key in keys:
+            counts[getShardIndex(key, 4)] += 1
+        self.assertTrue(all(2000 < count < 3000 for count in counts))
+        # By range, each block stays in one shard
+        for i in xrange(0, len(keys), 100):
+            self.assertEquals(len(set(getShardIndex(key, 4, RANGE_PARTITION) for key in keys[i:i + 100])), 1)
+        self.assertEquals(getShardIndex(INT64_MAX, 4, RANGE_PARTITION), 3)
+
+if __name__ == '__main__':
+    unittest.main()
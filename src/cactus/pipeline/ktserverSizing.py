@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Sizing of KyotoTycoon servers from the size of the problem they serve.
+
+The number of records in a cactus DB and their total size grow with the
+sequence loaded into it and the alignments it is built from. From
+estimates of both, a KtserverSizing derives the server's tuning (bnum,
+the number of hash buckets, and msiz, the most memory the cache DB may
+use before it starts discarding records), its thread count and the memory
+to request for it, in place of fixed defaults that suit neither two
+bacteria nor ten mammals. Explicit tuning and server options in the
+config still take precedence. A DB sharded across several servers (see
+ktserverShards) sizes each for its share of the records.
+
+The default coefficients reproduce the memory requests cactus used to
+make, max(2.5e9, 4.10201882 * totalSequenceSize + 2.01324291e8), so
+the alignments size only counts once coefficients are fitted. Running this module as a script (or cactus_db_sizing) compares the
+estimates with the peaks recorded in the dbStatus samples of metrics files
+(see cactus.shared.metrics), and can fit new coefficients to them for
+cactus --dbSizing.
+"""
+import os
+import json
+import math
+from collections import defaultdict
+from argparse import ArgumentParser
+
+from cactus.shared.metrics import readRecords
+
+DB_SIZING_ENV = "CACTUS_DB_SIZING"
+DB_SIZING_VERSION = 1
+
+# Requested memory beyond the estimated size, for fragmentation and the
+# server's own buffers
+MEMORY_HEADROOM = 1.3
+SERVER_OVERHEAD = 201324291
+MIN_MEMORY = 2500000000
+# The hash buckets of the cache DB take this much each
+BUCKET_BYTES = 8
+MIN_BUCKETS = 1000000
+
+# The memory cactus used to request was 4.10201882 bytes per base plus
+# SERVER_OVERHEAD, so the default bytes per base are those that, with the
+# headroom and hash buckets, come to the same. The alignments are left
+# out until coefficients are fitted to them.
+DEFAULT_COEFFICIENTS = { "recordsPerBase": 0.01, "recordsPerAlignmentByte": 0.0,
+                         "bytesPerBase": (4.10201882 - 2 * BUCKET_BYTES * 0.01) / MEMORY_HEADROOM,
+                         "bytesPerAlignmentByte": 0.0 }
+
+# Records beyond msiz are silently discarded, so it is only ever raised
+# above the old default, never lowered
+MSIZ_FACTOR = 4
+MIN_MSIZ = 50 * 1024**3
+MIN_THREADS = 16
+MAX_THREADS = 64
+RECORDS_PER_THREAD = 5000000
+
+def parseCoefficients(sizingString):
+    sizing = json.loads(sizingString)
+    if sizing.get("version") != DB_SIZING_VERSION:
+        raise RuntimeError("Unsupported DB sizing version %s" % sizing.get("version"))
+    coefficients = dict(DEFAULT_COEFFICIENTS)
+    coefficients.update(sizing["coefficients"])
+    return coefficients
+
+def getCoefficients():
+    """The coefficients in use: those fitted by cactus_db_sizing, if cactus
+    was given them with --dbSizing, or the defaults."""
+    sizingString = os.environ.get(DB_SIZING_ENV)
+    if sizingString is None:
+        return dict(DEFAULT_COEFFICIENTS)
+    return parseCoefficients(sizingString)
+
+def estimateLoad(totalSequenceSize, alignmentsSize=0, coefficients=None):
+    """Estimate the number of records and bytes a DB will hold."""
+    if coefficients is None:
+        coefficients = getCoefficients()
+    records = coefficients["recordsPerBase"] * totalSequenceSize + \
+              coefficients["recordsPerAlignmentByte"] * alignmentsSize
+    size = coefficients["bytesPerBase"] * totalSequenceSize + \
+           coefficients["bytesPerAlignmentByte"] * alignmentsSize
+    return int(records), int(size)
+
+class KtserverSizing(object):
+    def __init__(self, totalSequenceSize, alignmentsSize=0, coefficients=None, shards=1):
+        self.features = { "totalSequenceSize": totalSequenceSize, "alignmentsSize": alignmentsSize }
+        if shards > 1:
+            self.features["shards"] = shards
+        records, size = estimateLoad(totalSequenceSize, alignmentsSize, coefficients)
+        self.records, self.size = records // shards, size // shards
+
+    def getBucketCount(self):
+        return max(MIN_BUCKETS, 2 * self.records)
+
+    def getCacheSize(self):
+        return max(MIN_MSIZ, MSIZ_FACTOR * self.size)
+
+    def getThreads(self):
+        threads = MIN_THREADS * int(math.ceil(float(self.records) / RECORDS_PER_THREAD))
+        return max(MIN_THREADS, min(MAX_THREADS, threads))
+
+    def getMemory(self):
+        """The memory to request for the server."""
+        return max(MIN_MEMORY, int(MEMORY_HEADROOM * self.size) +
+                   BUCKET_BYTES * self.getBucketCount() + SERVER_OVERHEAD)
+
+    def getTuningOptions(self):
+        return "#opts=ls#bnum=%i#msiz=%i#ktopts=p" % (self.getBucketCount(), self.getCacheSize())
+
+    def getServerOptions(self):
+        return "-ls -tout 200000 -th %i" % self.getThreads()
+
+def serverPeaks(records):
+    """Group the dbStatus samples of metrics files by server, returning a
+    list of (features, phase, dbRole, peak records, peak size) for the
+    servers that recorded their sizing features. The peaks of the shards
+    of a DB are scaled up to the whole DB."""
+    servers = defaultdict(list)
+    for record in records:
+        if record.get("type") == "dbStatus" and record.get("jobInstance") is not None:
+            servers[record["jobInstance"]].append(record)
+    peaks = []
+    for samples in servers.itervalues():
+        first = samples[0]
+        features = first.get("jobFeatures")
+        if features is None or features.get("totalSequenceSize") is None:
+            continue
+        counts = [r["records"] for r in samples if r.get("records") is not None]
+        sizes = [r["size"] for r in samples if r.get("size") is not None]
+        if counts and sizes:
+            shards = features.get("shards", 1)
+            peaks.append((features, first.get("phase"), first.get("dbRole"),
+                          shards * max(counts), shards * max(sizes)))
+    return peaks
+
+def _fitPair(points, quantile):
+    """Fit y = a*x1 + b*x2 (a, b >= 0) to ((x1, x2), y) points by least
+    squares, then scale the fit up so that the given quantile of the
+    points lie on or under it."""
+    sxx = sum(x1 * x1 for (x1, x2), y in points)
+    sxz = sum(x1 * x2 for (x1, x2), y in points)
+    szz = sum(x2 * x2 for (x1, x2), y in points)
+    sxy = sum(x1 * y for (x1, x2), y in points)
+    szy = sum(x2 * y for (x1, x2), y in points)
+    determinant = sxx * szz - sxz * sxz
+    a = b = -1
+    if determinant > 0:
+        a = (sxy * szz - szy * sxz) / determinant
+        b = (szy * sxx - sxy * sxz) / determinant
+    if a < 0 or b < 0:
+        # Fall back to the sequence size alone
+        a = sxy / sxx if sxx > 0 else 0.0
+        b = 0.0
+    ratios = sorted(y / (a * x1 + b * x2) for (x1, x2), y in points if a * x1 + b * x2 > 0)
+    if ratios:
+        scale = ratios[max(0, min(len(ratios) - 1, int(math.ceil(quantile * len(ratios))) - 1))]
+        a, b = a * scale, b * scale
+    return a, b
+
+def fitCoefficients(peaks, quantile=0.95):
+    """Fit the coefficients to the peaks of recorded servers."""
+    def points(index):
+        return [((float(peak[0]["totalSequenceSize"]), float(peak[0].get("alignmentsSize") or 0)),
+                 float(peak[index])) for peak in peaks]
+    coefficients = {}
+    coefficients["recordsPerBase"], coefficients["recordsPerAlignmentByte"] = _fitPair(points(3), quantile)
+    coefficients["bytesPerBase"], coefficients["bytesPerAlignmentByte"] = _fitPair(points(4), quantile)
+    return coefficients
+
+def validate(peaks, coefficients=None):
+    """Compare the estimates with the recorded peaks, returning a list of
+    (phase, dbRole, estimated records, peak records, estimated size, peak
+    size) tuples."""
+    rows = []
+    for features, phase, dbRole, records, size in peaks:
+        estimatedRecords, estimatedSize = estimateLoad(features["totalSequenceSize"],
+                                                       features.get("alignmentsSize") or 0,
+                                                       coefficients)
+        rows.append((phase, dbRole, estimatedRecords, records, estimatedSize, size))
+    return rows
+
+def main():
+    parser = ArgumentParser(description="Compare the DB sizing estimates with the servers "
+                            "recorded in cactus metrics files, and optionally fit new "
+                            "coefficients for cactus --dbSizing")
+    parser.add_argument("metricsFiles", nargs="+")
+    parser.add_argument("--output", default=None,
+                        help="Fit coefficients to the recorded servers and write them here")
+    parser.add_argument("--quantile", type=float, default=0.95,
+                        help="Fraction of the recorded servers whose peaks the fitted "
+                        "estimates must cover [default: %(default)s]")
+    opts = parser.parse_args()
+    peaks = serverPeaks(readRecords(opts.metricsFiles))
+    if len(peaks) == 0:
+        raise RuntimeError("No DB samples with sizing features in the metrics files")
+    coefficients = getCoefficients()
+    if opts.output is not None:
+        coefficients = fitCoefficients(peaks, opts.quantile)
+        with open(opts.output, 'w') as outputFile:
+            json.dump({ "version": DB_SIZING_VERSION, "quantile": opts.quantile,
+                        "coefficients": coefficients }, outputFile, indent=2, sort_keys=True)
+    rows = validate(peaks, coefficients)
+    print "\t".join(["phase", "dbRole", "estimatedRecords", "records", "estimatedSize", "size"])
+    for row in rows:
+        print "\t".join(str(field) for field in row)
+    under = sum(1 for row in rows if row[2] < row[3] or row[4] < row[5])
+    print "%i of %i servers exceeded their estimates" % (under, len(peaks))
+
+if __name__ == '__main__':
+    main()
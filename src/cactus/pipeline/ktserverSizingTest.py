@@ -0,0 +1,105 @@
+import unittest
+import os
+import xml.etree.ElementTree as ET
+
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.experimentWrapper import DbElemWrapper
+from cactus.pipeline.ktserverControl import getKtserverCommand
+from cactus.pipeline.ktserverSizing import KtserverSizing, estimateLoad, serverPeaks, fitCoefficients, \
+    validate, parseCoefficients, getCoefficients, DB_SIZING_ENV, MIN_MEMORY, MIN_MSIZ
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.oldEnv = dict(os.environ)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+
+    def serverRecords(self, instance, totalSequenceSize, alignmentsSize, records, size):
+        context = { "type": "dbStatus", "jobInstance": instance, "phase": "setup", "dbRole": "primary",
+                    "jobFeatures": { "totalSequenceSize": totalSequenceSize, "alignmentsSize": alignmentsSize } }
+        return [dict(context, records=records / 2, size=size / 2), dict(context, records=records, size=size)]
+
+    @silentOnSuccess
+    def testSizing(self):
+        # Small problems get the floors
+        small = KtserverSizing(10 * 1000**2, 1000**2)
+        self.assertEquals(small.getMemory(), MIN_MEMORY)
+        self.assertEquals(small.getServerOptions(), "-ls -tout 200000 -th 16")
+        self.assertEquals(small.getTuningOptions(), "#opts=ls#bnum=1000000#msiz=%i#ktopts=p" % MIN_MSIZ)
+        large = KtserverSizing(30 * 1000**3)
+        self.assertEquals(large.getThreads(), 64)
+        self.assertEquals(large.getBucketCount(), 2 * large.records)
+        self.assertTrue(large.getCacheSize() > large.getMemory())
+
+    @silentOnSuccess
+    def testDefaultMemory(self):
+        # The defaults give the memory cactus used to request, whatever the
+        # size of the alignments
+        for totalSequenceSize in (0, 10**6, 5 * 10**8, 6 * 10**8, 3 * 10**9, 30 * 1000**3, 10**12):
+            oldMemory = max(2500000000, 4.10201882 * totalSequenceSize + 2.01324291e+08)
+            for alignmentsSize in (0, 10 * totalSequenceSize):
+                memory = KtserverSizing(totalSequenceSize, alignmentsSize).getMemory()
+                self.assertAlmostEquals(memory, oldMemory, delta=32)
+
+    @silentOnSuccess
+    def testShardSizing(self):
+        whole = KtserverSizing(30 * 1000**3)
+        shard = KtserverSizing(30 * 1000**3, shards=4)
+        self.assertEquals(shard.records, whole.records // 4)
+        self.assertEquals(shard.size, whole.size // 4)
+        self.assertTrue(shard.getMemory() < whole.getMemory())
+        # The peaks of a shard are scaled up to the whole DB for fitting
+        records = self.serverRecords("db1", 1000, 100, 20, 5000)
+        for record in records:
+            record["jobFeatures"]["shards"] = 4
+        self.assertEquals(serverPeaks(records)[0][3:], (80, 20000))
+
+    @silentOnSuccess
+    def testKtserverCommand(self):
+        dbElem = DbElemWrapper(ET.fromstring('<st_kv_database_conf type="kyoto_tycoon">'
+                                             '<kyoto_tycoon host="localhost" port="1978" database_dir="x"/>'
+                                             '</st_kv_database_conf>'))
+        sizing = KtserverSizing(1000**3)
+        command = getKtserverCommand(dbElem, "log", "snapshots", sizing)
+        self.assertEquals(command[-1], ":" + sizing.getTuningOptions())
+        self.assertTrue("-th" in command)
+        self.assertEquals(command[command.index("-th") + 1], str(sizing.getThreads()))
+        # The config takes precedence
+        dbElem.setDbTuningOptions("#opts=ls#bnum=30m")
+        dbElem.setDbServerOptions("-th 8")
+        command = getKtserverCommand(dbElem, "log", "snapshots", sizing)
+        self.assertEquals(command[-1], ":#opts=ls#bnum=30m")
+        self.assertEquals(command[command.index("-th") + 1], "8")
+
+    @silentOnSuccess
+    def testFitAndValidate(self):
+        records = []
+        for i in xrange(1, 11):
+            records += self.serverRecords("db%i" % i, 1000 * i, 100 * i, 20 * i + 2 * i, 5000 * i + 100 * i)
+        # Servers without features are ignored
+        records.append({ "type": "dbStatus", "jobInstance": "other", "records": 5, "size": 5 })
+        peaks = serverPeaks(records)
+        self.assertEquals(len(peaks), 10)
+        coefficients = fitCoefficients(peaks, quantile=1.0)
+        rows = validate(peaks, coefficients)
+        self.assertEquals(len(rows), 10)
+        for phase, dbRole, estimatedRecords, peakRecords, estimatedSize, peakSize in rows:
+            self.assertEquals((phase, dbRole), ("setup", "primary"))
+            self.assertTrue(estimatedRecords >= peakRecords - 1)
+            self.assertTrue(estimatedSize >= peakSize - 1)
+            self.assertTrue(estimatedSize <= peakSize * 1.01)
+
+    @silentOnSuccess
+    def testCoefficients(self):
+        self.assertEquals(estimateLoad(1000, 0, getCoefficients()), estimateLoad(1000))
+        self.assertRaises(RuntimeError, parseCoefficients, '{"version": 0, "coefficients": {}}')
+        os.environ[DB_SIZING_ENV] = '{"version": 1, "coefficients": {"bytesPerBase": 10.0}}'
+        self.assertEquals(estimateLoad(1000)[1], 10000)
+        self.assertEquals(getCoefficients()["recordsPerBase"], 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Export and loading of KyotoTycoon snapshots through the job store.
+
+A snapshot is streamed into the job store file that will hold it, and
+streamed back out into the snapshot directory of the next server, rather
+than being copied whole to and from local files. If the zstandard module
+is available, the server writes its snapshot uncompressed and it is
+compressed with multithreaded zstd on its way into the job store, which
+keeps up with the single-threaded lzo the server can use itself and gives
+considerably smaller snapshots to move. Such snapshots start with a line
+naming the codec. Without zstandard, the server compresses its snapshot
+with lzo as before and it is stored as it is. Snapshots without the header
+line are loaded as they are, so those of earlier runs can still be
+restored.
+
+Snapshots are in the server's own format (ktss), written by its
+background snapshot on termination, unless they were dumped through the
+server's script for a hand-off (see ktserverHandoff), which writes the
+database's format (kcss). The header line names the format of the latter,
+which are never compressed by the server.
+
+With delta snapshots enabled (see ktserverDelta), a snapshot may instead
+be a delta against a full one, in which case its header line gives the
+full snapshot it applies to and how the snapshot it makes would have been
+stored.
+
+The header, the zstd compression and any delta are only for moving
+snapshots through the job store. The dumps exported to
+--intermediateResultsUrl are unwrapped by exportPlainSnapshot into the
+ktss or kcss file the server or database wrote, so they can be loaded
+with the Kyoto tools as before. A ktss dump is lzo compressed by the
+server if zstandard isn't installed, and uncompressed otherwise.
+"""
+
+import os
+import json
+from time import sleep
+
+from cactus.shared.fileConcat import copyStream
+from cactus.pipeline.ktserverDelta import deltaSnapshotsEnabled, getDeltaCompaction, indexSnapshot, \
+    makeDelta, applyDelta
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SNAPSHOT_MAGIC = "CACTUSKTSNAPSHOT "
+ZSTD_LEVEL = 3
+
+KTSS = "ktss"
+KCSS = "kcss"
+
+def getSnapshotCodec(uncompressed=False):
+    """The codec snapshots are compressed with on export, or None if the
+    server should compress them itself. Snapshots the server can't
+    compress are stored "raw" if zstandard isn't available."""
+    if zstandard is not None:
+        return "zstd"
+    return "raw" if uncompressed else None
+
+def getKtserverCompressionOptions(codec):
+    """The ktserver options giving the compression of its own snapshots."""
+    if codec is None:
+        return ["-bgsc", "lzo"]
+    return []
+
+def exportSnapshot(jobStore, snapshotPath, snapshotID, codec, snapshotFormat=KTSS, base=None):
+    """Stream the snapshot at snapshotPath into the existing job store file
+    snapshotID, compressing it with codec if given.
+
+    If delta snapshots are enabled, only its differences from base, the
+    (snapshot ID, index) of the full snapshot it descends from, are
+    exported, unless they are too large. Returns the base of the snapshots
+    that descend from this one in that case, and None otherwise.
+    """
+    if not deltaSnapshotsEnabled():
+        _exportFull(jobStore, snapshotPath, snapshotID, codec, snapshotFormat)
+        return None
+    if base is not None:
+        deltaPath = snapshotPath + ".delta"
+        try:
+            size, literalBytes, index = makeDelta(snapshotPath, base[1], deltaPath)
+            if literalBytes <= getDeltaCompaction() * size:
+                _exportDelta(jobStore, deltaPath, snapshotID, codec, snapshotFormat, base[0])
+                return base
+        finally:
+            if os.path.exists(deltaPath):
+                os.remove(deltaPath)
+    else:
+        with open(snapshotPath, 'rb') as snapshotFile:
+            index = indexSnapshot(snapshotFile)
+    # Compacted into a new base
+    _exportFull(jobStore, snapshotPath, snapshotID, codec, snapshotFormat)
+    return snapshotID, index
+
+def _exportDelta(jobStore, deltaPath, snapshotID, codec, snapshotFormat, baseID):
+    compression = getSnapshotCodec(uncompressed=True)
+    header = { "base": baseID, "codec": codec, "format": snapshotFormat, "compression": compression }
+    with open(deltaPath, 'rb') as inFile:
+        with jobStore.updateFileStream(snapshotID) as outFile:
+            outFile.write(SNAPSHOT_MAGIC + "delta " + json.dumps(header) + "\n")
+            if compression == "raw":
+                copyStream(inFile, outFile)
+            else:
+                compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+                compressor.copy_stream(inFile, outFile)
+
+def _exportFull(jobStore, snapshotPath, snapshotID, codec, snapshotFormat):
+    if codec is None and snapshotFormat != KTSS:
+        raise RuntimeError("Only the server's own snapshots can be stored without a header")
+    if codec not in (None, "raw", "zstd"):
+        raise RuntimeError("Unknown snapshot codec %s" % codec)
+    with open(snapshotPath, 'rb') as inFile:
+        with jobStore.updateFileStream(snapshotID) as outFile:
+            if codec is None:
+                copyStream(inFile, outFile)
+                return
+            header = codec if snapshotFormat == KTSS else "%s %s" % (codec, snapshotFormat)
+            outFile.write(SNAPSHOT_MAGIC + header + "\n")
+            if codec == "raw":
+                copyStream(inFile, outFile)
+            else:
+                compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+                compressor.copy_stream(inFile, outFile)
+
+def publishSnapshot(jobStore, snapshotID, snapshotDoneID):
+    """Signal that the snapshot snapshotID is complete by writing its ID to
+    the job store file snapshotDoneID."""
+    with jobStore.updateFileStream(snapshotDoneID) as doneFile:
+        doneFile.write(str(snapshotID))
+
+def waitForSnapshot(jobStore, snapshotDoneID, maxStep=10):
+    """Wait for the snapshot to be published to snapshotDoneID. The file
+    is only a few bytes, so it is checked often to begin with."""
+    step = 0.1
+    while True:
+        with jobStore.readFileStream(snapshotDoneID) as doneFile:
+            if doneFile.read(1) != '':
+                return
+        sleep(step)
+        step = min(2 * step, maxStep)
+
+def loadSnapshot(jobStore, snapshotID, snapshotPath, basePath=None):
+    """Stream the snapshot snapshotID out of the job store to snapshotPath,
+    decompressing it as needed. Returns the codec it was compressed with
+    on export, if any, its format and the ID of the full snapshot it
+    descends from. If it is a delta, that full snapshot is left at
+    basePath, if given."""
+    with jobStore.readFileStream(snapshotID) as inFile:
+        with open(snapshotPath, 'wb') as outFile:
+            start = inFile.read(len(SNAPSHOT_MAGIC))
+            if start != SNAPSHOT_MAGIC:
+                # Stored as the server wrote it
+                outFile.write(start)
+                copyStream(inFile, outFile)
+                return None, KTSS, snapshotID
+            header = inFile.readline()
+            if header.startswith("delta "):
+                delta = json.loads(header[len("delta "):])
+                _loadDelta(jobStore, delta, inFile, outFile, basePath or snapshotPath + ".base",
+                           keepBase=basePath is not None)
+                return delta["codec"], delta["format"], delta["base"]
+            header = header.split()
+            codec = header[0] if header else None
+            snapshotFormat = header[1] if len(header) > 1 else KTSS
+            if snapshotFormat not in (KTSS, KCSS):
+                raise RuntimeError("Unknown format %s of snapshot %s" % (snapshotFormat, snapshotID))
+            if codec == "raw":
+                copyStream(inFile, outFile)
+            elif codec == "zstd":
+                if zstandard is None:
+                    raise RuntimeError("Snapshot %s is compressed with zstd, but the zstandard "
+                                       "module isn't installed" % snapshotID)
+                zstandard.ZstdDecompressor().copy_stream(inFile, outFile)
+            else:
+                raise RuntimeError("Unknown codec %s of snapshot %s" % (codec, snapshotID))
+            return codec, snapshotFormat, snapshotID
+
+def exportPlainSnapshot(fileStore, snapshotID, url):
+    """Export the snapshot snapshotID to url as the server or database wrote
+    it, without the header and compression it was stored with, applying
+    it to its base if it is a delta. Returns its format."""
+    with fileStore.jobStore.readFileStream(snapshotID) as inFile:
+        wrapped = inFile.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    if not wrapped:
+        # Stored as the server wrote it
+        fileStore.exportFile(snapshotID, url)
+        return KTSS
+    snapshotPath = fileStore.getLocalTempFile()
+    codec, snapshotFormat, baseID = loadSnapshot(fileStore.jobStore, snapshotID, snapshotPath)
+    plainID = fileStore.writeGlobalFile(snapshotPath)
+    os.remove(snapshotPath)
+    fileStore.exportFile(plainID, url)
+    fileStore.deleteGlobalFile(plainID)
+    return snapshotFormat
+
+def _loadDelta(jobStore, delta, inFile, outFile, basePath, keepBase):
+    loadSnapshot(jobStore, delta["base"], basePath)
+    try:
+        if delta["compression"] == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Delta snapshot is compressed with zstd, but the zstandard "
+                                   "module isn't installed")
+            inFile = zstandard.ZstdDecompressor().stream_reader(inFile)
+        elif delta["compression"] != "raw":
+            raise RuntimeError("Unknown compression %s of delta snapshot" % delta["compression"])
+        with open(basePath, 'rb') as baseFile:
+            applyDelta(baseFile, inFile, outFile)
+    finally:
+        if not keepBase:
+            os.remove(basePath)
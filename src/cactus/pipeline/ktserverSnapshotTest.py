@@ -0,0 +1,209 @@
+import os
+import random
+import shutil
+import unittest
+from contextlib import contextmanager
+
+from sonLib.bioio import getTempDirectory
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.ktserverSnapshot import zstandard, SNAPSHOT_MAGIC, KTSS, KCSS, exportSnapshot, \
+    loadSnapshot, publishSnapshot, waitForSnapshot, exportPlainSnapshot, getSnapshotCodec
+from cactus.pipeline.ktserverDelta import DELTA_SNAPSHOTS_ENV
+
+class FakeJobStore:
+    """Keeps the files of a job store in a local directory."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def getEmptyFileStoreID(self):
+        fileID = "file%i" % len(os.listdir(self.directory))
+        open(os.path.join(self.directory, fileID), 'w').close()
+        return fileID
+
+    @contextmanager
+    def updateFileStream(self, fileID):
+        with open(os.path.join(self.directory, fileID), 'wb') as f:
+            yield f
+
+    @contextmanager
+    def readFileStream(self, fileID):
+        with open(os.path.join(self.directory, fileID), 'rb') as f:
+            yield f
+
+class FakeFileStore:
+    """Exports the files of a FakeJobStore by copying them."""
+    def __init__(self, jobStore, tempDir):
+        self.jobStore = jobStore
+        self.tempDir = tempDir
+
+    def getLocalTempFile(self):
+        return os.path.join(self.tempDir, "local%i" % len(os.listdir(self.tempDir)))
+
+    def writeGlobalFile(self, path):
+        fileID = self.jobStore.getEmptyFileStoreID()
+        shutil.copyfile(path, os.path.join(self.jobStore.directory, fileID))
+        return fileID
+
+    def deleteGlobalFile(self, fileID):
+        os.remove(os.path.join(self.jobStore.directory, fileID))
+
+    def exportFile(self, fileID, url):
+        shutil.copyfile(os.path.join(self.jobStore.directory, fileID), url)
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory(os.getcwd())
+        self.storeDir = os.path.join(self.tempDir, "store")
+        os.mkdir(self.storeDir)
+        self.jobStore = FakeJobStore(self.storeDir)
+        self.snapshotPath = os.path.join(self.tempDir, "snapshot")
+        self.loadedPath = os.path.join(self.tempDir, "loaded")
+        self.contents = "".join(chr(i % 256) for i in xrange(300000)) + "ACGT" * 100000
+        with open(self.snapshotPath, 'wb') as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempDir)
+        os.environ.pop(DELTA_SNAPSHOTS_ENV, None)
+
+    def loaded(self):
+        with open(self.loadedPath, 'rb') as f:
+            return f.read()
+
+    @silentOnSuccess
+    def testUncompressed(self):
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, None)
+        self.assertEquals(loadSnapshot(self.jobStore, snapshotID, self.loadedPath),
+                          (None, KTSS, snapshotID))
+        self.assertEquals(self.loaded(), self.contents)
+
+    @silentOnSuccess
+    def testDeltaSnapshots(self):
+        os.environ[DELTA_SNAPSHOTS_ENV] = "1"
+        rng = random.Random(1)
+        records = ["".join(chr(rng.getrandbits(8)) for j in xrange(10000)) for i in xrange(100)]
+        with open(self.snapshotPath, 'wb') as f:
+            f.write("".join(records))
+        # With nothing to make a delta against, the snapshot is full
+        baseID = self.jobStore.getEmptyFileStoreID()
+        base = exportSnapshot(self.jobStore, self.snapshotPath, baseID, "raw", KCSS)
+        self.assertEquals(base[0], baseID)
+        # A small change is exported as a delta against it
+        records[50] = "x" * 10000
+        with open(self.snapshotPath, 'wb') as f:
+            f.write("".join(records))
+        deltaID = self.jobStore.getEmptyFileStoreID()
+        self.assertEquals(exportSnapshot(self.jobStore, self.snapshotPath, deltaID, "raw", KCSS, base), base)
+        self.assertTrue(os.path.getsize(os.path.join(self.storeDir, deltaID)) <
+                        os.path.getsize(self.snapshotPath) / 2)
+        basePath = os.path.join(self.tempDir, "base")
+        self.assertEquals(loadSnapshot(self.jobStore, deltaID, self.loadedPath, basePath),
+                          ("raw", KCSS, baseID))
+        with open(self.snapshotPath, 'rb') as f:
+            self.assertEquals(self.loaded(), f.read())
+        self.assertTrue(os.path.exists(basePath))
+        # A large one is compacted into a new base
+        with open(self.snapshotPath, 'wb') as f:
+            f.write("y" * 1000000)
+        compactedID = self.jobStore.getEmptyFileStoreID()
+        self.assertEquals(exportSnapshot(self.jobStore, self.snapshotPath, compactedID, "raw", KCSS, base)[0],
+                          compactedID)
+        self.assertEquals(loadSnapshot(self.jobStore, compactedID, self.loadedPath),
+                          ("raw", KCSS, compactedID))
+
+    @silentOnSuccess
+    def testScriptSnapshot(self):
+        # Dumped through the script, so not compressed by the server
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, "raw", KCSS)
+        self.assertEquals(loadSnapshot(self.jobStore, snapshotID, self.loadedPath)[:2], ("raw", KCSS))
+        self.assertEquals(self.loaded(), self.contents)
+        # Its format can't be told without the header
+        self.assertRaises(RuntimeError, exportSnapshot, self.jobStore, self.snapshotPath,
+                          snapshotID, None, KCSS)
+
+    @silentOnSuccess
+    def testLegacySnapshot(self):
+        # Written by the server and copied to the job store whole
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        shutil.copyfile(self.snapshotPath, os.path.join(self.storeDir, snapshotID))
+        loadSnapshot(self.jobStore, snapshotID, self.loadedPath)
+        self.assertEquals(self.loaded(), self.contents)
+
+    @silentOnSuccess
+    def testUnknownCodec(self):
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        with self.jobStore.updateFileStream(snapshotID) as f:
+            f.write(SNAPSHOT_MAGIC + "brotli\n" + self.contents)
+        self.assertRaises(RuntimeError, loadSnapshot, self.jobStore, snapshotID, self.loadedPath)
+        self.assertRaises(RuntimeError, exportSnapshot, self.jobStore, self.snapshotPath,
+                          snapshotID, "brotli")
+
+    @unittest.skipIf(zstandard is None, "the zstandard module isn't installed")
+    @silentOnSuccess
+    def testZstd(self):
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, "zstd")
+        self.assertTrue(os.path.getsize(os.path.join(self.storeDir, snapshotID)) < len(self.contents))
+        self.assertEquals(loadSnapshot(self.jobStore, snapshotID, self.loadedPath)[:2], ("zstd", KTSS))
+        self.assertEquals(self.loaded(), self.contents)
+
+    @silentOnSuccess
+    def testExportPlainSnapshot(self):
+        localDir = os.path.join(self.tempDir, "local")
+        os.mkdir(localDir)
+        fileStore = FakeFileStore(self.jobStore, localDir)
+        exportedPath = os.path.join(self.tempDir, "exported")
+        # The header and compression are stripped
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, getSnapshotCodec(True), KCSS)
+        self.assertEquals(exportPlainSnapshot(fileStore, snapshotID, exportedPath), KCSS)
+        with open(exportedPath, 'rb') as f:
+            self.assertEquals(f.read(), self.contents)
+        # Snapshots stored as the server wrote them are exported as they are
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, None)
+        self.assertEquals(exportPlainSnapshot(fileStore, snapshotID, exportedPath), KTSS)
+        with open(exportedPath, 'rb') as f:
+            self.assertEquals(f.read(), self.contents)
+        # Nothing is left behind
+        self.assertEquals(os.listdir(localDir), [])
+        self.assertEquals(len(os.listdir(self.storeDir)), 2)
+
+        # A delta is exported as the full snapshot it makes, not as a
+        # reference to a base that only exists in the job store
+        os.environ[DELTA_SNAPSHOTS_ENV] = "1"
+        rng = random.Random(1)
+        records = ["".join(chr(rng.getrandbits(8)) for j in xrange(10000)) for i in xrange(100)]
+        with open(self.snapshotPath, 'wb') as f:
+            f.write("".join(records))
+        baseID = self.jobStore.getEmptyFileStoreID()
+        base = exportSnapshot(self.jobStore, self.snapshotPath, baseID, "raw", KCSS)
+        records[50] = "x" * 10000
+        changed = "".join(records)
+        with open(self.snapshotPath, 'wb') as f:
+            f.write(changed)
+        deltaID = self.jobStore.getEmptyFileStoreID()
+        self.assertEquals(exportSnapshot(self.jobStore, self.snapshotPath, deltaID, "raw", KCSS, base), base)
+        with self.jobStore.readFileStream(deltaID) as f:
+            self.assertEquals(f.read(len(SNAPSHOT_MAGIC + "delta ")), SNAPSHOT_MAGIC + "delta ")
+        self.assertEquals(exportPlainSnapshot(fileStore, deltaID, exportedPath), KCSS)
+        with open(exportedPath, 'rb') as f:
+            self.assertEquals(f.read(), changed)
+        self.assertEquals(os.listdir(localDir), [])
+
+    @silentOnSuccess
+    def testPublishSnapshot(self):
+        snapshotID = self.jobStore.getEmptyFileStoreID()
+        snapshotDoneID = self.jobStore.getEmptyFileStoreID()
+        exportSnapshot(self.jobStore, self.snapshotPath, snapshotID, None)
+        publishSnapshot(self.jobStore, snapshotID, snapshotDoneID)
+        waitForSnapshot(self.jobStore, snapshotDoneID)
+        with self.jobStore.readFileStream(snapshotDoneID) as f:
+            self.assertEquals(f.read(), snapshotID)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,44 +7,55 @@
 import os
 import stat
 from toil.job import Job
-from cactus.pipeline.ktserverControl import runKtserver, blockUntilKtserverIsRunning, stopKtserver, \
-    blockUntilKtserverIsFinished
+from cactus.pipeline.ktserverControl import runKtserver
 
 class KtServerService(Job.Service):
     def __init__(self, dbElem, isSecondary, existingSnapshotID=None,
-                 memory=None, cores=None, disk=None):
+                 memory=None, cores=None, disk=None, phase=None, sizing=None):
         Job.Service.__init__(self, memory=memory, cores=cores, disk=disk, preemptable=False)
         self.dbElem = dbElem
         self.isSecondary = isSecondary
+        self.phase = phase
+        self.sizing = sizing
         self.existingSnapshotID = existingSnapshotID
         self.failed = False
         self.process = None
 
     def start(self, job):
-        snapshotExportID = job.fileStore.jobStore.getEmptyFileStoreID()
-        # We need to run this garbage in case we are on a file-based
-        # jobStore with caching enabled. The caching jobStore sets
-        # this empty file to be unwritable for some reason. Since we
-        # need to write something to it, obviously that won't do.
-        path = job.fileStore.readGlobalFile(snapshotExportID)
-        os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+        # A secondary DB is scratch space, which nothing reads once the
+        # server has stopped, so it isn't snapshotted
+        snapshotExportID, snapshotDoneID = None, None
+        if not self.isSecondary:
+            snapshotExportID = job.fileStore.jobStore.getEmptyFileStoreID()
+            # We need to run this garbage in case we are on a file-based
+            # jobStore with caching enabled. The caching jobStore sets
+            # this empty file to be unwritable for some reason. Since we
+            # need to write something to it, obviously that won't do.
+            path = job.fileStore.readGlobalFile(snapshotExportID)
+            os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+            # Written once the snapshot has been exported
+            snapshotDoneID = job.fileStore.jobStore.getEmptyFileStoreID()
         self.process, self.dbElem, self.logPath = runKtserver(self.dbElem, fileStore=job.fileStore,
                                                               existingSnapshotID=self.existingSnapshotID,
-                                                              snapshotExportID=snapshotExportID)
+                                                              snapshotExportID=snapshotExportID,
+                                                              phase=self.phase,
+                                                              dbRole="secondary" if self.isSecondary else "primary",
+                                                              sizing=self.sizing,
+                                                              snapshotDoneID=snapshotDoneID)
         assert self.dbElem.getDbHost() != None
-        blockUntilKtserverIsRunning(self.logPath)
         self.check()
-        return self.dbElem.getConfString(), snapshotExportID
+        return self.dbElem.getConfString(), snapshotExportID, snapshotDoneID
 
     def stop(self, job):
         self.check()
-        try:
-            stopKtserver(self.dbElem)
-        except:
-            # Server is probably already terminated
-            pass
+        # The server process is ours, so it can be told to stop directly
+        # rather than through the TERMINATE key
+        self.process.stopEvent.set()
         if not self.failed:
-            blockUntilKtserverIsFinished(self.logPath, timeout=1200)
+            self.process.join(1200)
+            if self.process.is_alive():
+                raise RuntimeError("Timeout reached while waiting for ktserver.")
+            self.check()
 
     def check(self):
         if self.process.exceptionMsg.empty():
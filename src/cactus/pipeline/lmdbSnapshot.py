@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""
+Checkpoints of the embedded LMDB databases of --database lmdb.
+
+An LMDB environment stays in its directory from one phase to the next
+rather than being served, so unlike a KyotoTycoon server started afresh
+from a snapshot, it would carry the changes of a failed attempt at a
+checkpoint into its rerun. SavePrimaryDB copies the environment into the
+job store at the end of each checkpoint, as a server's snapshot is
+exported, with mdb_copy (which uses LMDB's mdb_env_copy to take a
+consistent copy), and the next checkpoint starts from that copy.
+
+A marker file beside the directory names the copy the environment still
+matches. A checkpoint started while it does uses the environment as it is;
+otherwise, as when a checkpoint is rerun after a failure, the environment
+is replaced by the copy. The setup phase, which creates the cactus disk,
+always starts from an empty environment.
+"""
+
+import os
+import shutil
+
+from cactus.shared.common import cactus_call
+
+# The file an LMDB environment keeps its records in
+DATA_FILE = "data.mdb"
+
+def getMarkerPath(dbDir):
+    return dbDir + ".checkpoint"
+
+def saveLmdbSnapshot(fileStore, dbDir):
+    """Copy the environment in dbDir into the job store, returning the ID
+    of the copy."""
+    copyPath = fileStore.getLocalTempFile()
+    cactus_call(parameters=["mdb_copy", "-c", dbDir], outfile=copyPath)
+    snapshotID = fileStore.writeGlobalFile(copyPath)
+    with open(getMarkerPath(dbDir), 'w') as markerFile:
+        markerFile.write(str(snapshotID))
+    return snapshotID
+
+def restoreLmdbSnapshot(fileStore, dbDir, snapshotID):
+    """Make the environment in dbDir match the copy snapshotID, or be empty
+    if it is None, before a checkpoint starts changing it."""
+    markerPath = getMarkerPath(dbDir)
+    unchanged = False
+    if os.path.exists(markerPath):
+        with open(markerPath) as markerFile:
+            unchanged = snapshotID is not None and markerFile.read() == str(snapshotID)
+        # From here on the environment no longer matches any copy
+        os.remove(markerPath)
+    if unchanged:
+        return
+    if os.path.exists(dbDir):
+        shutil.rmtree(dbDir)
+    os.makedirs(dbDir)
+    if snapshotID is not None:
+        # Not through the cache, since the environment is written in place
+        fileStore.jobStore.readFile(snapshotID, os.path.join(dbDir, DATA_FILE))
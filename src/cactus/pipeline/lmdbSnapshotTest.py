@@ -0,0 +1,98 @@
+import os
+import shutil
+import unittest
+from contextlib import contextmanager
+
+from sonLib.bioio import getTempDirectory
+from cactus.shared.test import silentOnSuccess
+from cactus.pipeline.lmdbSnapshot import saveLmdbSnapshot, restoreLmdbSnapshot, getMarkerPath, DATA_FILE
+
+class FakeJobStore:
+    """Keeps the files of a job store in a local directory."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def readFile(self, fileID, localPath):
+        shutil.copyfile(os.path.join(self.directory, fileID), localPath)
+
+class FakeFileStore:
+    def __init__(self, jobStore, tempDir):
+        self.jobStore = jobStore
+        self.tempDir = tempDir
+
+    def getLocalTempFile(self):
+        return os.path.join(self.tempDir, "local%i" % len(os.listdir(self.tempDir)))
+
+    def writeGlobalFile(self, path):
+        fileID = "file%i" % len(os.listdir(self.jobStore.directory))
+        shutil.copyfile(path, os.path.join(self.jobStore.directory, fileID))
+        return fileID
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory(os.getcwd())
+        for directory in ("store", "local", "bin"):
+            os.mkdir(os.path.join(self.tempDir, directory))
+        self.fileStore = FakeFileStore(FakeJobStore(os.path.join(self.tempDir, "store")),
+                                       os.path.join(self.tempDir, "local"))
+        self.dbDir = os.path.join(self.tempDir, "db")
+        os.mkdir(self.dbDir)
+        self.writeRecords("checkpoint")
+        # Stands in for mdb_copy, which writes a copy of the environment
+        # to stdout
+        mdbCopy = os.path.join(self.tempDir, "bin", "mdb_copy")
+        with open(mdbCopy, 'w') as f:
+            f.write('#!/bin/sh\n[ "$1" = "-c" ] && cat "$2/%s"\n' % DATA_FILE)
+        os.chmod(mdbCopy, 0755)
+        self.oldEnv = dict(os.environ)
+        os.environ["PATH"] = os.path.join(self.tempDir, "bin") + os.pathsep + os.environ["PATH"]
+        os.environ["CACTUS_BINARIES_MODE"] = "local"
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+        shutil.rmtree(self.tempDir)
+
+    def writeRecords(self, records):
+        with open(os.path.join(self.dbDir, DATA_FILE), 'w') as f:
+            f.write(records)
+
+    def readRecords(self):
+        with open(os.path.join(self.dbDir, DATA_FILE)) as f:
+            return f.read()
+
+    @silentOnSuccess
+    def testRestore(self):
+        snapshotID = saveLmdbSnapshot(self.fileStore, self.dbDir)
+        self.assertTrue(os.path.exists(getMarkerPath(self.dbDir)))
+        # The first attempt at the next checkpoint uses the environment as
+        # it is
+        open(os.path.join(self.dbDir, "lock.mdb"), 'w').close()
+        restoreLmdbSnapshot(self.fileStore, self.dbDir, snapshotID)
+        self.assertTrue(os.path.exists(os.path.join(self.dbDir, "lock.mdb")))
+        self.assertFalse(os.path.exists(getMarkerPath(self.dbDir)))
+        # A rerun starts from the copy, not from what the failed attempt
+        # left behind
+        self.writeRecords("failed attempt")
+        restoreLmdbSnapshot(self.fileStore, self.dbDir, snapshotID)
+        self.assertEquals(os.listdir(self.dbDir), [DATA_FILE])
+        self.assertEquals(self.readRecords(), "checkpoint")
+        self.writeRecords("second failed attempt")
+        restoreLmdbSnapshot(self.fileStore, self.dbDir, snapshotID)
+        self.assertEquals(self.readRecords(), "checkpoint")
+
+    @silentOnSuccess
+    def testEmpty(self):
+        # The setup phase always starts from an empty environment
+        saveLmdbSnapshot(self.fileStore, self.dbDir)
+        restoreLmdbSnapshot(self.fileStore, self.dbDir, None)
+        self.assertEquals(os.listdir(self.dbDir), [])
+        self.assertFalse(os.path.exists(getMarkerPath(self.dbDir)))
+        shutil.rmtree(self.dbDir)
+        restoreLmdbSnapshot(self.fileStore, self.dbDir, None)
+        self.assertEquals(os.listdir(self.dbDir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,8 @@ from cactus.shared.common import makeURL
 from cactus.shared.common import readGlobalFileWithoutCache
 from cactus.shared.common import cactusRootPath
 from cactus.shared.configWrapper import ConfigWrapper
+from cactus.shared.twoBit import fastaToTwoBit
+from cactus.shared.fastaIO import transformFasta
 
 from toil.lib.bioio import setLoggingFromOptions
 
@@ -34,7 +36,8 @@ from cactus.preprocessor.lastzRepeatMasking.cactus_lastzRepeatMask import Repeat
 
 class PreprocessorOptions:
     def __init__(self, chunkSize, memory, cpu, check, proportionToSample, unmask,
-                 preprocessJob, checkAssemblyHub=None, lastzOptions=None, minPeriod=None):
+                 preprocessJob, checkAssemblyHub=None, lastzOptions=None, minPeriod=None,
+                 twoBit=False):
         self.chunkSize = chunkSize
         self.memory = memory
         self.cpu = cpu
@@ -45,6 +48,7 @@ class PreprocessorOptions:
         self.checkAssemblyHub = checkAssemblyHub
         self.lastzOptions = lastzOptions
         self.minPeriod = minPeriod
+        self.twoBit = twoBit
 
 class CheckUniqueHeaders(RoundedJob):
     """
@@ -105,6 +109,9 @@ class PreprocessSequence(RoundedJob):
         self.inSequenceID = inSequenceID
         self.chunksToCompute = chunksToCompute
 
+    def useTwoBitTargets(self):
+        return self.prepOptions.twoBit and self.prepOptions.preprocessJob == "lastzRepeatMask"
+
     def getChunkedJobForCurrentStage(self, seqIDs, proportionSampled, inChunkID):
         """
         Give the chunked work to the appropriate job.
@@ -114,7 +121,8 @@ class PreprocessSequence(RoundedJob):
         elif self.prepOptions.preprocessJob == "lastzRepeatMask":
             repeatMaskOptions = RepeatMaskOptions(proportionSampled=proportionSampled,
                                                   minPeriod=self.prepOptions.minPeriod,
-                                                  lastzOpts=self.prepOptions.lastzOptions)
+                                                  lastzOpts=self.prepOptions.lastzOptions,
+                                                  twoBit=self.prepOptions.twoBit)
             return LastzRepeatMaskJob(repeatMaskOptions=repeatMaskOptions,
                                       queryID=inChunkID,
                                       targetIDs=seqIDs)
@@ -141,6 +149,15 @@ class PreprocessSequence(RoundedJob):
         logger.info("Chunks = %s" % inChunkList)
 
         inChunkIDList = [fileStore.writeGlobalFile(chunk, cleanup=True) for chunk in inChunkList]
+        if self.useTwoBitTargets():
+            # The chunks used as lastz targets are shipped in 2bit format,
+            # the queries stay as fasta as they get masked in place.
+            targetChunkIDList = []
+            for chunk in inChunkList:
+                fastaToTwoBit(chunk, chunk + ".2bit")
+                targetChunkIDList.append(fileStore.writeGlobalFile(chunk + ".2bit", cleanup=True))
+        else:
+            targetChunkIDList = inChunkIDList
         outChunkIDList = []
         #For each input chunk we create an output chunk, it is the output chunks that get concatenated together.
         if not self.chunksToCompute:
@@ -151,9 +168,9 @@ class PreprocessSequence(RoundedJob):
             assert inChunkNumber <= len(inChunkList) and inChunkNumber > 0
             #Now get the list of chunks flanking and including the current chunk
             j = max(0, i - inChunkNumber/2)
-            inChunkIDs = inChunkIDList[j:j+inChunkNumber]
+            inChunkIDs = targetChunkIDList[j:j+inChunkNumber]
             if len(inChunkIDs) < inChunkNumber: #This logic is like making the list circular
-                inChunkIDs += inChunkIDList[:inChunkNumber-len(inChunkIDs)]
+                inChunkIDs += targetChunkIDList[:inChunkNumber-len(inChunkIDs)]
             assert len(inChunkIDs) == inChunkNumber
             outChunkIDList.append(self.addChild(self.getChunkedJobForCurrentStage(inChunkIDs, float(inChunkNumber)/len(inChunkIDList), inChunkIDList[i])).rv())
 
@@ -166,12 +183,8 @@ class PreprocessSequence(RoundedJob):
 
 def unmaskFasta(inFasta, outFasta):
     """Uppercase a fasta file (removing the soft-masking)."""
-    with open(outFasta, 'w') as out:
-        for line in open(inFasta):
-            if len(line) > 0 and line[0] != ">":
-                out.write(line.upper())
-            else:
-                out.write(line)
+    # Only changes the case, so is left to the preprocessor's other checks
+    transformFasta(inFasta, outFasta, sequenceFn=str.upper, validate=False)
 
 class BatchPreprocessor(RoundedJob):
     def __init__(self, prepXmlElems, inSequenceID, iteration = 0):
@@ -194,6 +207,7 @@ class BatchPreprocessor(RoundedJob):
                                           unmask = getOptionalAttrib(prepNode, "unmask", typeFn=bool, default=False),
                                           lastzOptions = getOptionalAttrib(prepNode, "lastzOpts", default=""),
                                           minPeriod = getOptionalAttrib(prepNode, "minPeriod", typeFn=int, default="0"),
+                                          twoBit = getOptionalAttrib(prepNode, "twoBit", typeFn=bool, default=False),
                                           checkAssemblyHub = getOptionalAttrib(prepNode, "checkAssemblyHub", typeFn=bool, default=False))
         
         lastIteration = self.iteration == len(self.prepXmlElems) - 1
@@ -202,7 +216,7 @@ class BatchPreprocessor(RoundedJob):
             inSequence = fileStore.readGlobalFile(self.inSequenceID)
             unmaskedInputFile = fileStore.getLocalTempFile()
             unmaskFasta(inSequence, unmaskedInputFile)
-            self.inSequenceID = fileStore.writeGlobalFile(inSequence)
+            self.inSequenceID = fileStore.writeGlobalFile(unmaskedInputFile)
 
         outSeqID = self.addChild(PreprocessSequence(prepOptions, self.inSequenceID)).rv()
         
@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 """Checks headers are all unique.
 """
-from sonLib.bioio import fastaRead
+from cactus.shared.fastaIO import iterHeaders
 
 def checkUniqueHeaders(inputFile, checkAlphaNumeric=False, checkUCSC=False, checkAssemblyHub=True):
     """Check that headers are unique and meet certain requirements."""
     seen = set()
-    for header, seq in fastaRead(inputFile):
+    for header in iterHeaders(inputFile):
         if " " in header or "\t" in header:
             raise RuntimeError("The fasta header '%s' contains spaces or tabs. These characters will cause issues in space-separated formats like MAF, and may not function properly when viewed in a browser. Please remove these characters from the input headers and try again." % header)
         mungedHeader = header.split()[0]
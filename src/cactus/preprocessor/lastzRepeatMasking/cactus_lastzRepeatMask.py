@@ -4,10 +4,13 @@
 
 import os
 
-from sonLib.bioio import catFiles
+from cactus.shared.common import catFiles
 
 from cactus.shared.common import cactus_call
 from cactus.shared.common import RoundedJob
+from cactus.shared.fileStoreIO import ParallelFileIO
+from cactus.shared import nodeCache
+from cactus.shared.twoBit import catTwoBitFiles
 
 class RepeatMaskOptions:
     def __init__(self, 
@@ -16,13 +19,16 @@ class RepeatMaskOptions:
             lastzOpts="",
             unmaskInput=False,
             unmaskOutput=False,
-            proportionSampled=1.0):
+            proportionSampled=1.0,
+            twoBit=False):
         self.fragment = fragment
         self.minPeriod = minPeriod
         self.lastzOpts = lastzOpts
         self.unmaskInput = unmaskInput
         self.unmaskOutput = unmaskOutput
         self.proportionSampled = proportionSampled
+        # The targets are 2bit rather than fasta files
+        self.twoBit = twoBit
 
         self.period = max(1, round(self.proportionSampled * self.minPeriod))
 
@@ -59,7 +65,10 @@ class LastzRepeatMaskJob(RoundedJob):
         early to avoid exponential blowup if too many alignments are found.
         """
         target = fileStore.getLocalTempFile()
-        catFiles(targetFiles, target)
+        if self.repeatMaskOptions.twoBit:
+            catTwoBitFiles(targetFiles, target)
+        else:
+            catFiles(targetFiles, target)
         lastZSequenceHandling  = ['%s[multiple][nameparse=darkspace]' % os.path.basename(target), '%s[nameparse=darkspace]' % os.path.basename(fragments)]
         if self.repeatMaskOptions.unmaskInput:
             lastZSequenceHandling  = ['%s[multiple,unmask][nameparse=darkspace]' % os.path.basename(target), '%s[unmask][nameparse=darkspace]' % os.path.basename(fragments)]
@@ -106,10 +115,13 @@ class LastzRepeatMaskJob(RoundedJob):
         """
         assert len(self.targetIDs) >= 1
         assert self.repeatMaskOptions.fragment > 1
-        queryFile = fileStore.readGlobalFile(self.queryID)
-        targetFiles = [fileStore.readGlobalFile(fileID) for fileID in self.targetIDs]
-
-        fragments = self.getFragments(fileStore, queryFile)
+        # The same chunks are sampled as targets by many of these jobs
+        with ParallelFileIO(fileStore, cached=True) as fileIO:
+            # The targets download while the query is fragmented
+            targetReads = fileIO.prefetch(self.targetIDs)
+            queryFile = nodeCache.readGlobalFile(fileStore, self.queryID)
+            fragments = self.getFragments(fileStore, queryFile)
+            targetFiles = [read.get() for read in targetReads]
         alignment = self.alignFastaFragments(fileStore, targetFiles, fragments)
         maskedQuery = self.maskCoveredIntervals(fileStore, queryFile, alignment)
         return fileStore.writeGlobalFile(maskedQuery)
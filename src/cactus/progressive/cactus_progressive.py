@@ -11,6 +11,7 @@ tree.
 """
 
 import os
+import tempfile
 import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
 from base64 import b64encode
@@ -22,6 +23,8 @@ from toil.lib.bioio import logger
 from toil.lib.bioio import setLoggingFromOptions
 
 from cactus.shared.common import getOptionalAttrib
+from cactus.shared.resourceModel import parseProfile
+from cactus.pipeline.ktserverSizing import parseCoefficients
 from cactus.shared.common import findRequiredNode
 from cactus.shared.common import makeURL
 from cactus.shared.common import catFiles
@@ -161,6 +164,10 @@ class ProgressiveUp(RoundedJob):
                 seqIDMap[name] = self.project.outputSequenceIDMap[name]
                 seqNames.append(name)
         logger.info("Sequences in progressive, %s: %s" % (self.event, seqNames))
+
+        if experiment.getDbType() == "lmdb":
+            # Each subproblem is aligned in an embedded DB of its own
+            experiment.setDbDir(os.path.join(self.options.dbDir, self.event))
             
         experimentFile = fileStore.getLocalTempFile()
         experiment.writeXML(experimentFile)
@@ -373,6 +380,12 @@ def setupBinaries(options):
         else:
             imgPath = os.path.join(os.path.abspath(locator), "cactus.img")
         os.environ["CACTUS_SINGULARITY_IMG"] = imgPath
+    if getattr(options, "persistentContainers", False) and mode in ("docker", "singularity"):
+        # Run the binaries of each worker in one long-lived container,
+        # mounting the directory the workers' temp dirs are made in.
+        os.environ["CACTUS_PERSISTENT_CONTAINERS"] = "1"
+        workDir = getattr(options, "workDir", None) or tempfile.gettempdir()
+        os.environ["CACTUS_PERSISTENT_MOUNT"] = os.path.abspath(workDir)
 
 def importSingularityImage():
     """Import the Singularity image from Docker if using Singularity."""
@@ -408,9 +421,15 @@ def main():
 
     #Progressive Cactus Options
     parser.add_argument("--database", dest="database",
-                      help="Database type: tokyo_cabinet or kyoto_tycoon"
-                      " [default: %(default)s]",
+                      choices=["tokyo_cabinet", "kyoto_tycoon", "lmdb"],
+                      help="Database type: tokyo_cabinet, kyoto_tycoon, or lmdb, an "
+                      "embedded database for runs on a single machine (--batchSystem "
+                      "singleMachine) that needs no servers [default: %(default)s]",
                       default="kyoto_tycoon")
+    parser.add_argument("--dbDir", default=None,
+                        help="With --database lmdb, keep the databases in this directory, "
+                        "which must be reachable by all the jobs [default: a directory "
+                        "in the working directory of the run]")
     parser.add_argument("--configFile", dest="configFile",
                       help="Specify cactus configuration file",
                       default=None)
@@ -425,11 +444,94 @@ def main():
                         "rather than pulling from quay.io")
     parser.add_argument("--binariesMode", choices=["docker", "local", "singularity"],
                         help="The way to run the Cactus binaries", default=None)
+    parser.add_argument("--metricsFile", default=None,
+                        help="Append a JSON performance record for every binary run to this "
+                        "file, which must be on a filesystem shared by all the workers. "
+                        "Summarise it with cactus_metrics_report")
+    parser.add_argument("--dbSizing", default=None,
+                        help="Size the database servers with the coefficients in this "
+                        "file, fitted by cactus_db_sizing to the metrics of earlier "
+                        "runs, rather than the defaults")
+    parser.add_argument("--dbMetricsInterval", type=float, default=60,
+                        help="With --metricsFile, sample the status of the database "
+                        "servers into it this often, in seconds [default: %(default)s]")
+    parser.add_argument("--dbHandoffDir", default=None,
+                        help="Keep the primary database server running between checkpoints "
+                        "run on the same node, handing it over through this node-local "
+                        "directory rather than reloading it from its snapshot. Needs "
+                        "ktserver built with Lua")
+    parser.add_argument("--dbHandoffTimeout", type=float, default=600,
+                        help="Stop a server offered for hand-off if no checkpoint on its "
+                        "node claims it within this many seconds [default: %(default)s]")
+    parser.add_argument("--dbDeltaSnapshots", action="store_true",
+                        help="Save the database at each checkpoint as the differences from "
+                        "its last full snapshot, rather than as a whole")
+    parser.add_argument("--dbDeltaCompaction", type=float, default=0.5,
+                        help="With --dbDeltaSnapshots, save a full snapshot instead once the "
+                        "differences come to this fraction of it [default: %(default)s]")
+    parser.add_argument("--dbShards", type=int, default=1,
+                        help="Shard each primary database across this many servers, "
+                        "spreading its records and load over them [default: %(default)s]")
+    parser.add_argument("--dbShardPartition", choices=["hash", "range"], default="hash",
+                        help="With --dbShards, partition the records across the servers by a "
+                        "hash of their names, or by ranges of names [default: %(default)s]")
+    parser.add_argument("--oomEscalationFactor", type=float, default=2.0,
+                        help="Multiply the memory and disk of a job that runs out of "
+                        "memory by this much for its retry (up to its memoryCap and "
+                        "--maxMemory) [default: %(default)s]")
+    parser.add_argument("--resourceProfile", default=None,
+                        help="Size jobs with the models in this profile, fitted by "
+                        "cactus_fit_resources to the metrics of earlier runs, rather "
+                        "than the default polynomials")
+    parser.add_argument("--nodeCacheDir", default=None,
+                        help="Keep the large inputs that jobs read, such as genome chunks, "
+                        "in this node-local directory and share them between the jobs "
+                        "run on each node")
+    parser.add_argument("--nodeCacheSize", type=int, default=50*1024**3,
+                        help="Most bytes to keep in each node's --nodeCacheDir, evicting "
+                        "the least recently used files beyond it [default: %(default)s]")
+    parser.add_argument("--persistentContainers", action="store_true",
+                        help="In docker or singularity mode, run each worker's binaries in "
+                        "a single long-lived container instead of starting one per call")
 
     options = parser.parse_args()
 
     setupBinaries(options)
     setLoggingFromOptions(options)
+    if options.database == "lmdb" and os.environ["CACTUS_BINARIES_MODE"] == "docker":
+        raise RuntimeError("The binaries can't reach an lmdb database from their docker "
+                           "containers, so it needs --binariesMode local or singularity")
+    if options.database == "lmdb" and options.batchSystem != "singleMachine":
+        raise RuntimeError("An lmdb database is kept on the local disk of the machine running "
+                           "cactus, so it needs --batchSystem singleMachine")
+    if options.metricsFile is not None:
+        os.environ["CACTUS_METRICS_FILE"] = os.path.abspath(options.metricsFile)
+    os.environ["CACTUS_DB_METRICS_INTERVAL"] = str(options.dbMetricsInterval)
+    os.environ["CACTUS_OOM_ESCALATION_FACTOR"] = str(options.oomEscalationFactor)
+    if options.nodeCacheDir is not None:
+        os.environ["CACTUS_NODE_CACHE_DIR"] = options.nodeCacheDir
+        os.environ["CACTUS_NODE_CACHE_SIZE"] = str(options.nodeCacheSize)
+    if options.dbHandoffDir is not None:
+        os.environ["CACTUS_DB_HANDOFF_DIR"] = options.dbHandoffDir
+        os.environ["CACTUS_DB_HANDOFF_TIMEOUT"] = str(options.dbHandoffTimeout)
+    if options.dbDeltaSnapshots:
+        os.environ["CACTUS_DB_DELTA_SNAPSHOTS"] = "1"
+        os.environ["CACTUS_DB_DELTA_COMPACTION"] = str(options.dbDeltaCompaction)
+    if options.dbShards > 1:
+        os.environ["CACTUS_DB_SHARDS"] = str(options.dbShards)
+        os.environ["CACTUS_DB_SHARD_PARTITION"] = options.dbShardPartition
+    if options.dbSizing is not None:
+        with open(options.dbSizing) as sizingFile:
+            sizingString = sizingFile.read()
+        parseCoefficients(sizingString)
+        os.environ["CACTUS_DB_SIZING"] = sizingString
+    if options.resourceProfile is not None:
+        # The profile itself goes to the workers in the environment, so it
+        # needn't be on a shared filesystem
+        with open(options.resourceProfile) as profileFile:
+            profileString = profileFile.read()
+        parseProfile(profileString)
+        os.environ["CACTUS_RESOURCE_PROFILE"] = profileString
 
     # Mess with some toil options to create useful defaults.
 
@@ -458,6 +560,12 @@ def main():
             halID = toil.restart()
         else:
             options.cactusDir = getTempDirectory()
+            if options.database == "lmdb":
+                if options.dbDir is None:
+                    options.dbDir = os.path.join(options.cactusDir, "databases")
+                options.dbDir = os.path.abspath(options.dbDir)
+                if not os.path.isdir(options.dbDir):
+                    os.makedirs(options.dbDir)
             #Create the progressive cactus project 
             projWrapper = ProjectWrapper(options)
             projWrapper.writeXml()
@@ -51,7 +51,7 @@ class ProjectWrapper:
         #create the cactus disk
         cdElem = ET.SubElement(expXml, "cactus_disk")
         database = self.options.database
-        assert database == "kyoto_tycoon" or database == "tokyo_cabinet"
+        assert database in ("kyoto_tycoon", "tokyo_cabinet", "lmdb")
         confElem = ET.SubElement(cdElem, "st_kv_database_conf")
         confElem.attrib["type"] = database
         ET.SubElement(confElem, database)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Measures the fixed cost of a cactus_call in each of the ways binaries
+can be run: locally, in a new docker container or Singularity run per
+call, and in a persistent docker container or Singularity instance.
+
+Modes whose executables (or Singularity image) aren't available are
+skipped.
+"""
+import os
+import time
+from argparse import ArgumentParser
+from distutils.spawn import find_executable
+
+from cactus.shared.common import cactus_call, getPersistentContainer
+
+# (name, CACTUS_BINARIES_MODE, persistent)
+MODES = [("local", "local", False),
+         ("docker", "docker", False),
+         ("docker-persistent", "docker", True),
+         ("singularity", "singularity", False),
+         ("singularity-persistent", "singularity", True)]
+
+def modeAvailable(binariesMode):
+    if binariesMode == "local":
+        return True
+    if find_executable(binariesMode) is None:
+        return False
+    return binariesMode != "singularity" or os.path.exists(os.environ.get("CACTUS_SINGULARITY_IMG", ""))
+
+def timeCalls(binariesMode, persistent, calls, parameters):
+    """Returns the mean wall time in seconds of a cactus_call running the
+    given parameters. The persistent container is started before timing.
+    """
+    oldEnv = dict(os.environ)
+    os.environ["CACTUS_BINARIES_MODE"] = binariesMode
+    os.environ["CACTUS_PERSISTENT_CONTAINERS"] = "1" if persistent else "0"
+    try:
+        if persistent:
+            getPersistentContainer(binariesMode)
+        work_dir = os.getcwd()
+        start = time.time()
+        for i in xrange(calls):
+            cactus_call(work_dir=work_dir, parameters=parameters)
+        return (time.time() - start) / calls
+    finally:
+        os.environ.clear()
+        os.environ.update(oldEnv)
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=20,
+                        help="Number of calls to time in each mode")
+    parser.add_argument("--modes", nargs="*", default=[name for name, _, _ in MODES],
+                        choices=[name for name, _, _ in MODES])
+    parser.add_argument("--command", nargs="*", default=["true"],
+                        help="The command to run")
+    opts = parser.parse_args()
+    # Persistent containers mount the working directory
+    os.environ["CACTUS_PERSISTENT_MOUNT"] = os.getcwd()
+    for name, binariesMode, persistent in MODES:
+        if name not in opts.modes:
+            continue
+        if not modeAvailable(binariesMode):
+            print "%s\tskipped (not available)" % name
+            continue
+        print "%s\t%.1f ms/call" % (name, 1000 * timeCalls(binariesMode, persistent, opts.calls, opts.command))
+
+if __name__ == '__main__':
+    main()
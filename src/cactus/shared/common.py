@@ -6,17 +6,22 @@
 """
 
 import os
+import re
 import cPickle
 import pickle
 import sys
 import shutil
 import subprocess32
 import logging
-import pipes
 import uuid
 import json
 import time
 import signal
+import errno
+import atexit
+import tempfile
+import resource
+import threading
 
 from urlparse import urlparse
 
@@ -29,6 +34,9 @@ from toil.job import Job
 from sonLib.bioio import popenCatch
 
 from cactus.shared.version import cactus_commit
+from cactus.shared.fileConcat import concatenateFiles
+from cactus.shared.metrics import metricsEnabled, inputBytes, writeRecord, setJobContext, directorySize
+from cactus.shared import nodeCache
 
 _log = logging.getLogger(__name__)
 
@@ -41,18 +49,9 @@ def makeURL(path_or_url):
         return path_or_url
 
 def catFiles(filesToCat, catFile):
-    """Cats a bunch of files into one file. Ensures a no more than maxCat files
-    are concatenated at each step.
+    """Cats a bunch of files into one file.
     """
-    if len(filesToCat) == 0: #We must handle this case or the cat call will hang waiting for input
-        open(catFile, 'w').close()
-        return
-    maxCat = 25
-    system("cat %s > %s" % (" ".join(filesToCat[:maxCat]), catFile))
-    filesToCat = filesToCat[maxCat:]
-    while len(filesToCat) > 0:
-        system("cat %s >> %s" % (" ".join(filesToCat[:maxCat]), catFile))
-        filesToCat = filesToCat[maxCat:]
+    concatenateFiles(filesToCat, catFile)
 
 def cactusRootPath():
     """
@@ -96,8 +95,13 @@ def findRequiredNode(configNode, nodeName):
 #############################################  
 
 def readFlowerNames(flowerStrings):
-    ret = []
-    for line in flowerStrings.split("\n"):
+    return list(iterFlowerNames(flowerStrings.split("\n")))
+
+def iterFlowerNames(flowerLines):
+    """Parse lines of the output of cactus_workflow_getFlowers or
+    cactus_workflow_extendFlowers into (overlarge, flowerNames, sizes)
+    tuples as they come."""
+    for line in flowerLines:
         if line == '':
             continue
         flowersAndSizes = line[1:].split()
@@ -115,8 +119,7 @@ def readFlowerNames(flowerStrings):
                 sizes += [int(token)]
                 currentlyAFlower = True
         assert len(sizes) == int(numFlowers)
-        ret += [(bool(int(line[0])), " ".join([numFlowers] + flowers), sizes)]
-    return ret
+        yield (bool(int(line[0])), " ".join([numFlowers] + flowers), sizes)
 
 def runCactusGetFlowers(cactusDiskDatabaseString, flowerNames,
                         jobName=None, features=None, fileStore=None,
@@ -124,21 +127,21 @@ def runCactusGetFlowers(cactusDiskDatabaseString, flowerNames,
                         maxSequenceSizeOfFlowerGrouping=-1, 
                         maxSequenceSizeOfSecondaryFlowerGrouping=-1, 
                         logLevel=None):
-    """Gets a list of flowers attached to the given flower. 
+    """Gets the flowers attached to the given flower, as an iterator that
+    yields them as cactus_workflow_getFlowers finds them.
     """
     logLevel = getLogLevelString2(logLevel)
-    flowerStrings = cactus_call(check_output=True, stdin_string=flowerNames,
-                                parameters=["cactus_workflow_getFlowers", logLevel,
-                                            cactusDiskDatabaseString,
-                                            str(minSequenceSizeOfFlower),
-                                            str(maxSequenceSizeOfFlowerGrouping),
-                                            str(maxSequenceSizeOfSecondaryFlowerGrouping)],
-                                job_name=jobName,
-                                features=features,
-                                fileStore=fileStore)
-
-    l = readFlowerNames(flowerStrings)
-    return l
+    flowerLines = cactus_call(stream_output=True, stdin_string=flowerNames,
+                              parameters=["cactus_workflow_getFlowers", logLevel,
+                                          cactusDiskDatabaseString,
+                                          str(minSequenceSizeOfFlower),
+                                          str(maxSequenceSizeOfFlowerGrouping),
+                                          str(maxSequenceSizeOfSecondaryFlowerGrouping)],
+                              job_name=jobName,
+                              features=features,
+                              fileStore=fileStore)
+
+    return iterFlowerNames(flowerLines)
 
 def runCactusExtendFlowers(cactusDiskDatabaseString, flowerNames, 
                         jobName=None, features=None, fileStore=None,
@@ -149,20 +152,20 @@ def runCactusExtendFlowers(cactusDiskDatabaseString, flowerNames,
     """Extends the terminal groups in the cactus and returns the list
     of their child flowers with which to pass to core.
     The order of the flowers is by ascending depth first discovery time.
+    The flowers are yielded as cactus_workflow_extendFlowers finds them.
     """
     logLevel = getLogLevelString2(logLevel)
-    flowerStrings = cactus_call(check_output=True, stdin_string=flowerNames,
-                                parameters=["cactus_workflow_extendFlowers", logLevel,
-                                            cactusDiskDatabaseString,
-                                            str(minSequenceSizeOfFlower),
-                                            str(maxSequenceSizeOfFlowerGrouping),
-                                            str(maxSequenceSizeOfSecondaryFlowerGrouping)],
-                                job_name=jobName,
-                                features=features,
-                                fileStore=fileStore)
-
-    l = readFlowerNames(flowerStrings)
-    return l
+    flowerLines = cactus_call(stream_output=True, stdin_string=flowerNames,
+                              parameters=["cactus_workflow_extendFlowers", logLevel,
+                                          cactusDiskDatabaseString,
+                                          str(minSequenceSizeOfFlower),
+                                          str(maxSequenceSizeOfFlowerGrouping),
+                                          str(maxSequenceSizeOfSecondaryFlowerGrouping)],
+                              job_name=jobName,
+                              features=features,
+                              fileStore=fileStore)
+
+    return iterFlowerNames(flowerLines)
 
 def encodeFlowerNames(flowerNames):
     if len(flowerNames) == 0:
@@ -180,24 +183,28 @@ def decodeFirstFlowerName(encodedFlowerNames):
 def runCactusSplitFlowersBySecondaryGrouping(flowerNames):
     """Splits a list of flowers into smaller lists.
     """
-    flowerNames = flowerNames.split()
-    flowerGroups = []
+    return list(iterFlowerGroups(flowerNames))
+
+def iterFlowerGroups(flowerNames):
+    """Yields the groups of a list of flowers as runCactusSplitFlowersBySecondaryGrouping
+    does, without splitting the whole list up first.
+    """
     stack = []
     overlarge = False
     name = 0
-    for i in flowerNames[1:]:
-        if i != '':
-            if i in ('a', 'b'):
-                if len(stack) > 0:
-                    flowerGroups.append((overlarge, encodeFlowerNames(stack))) #b indicates the stack is overlarge
-                    stack = []
-                overlarge = i == 'b'
-            else:
-                name = int(i) + name
-                stack.append(name)
+    tokens = (match.group() for match in re.finditer(r'\S+', flowerNames))
+    next(tokens, None) # The number of flowers
+    for i in tokens:
+        if i in ('a', 'b'):
+            if len(stack) > 0:
+                yield (overlarge, encodeFlowerNames(stack)) #b indicates the stack is overlarge
+                stack = []
+            overlarge = i == 'b'
+        else:
+            name = int(i) + name
+            stack.append(name)
     if len(stack) > 0:
-        flowerGroups.append((overlarge, encodeFlowerNames(stack)))
-    return flowerGroups
+        yield (overlarge, encodeFlowerNames(stack))
 
 #############################################
 #############################################
@@ -453,8 +460,10 @@ def runCactusBar(cactusDiskDatabaseString, flowerNames, logLevel=None,
                  minimumNumberOfSpecies=None,
                  jobName=None,
                  fileStore=None,
-                 features=None):
-    """Runs cactus base aligner."""
+                 features=None,
+                 streamOutput=False):
+    """Runs cactus base aligner. With streamOutput, returns an iterator over
+    its messages as it writes them rather than a list."""
     logLevel = getLogLevelString2(logLevel)
     args = ["--logLevel", logLevel, "--cactusDisk", cactusDiskDatabaseString]
     if maximumLength is not None:
@@ -507,6 +516,14 @@ def runCactusBar(cactusDiskDatabaseString, flowerNames, logLevel=None,
     if minimumNumberOfSpecies is not None:
         args += ["--minimumNumberOfSpecies", str(minimumNumberOfSpecies)]
 
+    if streamOutput:
+        # Yield the messages as they're written, leaving the checking of
+        # the call to whoever reads them all
+        masterMessages = cactus_call(stdin_string=flowerNames, stream_output=True,
+                                     parameters=["cactus_bar"] + args,
+                                     job_name=jobName, fileStore=fileStore, features=features)
+        return (i for i in masterMessages if i != '')
+
     masterMessages = cactus_call(stdin_string=flowerNames, check_output=True,
                                  parameters=["cactus_bar"] + args,
                                  job_name=jobName, fileStore=fileStore, features=features)
@@ -821,8 +838,7 @@ def getDockerImage():
     """Get fully specified Docker image name."""
     return "%s/cactus:%s" % (getDockerOrg(), getDockerTag())
 
-def maxMemUsageOfContainer(containerInfo):
-    """Return the max RSS usage (in bytes) of a container, or None if something failed."""
+def _containerId(containerInfo):
     if containerInfo['id'] is None:
         # Try to get the internal container ID from the docker name
         try:
@@ -831,21 +847,443 @@ def maxMemUsageOfContainer(containerInfo):
         except:
             # Not yet running
             return None
+    return containerInfo['id']
+
+def _readContainerCgroupFile(containerInfo, possibleLocations):
+    """Return the contents of the first of the given cgroup files of a
+    container that exists, or None."""
+    id = _containerId(containerInfo)
+    if id is None:
+        return None
+    for location in possibleLocations:
+        try:
+            with open(location % id) as f:
+                return f.read()
+        except IOError:
+            # Not at this location, or sysfs isn't mounted
+            continue
+    return None
+
+def maxMemUsageOfContainer(containerInfo):
+    """Return the max RSS usage (in bytes) of a container, or None if something failed."""
     # Try to check for the maximum memory usage ever used by that
     # container, in a few different possible locations depending on
-    # the distribution
+    # the distribution and on whether cgroups v1 or v2 are in use
     possibleLocations = ["/sys/fs/cgroup/memory/docker/%s/memory.max_usage_in_bytes",
-                         "/sys/fs/cgroup/memory/system.slice.docker-%s.scope/memory.max_usage_in_bytes"]
-    possibleLocations = [s % containerInfo['id'] for s in possibleLocations]
-    for location in possibleLocations:
+                         "/sys/fs/cgroup/memory/system.slice.docker-%s.scope/memory.max_usage_in_bytes",
+                         "/sys/fs/cgroup/memory/system.slice/docker-%s.scope/memory.max_usage_in_bytes",
+                         "/sys/fs/cgroup/system.slice/docker-%s.scope/memory.peak",
+                         "/sys/fs/cgroup/docker/%s/memory.peak"]
+    contents = _readContainerCgroupFile(containerInfo, possibleLocations)
+    return None if contents is None else int(contents)
+
+def cpuUsageOfContainer(containerInfo):
+    """Return the (user, system) CPU time in seconds used so far by a
+    container, or None if something failed."""
+    # cgroups v2 report microseconds, v1 clock ticks
+    contents = _readContainerCgroupFile(containerInfo, ["/sys/fs/cgroup/system.slice/docker-%s.scope/cpu.stat",
+                                                        "/sys/fs/cgroup/docker/%s/cpu.stat"])
+    if contents is not None:
+        stats = dict(line.split() for line in contents.splitlines() if len(line.split()) == 2)
+        return int(stats["user_usec"]) / 1e6, int(stats["system_usec"]) / 1e6
+    contents = _readContainerCgroupFile(containerInfo, ["/sys/fs/cgroup/cpuacct/docker/%s/cpuacct.stat",
+                                                        "/sys/fs/cgroup/cpu,cpuacct/docker/%s/cpuacct.stat",
+                                                        "/sys/fs/cgroup/cpuacct/system.slice/docker-%s.scope/cpuacct.stat"])
+    if contents is not None:
+        stats = dict(line.split() for line in contents.splitlines() if len(line.split()) == 2)
+        ticks = float(os.sysconf("SC_CLK_TCK"))
+        return int(stats["user"]) / ticks, int(stats["system"]) / ticks
+    return None
+
+def oomKillCount():
+    """Return the number of processes the kernel has killed for running out
+    of memory in this process's memory cgroup (and those under it), or None
+    if it can't be read."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            cgroups = [line.strip().split(":", 2) for line in f]
+    except IOError:
+        return None
+    for hierarchy, controllers, path in cgroups:
+        if hierarchy == "0" and controllers == "":
+            # cgroups v2
+            location = "/sys/fs/cgroup%s/memory.events" % path
+        elif "memory" in controllers.split(","):
+            location = "/sys/fs/cgroup/memory%s/memory.oom_control" % path
+        else:
+            continue
         try:
             with open(location) as f:
-                return int(f.read())
+                stats = dict(line.split() for line in f if len(line.split()) == 2)
         except IOError:
-            # Not at this location, or sysfs isn't mounted
             continue
+        if "oom_kill" in stats:
+            return int(stats["oom_kill"])
     return None
 
+class OutOfMemoryError(RuntimeError):
+    """A command was killed for running out of memory."""
+    pass
+
+class SoftTimeoutError(RuntimeError):
+    """A command streaming its output was interrupted for passing its soft
+    timeout, so the output read was cut short."""
+    pass
+
+def killedForMemory(returncode, mode, oomKillsBefore, oomKillsAfter, containersOOMKilled=None):
+    """Guess whether a command that exited with the given status was killed
+    by the OOM killer, from whether it got a SIGKILL and, if they could be
+    read, the OOM kill counts of our cgroup before and after it ran. In
+    docker mode, containersOOMKilled gives what docker says of each of the
+    command's containers (see containerOOMKilled)."""
+    # A SIGKILL shows as -9 for a process we ran directly, and as an exit
+    # status of 137 from docker or from bash running a pipeline
+    if returncode not in (-signal.SIGKILL, 128 + signal.SIGKILL):
+        return False
+    if mode == "docker":
+        # Containers run under the docker daemon's cgroup, not ours, and
+        # are SIGKILLed by docker kill too
+        return any(containersOOMKilled or [])
+    if oomKillsBefore is None or oomKillsAfter is None:
+        return True
+    return oomKillsAfter > oomKillsBefore
+
+def containerOOMKilled(containerInfo):
+    """Whether docker says the container was killed by the OOM killer, or
+    None if it can't be inspected. The container must not have been run
+    with --rm."""
+    try:
+        return popenCatch("docker inspect -f '{{.State.OOMKilled}}' %s" % containerInfo['name']).strip() == "true"
+    except RuntimeError:
+        return None
+
+def killContainer(containerInfo):
+    """Kill a docker container. Killing the docker client running it isn't
+    enough, since the client can't pass a SIGKILL on to the container."""
+    with open(os.devnull, 'w') as devnull:
+        subprocess32.call(["docker", "kill", containerInfo['name']], stdout=devnull, stderr=devnull)
+
+def removeContainer(containerInfo):
+    """Remove a docker container, killing it first if it's still running."""
+    with open(os.devnull, 'w') as devnull:
+        subprocess32.call(["docker", "rm", "-f", containerInfo['name']], stdout=devnull, stderr=devnull)
+
+class ResourceUsage(object):
+    """The peak memory (in bytes), user and system CPU time and wall time
+    (in seconds) used by a command. Figures that couldn't be measured are
+    None."""
+    def __init__(self, maxMemory=None, userTime=None, systemTime=None, wallTime=None):
+        self.maxMemory = maxMemory
+        self.userTime = userTime
+        self.systemTime = systemTime
+        self.wallTime = wallTime
+
+    @staticmethod
+    def fromRusage(rusage, wallTime=None):
+        # ru_maxrss is in kilobytes on Linux but bytes on OS X
+        maxMemory = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+        return ResourceUsage(maxMemory=maxMemory, userTime=rusage.ru_utime,
+                             systemTime=rusage.ru_stime, wallTime=wallTime)
+
+    def asDict(self):
+        return { "maxMemory": self.maxMemory, "userTime": self.userTime,
+                 "systemTime": self.systemTime, "wallTime": self.wallTime }
+
+class AccountedPopen(subprocess32.Popen):
+    """A Popen that reaps its child with wait4, keeping the child's resource
+    usage. On Linux the peak RSS covers the child and any descendants it
+    waited for, and the CPU times are their sum, so a shell running a
+    pipeline reports the largest stage and the total CPU.
+    """
+    def __init__(self, *args, **kwargs):
+        self.rusage = None
+        self.startTime = time.time()
+        self.endTime = None
+        super(AccountedPopen, self).__init__(*args, **kwargs)
+
+    def _wait4(self, pid, flags):
+        pid, status, rusage = os.wait4(pid, flags)
+        if pid == self.pid:
+            self.rusage = rusage
+            self.endTime = time.time()
+        return pid, status
+
+    def _try_wait(self, wait_flags):
+        try:
+            (pid, sts) = subprocess32._eintr_retry_call(self._wait4, self.pid, wait_flags)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            # The child has already been reaped elsewhere
+            pid = self.pid
+            sts = 0
+        return (pid, sts)
+
+    def _internal_poll(self, _deadstate=None):
+        return super(AccountedPopen, self)._internal_poll(_deadstate=_deadstate, _waitpid=self._wait4)
+
+    def resourceUsage(self):
+        """The resource usage of the finished child, or None if it hasn't
+        been reaped by this object."""
+        if self.rusage is None:
+            return None
+        return ResourceUsage.fromRusage(self.rusage, self.endTime - self.startTime)
+
+def _defaultSigpipe():
+    # Python ignores SIGPIPE, and subprocess32 doesn't always restore it,
+    # but a stage should die quietly, as it would in a shell pipeline, when
+    # a later one stops reading
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+class PipelineProcess(object):
+    """Runs the stages of a pipeline connected by OS pipes, providing the
+    parts of the Popen interface cactus_call uses.
+
+    Each stage is a (name, command, containerInfo) tuple. The command is
+    either a command line, run with AccountedPopen, or a Python callable,
+    run in a thread, that is given an iterator over the lines of its input
+    and returns an iterable of lines to output. As soon as a stage fails the
+    others are killed, and the pipeline's returncode is that of the failing
+    stage, which is named by failedStage. A stage killed by SIGPIPE because
+    a later stage stopped reading only counts as failing if no other did.
+
+    The resource usage of command stages is taken from wait4 if
+    useRusage is set, and otherwise from the cgroups of their containers.
+    """
+    # How often the cgroups of containers are checked, in seconds
+    containerCheckInterval = 10
+
+    def __init__(self, stages, stdin=None, stdout=None, stderr=None, useRusage=True):
+        self.names = [name for name, command, containerInfo in stages]
+        self.args = "|".join(self.names)
+        self.containerInfos = [containerInfo for name, command, containerInfo in stages]
+        self.useRusage = useRusage
+        self.stdin = None
+        self.stdout = None
+        self.returncode = None
+        self.failedStage = None
+        self.errors = [None] * len(stages)
+        self.exitStatuses = [None] * len(stages)
+        self.wallTimes = [None] * len(stages)
+        self.memUsages = [None] * len(stages)
+        self.cpuUsages = [None] * len(stages)
+        self.processes = [None] * len(stages)
+        self.threads = [None] * len(stages)
+        self.startTime = time.time()
+        self._output = None
+        self._reader = None
+        self._waiter = None
+        self._done = threading.Event()
+
+        # What the next stage reads from: stdin, or the read end of the
+        # pipe from the previous stage
+        readEnd = stdin
+        for i, (name, command, containerInfo) in enumerate(stages):
+            if i == len(stages) - 1:
+                writeEnd = stdout
+                nextReadEnd = None
+            else:
+                nextReadEnd, writeEnd = os.pipe()
+            if callable(command):
+                inFile, ownInFile = self._stageFile(readEnd, 'r')
+                outFile, ownOutFile = self._stageFile(writeEnd, 'w')
+                self.threads[i] = threading.Thread(target=self._runPythonStage,
+                                                   args=(i, command, inFile, ownInFile, outFile, ownOutFile))
+                self.threads[i].daemon = True
+            else:
+                self.processes[i] = AccountedPopen(command, stdin=readEnd, stdout=writeEnd,
+                                                   stderr=stderr, bufsize=-1,
+                                                   preexec_fn=_defaultSigpipe)
+                if readEnd == subprocess32.PIPE:
+                    self.stdin = self.processes[i].stdin
+                if writeEnd == subprocess32.PIPE:
+                    self.stdout = self.processes[i].stdout
+                # The stage has its own copies of the pipes between stages
+                for end in (readEnd, writeEnd):
+                    if self._isStagePipe(end):
+                        os.close(end)
+            readEnd = nextReadEnd
+        # The Python stages are only started once all the processes have
+        # been, since preexec_fn isn't safe to use alongside other threads
+        for thread in self.threads:
+            if thread is not None:
+                thread.start()
+
+    def _isStagePipe(self, end):
+        return isinstance(end, int) and end >= 0
+
+    def _stageFile(self, end, fileMode):
+        """Get a file object for a Python stage to read or write, and whether
+        the stage should close it when it's done."""
+        if self._isStagePipe(end):
+            return os.fdopen(end, fileMode), True
+        if end == subprocess32.PIPE:
+            readFd, writeFd = os.pipe()
+            if fileMode == 'r':
+                self.stdin = os.fdopen(writeFd, 'w')
+                return os.fdopen(readFd, 'r'), True
+            self.stdout = os.fdopen(readFd, 'r')
+            return os.fdopen(writeFd, 'w'), True
+        if end is None:
+            return (open(os.devnull, 'r'), True) if fileMode == 'r' else (sys.stdout, False)
+        return end, False
+
+    def _runPythonStage(self, i, function, inFile, ownInFile, outFile, ownOutFile):
+        start = time.time()
+        exitStatus = 0
+        try:
+            for line in function(iter(inFile.readline, '')):
+                outFile.write(line)
+            outFile.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                self.errors[i] = e
+                exitStatus = 1
+            else:
+                # The next stage stopped reading
+                exitStatus = -signal.SIGPIPE
+        except Exception as e:
+            _log.exception("Python stage %s of pipeline %s failed", self.names[i], self.args)
+            self.errors[i] = e
+            exitStatus = 1
+        finally:
+            # Closing our ends passes EOF on to the next stage and SIGPIPE
+            # back to the previous one
+            for stageFile, own in ((inFile, ownInFile), (outFile, ownOutFile)):
+                if own:
+                    try:
+                        stageFile.close()
+                    except IOError:
+                        pass
+            self.wallTimes[i] = time.time() - start
+            self.exitStatuses[i] = exitStatus
+
+    def _checkContainers(self):
+        for i, containerInfo in enumerate(self.containerInfos):
+            if containerInfo is not None and self.exitStatuses[i] is None:
+                self.memUsages[i] = max(self.memUsages[i], maxMemUsageOfContainer(containerInfo))
+                self.cpuUsages[i] = cpuUsageOfContainer(containerInfo) or self.cpuUsages[i]
+
+    def _waitForStages(self):
+        delay = 0.001
+        lastContainerCheck = time.time()
+        while True:
+            for i, process in enumerate(self.processes):
+                if process is not None and self.exitStatuses[i] is None:
+                    exitStatus = process.poll()
+                    if exitStatus is not None:
+                        self.wallTimes[i] = time.time() - self.startTime
+                        self.exitStatuses[i] = exitStatus
+            if self.failedStage is None:
+                failed = [i for i, exitStatus in enumerate(self.exitStatuses)
+                          if exitStatus not in (None, 0, -signal.SIGPIPE)]
+                if len(failed) > 0:
+                    self.failedStage = failed[0]
+                    self.kill()
+            if all(exitStatus is not None for exitStatus in self.exitStatuses):
+                break
+            if time.time() - lastContainerCheck > self.containerCheckInterval:
+                self._checkContainers()
+                lastContainerCheck = time.time()
+            time.sleep(delay)
+            delay = min(2 * delay, 0.05)
+        if self.failedStage is None:
+            failed = [i for i, exitStatus in enumerate(self.exitStatuses) if exitStatus != 0]
+            if len(failed) > 0:
+                self.failedStage = failed[0]
+        self.returncode = 0 if self.failedStage is None else self.exitStatuses[self.failedStage]
+        if self._reader is not None:
+            self._reader.join()
+        self._done.set()
+
+    def _startWaiting(self):
+        if self._waiter is None:
+            self._waiter = threading.Thread(target=self._waitForStages)
+            self._waiter.daemon = True
+            self._waiter.start()
+
+    def _read(self):
+        self._output = self.stdout.read()
+        self.stdout.close()
+
+    def communicate(self, input=None, timeout=None):
+        if self._waiter is None:
+            if self.stdin is not None:
+                if input:
+                    feeder = threading.Thread(target=_feedStdin, args=(self.stdin, input))
+                    feeder.daemon = True
+                    feeder.start()
+                else:
+                    self.stdin.close()
+            if self.stdout is not None:
+                self._reader = threading.Thread(target=self._read)
+                self._reader.daemon = True
+                self._reader.start()
+            self._startWaiting()
+        if not self._done.wait(timeout):
+            raise subprocess32.TimeoutExpired(self.args, timeout)
+        return self._output, None
+
+    def wait(self, timeout=None):
+        self._startWaiting()
+        if not self._done.wait(timeout):
+            raise subprocess32.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def poll(self):
+        self._startWaiting()
+        return self.returncode if self._done.is_set() else None
+
+    def send_signal(self, sig):
+        for i, process in enumerate(self.processes):
+            if process is not None and self.exitStatuses[i] is None:
+                try:
+                    process.send_signal(sig)
+                except OSError:
+                    # Already gone
+                    pass
+
+    def kill(self):
+        running = [i for i, exitStatus in enumerate(self.exitStatuses) if exitStatus is None]
+        self.send_signal(signal.SIGKILL)
+        for i in running:
+            if self.containerInfos[i] is not None:
+                killContainer(self.containerInfos[i])
+
+    def stageUsage(self, i):
+        """The resource usage of a stage, or None for a Python stage."""
+        if self.processes[i] is None:
+            return None
+        if self.useRusage:
+            return self.processes[i].resourceUsage() or ResourceUsage(wallTime=self.wallTimes[i])
+        usage = ResourceUsage(maxMemory=self.memUsages[i], wallTime=self.wallTimes[i])
+        if self.cpuUsages[i] is not None:
+            usage.userTime, usage.systemTime = self.cpuUsages[i]
+        return usage
+
+    def resourceUsage(self):
+        """The total usage of the stages. The stages run at the same time,
+        so the sum of their peaks is taken as the peak memory."""
+        usage = ResourceUsage(wallTime=time.time() - self.startTime if self.returncode is None
+                              else max([0] + [w for w in self.wallTimes if w is not None]))
+        for i in xrange(len(self.names)):
+            stageUsage = self.stageUsage(i)
+            if stageUsage is None:
+                continue
+            for field in ("maxMemory", "userTime", "systemTime"):
+                if getattr(stageUsage, field) is not None:
+                    setattr(usage, field, (getattr(usage, field) or 0) + getattr(stageUsage, field))
+        return usage
+
+    def stageRecords(self):
+        """Per-stage exit statuses and resource usage, for the metrics."""
+        records = []
+        for i, name in enumerate(self.names):
+            record = { "stage": name, "exitStatus": self.exitStatuses[i] }
+            record.update((self.stageUsage(i) or ResourceUsage(wallTime=self.wallTimes[i])).asDict())
+            records.append(record)
+        return records
+
 def singularityCommand(tool=None,
                        work_dir=None,
                        parameters=None,
@@ -891,6 +1329,119 @@ def dockerCommand(tool=None,
     call = base_docker_call + [tool] + parameters
     return call, containerInfo
 
+def persistentContainersEnabled():
+    """Whether binaries should be run in a long-lived container rather than
+    a new one per call (see PersistentContainer)."""
+    return os.environ.get("CACTUS_PERSISTENT_CONTAINERS") == "1"
+
+class PersistentContainer(object):
+    """A docker container or Singularity instance that stays up for the
+    lifetime of the worker process, so that binaries can be run in it with
+    exec rather than paying the start-up cost of a new container each call.
+
+    In docker mode the directory tree under mountRoot is bind-mounted at
+    the same path inside the container, so only calls whose work dir lies
+    under it can be run this way.
+    """
+    pidLabel = "cactus.persistent.pid"
+
+    def __init__(self, mode, mountRoot):
+        assert mode in ("docker", "singularity")
+        self.mode = mode
+        self.mountRoot = os.path.abspath(mountRoot)
+        self.name = "cactus-%s" % uuid.uuid4()
+        self.pid = os.getpid()
+        self.running = False
+
+    def start(self):
+        with open(os.devnull, 'w') as devnull:
+            if self.mode == "docker":
+                reapPersistentContainers()
+                subprocess32.check_call(["docker", "run", "--detach", "--rm",
+                                         "--net=host",
+                                         "--log-driver=none",
+                                         "-u", "%s:%s" % (os.getuid(), os.getgid()),
+                                         "-v", "{0}:{0}".format(self.mountRoot),
+                                         "--label", "%s=%d" % (self.pidLabel, self.pid),
+                                         "--name", self.name,
+                                         "--entrypoint", "sleep",
+                                         getDockerImage(), "infinity"], stdout=devnull)
+            else:
+                subprocess32.check_call(["singularity", "--silent", "instance", "start",
+                                         "-B", self.mountRoot,
+                                         os.environ["CACTUS_SINGULARITY_IMG"], self.name], stdout=devnull)
+        self.running = True
+
+    def stop(self):
+        if not self.running or os.getpid() != self.pid:
+            # Forked children must leave their parent's container alone
+            return
+        self.running = False
+        if self.mode == "docker":
+            call = ["docker", "rm", "--force", self.name]
+        else:
+            call = ["singularity", "--silent", "instance", "stop", self.name]
+        with open(os.devnull, 'w') as devnull:
+            subprocess32.call(call, stdout=devnull, stderr=devnull)
+
+    def canRun(self, work_dir):
+        if self.mode == "singularity":
+            return True
+        work_dir = os.path.abspath(work_dir)
+        return work_dir == self.mountRoot or work_dir.startswith(self.mountRoot.rstrip("/") + "/")
+
+    def execCommand(self, work_dir=None, parameters=None, entrypoint=None):
+        """Get the command that runs the parameters in the container, from
+        work_dir (which the parameters are relative to).
+        """
+        if self.mode == "docker":
+            if entrypoint is None:
+                entrypoint = ["bash", "/opt/cactus/wrapper.sh"]
+            else:
+                entrypoint = [entrypoint]
+            return ["docker", "exec", "--interactive",
+                    "-u", "%s:%s" % (os.getuid(), os.getgid()),
+                    "-w", os.path.abspath(work_dir),
+                    self.name] + entrypoint + parameters
+        else:
+            return ["singularity", "--silent", "run", "instance://%s" % self.name] + parameters
+
+_persistentContainers = {}
+
+def getPersistentContainer(mode):
+    """Get this process's persistent container for the given binaries mode,
+    starting it if necessary. It is stopped when the process exits.
+    """
+    key = (os.getpid(), mode)
+    if key not in _persistentContainers:
+        container = PersistentContainer(mode, os.environ.get("CACTUS_PERSISTENT_MOUNT", tempfile.gettempdir()))
+        container.start()
+        atexit.register(container.stop)
+        _persistentContainers[key] = container
+    return _persistentContainers[key]
+
+def reapPersistentContainers():
+    """Remove the persistent docker containers of worker processes on this
+    host that died without stopping them."""
+    try:
+        output = popenCatch("docker ps --filter label=%s --format '{{.Names}} {{.Label \"%s\"}}'" % (PersistentContainer.pidLabel,
+                                                                                                    PersistentContainer.pidLabel))
+    except RuntimeError:
+        return
+    for line in output.split("\n"):
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        name, pid = fields
+        try:
+            os.kill(int(pid), 0)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                with open(os.devnull, 'w') as devnull:
+                    subprocess32.call(["docker", "rm", "--force", name], stdout=devnull, stderr=devnull)
+        except ValueError:
+            continue
+
 def prepareWorkDir(work_dir, parameters):
     if not work_dir:
     #Make sure all the paths we're accessing are in the same directory
@@ -945,45 +1496,98 @@ def cactus_call(tool=None,
                 job_name=None,
                 features=None,
                 fileStore=None,
-                swallowStdErr=False):
+                swallowStdErr=False,
+                stream_output=False):
+    """Run a Cactus binary (or a list of lists, for commands piped into one
+    another) in the way set by CACTUS_BINARIES_MODE. The stages of a
+    pipeline may also be Python callables, run as PipelineProcess
+    describes. With stream_output,
+    returns an iterator over the lines of the command's stdout as they are
+    written rather than waiting for it to finish; the command is checked,
+    and its resource usage recorded, once they have all been read. A
+    streamed command that passes its soft_timeout is interrupted and
+    raises SoftTimeoutError once its output so far has been read, where
+    otherwise None is returned.
+    """
     mode = os.environ.get("CACTUS_BINARIES_MODE", "docker")
+    if stream_output and (check_output or check_result or outfile or server):
+        raise RuntimeError("stream_output can't be combined with check_output, "
+                           "check_result, outfile or server")
     if dockstore is None:
         dockstore = getDockerOrg()
     if parameters is None:
         parameters = []
+    toolName = parameters[0] if len(parameters) > 0 else None
+    # We may have a list of lists, which is the convention for commands
+    # piped into one another. Stages may also be Python callables.
+    isPipeline = len(parameters) > 0 and (type(parameters[0]) is list or callable(parameters[0]))
+    if isPipeline:
+        stageNames = [stage[0] if type(stage) is list else stage.__name__ for stage in parameters]
+        toolName = "|".join(stageNames)
+    if metricsEnabled():
+        paths = [i for stage in parameters if type(stage) is list for i in stage] if isPipeline else parameters
+        callInputBytes = inputBytes(paths + ([infile] if infile else []))
     if tool is None:
         tool = "cactus"
 
-    entrypoint = None
-    if len(parameters) > 0 and type(parameters[0]) is list:
-        # We have a list of lists, which is the convention for commands piped into one another.
-        flattened = [i for sublist in parameters for i in sublist]
-        chain_params = [' '.join(p) for p in [list(map(pipes.quote, q)) for q in parameters]]
-        parameters = ['bash', '-c', 'set -eo pipefail && ' + ' | '.join(chain_params)]
-        if mode == "docker":
-            # We want to shell into bash directly rather than going
-            # through the default cactus entrypoint.
-            entrypoint = '/bin/bash'
-            parameters = parameters[1:]
-            work_dir, _ = prepareWorkDir(work_dir, flattened)
-
     if mode in ("docker", "singularity"):
-        work_dir, parameters = prepareWorkDir(work_dir, parameters)
-
-    if mode == "docker":
-        call, containerInfo = dockerCommand(tool=tool,
-                                            work_dir=work_dir,
-                                            parameters=parameters,
-                                            rm=rm,
-                                            port=port,
-                                            dockstore=dockstore,
-                                            entrypoint=entrypoint)
-    elif mode == "singularity":
-        call = singularityCommand(tool=tool, work_dir=work_dir,
-                                  parameters=parameters, port=port)
+        if isPipeline:
+            # All the stages share a work dir
+            flattened = [i for stage in parameters if type(stage) is list for i in stage]
+            work_dir, _ = prepareWorkDir(work_dir, flattened)
+            parameters = [prepareWorkDir(work_dir, stage)[1] if type(stage) is list else stage
+                          for stage in parameters]
+        else:
+            work_dir, parameters = prepareWorkDir(work_dir, parameters)
+
+    # Servers, calls that may be interrupted and calls whose container
+    # should be kept can't share a persistent container, since docker exec
+    # doesn't pass signals on to the process it runs.
+    container = None
+    if mode in ("docker", "singularity") and persistentContainersEnabled() and \
+       not server and port is None and rm and soft_timeout is None:
+        container = getPersistentContainer(mode)
+        if not container.canRun(work_dir):
+            container = None
+
+    # Containers we remove ourselves once the call is done, rather than
+    # with --rm, so that we can first ask docker if they were OOM killed.
+    # Calls that may be left running when their soft timeout passes keep
+    # --rm.
+    removeContainers = mode == "docker" and rm and not server and soft_timeout is None
+
+    def command(parameters):
+        """Get the command line that runs the parameters, and the info of
+        the docker container it creates, if any."""
+        if container is not None:
+            return container.execCommand(work_dir=work_dir, parameters=parameters), None
+        elif mode == "docker":
+            return dockerCommand(tool=tool,
+                                 work_dir=work_dir,
+                                 parameters=parameters,
+                                 rm=rm and not removeContainers,
+                                 port=port,
+                                 dockstore=dockstore)
+        elif mode == "singularity":
+            return singularityCommand(tool=tool, work_dir=work_dir,
+                                      parameters=parameters, port=port), None
+        else:
+            assert mode == "local"
+            return parameters, None
+
+    containerInfo = None
+    if isPipeline:
+        # Each stage is run as it would be on its own, in its own container
+        stages = []
+        for name, stage in zip(stageNames, parameters):
+            if callable(stage):
+                stages.append((name, stage, None))
+            else:
+                stageCall, stageContainerInfo = command(stage)
+                stages.append((name, stageCall, stageContainerInfo))
+        call = [stageCall for name, stageCall, stageContainerInfo in stages]
     else:
-        assert mode == "local"
-        call = parameters
+        call, containerInfo = command(parameters)
 
     stdinFileHandle = None
     stdoutFileHandle = None
@@ -993,11 +1597,19 @@ def cactus_call(tool=None,
         stdinFileHandle = open(infile, 'r')
     if outfile:
         stdoutFileHandle = open(outfile, 'w')
-    if check_output:
+    if check_output or stream_output:
         stdoutFileHandle = subprocess32.PIPE
 
+    oomKillsBefore = oomKillCount()
     _log.info("Running the command %s" % call)
-    process = subprocess32.Popen(call, shell=shell,
+    if isPipeline:
+        # The stages' own usage is only meaningful if they aren't run
+        # through the docker client
+        process = PipelineProcess(stages, stdin=stdinFileHandle, stdout=stdoutFileHandle,
+                                  stderr=subprocess32.PIPE if swallowStdErr else sys.stderr,
+                                  useRusage=mode != "docker")
+    else:
+        process = AccountedPopen(call, shell=shell,
                                  stdin=stdinFileHandle, stdout=stdoutFileHandle,
                                  stderr=subprocess32.PIPE if swallowStdErr else sys.stderr,
                                  bufsize=-1)
@@ -1005,40 +1617,194 @@ def cactus_call(tool=None,
     if server:
         return process
 
+    start_time = time.time()
+
+    def cleanUpContainers(killed=False):
+        """Remove the containers of the call, first checking whether any was
+        OOM killed if it failed. If the call was killed, those that aren't
+        removed are killed."""
+        containerInfos = [info for info in (process.containerInfos if isPipeline else [containerInfo])
+                          if info is not None]
+        if killed and not removeContainers and not isPipeline:
+            # A pipeline kills its own stages' containers
+            for info in containerInfos:
+                killContainer(info)
+        oomKilled = [containerOOMKilled(info) for info in containerInfos] \
+                    if process.returncode != 0 and removeContainers else []
+        if removeContainers:
+            for info in containerInfos:
+                removeContainer(info)
+        return oomKilled
+
+    def finish(output, memUsage, cpuUsage):
+        """Account for, log and check the result of the finished process."""
+        wallTime = time.time() - start_time
+        if isPipeline:
+            usage = process.resourceUsage()
+            usage.wallTime = wallTime
+        elif containerInfo is not None:
+            # The docker client's own usage says nothing about the container,
+            # so use what was seen in the container's cgroup. CPU times are
+            # those of the last check and so may be underestimates.
+            usage = ResourceUsage(maxMemory=memUsage, wallTime=wallTime)
+            if cpuUsage is not None:
+                usage.userTime, usage.systemTime = cpuUsage
+        elif mode == "docker":
+            # Run through docker exec in a persistent container
+            usage = ResourceUsage(wallTime=wallTime)
+        else:
+            usage = process.resourceUsage() or ResourceUsage(wallTime=wallTime)
+        if job_name is not None and features is not None and fileStore is not None:
+            # Log a datapoint for the resource usage for these features.
+            if usage.maxMemory is not None:
+                fileStore.logToMaster("Max memory used for job %s (tool %s) "
+                                      "on JSON features %s: %s" % (job_name, toolName,
+                                                                   json.dumps(features), usage.maxMemory))
+            fileStore.logToMaster("Resource usage for job %s (tool %s) "
+                                  "on JSON features %s: %s" % (job_name, toolName,
+                                                               json.dumps(features), json.dumps(usage.asDict())))
+        containersOOMKilled = cleanUpContainers()
+        outOfMemory = process.returncode != 0 and killedForMemory(process.returncode, mode,
+                                                                  oomKillsBefore, oomKillCount(),
+                                                                  containersOOMKilled)
+        if metricsEnabled():
+            record = { "tool": toolName, "mode": mode, "jobName": job_name, "features": features,
+                       "inputBytes": callInputBytes, "exitStatus": process.returncode,
+                       "outOfMemory": outOfMemory }
+            record.update(usage.asDict())
+            if isPipeline:
+                record["stages"] = process.stageRecords()
+            writeRecord(record)
+        if check_result:
+            return process.returncode
+
+        if outOfMemory:
+            raise OutOfMemoryError("Command %s was killed for running out of memory "
+                                   "(peak usage %s bytes)" % (call, usage.maxMemory))
+        if isPipeline and process.returncode != 0:
+            raise RuntimeError("Stage %s of command %s failed with exit status %s%s" %
+                               (stageNames[process.failedStage], call, process.returncode,
+                                "" if process.errors[process.failedStage] is None
+                                else " (%s)" % process.errors[process.failedStage]))
+        if process.returncode != 0:
+            raise RuntimeError("Command %s failed with output: %s" % (call, output))
+
+        if check_output:
+            return output
+
+    def timedOut():
+        if metricsEnabled():
+            writeRecord({ "tool": toolName, "mode": mode, "jobName": job_name, "features": features,
+                          "inputBytes": callInputBytes, "wallTime": time.time() - start_time,
+                          "exitStatus": None, "timedOut": True })
+
+    if stream_output:
+        return _streamOutput(process, stdin_string, containerInfo, soft_timeout, finish, timedOut,
+                             cleanUpContainers)
+
     memUsage = 0
+    cpuUsage = None
     first_run = True
-    start_time = time.time()
     while True:
         try:
             # Wait a bit to see if the process is done
             output, nothing = process.communicate(stdin_string if first_run else None, timeout=10)
         except subprocess32.TimeoutExpired:
-            if mode == "docker":
+            if containerInfo is not None:
                 # Every so often, check the memory usage of the container
                 updatedMemUsage = maxMemUsageOfContainer(containerInfo)
                 if updatedMemUsage is not None:
                     assert memUsage <= updatedMemUsage, "memory.max_usage_in_bytes should never decrease"
                     memUsage = updatedMemUsage
+                cpuUsage = cpuUsageOfContainer(containerInfo) or cpuUsage
             first_run = False
             if soft_timeout is not None and time.time() - start_time > soft_timeout:
                 # Soft timeout has been triggered. Just return early.
                 process.send_signal(signal.SIGINT)
+                timedOut()
                 return None
         else:
             break
-    if mode == "docker" and job_name is not None and features is not None and fileStore is not None:
-        # Log a datapoint for the memory usage for these features.
-        fileStore.logToMaster("Max memory used for job %s (tool %s) "
-                              "on JSON features %s: %s" % (job_name, parameters[0],
-                                                           json.dumps(features), memUsage))
-    if check_result:
-        return process.returncode
-
-    if process.returncode != 0:
-        raise RuntimeError("Command %s failed with output: %s" % (call, output))
-
-    if check_output:
-        return output
+    return finish(output, memUsage, cpuUsage)
+
+class CallMonitor(threading.Thread):
+    """Does for a streaming cactus_call what its wait loop does for the
+    others, from a separate thread, since the caller is blocked reading
+    output: checks the peak memory and CPU use of the container, if there
+    is one, every so often and interrupts the process once it passes its
+    soft timeout."""
+    def __init__(self, process, containerInfo, soft_timeout, interval=10):
+        super(CallMonitor, self).__init__()
+        self.daemon = True
+        self.process = process
+        self.containerInfo = containerInfo
+        self.soft_timeout = soft_timeout
+        self.interval = interval
+        self.memUsage = 0
+        self.cpuUsage = None
+        self.timedOut = False
+        self.startTime = time.time()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            if self.containerInfo is not None:
+                self.memUsage = max(self.memUsage, maxMemUsageOfContainer(self.containerInfo))
+                self.cpuUsage = cpuUsageOfContainer(self.containerInfo) or self.cpuUsage
+            if self.soft_timeout is not None and time.time() - self.startTime > self.soft_timeout:
+                self.timedOut = True
+                self.process.send_signal(signal.SIGINT)
+                return
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+def _feedStdin(stdin, stdin_string):
+    try:
+        stdin.write(stdin_string)
+        stdin.close()
+    except IOError as e:
+        # The process stopped reading
+        if e.errno != errno.EPIPE:
+            raise
+
+def _streamOutput(process, stdin_string, containerInfo, soft_timeout, finish, timedOut,
+                  cleanUpContainers):
+    """Yield the lines of output of a cactus_call process as it writes them,
+    without their newlines, then account for and check its result as
+    cactus_call would. Closing the generator early kills the process."""
+    if stdin_string:
+        # Feed the input from another thread, so the process can't block
+        # on a full output pipe while we block on its full input pipe
+        feeder = threading.Thread(target=_feedStdin, args=(process.stdin, stdin_string))
+        feeder.daemon = True
+        feeder.start()
+    elif process.stdin is not None:
+        process.stdin.close()
+    monitor = CallMonitor(process, containerInfo, soft_timeout)
+    monitor.start()
+    try:
+        for line in iter(process.stdout.readline, ''):
+            yield line.rstrip("\n")
+        process.stdout.close()
+        process.wait()
+    except GeneratorExit:
+        process.kill()
+        process.wait()
+        cleanUpContainers(killed=True)
+        raise
+    finally:
+        monitor.stop()
+    if monitor.timedOut:
+        timedOut()
+        # The consumer can't tell the output was cut short from its ending
+        raise SoftTimeoutError("Command %s was interrupted after passing its soft timeout "
+                               "of %s seconds" % (process.args, soft_timeout))
+    if containerInfo is not None:
+        # A last look, for anything since the monitor's
+        monitor.memUsage = max(monitor.memUsage, maxMemUsageOfContainer(containerInfo))
+    finish("", monitor.memUsage, monitor.cpuUsage)
 
 class RunAsFollowOn(Job):
     def __init__(self, job, *args, **kwargs):
@@ -1091,7 +1857,67 @@ class RoundedJob(Job):
     def _runner(self, jobGraph, jobStore, fileStore):
         if jobStore.config.workDir is not None:
             os.environ['TMPDIR'] = fileStore.getLocalTempDir()
-        super(RoundedJob, self)._runner(jobGraph=jobGraph, jobStore=jobStore, fileStore=fileStore)
+        # Attribute the performance records of the calls made by this job
+        phaseNode = getattr(self, "phaseNode", None)
+        setJobContext(jobClass=self.__class__.__name__,
+                      phase=phaseNode.tag if phaseNode is not None else None,
+                      retries=max(0, jobStore.config.retryCount - jobGraph.remainingRetryCount),
+                      jobInstance=str(uuid.uuid4()),
+                      jobFeatures=getattr(self, "sizingFeatures", None),
+                      sizingFeature=getattr(self, "sizingFeature", None))
+        startTime = time.time()
+        startPeak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        failed = True
+        try:
+            super(RoundedJob, self)._runner(jobGraph=jobGraph, jobStore=jobStore, fileStore=fileStore)
+            failed = False
+        except (OutOfMemoryError, MemoryError):
+            self.escalateResources(jobGraph, jobStore)
+            raise
+        finally:
+            cacheStats = nodeCache.logStatistics(fileStore)
+            if metricsEnabled():
+                # A record for the job as a whole, giving the peak memory of
+                # the worker itself and the disk left in use at the end. The
+                # worker's peak never falls, so it is only the job's own if
+                # it rose while the job ran; the peaks of the job's calls
+                # are in their own records.
+                localTempDir = getattr(fileStore, "localTempDir", None)
+                rusage = resource.getrusage(resource.RUSAGE_SELF)
+                writeRecord({ "type": "job", "failed": failed,
+                              "wallTime": time.time() - startTime,
+                              "maxMemory": ResourceUsage.fromRusage(rusage).maxMemory
+                                           if rusage.ru_maxrss > startPeak else None,
+                              "disk": directorySize(localTempDir) if localTempDir is not None else None,
+                              "requestedMemory": self.memory, "requestedDisk": self.disk,
+                              "nodeCache": cacheStats })
+
+    def escalateResources(self, jobGraph, jobStore):
+        """Raise the memory and disk the job will be retried with after it ran
+        out of memory, by the factor in CACTUS_OOM_ESCALATION_FACTOR (default
+        2), up to its memoryCap if it has one and Toil's --maxMemory and
+        --maxDisk. The worker reloads the job graph from the job store when
+        the job fails, so the new requirements are written there for the
+        leader to issue the retry with.
+        """
+        factor = float(os.environ.get("CACTUS_OOM_ESCALATION_FACTOR", 2))
+        memoryCap = min(getattr(self, "memoryCap", sys.maxint), jobStore.config.maxMemory)
+        oldMemory, oldDisk = jobGraph.memory, jobGraph.disk
+        newMemory = max(oldMemory, int(min(self.roundUp(oldMemory * factor), memoryCap)))
+        newDisk = max(oldDisk, int(min(self.roundUp(oldDisk * factor), jobStore.config.maxDisk)))
+        storedJobGraph = jobStore.load(jobGraph.jobStoreID)
+        for graph in (jobGraph, storedJobGraph):
+            graph._memory = newMemory
+            graph._disk = newDisk
+        jobStore.update(storedJobGraph)
+        if newMemory > oldMemory:
+            _log.warning("Job %s ran out of memory with %s bytes, raising its memory to %s bytes "
+                         "and its disk to %s bytes for the retry", self, oldMemory, newMemory, newDisk)
+        else:
+            _log.warning("Job %s ran out of memory with %s bytes, which is already its cap", self, oldMemory)
+        if metricsEnabled():
+            writeRecord({ "type": "outOfMemory", "requestedMemory": oldMemory, "requestedDisk": oldDisk,
+                          "escalatedMemory": newMemory, "escalatedDisk": newDisk })
 
 def readGlobalFileWithoutCache(fileStore, jobStoreID):
     """Reads a jobStoreID into a file and returns it, without touching
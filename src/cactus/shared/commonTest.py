@@ -1,4 +1,7 @@
 import os
+import sys
+import json
+import time
 import shutil
 import unittest
 
@@ -11,7 +14,9 @@ from toil.common import Toil
 from cactus.shared.test import silentOnSuccess
 from cactus.shared.common import encodeFlowerNames, decodeFirstFlowerName, \
                                  runCactusSplitFlowersBySecondaryGrouping, \
-                                 cactus_call, ChildTreeJob
+                                 cactus_call, ChildTreeJob, PersistentContainer, \
+                                 AccountedPopen, RoundedJob, killedForMemory, \
+                                 OutOfMemoryError, SoftTimeoutError, PipelineProcess
 
 class TestCase(unittest.TestCase):
     def setUp(self):
@@ -83,6 +88,196 @@ class TestCase(unittest.TestCase):
                              check_output=True)
         self.assertEquals(output, 'quuxbazbar\n')
 
+    def testPersistentContainerCommands(self):
+        container = PersistentContainer("docker", "/tmp/work/")
+        self.assertTrue(container.canRun("/tmp/work"))
+        self.assertTrue(container.canRun("/tmp/work/job/sub"))
+        self.assertFalse(container.canRun("/tmp/workspace"))
+        call = container.execCommand(work_dir="/tmp/work/job", parameters=["cactus_caf", "seq.fa"])
+        self.assertEquals(call[:2], ["docker", "exec"])
+        self.assertEquals(call[-5:], [container.name, "bash", "/opt/cactus/wrapper.sh", "cactus_caf", "seq.fa"])
+        self.assertEquals(call[call.index("-w") + 1], "/tmp/work/job")
+        call = container.execCommand(work_dir="/tmp/work/job", parameters=["-c", "true"], entrypoint="/bin/bash")
+        self.assertEquals(call[-4:], [container.name, "/bin/bash", "-c", "true"])
+        container = PersistentContainer("singularity", "/tmp/work")
+        self.assertTrue(container.canRun("/elsewhere"))
+        self.assertEquals(container.execCommand(parameters=["cactus_caf"]),
+                          ["singularity", "--silent", "run", "instance://%s" % container.name, "cactus_caf"])
+
+    def testResourceAccounting(self):
+        # Allocate and touch 100MB, then burn some CPU
+        script = "x = bytearray(100 * 1024 * 1024); sum(xrange(3000000))"
+        process = AccountedPopen([sys.executable, "-c", script])
+        self.assertEquals(process.wait(), 0)
+        usage = process.resourceUsage()
+        self.assertTrue(usage.maxMemory >= 100 * 1024 * 1024)
+        self.assertTrue(usage.userTime > 0)
+        self.assertTrue(usage.wallTime >= usage.userTime)
+
+        # In local mode the usage of each call is logged with its features
+        class FakeFileStore(object):
+            messages = []
+            def logToMaster(self, message):
+                self.messages.append(message)
+        fileStore = FakeFileStore()
+        oldMode = os.environ.get("CACTUS_BINARIES_MODE")
+        os.environ["CACTUS_BINARIES_MODE"] = "local"
+        try:
+            cactus_call(parameters=[[sys.executable, "-c", script], ["cat"]],
+                        job_name="testJob", features={"size": 1}, fileStore=fileStore)
+        finally:
+            if oldMode is None:
+                del os.environ["CACTUS_BINARIES_MODE"]
+            else:
+                os.environ["CACTUS_BINARIES_MODE"] = oldMode
+        self.assertEquals(len(fileStore.messages), 2)
+        memoryMessage, usageMessage = fileStore.messages
+        self.assertTrue(memoryMessage.startswith("Max memory used for job testJob (tool %s|cat) "
+                                                 "on JSON features {\"size\": 1}: " % sys.executable))
+        self.assertTrue(int(memoryMessage.split(": ")[-1]) >= 100 * 1024 * 1024)
+        usage = json.loads(usageMessage.split("}: ", 1)[1])
+        self.assertTrue(usage["userTime"] > 0)
+
+    @silentOnSuccess
+    def testCactusCallPipelineStages(self):
+        oldMode = os.environ.get("CACTUS_BINARIES_MODE")
+        os.environ["CACTUS_BINARIES_MODE"] = "local"
+        try:
+            def upper(lines):
+                for line in lines:
+                    yield line.upper()
+            def dropFirst(lines):
+                next(lines)
+                return lines
+            output = cactus_call(parameters=[["printf", "b\\na\\nb\\n"], upper, ["sort"]],
+                                 check_output=True)
+            self.assertEquals(output, "A\nB\nB\n")
+            # Python stages at either end
+            output = cactus_call(parameters=[upper, ["sort", "-r"], dropFirst],
+                                 stdin_string="x\ny\nz\n", check_output=True)
+            self.assertEquals(output, "Y\nX\n")
+            outputs = list(cactus_call(parameters=[["seq", "1", "5"], dropFirst], stream_output=True))
+            self.assertEquals(outputs, ["2", "3", "4", "5"])
+            # As with pipefail, a stage killed by SIGPIPE fails the pipeline
+            self.assertRaises(RuntimeError, cactus_call, parameters=[["yes"], ["head", "-n", "1"]])
+
+            # The failing stage is named, and the others don't hold the
+            # pipeline up
+            start = time.time()
+            try:
+                cactus_call(parameters=[["sleep", "60"], ["false"], ["cat"]])
+                self.fail("The pipeline should have failed")
+            except RuntimeError as e:
+                self.assertTrue(str(e).startswith("Stage false of command"))
+            self.assertTrue(time.time() - start < 30)
+            def broken(lines):
+                raise ValueError("broken stage")
+            try:
+                cactus_call(parameters=[["echo", "x"], broken, ["cat"]])
+                self.fail("The pipeline should have failed")
+            except RuntimeError as e:
+                self.assertTrue(str(e).startswith("Stage broken of command"))
+                self.assertTrue("broken stage" in str(e))
+        finally:
+            if oldMode is None:
+                del os.environ["CACTUS_BINARIES_MODE"]
+            else:
+                os.environ["CACTUS_BINARIES_MODE"] = oldMode
+
+    @silentOnSuccess
+    def testPipelineKillsContainers(self):
+        # A fake docker that logs what it's asked to do
+        binDir = os.path.join(self.tempDir, "bin")
+        os.mkdir(binDir)
+        dockerLog = os.path.join(self.tempDir, "docker.log")
+        with open(os.path.join(binDir, "docker"), 'w') as f:
+            f.write("#!/bin/sh\necho \"$@\" >> %s\n" % dockerLog)
+        os.chmod(os.path.join(binDir, "docker"), 0755)
+        oldPath = os.environ["PATH"]
+        os.environ["PATH"] = binDir + os.pathsep + oldPath
+        try:
+            # Killing the pipeline kills the containers of its stages, not
+            # just the docker clients running them
+            process = PipelineProcess([("sleep", ["sleep", "60"], { 'name': 'sleeper', 'id': None })])
+            process.kill()
+            process.wait()
+            with open(dockerLog) as f:
+                self.assertEquals(f.read().split("\n"), ["kill sleeper", ""])
+        finally:
+            os.environ["PATH"] = oldPath
+
+    @silentOnSuccess
+    def testStreamingCactusCall(self):
+        oldMode = os.environ.get("CACTUS_BINARIES_MODE")
+        os.environ["CACTUS_BINARIES_MODE"] = "local"
+        try:
+            # More input than fits in a pipe, so feeding it mustn't wait
+            # for the output to be read
+            lines = ["line %i" % i for i in xrange(100000)]
+            output = cactus_call(parameters=["cat"], stdin_string="\n".join(lines) + "\n",
+                                 stream_output=True)
+            self.assertEquals(list(output), lines)
+
+            # Failures are raised once the output has been read
+            script = "print 'partial'; import sys; sys.stdout.flush(); sys.exit(1)"
+            output = cactus_call(parameters=[sys.executable, "-c", script], stream_output=True)
+            self.assertEquals(output.next(), "partial")
+            self.assertRaises(RuntimeError, list, output)
+
+            # Passing the soft timeout is raised rather than cutting the
+            # output short
+            script = "print 'partial'; import sys, time; sys.stdout.flush(); time.sleep(60)"
+            output = cactus_call(parameters=[sys.executable, "-c", script], stream_output=True,
+                                 soft_timeout=1)
+            self.assertEquals(output.next(), "partial")
+            self.assertRaises(SoftTimeoutError, list, output)
+
+            # Stopping early kills the process
+            output = cactus_call(parameters=["yes"], stream_output=True)
+            self.assertEquals(output.next(), "y")
+            output.close()
+
+            self.assertRaises(RuntimeError, cactus_call, parameters=["true"],
+                              stream_output=True, check_output=True)
+        finally:
+            if oldMode is None:
+                del os.environ["CACTUS_BINARIES_MODE"]
+            else:
+                os.environ["CACTUS_BINARIES_MODE"] = oldMode
+
+    @silentOnSuccess
+    def testOutOfMemoryEscalation(self):
+        # Only SIGKILLs count, and only if our cgroup saw an OOM kill when
+        # we can tell, or if docker says the container was OOM killed
+        self.assertTrue(killedForMemory(-9, "local", 0, 1))
+        self.assertFalse(killedForMemory(-9, "local", 1, 1))
+        self.assertTrue(killedForMemory(-9, "local", None, None))
+        self.assertTrue(killedForMemory(137, "docker", 1, 1, [False, True]))
+        self.assertFalse(killedForMemory(137, "docker", 1, 1, [False, None]))
+        self.assertFalse(killedForMemory(137, "docker", None, None))
+        self.assertFalse(killedForMemory(1, "local", 0, 1))
+
+        # The retry is run with the escalated memory
+        def runOutOfMemoryOnce(memory, maxMemory, memoryCap=None):
+            options = Job.Runner.getDefaultOptions(getTempDirectory())
+            shutil.rmtree(options.jobStore)
+            options.disableCaching = True
+            options.logLevel = "CRITICAL"
+            options.retryCount = 1
+            options.maxMemory = maxMemory
+            # Toil raises the memory of a failed job to at least the default
+            options.defaultMemory = RoundedJob.roundingAmount
+            job = OutOfMemoryOnce(getTempFile(rootDir=self.tempDir), memory)
+            if memoryCap is not None:
+                job.memoryCap = memoryCap
+            with Toil(options) as toil:
+                return toil.start(job)
+        unit = RoundedJob.roundingAmount
+        self.assertEquals(runOutOfMemoryOnce(unit, 10 * unit), 2 * unit)
+        # Capped by --maxMemory, then by the job's memoryCap
+        self.assertEquals(runOutOfMemoryOnce(2 * unit, 3 * unit), 3 * unit)
+        self.assertEquals(runOutOfMemoryOnce(2 * unit, 10 * unit, memoryCap=3 * unit), 3 * unit)
+
     @silentOnSuccess
     def testChildTreeJob(self):
         """Check that the ChildTreeJob class runs all children."""
@@ -123,5 +318,19 @@ class CTTestChild(Job):
             # Empty file
             f.write('')
 
+class OutOfMemoryOnce(RoundedJob):
+    """Runs out of memory the first time it is run, then returns the memory
+    it was retried with."""
+    def __init__(self, markerFile, memory):
+        RoundedJob.__init__(self, memory=memory, cores=1, disk=RoundedJob.roundingAmount)
+        self.markerFile = markerFile
+
+    def run(self, fileStore):
+        if os.path.getsize(self.markerFile) == 0:
+            with open(self.markerFile, 'w') as f:
+                f.write("ran")
+            raise OutOfMemoryError("out of memory")
+        return fileStore.jobGraph.memory
+
 if __name__ == '__main__':
     unittest.main()
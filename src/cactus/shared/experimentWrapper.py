@@ -20,7 +20,10 @@ class DbElemWrapper(object):
         dbElem = confElem.find(typeString)
         self.dbElem = dbElem
         self.confElem = confElem
-        self.dbElem.attrib["database_dir"] = "fakepath"
+        # An embedded database is opened from its directory by each process
+        # using it, so its directory is kept
+        if typeString != "lmdb" or "database_dir" not in self.dbElem.attrib:
+            self.dbElem.attrib["database_dir"] = "fakepath"
 
     def check(self):
         """Function checks the database conf is as expected and creates useful exceptions
@@ -43,6 +46,14 @@ class DbElemWrapper(object):
                 raise RuntimeError("Database conf is of kyoto tycoon but there is no nested kyoto tycoon tag: %s" % dataString)
             if not set(("host", "port", "database_dir")).issubset(set(kyotoTycoon.attrib.keys())):
                 raise RuntimeError("The kyoto tycoon tag has a missing attribute: %s" % dataString)
+        elif typeString == "lmdb":
+            lmdb = self.confElem.find("lmdb")
+            if lmdb == None:
+                raise RuntimeError("Database conf is of type lmdb but there is no nested lmdb tag: %s" % dataString)
+            if not lmdb.attrib.has_key("database_dir"):
+                raise RuntimeError("The lmdb tag has no database_dir tag: %s" % dataString)
+            if not os.path.isabs(lmdb.attrib["database_dir"]):
+                raise RuntimeError("The lmdb database_dir must be an absolute path: %s" % dataString)
         else:
             raise RuntimeError("Unrecognised database type in conf string: %s" % typeString)
 
@@ -55,6 +66,12 @@ class DbElemWrapper(object):
     def getDbType(self):
         return self.dbElem.tag
 
+    def getDbDir(self):
+        return self.dbElem.attrib["database_dir"]
+
+    def setDbDir(self, databaseDir):
+        self.dbElem.attrib["database_dir"] = databaseDir
+
     def getDbPort(self):
         assert self.getDbType() == "kyoto_tycoon"
         return int(self.dbElem.attrib["port"])
@@ -9,7 +9,7 @@
 import unittest
 import os
 import xml.etree.ElementTree as ET
-from cactus.shared.experimentWrapper import ExperimentWrapper
+from cactus.shared.experimentWrapper import ExperimentWrapper, DbElemWrapper
 from sonLib.nxnewick import NXNewick
 
 class TestCase(unittest.TestCase):
@@ -29,6 +29,21 @@ class TestCase(unittest.TestCase):
         for i in seqList:
             assert seqMap[os.path.splitext(i)[0].upper()] == i
     
+    def testEmbeddedDb(self):
+        confElem = ET.Element("st_kv_database_conf", type="lmdb")
+        ET.SubElement(confElem, "lmdb")
+        dbElem = DbElemWrapper(confElem)
+        self.assertEquals(dbElem.getDbType(), "lmdb")
+        # Its directory has to be given
+        self.assertRaises(RuntimeError, dbElem.check)
+        dbElem.setDbDir("/tmp/cactusDbs/Anc0")
+        dbElem.check()
+        # and is kept when the conf is wrapped again, unlike a server's
+        self.assertEquals(DbElemWrapper(confElem).getDbDir(), "/tmp/cactusDbs/Anc0")
+        serverConf = ET.Element("st_kv_database_conf", type="kyoto_tycoon")
+        ET.SubElement(serverConf, "kyoto_tycoon", database_dir="/tmp/cactusDbs/Anc0")
+        self.assertEquals(DbElemWrapper(serverConf).getDbDir(), "fakepath")
+
     def __makeXmlDummy(self, treeString, sequenceString):
         rootElem =  ET.Element("dummy")
         rootElem.attrib['species_tree'] = self.tree
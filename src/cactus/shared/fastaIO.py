@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Streaming fasta reading and writing.
+
+Fasta files are memory mapped (or, if that isn't possible, read into
+memory) and records are found by searching for "\\n>", so the only
+strings built per record are its header and whatever slices of the
+sequence are asked for. Transforms that only touch the headers copy the
+sequence bytes through unchanged, a block at a time, keeping the original
+line layout; transforms of the sequence (such as changing its case) are
+applied to whole blocks rather than line by line. As with fastaRead, the
+sequences are checked for characters other than letters and "-" unless
+the check is turned off.
+
+Running this module as a script benchmarks the throughput of these
+functions against sonLib's fastaRead and fastaWrite.
+"""
+import os
+import mmap
+import time
+import string
+from argparse import ArgumentParser
+
+DEFAULT_BLOCK_SIZE = 1 << 24
+
+_whitespace = " \t\r\n"
+
+# The characters fastaRead accepts in a sequence line, and the line breaks
+# and spaces it removes from them
+_validSequenceChars = string.ascii_letters + "-" + "\n "
+
+class FastaRecord(object):
+    """A record of a fasta file, given by its offsets into the file's buffer.
+
+    The header is the header line without the ">" and newline. The sequence
+    is held as it is in the file, spread across lines; use sequenceBlocks()
+    to get it without the line breaks.
+    """
+    def __init__(self, data, start, sequenceStart, end):
+        self.data = data
+        self.start = start
+        self.sequenceStart = sequenceStart
+        self.end = end
+        headerEnd = sequenceStart
+        if headerEnd > start + 1 and data[headerEnd - 1] == "\n":
+            headerEnd -= 1
+        self.header = data[start + 1:headerEnd]
+
+    def name(self):
+        """The first word of the header.
+        """
+        words = self.header.split()
+        return words[0] if len(words) > 0 else ""
+
+    def rawBlocks(self, blockSize=DEFAULT_BLOCK_SIZE):
+        """Yields the bytes of the sequence lines as they are in the file,
+        as buffers that can be written without being copied.
+        """
+        for blockStart in xrange(self.sequenceStart, self.end, blockSize):
+            yield buffer(self.data, blockStart, min(blockSize, self.end - blockStart))
+
+    def sequenceBlocks(self, blockSize=DEFAULT_BLOCK_SIZE):
+        """Yields the sequence in consecutive pieces, with the line breaks
+        (and any other whitespace) removed.
+        """
+        for blockStart in xrange(self.sequenceStart, self.end, blockSize):
+            block = self.data[blockStart:min(blockStart + blockSize, self.end)].translate(None, _whitespace)
+            if len(block) > 0:
+                yield block
+
+    def checkBlock(self, block):
+        """Raise an error if the block of the sequence lines has characters
+        that fastaRead wouldn't accept. Lines starting with "#" are
+        comments, which fastaRead skips.
+        """
+        if len(str(block).translate(None, _validSequenceChars)) == 0:
+            return
+        # The block may hold part of a comment line, so the whole record
+        # is checked line by line
+        lines = self.data[self.sequenceStart:self.end].split("\n")
+        invalid = "".join(line.translate(None, _validSequenceChars) for line in lines
+                          if not line.startswith("#"))
+        if len(invalid) > 0:
+            raise RuntimeError("Invalid FASTA character(s) seen in fasta sequence %s: %s" %
+                               (self.header, set(invalid)))
+
+    def checkSequence(self, blockSize=DEFAULT_BLOCK_SIZE):
+        for block in self.rawBlocks(blockSize):
+            self.checkBlock(block)
+
+    def length(self):
+        return sum(len(block) for block in self.sequenceBlocks())
+
+    def sequence(self):
+        return "".join(self.sequenceBlocks())
+
+class FastaFile(object):
+    """A fasta file opened for streaming, given either its path or an open
+    file handle. Use it as a context manager, or close it when done.
+    """
+    def __init__(self, pathOrFile):
+        if isinstance(pathOrFile, basestring):
+            self.fileHandle = open(pathOrFile, 'rb')
+            self.ownsFile = True
+        else:
+            self.fileHandle = pathOrFile
+            self.ownsFile = False
+        try:
+            self.data = mmap.mmap(self.fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError, AttributeError):
+            # Empty files, pipes and file-like objects can't be mapped
+            self.data = self.fileHandle.read()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = ""
+        if self.ownsFile:
+            self.fileHandle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def firstRecordStart(self):
+        """The offset of the first record, which is the length of anything
+        (usually blank lines) before it.
+        """
+        if self.data[:1] == ">":
+            return 0
+        start = self.data.find("\n>")
+        return len(self.data) if start == -1 else start + 1
+
+    def records(self):
+        """Yields the records of the file in order.
+        """
+        data = self.data
+        length = len(data)
+        start = self.firstRecordStart()
+        while start < length:
+            headerEnd = data.find("\n", start)
+            sequenceStart = length if headerEnd == -1 else headerEnd + 1
+            end = data.find("\n>", sequenceStart - 1)
+            end = length if end == -1 else end + 1
+            yield FastaRecord(data, start, sequenceStart, end)
+            start = end
+
+def iterHeaders(pathOrFile, validate=True):
+    """Yields the headers of a fasta file. Unless validate is off, the
+    sequences are checked for invalid characters, as fastaRead checks them,
+    otherwise they aren't read at all.
+    """
+    with FastaFile(pathOrFile) as fastaFile:
+        for record in fastaFile.records():
+            if validate:
+                record.checkSequence()
+            yield record.header
+
+def sequenceLengths(pathOrFile, validate=True):
+    """Yields (header, sequence length) for the records of a fasta file,
+    checking the sequences for invalid characters unless validate is off.
+    """
+    with FastaFile(pathOrFile) as fastaFile:
+        for record in fastaFile.records():
+            if validate:
+                record.checkSequence()
+            yield record.header, record.length()
+
+def transformFasta(inPath, outPath, headerFn=None, sequenceFn=None, keepFn=None,
+                   blockSize=DEFAULT_BLOCK_SIZE, validate=True):
+    """Copy a fasta file, changing the headers, the sequences or which
+    records are kept.
+
+    headerFn maps each header to its replacement. sequenceFn is applied to
+    blocks of the sequence lines, newlines included, so it must act on each
+    character independently (str.upper, or a str.translate, for example).
+    keepFn is given each FastaRecord and returns whether to keep it.
+    Anything before the first record is copied unchanged. Unless validate is
+    off, the sequences of the kept records are checked for invalid
+    characters, as fastaRead and fastaWrite check them.
+    """
+    with FastaFile(inPath) as fastaFile, open(outPath, 'wb') as outFile:
+        data = fastaFile.data
+        outFile.write(buffer(data, 0, fastaFile.firstRecordStart()))
+        for record in fastaFile.records():
+            if keepFn is not None and not keepFn(record):
+                continue
+            if headerFn is None:
+                outFile.write(buffer(data, record.start, record.sequenceStart - record.start))
+            else:
+                outFile.write(">%s\n" % headerFn(record.header))
+            if sequenceFn is None:
+                for block in record.rawBlocks(blockSize):
+                    if validate:
+                        record.checkBlock(block)
+                    outFile.write(block)
+            else:
+                for blockStart in xrange(record.sequenceStart, record.end, blockSize):
+                    block = data[blockStart:min(blockStart + blockSize, record.end)]
+                    if validate:
+                        record.checkBlock(block)
+                    outFile.write(sequenceFn(block))
+
+def writeSubsequences(record, intervals, outFile, headerFn, blockSize=DEFAULT_BLOCK_SIZE):
+    """Write the given intervals of a record's sequence to outFile as fasta
+    records, each on a single line under the header headerFn(start).
+
+    The intervals are (start, end) pairs, which must be sorted and must not
+    overlap. As with slicing, they are cut short at the end of the sequence.
+    """
+    intervals = list(intervals)
+    for i in xrange(1, len(intervals)):
+        if intervals[i][0] < intervals[i - 1][1]:
+            raise RuntimeError("Intervals of %s are unsorted or overlapping" % record.header)
+    position = 0
+    current = 0
+    started = False
+    for block in record.sequenceBlocks(blockSize):
+        blockEnd = position + len(block)
+        while current < len(intervals) and intervals[current][0] < blockEnd:
+            start, end = intervals[current]
+            if not started:
+                outFile.write(">%s\n" % headerFn(start))
+                started = True
+            outFile.write(block[max(start - position, 0):max(min(end, blockEnd) - position, 0)])
+            if end > blockEnd:
+                break
+            outFile.write("\n")
+            current += 1
+            started = False
+        position = blockEnd
+    for start, end in intervals[current:]:
+        if not started:
+            outFile.write(">%s\n" % headerFn(start))
+        outFile.write("\n")
+        started = False
+
+def makeRandomFastaFile(path, size, recordSize=1000000, lineLength=80):
+    """Write a fasta file of about size bytes of repetitive sequence.
+    """
+    unit = "ACGTacgtNNACGTTGCA" * 16
+    line = (unit * (lineLength / len(unit) + 1))[:lineLength] + "\n"
+    linesPerRecord = max(1, recordSize / lineLength)
+    with open(path, 'w') as fileHandle:
+        written = 0
+        recordNumber = 0
+        while written < size:
+            record = ">seq%i\n%s" % (recordNumber, line * linesPerRecord)
+            fileHandle.write(record)
+            written += len(record)
+            recordNumber += 1
+
+def benchmark(fastaPath, repeats=3):
+    """Time streaming through the fasta file in various ways, returning a
+    dict of rates in GB/s.
+    """
+    size = os.path.getsize(fastaPath) / 1e9
+    outPath = fastaPath + ".benchmark"
+    def rate(fn):
+        best = min(timeIt(fn) for i in xrange(repeats))
+        return size / best if best > 0 else float("inf")
+    def timeIt(fn):
+        start = time.time()
+        fn()
+        return time.time() - start
+    def headers():
+        for header in iterHeaders(fastaPath):
+            pass
+    def lengths():
+        for header, length in sequenceLengths(fastaPath):
+            pass
+    def lineLoopHeaders():
+        with open(fastaPath) as fileHandle, open(outPath, 'w') as outFile:
+            for line in fileHandle:
+                if line[0] == ">":
+                    outFile.write(">id=0|%s\n" % line[1:-1])
+                else:
+                    outFile.write(line)
+    rates = { "iterHeaders": rate(headers),
+              "sequenceLengths": rate(lengths),
+              "transformHeaders": rate(lambda: transformFasta(fastaPath, outPath, headerFn=lambda h: "id=0|" + h)),
+              "transformUpper": rate(lambda: transformFasta(fastaPath, outPath, sequenceFn=str.upper)),
+              "lineLoopHeaders": rate(lineLoopHeaders) }
+    try:
+        from sonLib.bioio import fastaRead, fastaWrite
+    except ImportError:
+        pass
+    else:
+        def sonLibCopy():
+            with open(fastaPath) as fileHandle, open(outPath, 'w') as outFile:
+                for header, sequence in fastaRead(fileHandle):
+                    fastaWrite(outFile, "id=0|" + header, sequence)
+        rates["fastaReadWrite"] = rate(sonLibCopy)
+    os.remove(outPath)
+    return rates
+
+def main():
+    parser = ArgumentParser(description="Benchmark the streaming fasta functions "
+                            "against sonLib's fastaRead and fastaWrite")
+    parser.add_argument("fastaFiles", nargs="*", help="Fasta files to benchmark on, "
+                        "a random file is used if none are given")
+    parser.add_argument("--randomSize", type=int, default=200000000,
+                        help="Size in bytes of the random file")
+    parser.add_argument("--repeats", type=int, default=3)
+    opts = parser.parse_args()
+    fastaFiles = opts.fastaFiles
+    if len(fastaFiles) == 0:
+        randomFastaPath = os.path.abspath("randomSequences.fa")
+        makeRandomFastaFile(randomFastaPath, opts.randomSize)
+        fastaFiles = [randomFastaPath]
+    for fastaPath in fastaFiles:
+        rates = benchmark(fastaPath, opts.repeats)
+        print "%s (%.2f GB):" % (fastaPath, os.path.getsize(fastaPath) / 1e9)
+        for name in sorted(rates.keys()):
+            print "\t%s\t%.3f GB/s" % (name, rates[name])
+    if len(opts.fastaFiles) == 0:
+        os.remove(randomFastaPath)
+
+if __name__ == '__main__':
+    main()
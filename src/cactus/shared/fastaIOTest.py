@@ -0,0 +1,127 @@
+import unittest
+import os
+from StringIO import StringIO
+from textwrap import dedent
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.fastaIO import FastaFile, iterHeaders, sequenceLengths, transformFasta, writeSubsequences
+from cactus.preprocessor.checkUniqueHeaders import checkUniqueHeaders
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.faPath = getTempFile()
+        open(self.faPath, 'w').write(dedent('''
+        >seq1 description
+        ACGTac
+        gtNN
+
+        A
+        >seq2
+        >seq3
+        GATTACA'''))
+        self.tempFiles = [self.faPath]
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    @silentOnSuccess
+    def testRecords(self):
+        with FastaFile(self.faPath) as fastaFile:
+            records = [(record.header, record.name(), record.sequence()) for record in fastaFile.records()]
+        self.assertEquals(records, [("seq1 description", "seq1", "ACGTacgtNNA"),
+                                    ("seq2", "seq2", ""),
+                                    ("seq3", "seq3", "GATTACA")])
+        self.assertEquals(list(iterHeaders(self.faPath)), ["seq1 description", "seq2", "seq3"])
+        with open(self.faPath) as fileHandle:
+            self.assertEquals(list(sequenceLengths(fileHandle)), [("seq1 description", 11), ("seq2", 0), ("seq3", 7)])
+        # Blocks smaller than a line
+        with FastaFile(self.faPath) as fastaFile:
+            record = fastaFile.records().next()
+            self.assertEquals(list(record.sequenceBlocks(blockSize=3)), ["ACG", "Tac", "gt", "NN", "A"])
+
+    @silentOnSuccess
+    def testEmptyFile(self):
+        open(self.faPath, 'w').close()
+        self.assertEquals(list(iterHeaders(self.faPath)), [])
+        outPath = self.getTempFile()
+        transformFasta(self.faPath, outPath, headerFn=str.upper)
+        self.assertEquals(open(outPath).read(), "")
+
+    @silentOnSuccess
+    def testTransformFasta(self):
+        outPath = self.getTempFile()
+        # The layout of the file is kept, including lines before the first record
+        transformFasta(self.faPath, outPath, headerFn=lambda header: "id=0|" + header, blockSize=4)
+        self.assertEquals(open(outPath).read(), dedent('''
+        >id=0|seq1 description
+        ACGTac
+        gtNN
+
+        A
+        >id=0|seq2
+        >id=0|seq3
+        GATTACA'''))
+        transformFasta(self.faPath, outPath, sequenceFn=str.upper,
+                       keepFn=lambda record: record.length() > 0, blockSize=5)
+        self.assertEquals(open(outPath).read(), dedent('''
+        >seq1 description
+        ACGTAC
+        GTNN
+
+        A
+        >seq3
+        GATTACA'''))
+
+    @silentOnSuccess
+    def testInvalidCharacters(self):
+        open(self.faPath, 'w').write(dedent('''\
+        >seq1
+        # A comment, which can hold anything: *.!
+        ACGT-acgt
+        >seq2
+        ACG*T
+        '''))
+        outPath = self.getTempFile()
+        # Rejected wherever the sequences are read, as fastaRead rejects them
+        self.assertRaises(RuntimeError, list, iterHeaders(self.faPath))
+        self.assertRaises(RuntimeError, list, sequenceLengths(self.faPath))
+        self.assertRaises(RuntimeError, transformFasta, self.faPath, outPath, headerFn=str.upper)
+        self.assertRaises(RuntimeError, transformFasta, self.faPath, outPath, sequenceFn=str.upper, blockSize=3)
+        self.assertRaises(RuntimeError, checkUniqueHeaders, self.faPath)
+        # Unless the check is turned off
+        self.assertEquals(list(iterHeaders(self.faPath, validate=False)), ["seq1", "seq2"])
+        transformFasta(self.faPath, outPath, headerFn=str.upper, validate=False)
+        # Comments are allowed, as are records that are dropped
+        transformFasta(self.faPath, outPath, keepFn=lambda record: record.name() == "seq1", blockSize=7)
+        self.assertEquals(open(outPath).read().count(">"), 1)
+
+    @silentOnSuccess
+    def testWriteSubsequences(self):
+        out = StringIO()
+        with FastaFile(self.faPath) as fastaFile:
+            record = fastaFile.records().next()
+            writeSubsequences(record, [(0, 2), (3, 9), (10, 15), (20, 25)], out,
+                              lambda start: "seq1|%d" % start, blockSize=4)
+            self.assertRaises(RuntimeError, writeSubsequences, record, [(3, 9), (0, 4)], out, str)
+        self.assertEquals(out.getvalue(), dedent('''\
+        >seq1|0
+        AC
+        >seq1|3
+        TacgtN
+        >seq1|10
+        A
+        >seq1|20
+
+        '''))
+
+if __name__ == '__main__':
+    unittest.main()
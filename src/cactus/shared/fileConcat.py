@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""In-process file concatenation.
+
+Files are copied into the output within the kernel where possible: with
+copy_file_range, which on filesystems that support it (XFS, btrfs, NFS
+4.2) shares or offloads the data rather than copying it, and otherwise
+with sendfile. Both are called through ctypes, since Python 2 has neither.
+Streams that aren't backed by a regular file, such as some job store read
+streams, are copied through a large buffer.
+
+Running this module as a script benchmarks concatenation against the
+shell cat that catFiles used to run, on many small files and a few large
+ones.
+"""
+import os
+import sys
+import stat
+import time
+import errno
+import ctypes
+import ctypes.util
+import shutil
+import tempfile
+import subprocess32
+from argparse import ArgumentParser
+
+DEFAULT_BUFFER_SIZE = 1 << 24
+
+# The errors with which copy_file_range and sendfile say they can't copy
+# between these files, rather than that the copy failed
+_unsupportedErrnos = (errno.ENOSYS, errno.EINVAL, errno.EXDEV, errno.EOPNOTSUPP,
+                      errno.EBADF, errno.ETXTBSY)
+
+_copyFileRange = None
+_sendfile = None
+if sys.platform.startswith("linux"):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        _libc = None
+    if _libc is not None:
+        _copyFileRange = getattr(_libc, "copy_file_range", None)
+        if _copyFileRange is not None:
+            _copyFileRange.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                       ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+            _copyFileRange.restype = ctypes.c_ssize_t
+        _sendfile = getattr(_libc, "sendfile", None)
+        if _sendfile is not None:
+            _sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+            _sendfile.restype = ctypes.c_ssize_t
+
+def _kernelCopy(function, inFd, outFd, count, bufferSize):
+    """Copy up to count bytes from the current offset of inFd to that of
+    outFd with copy_file_range or sendfile, which both move the offsets.
+    Returns the number of bytes copied, stopping early if the function
+    turns out not to work on these files.
+    """
+    copied = 0
+    while copied < count:
+        if function is _copyFileRange:
+            n = function(inFd, None, outFd, None, min(bufferSize, count - copied), 0)
+        else:
+            n = function(outFd, inFd, None, min(bufferSize, count - copied))
+        if n < 0:
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            if error in _unsupportedErrnos:
+                return copied
+            raise OSError(error, os.strerror(error))
+        if n == 0:
+            # The input was shorter than its size said
+            break
+        copied += n
+    return copied
+
+def copyFd(inFd, outFd, count, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Copy count bytes from the current offset of inFd, a regular file, to
+    that of outFd, leaving both offsets after the copied bytes. Returns the
+    number of bytes copied, which is less than count only if the input was
+    truncated.
+    """
+    copied = 0
+    for function in (_copyFileRange, _sendfile):
+        if function is not None and copied < count:
+            copied += _kernelCopy(function, inFd, outFd, count - copied, bufferSize)
+    while copied < count:
+        block = os.read(inFd, min(bufferSize, count - copied))
+        if block == "":
+            break
+        while len(block) > 0:
+            written = os.write(outFd, block)
+            block = block[written:]
+            copied += written
+    return copied
+
+def _regularFileno(stream):
+    """The file descriptor of a stream backed by a regular file, or None."""
+    try:
+        fd = stream.fileno()
+    except (AttributeError, IOError, ValueError):
+        return None
+    return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+
+def copyStream(inStream, outFile, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Copy the rest of inStream to the file object outFile. If both are
+    backed by files, the copy is done in the kernel.
+    """
+    inFd = _regularFileno(inStream)
+    try:
+        outFd = outFile.fileno()
+    except (AttributeError, IOError, ValueError):
+        outFd = None
+    if inFd is None or outFd is None:
+        shutil.copyfileobj(inStream, outFile, bufferSize)
+        return
+    # Whatever either file object has buffered must be accounted for
+    # before going around it
+    outFile.flush()
+    position = inStream.tell()
+    os.lseek(inFd, position, os.SEEK_SET)
+    copyFd(inFd, outFd, os.fstat(inFd).st_size - position, bufferSize)
+    inStream.seek(0, os.SEEK_END)
+    outFile.seek(os.lseek(outFd, 0, os.SEEK_CUR), os.SEEK_SET)
+
+def _openOutput(outPath, append):
+    # Files opened with O_APPEND can't be written by copy_file_range or
+    # sendfile, so an existing file is appended to by seeking to its end
+    if append and os.path.exists(outPath):
+        outFile = open(outPath, 'r+b')
+        outFile.seek(0, os.SEEK_END)
+        return outFile
+    return open(outPath, 'wb')
+
+def concatenateFiles(paths, outPath, append=False, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Concatenate the files at paths into the file at outPath, appending to
+    it if append is set.
+    """
+    with _openOutput(outPath, append) as outFile:
+        for path in paths:
+            with open(path, 'rb') as inFile:
+                copyStream(inFile, outFile, bufferSize)
+
+def concatenateStreams(streams, outPath, append=False, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Concatenate streams into the file at outPath, appending to it if
+    append is set. Each item of streams is a file-like object or a context
+    manager giving one, such as the read streams of a job store, which is
+    only opened when it is reached.
+    """
+    with _openOutput(outPath, append) as outFile:
+        for stream in streams:
+            if hasattr(stream, "__enter__"):
+                with stream as inStream:
+                    copyStream(inStream, outFile, bufferSize)
+            else:
+                copyStream(stream, outFile, bufferSize)
+
+def kernelCopyMethod():
+    """The in-kernel copy that will be tried first, if any."""
+    if _copyFileRange is not None:
+        return "copy_file_range"
+    if _sendfile is not None:
+        return "sendfile"
+    return None
+
+def shellCatFiles(filesToCat, catFile):
+    """What catFiles did before: cat 25 files at a time through the shell."""
+    if len(filesToCat) == 0:
+        open(catFile, 'w').close()
+        return
+    maxCat = 25
+    subprocess32.check_call("cat %s > %s" % (" ".join(filesToCat[:maxCat]), catFile), shell=True)
+    filesToCat = filesToCat[maxCat:]
+    while len(filesToCat) > 0:
+        subprocess32.check_call("cat %s >> %s" % (" ".join(filesToCat[:maxCat]), catFile), shell=True)
+        filesToCat = filesToCat[maxCat:]
+
+def makeFiles(workDir, number, size, prefix):
+    paths = []
+    block = os.urandom(min(size, 1 << 20))
+    for i in xrange(number):
+        path = os.path.join(workDir, "%s%i" % (prefix, i))
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+def benchmark(workDir, smallFiles=10000, smallSize=4096, largeFiles=3, largeSize=1 << 30, repeats=3):
+    """Time concatenating many small files and a few large ones with
+    concatenateFiles and with the shell, returning a list of (case,
+    implementation, seconds, GB/s) tuples for the best of the repeats.
+    """
+    cases = [("%i x %i bytes" % (smallFiles, smallSize), makeFiles(workDir, smallFiles, smallSize, "small")),
+             ("%i x %i bytes" % (largeFiles, largeSize), makeFiles(workDir, largeFiles, largeSize, "large"))]
+    outPath = os.path.join(workDir, "out")
+    results = []
+    for case, paths in cases:
+        size = sum(os.path.getsize(path) for path in paths) / 1e9
+        for name, fn in (("shell cat", shellCatFiles), ("concatenateFiles", concatenateFiles)):
+            times = []
+            for i in xrange(repeats):
+                start = time.time()
+                fn(paths, outPath)
+                times.append(time.time() - start)
+                os.remove(outPath)
+            best = min(times)
+            results.append((case, name, best, size / best if best > 0 else float("inf")))
+        for path in paths:
+            os.remove(path)
+    return results
+
+def main():
+    parser = ArgumentParser(description="Benchmark in-process file concatenation "
+                            "against the shell cat catFiles used to run")
+    parser.add_argument("--workDir", default=None,
+                        help="Directory to make the test files in [default: a temporary directory]")
+    parser.add_argument("--smallFiles", type=int, default=10000)
+    parser.add_argument("--smallSize", type=int, default=4096)
+    parser.add_argument("--largeFiles", type=int, default=3)
+    parser.add_argument("--largeSize", type=int, default=1 << 30)
+    parser.add_argument("--repeats", type=int, default=3)
+    opts = parser.parse_args()
+    workDir = tempfile.mkdtemp(dir=opts.workDir)
+    try:
+        print "In-kernel copy: %s" % (kernelCopyMethod() or "none")
+        for case, name, seconds, rate in benchmark(workDir, opts.smallFiles, opts.smallSize,
+                                                   opts.largeFiles, opts.largeSize, opts.repeats):
+            print "%s\t%s\t%.3f s\t%.2f GB/s" % (case, name, seconds, rate)
+    finally:
+        shutil.rmtree(workDir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+from StringIO import StringIO
+from contextlib import contextmanager
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.shared import fileConcat
+from cactus.shared.fileConcat import concatenateFiles, concatenateStreams, copyStream
+from cactus.shared.common import catFiles
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempFiles = []
+        self.contents = ["first\n", "", "x" * 100000, "last"]
+        self.paths = []
+        for contents in self.contents:
+            path = self.getTempFile()
+            open(path, 'w').write(contents)
+            self.paths.append(path)
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    @silentOnSuccess
+    def testConcatenateFiles(self):
+        outPath = self.getTempFile()
+        open(outPath, 'w').write("overwritten")
+        concatenateFiles(self.paths, outPath, bufferSize=4096)
+        self.assertEquals(open(outPath).read(), "".join(self.contents))
+        concatenateFiles(self.paths[:1], outPath, append=True)
+        self.assertEquals(open(outPath).read(), "".join(self.contents + self.contents[:1]))
+        catFiles([], outPath)
+        self.assertEquals(open(outPath).read(), "")
+        catFiles(self.paths, outPath)
+        self.assertEquals(open(outPath).read(), "".join(self.contents))
+
+    @silentOnSuccess
+    def testWithoutKernelCopy(self):
+        copyFileRange, sendfile = fileConcat._copyFileRange, fileConcat._sendfile
+        fileConcat._copyFileRange, fileConcat._sendfile = None, None
+        try:
+            outPath = self.getTempFile()
+            concatenateFiles(self.paths, outPath, bufferSize=4096)
+            self.assertEquals(open(outPath).read(), "".join(self.contents))
+        finally:
+            fileConcat._copyFileRange, fileConcat._sendfile = copyFileRange, sendfile
+
+    @silentOnSuccess
+    def testConcatenateStreams(self):
+        @contextmanager
+        def openStream(path):
+            with open(path) as stream:
+                yield stream
+        # Partly read streams are copied from where they are
+        partlyRead = open(self.paths[0])
+        partlyRead.read(2)
+        outPath = self.getTempFile()
+        concatenateStreams([partlyRead, StringIO("in memory\n")] +
+                           [openStream(path) for path in self.paths], outPath)
+        partlyRead.close()
+        self.assertEquals(open(outPath).read(), "rst\nin memory\n" + "".join(self.contents))
+        # Writes through the file object before and after a copy stay in order
+        with open(outPath, 'w') as outFile:
+            outFile.write("before\n")
+            with open(self.paths[0]) as inFile:
+                copyStream(inFile, outFile)
+            outFile.write("after\n")
+        self.assertEquals(open(outPath).read(), "before\nfirst\nafter\n")
+
+if __name__ == '__main__':
+    unittest.main()
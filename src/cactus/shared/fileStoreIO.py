@@ -0,0 +1,119 @@
+#Released under the MIT license, see LICENSE.txt
+
+"""Concurrent reads from and writes to the job store, for use in Job.run.
+
+Reading or writing a global file is a round trip to the job store, which
+for object-store-backed job stores costs far more than the transfer of a
+small file. A ParallelFileIO reads lists of files concurrently, can
+prefetch files while the job gets on with other work, and can write files
+behind the work that produces them, all with a bounded pool of threads:
+
+    with ParallelFileIO(fileStore) as fileIO:
+        targetReads = fileIO.prefetch(targetIDs)
+        queryFile = fileStore.readGlobalFile(queryID)
+        ... # work on the query while the targets download
+        targetFiles = [read.get() for read in targetReads]
+        chunkWrites = [fileIO.writeBehind(makeChunk(i)) for i in xrange(n)]
+        chunkIDs = [write.get() for write in chunkWrites]
+
+Leaving the with block waits for any reads and writes still going, so a
+job never finishes with a write half done; the first error of any of them
+is raised. With cached set, reads go through the node cache (see
+cactus.shared.nodeCache), for inputs that many jobs on a node share.
+"""
+from multiprocessing.pool import ThreadPool
+
+from cactus.shared import nodeCache
+
+DEFAULT_THREADS = 8
+
+class ParallelFileIO(object):
+    def __init__(self, fileStore, threads=DEFAULT_THREADS, cached=False):
+        self.fileStore = fileStore
+        self.threads = threads
+        self.cached = cached
+        self.pool = None
+        self.pending = []
+
+    def _submit(self, function, *args, **kwargs):
+        if self.pool is None:
+            self.pool = ThreadPool(self.threads)
+        result = self.pool.apply_async(function, args, kwargs)
+        self.pending.append(result)
+        return result
+
+    def prefetch(self, fileIDs, **readKwargs):
+        """Start reading the files, returning a result per file whose get()
+        waits for and returns its local path. The keyword arguments are
+        passed on to readGlobalFile.
+        """
+        if self.cached and len(readKwargs) == 0:
+            return [self._submit(nodeCache.readGlobalFile, self.fileStore, fileID) for fileID in fileIDs]
+        return [self._submit(self.fileStore.readGlobalFile, fileID, **readKwargs) for fileID in fileIDs]
+
+    def readGlobalFiles(self, fileIDs, **readKwargs):
+        """Read the files concurrently, returning their local paths in order.
+        """
+        return [read.get() for read in self.prefetch(fileIDs, **readKwargs)]
+
+    def writeBehind(self, localFileName, cleanup=False):
+        """Start writing a file, returning a result whose get() waits for and
+        returns its file ID. The file mustn't be changed until then.
+        """
+        return self._submit(self.fileStore.writeGlobalFile, localFileName, cleanup=cleanup)
+
+    def writeGlobalFiles(self, localFileNames, cleanup=False):
+        """Write the files concurrently, returning their file IDs in order.
+        """
+        return [write.get() for write in [self.writeBehind(localFileName, cleanup=cleanup)
+                                          for localFileName in localFileNames]]
+
+    def wait(self):
+        """Wait for all the reads and writes started so far, raising the
+        first error of any of them.
+        """
+        pending, self.pending = self.pending, []
+        error = None
+        for result in pending:
+            try:
+                result.get()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        if exceptionType is None:
+            self.close()
+        else:
+            # Don't hide the job's own error behind one of ours
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
+
+def readGlobalFiles(fileStore, fileIDs, threads=DEFAULT_THREADS, cached=False, **readKwargs):
+    """Read the files concurrently, returning their local paths in order.
+    """
+    with ParallelFileIO(fileStore, threads, cached) as fileIO:
+        return fileIO.readGlobalFiles(fileIDs, **readKwargs)
+
+def writeGlobalFiles(fileStore, localFileNames, cleanup=False, threads=DEFAULT_THREADS):
+    """Write the files concurrently, returning their file IDs in order.
+    """
+    with ParallelFileIO(fileStore, threads) as fileIO:
+        return fileIO.writeGlobalFiles(localFileNames, cleanup=cleanup)
@@ -0,0 +1,72 @@
+import os
+import shutil
+import unittest
+
+from sonLib.bioio import getTempDirectory
+from toil.job import Job
+from toil.common import Toil
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.fileStoreIO import ParallelFileIO, readGlobalFiles, writeGlobalFiles
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tempDir)
+
+    def runJob(self, job):
+        options = Job.Runner.getDefaultOptions(os.path.join(self.tempDir, "jobStore"))
+        options.disableCaching = True
+        options.logLevel = "CRITICAL"
+        with Toil(options) as toil:
+            return toil.start(job)
+
+    @silentOnSuccess
+    def testReadAndWrite(self):
+        """Files written behind and in parallel read back intact and in order."""
+        contents = self.runJob(Job.wrapJobFn(parallelIOJob, 50))
+        self.assertEquals(contents, ["file %i\n" % i for i in xrange(50)] * 2)
+
+    @silentOnSuccess
+    def testErrors(self):
+        """The first error of a read or write is raised by wait()."""
+        self.assertTrue(self.runJob(Job.wrapJobFn(parallelIOErrorJob)))
+
+def parallelIOJob(job, n):
+    fileStore = job.fileStore
+    paths = []
+    for i in xrange(n):
+        path = fileStore.getLocalTempFile()
+        with open(path, 'w') as f:
+            f.write("file %i\n" % i)
+        paths.append(path)
+    with ParallelFileIO(fileStore, threads=4) as fileIO:
+        writes = [fileIO.writeBehind(path) for path in paths]
+        fileIDs = [write.get() for write in writes]
+        reads = fileIO.prefetch(fileIDs)
+        readPaths = [read.get() for read in reads]
+    # The module functions too
+    readPaths += readGlobalFiles(fileStore, writeGlobalFiles(fileStore, paths, threads=3), threads=3)
+    return [open(path).read() for path in readPaths]
+
+def parallelIOErrorJob(job):
+    fileStore = job.fileStore
+    fileIO = ParallelFileIO(fileStore, threads=2)
+    fileIO.writeBehind(os.path.join(fileStore.getLocalTempDir(), "missing"))
+    try:
+        fileIO.wait()
+    except Exception:
+        raised = True
+    else:
+        raised = False
+    # The pool is still usable after an error, and closing it waits
+    goodPath = fileStore.getLocalTempFile()
+    write = fileIO.writeBehind(goodPath)
+    fileIO.close()
+    return raised and write.ready() and write.successful()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Per-call performance records and a report summarising them.
+
+When the CACTUS_METRICS_FILE environment variable is set (cactus sets it
+from --metricsFile), every cactus_call appends a JSON record to that file
+giving the tool run, the job and phase it was run from, the size of its
+inputs, its features, its resource usage, exit status and how many times
+the job had been retried. The file must be on a filesystem shared by all
+the workers. Records are appended with a single write each, so workers
+can share the file.
+
+The database servers add "dbStatus" records, sampled from the server's
+status and report at a fixed interval (see cactus.pipeline.ktserverControl).
+
+Running this module as a script (or cactus_metrics_report) aggregates
+records by phase and tool into percentile tables, or with --database
+summarises the database samples by phase.
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+from collections import defaultdict
+from argparse import ArgumentParser
+
+METRICS_FILE_ENV = "CACTUS_METRICS_FILE"
+
+# The job running in this process, as set by RoundedJob
+_jobContext = {}
+
+def setJobContext(**context):
+    """Set the fields, such as jobClass, phase and retries, describing the
+    job that later records are attributed to.
+    """
+    _jobContext.clear()
+    _jobContext.update(context)
+
+def getJobContext():
+    return dict(_jobContext)
+
+def metricsEnabled():
+    return os.environ.get(METRICS_FILE_ENV) is not None
+
+def inputBytes(paths):
+    """The total size of those of the given paths that are files.
+    """
+    total = 0
+    for path in paths:
+        if isinstance(path, basestring) and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+def writeRecord(record, metricsPath=None):
+    """Append a record to the metrics file, filling in the job context.
+    """
+    if metricsPath is None:
+        metricsPath = os.environ[METRICS_FILE_ENV]
+    fullRecord = { "time": time.time(), "host": socket.gethostname(), "pid": os.getpid() }
+    fullRecord.update(_jobContext)
+    fullRecord.update(record)
+    line = json.dumps(fullRecord, sort_keys=True) + "\n"
+    # A single write to a file opened for appending isn't interleaved with
+    # those of other processes
+    fd = os.open(metricsPath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def directorySize(path):
+    """The total size of the files under a directory.
+    """
+    total = 0
+    for dirPath, dirNames, fileNames in os.walk(path):
+        for fileName in fileNames:
+            try:
+                total += os.path.getsize(os.path.join(dirPath, fileName))
+            except OSError:
+                # Removed while we were looking
+                continue
+    return total
+
+def readRecords(metricsPaths):
+    """Yields the records of one or more metrics files, skipping any
+    truncated lines.
+    """
+    for metricsPath in metricsPaths:
+        with open(metricsPath) as metricsFile:
+            for line in metricsFile:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def percentile(sortedValues, fraction):
+    """The nearest-rank percentile of a sorted list.
+    """
+    if len(sortedValues) == 0:
+        return None
+    index = max(0, min(len(sortedValues) - 1, int(math.ceil(fraction * len(sortedValues))) - 1))
+    return sortedValues[index]
+
+def summarise(records, groupBy=("phase", "tool"), fractions=(0.5, 0.9, 0.99)):
+    """Aggregate records into a list of (group, summary) pairs, most
+    expensive (by total wall time) first. Each summary holds the count,
+    number of failures, total wall and CPU time and the given percentiles
+    of wall time and peak memory. Only the records of calls are counted,
+    not the typed records of jobs and database servers.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        if record.get("type") is not None:
+            continue
+        groups[tuple(record.get(field) for field in groupBy)].append(record)
+    summaries = []
+    for group, groupRecords in groups.iteritems():
+        wallTimes = sorted(r["wallTime"] for r in groupRecords if r.get("wallTime") is not None)
+        memories = sorted(r["maxMemory"] for r in groupRecords if r.get("maxMemory") is not None)
+        summary = { "count": len(groupRecords),
+                    "failed": sum(1 for r in groupRecords if r.get("exitStatus") != 0),
+                    "wallTime": sum(wallTimes),
+                    "cpuTime": sum((r.get("userTime") or 0) + (r.get("systemTime") or 0) for r in groupRecords),
+                    "inputBytes": sum(r.get("inputBytes") or 0 for r in groupRecords) }
+        for fraction in fractions:
+            summary["wallTime%g" % (100 * fraction)] = percentile(wallTimes, fraction)
+            summary["maxMemory%g" % (100 * fraction)] = percentile(memories, fraction)
+        summary["wallTimeMax"] = wallTimes[-1] if wallTimes else None
+        summary["maxMemoryMax"] = memories[-1] if memories else None
+        summaries.append((group, summary))
+    summaries.sort(key=lambda groupSummary: -groupSummary[1]["wallTime"])
+    return summaries
+
+def _formatValue(value, unit):
+    if value is None:
+        return "-"
+    if unit == "bytes":
+        for suffix in ("B", "K", "M", "G", "T"):
+            if abs(value) < 1024 or suffix == "T":
+                return "%.1f%s" % (value, suffix)
+            value /= 1024.0
+    return "%.2f" % value if isinstance(value, float) else str(value)
+
+def formatReport(summaries, groupBy=("phase", "tool"), fractions=(0.5, 0.9, 0.99)):
+    """Format summaries as a tab-separated table.
+    """
+    columns = [("count", None), ("failed", None), ("wallTime", "s"), ("cpuTime", "s")]
+    columns += [("wallTime%g" % (100 * f), "s") for f in fractions] + [("wallTimeMax", "s")]
+    columns += [("maxMemory%g" % (100 * f), "bytes") for f in fractions] + [("maxMemoryMax", "bytes")]
+    columns += [("inputBytes", "bytes")]
+    lines = ["\t".join(list(groupBy) + [name for name, unit in columns])]
+    for group, summary in summaries:
+        lines.append("\t".join([str(field) for field in group] +
+                               [_formatValue(summary[name], unit) for name, unit in columns]))
+    return "\n".join(lines)
+
+DB_RATES = ("getRate", "setRate", "removeRate", "miscRate")
+
+def summariseDatabase(records, fractions=(0.5, 0.99)):
+    """Aggregate the dbStatus records of the database servers by phase and
+    database role into a list of (group, summary) pairs, in the order the
+    phases started. Each summary holds the number of samples, the time
+    spanned, the peak record count, size, memory and connections, the mean
+    and peak rate of each type of operation and percentiles of the latency
+    of the status request.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        if record.get("type") == "dbStatus":
+            groups[(record.get("phase"), record.get("dbRole"))].append(record)
+    summaries = []
+    for group, groupRecords in groups.iteritems():
+        groupRecords.sort(key=lambda r: r.get("time"))
+        def peak(field):
+            values = [r[field] for r in groupRecords if r.get(field) is not None]
+            return max(values) if values else None
+        summary = { "samples": len(groupRecords),
+                    "start": groupRecords[0].get("time"),
+                    "duration": (groupRecords[-1].get("time") or 0) - (groupRecords[0].get("time") or 0),
+                    "records": peak("records"), "size": peak("size"),
+                    "memory": peak("memory"), "connections": peak("connections") }
+        for rate in DB_RATES:
+            rates = [r[rate] for r in groupRecords if r.get(rate) is not None]
+            summary[rate] = sum(rates) / len(rates) if rates else None
+            summary[rate + "Max"] = max(rates) if rates else None
+        latencies = sorted(r["latency"] for r in groupRecords if r.get("latency") is not None)
+        for fraction in fractions:
+            summary["latency%g" % (100 * fraction)] = percentile(latencies, fraction)
+        summaries.append((group, summary))
+    summaries.sort(key=lambda groupSummary: groupSummary[1]["start"])
+    return summaries
+
+def formatDatabaseReport(summaries, fractions=(0.5, 0.99)):
+    """Format database summaries as a tab-separated table.
+    """
+    columns = [("samples", None), ("duration", "s"), ("records", None), ("size", "bytes"),
+               ("memory", "bytes"), ("connections", None)]
+    for rate in DB_RATES:
+        columns += [(rate, "/s"), (rate + "Max", "/s")]
+    columns += [("latency%g" % (100 * f), "s") for f in fractions]
+    lines = ["\t".join(["phase", "dbRole"] + [name for name, unit in columns])]
+    for group, summary in summaries:
+        lines.append("\t".join([str(field) for field in group] +
+                               [_formatValue(summary[name], unit) for name, unit in columns]))
+    return "\n".join(lines)
+
+def main(args=None):
+    parser = ArgumentParser(description="Summarise cactus per-call metrics files by phase and tool")
+    parser.add_argument("metricsFiles", nargs="+")
+    parser.add_argument("--groupBy", default="phase,tool",
+                        help="Comma-separated record fields to group by, from phase, "
+                        "tool, jobClass, jobName and host [default: %(default)s]")
+    parser.add_argument("--percentiles", default="50,90,99",
+                        help="Comma-separated percentiles to report [default: %(default)s]")
+    parser.add_argument("--json", action="store_true", help="Print the summaries as JSON")
+    parser.add_argument("--database", action="store_true",
+                        help="Summarise the samples of the database servers by phase instead")
+    opts = parser.parse_args(args)
+    fractions = tuple(float(p) / 100 for p in opts.percentiles.split(","))
+    if opts.database:
+        summaries = summariseDatabase(readRecords(opts.metricsFiles), fractions)
+        if opts.json:
+            json.dump([dict(phase=group[0], dbRole=group[1], **summary) for group, summary in summaries],
+                      sys.stdout, indent=2)
+            print
+        else:
+            print formatDatabaseReport(summaries, fractions)
+        return
+    groupBy = tuple(opts.groupBy.split(","))
+    summaries = summarise(readRecords(opts.metricsFiles), groupBy, fractions)
+    if opts.json:
+        json.dump([dict(zip(groupBy, group), **summary) for group, summary in summaries], sys.stdout, indent=2)
+        print
+    else:
+        print formatReport(summaries, groupBy, fractions)
+
+if __name__ == '__main__':
+    main()
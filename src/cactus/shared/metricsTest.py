@@ -0,0 +1,146 @@
+import unittest
+import os
+import sys
+import json
+from StringIO import StringIO
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.common import cactus_call
+from cactus.shared.metrics import percentile, writeRecord, readRecords, summarise, \
+                                  formatReport, setJobContext, summariseDatabase, \
+                                  formatDatabaseReport, main, METRICS_FILE_ENV
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.metricsPath = getTempFile()
+        self.oldEnv = dict(os.environ)
+        setJobContext()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+        setJobContext()
+        if os.path.exists(self.metricsPath):
+            os.remove(self.metricsPath)
+
+    @silentOnSuccess
+    def testPercentile(self):
+        values = range(1, 101)
+        self.assertEquals(percentile(values, 0.5), 50)
+        self.assertEquals(percentile(values, 0.9), 90)
+        self.assertEquals(percentile(values, 1.0), 100)
+        self.assertEquals(percentile([7], 0.99), 7)
+        self.assertEquals(percentile([], 0.5), None)
+
+    @silentOnSuccess
+    def testSummarise(self):
+        setJobContext(jobClass="CactusCafWrapper", phase="caf", retries=0)
+        for i in xrange(10):
+            writeRecord({ "tool": "cactus_caf", "wallTime": float(i), "maxMemory": 1000 * i,
+                          "exitStatus": 0 }, self.metricsPath)
+        setJobContext(jobClass="CactusBarWrapper", phase="bar", retries=1)
+        writeRecord({ "tool": "cactus_bar", "wallTime": 100.0, "maxMemory": None,
+                      "exitStatus": 1 }, self.metricsPath)
+        # Truncated lines are skipped
+        open(self.metricsPath, 'a').write('{"tool": "cactus_b')
+        records = list(readRecords([self.metricsPath]))
+        self.assertEquals(len(records), 11)
+        self.assertEquals(records[-1]["jobClass"], "CactusBarWrapper")
+        self.assertEquals(records[-1]["retries"], 1)
+        summaries = summarise(records)
+        self.assertEquals([group for group, summary in summaries], [("bar", "cactus_bar"), ("caf", "cactus_caf")])
+        bar, caf = [summary for group, summary in summaries]
+        self.assertEquals(bar["failed"], 1)
+        self.assertEquals(bar["maxMemory50"], None)
+        self.assertEquals(caf["count"], 10)
+        self.assertEquals(caf["wallTime"], 45.0)
+        self.assertEquals(caf["wallTime50"], 4.0)
+        self.assertEquals(caf["maxMemory90"], 8000)
+        self.assertEquals(caf["maxMemoryMax"], 9000)
+        report = formatReport(summaries).split("\n")
+        self.assertEquals(len(report), 3)
+        self.assertTrue(report[2].startswith("caf\tcactus_caf\t10\t0\t45.00"))
+
+    @silentOnSuccess
+    def testSummariseSkipsTypedRecords(self):
+        setJobContext(jobClass="CactusBarWrapper", phase="bar", retries=0)
+        writeRecord({ "tool": "cactus_bar", "wallTime": 1.0, "exitStatus": 0 }, self.metricsPath)
+        writeRecord({ "type": "job", "failed": False, "wallTime": 2.0, "maxMemory": 1000 }, self.metricsPath)
+        writeRecord({ "type": "dbStatus", "time": 0, "records": 10 }, self.metricsPath)
+        writeRecord({ "type": "outOfMemory", "requestedMemory": 100, "escalatedMemory": 200 }, self.metricsPath)
+        summaries = summarise(readRecords([self.metricsPath]))
+        self.assertEquals([group for group, summary in summaries], [("bar", "cactus_bar")])
+        self.assertEquals((summaries[0][1]["count"], summaries[0][1]["failed"]), (1, 0))
+
+    @silentOnSuccess
+    def testSummariseDatabase(self):
+        for phase, start in (("setup", 0), ("bar", 100)):
+            setJobContext(jobClass="KtServerService", phase=phase, dbRole="primary")
+            for i in xrange(5):
+                writeRecord({ "type": "dbStatus", "time": start + 10 * i, "records": 100 * i,
+                              "size": 1000 * i, "latency": 0.001 * (i + 1),
+                              "getRate": float(i) if i > 0 else None }, self.metricsPath)
+        # Other records are ignored
+        writeRecord({ "tool": "cactus_caf", "wallTime": 1.0 }, self.metricsPath)
+        summaries = summariseDatabase(readRecords([self.metricsPath]))
+        self.assertEquals([group for group, summary in summaries], [("setup", "primary"), ("bar", "primary")])
+        summary = summaries[0][1]
+        self.assertEquals(summary["samples"], 5)
+        self.assertEquals(summary["duration"], 40)
+        self.assertEquals(summary["records"], 400)
+        self.assertEquals(summary["size"], 4000)
+        self.assertEquals(summary["getRate"], 2.5)
+        self.assertEquals(summary["getRateMax"], 4.0)
+        self.assertEquals(summary["setRate"], None)
+        self.assertEquals(summary["latency99"], 0.005)
+        report = formatDatabaseReport(summaries).split("\n")
+        self.assertEquals(len(report), 3)
+        self.assertTrue(report[1].startswith("setup\tprimary\t5\t"))
+
+        # The report script passes on the percentiles asked for
+        def runReport(args):
+            oldStdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                main(["--database", "--percentiles", "20,80"] + args + [self.metricsPath])
+                return sys.stdout.getvalue()
+            finally:
+                sys.stdout = oldStdout
+        self.assertEquals(runReport([]).split("\n")[0].split("\t")[-2:], ["latency20", "latency80"])
+        summary = json.loads(runReport(["--json"]))[0]
+        self.assertEquals((summary["latency20"], summary["latency80"]), (0.001, 0.004))
+        self.assertFalse("latency99" in summary)
+
+    @silentOnSuccess
+    def testCactusCallRecords(self):
+        os.environ[METRICS_FILE_ENV] = self.metricsPath
+        os.environ["CACTUS_BINARIES_MODE"] = "local"
+        inputPath = getTempFile()
+        open(inputPath, 'w').write("x" * 1000)
+        setJobContext(jobClass="TestJob", phase="test", retries=2)
+        cactus_call(parameters=["cat", inputPath], check_output=True, features={ "size": 1000 })
+        self.assertEquals(cactus_call(parameters=[sys.executable, "-c", "import sys; sys.exit(3)"],
+                                      check_result=True), 3)
+        os.remove(inputPath)
+        records = list(readRecords([self.metricsPath]))
+        self.assertEquals(len(records), 2)
+        self.assertEquals(records[0]["tool"], "cat")
+        self.assertEquals(records[0]["inputBytes"], 1000)
+        self.assertEquals(records[0]["features"], { "size": 1000 })
+        self.assertEquals(records[0]["exitStatus"], 0)
+        self.assertEquals((records[0]["jobClass"], records[0]["phase"], records[0]["retries"]), ("TestJob", "test", 2))
+        self.assertTrue(records[0]["maxMemory"] > 0)
+        self.assertEquals(records[1]["exitStatus"], 3)
+
+        # Pipelines record each stage
+        cactus_call(parameters=[["echo", "x"], ["cat"]])
+        record = list(readRecords([self.metricsPath]))[-1]
+        self.assertEquals(record["tool"], "echo|cat")
+        self.assertEquals([stage["stage"] for stage in record["stages"]], ["echo", "cat"])
+        self.assertEquals([stage["exitStatus"] for stage in record["stages"]], [0, 0])
+        self.assertTrue(all(stage["maxMemory"] > 0 for stage in record["stages"]))
+
+if __name__ == '__main__':
+    unittest.main()
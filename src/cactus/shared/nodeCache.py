@@ -0,0 +1,196 @@
+#Released under the MIT license, see LICENSE.txt
+
+"""A read-only cache of job store files in a node-local directory.
+
+Toil's own caching is disabled for cactus, so without this every job on a
+node downloads its inputs afresh, even when the jobs before it on the node
+read the same genomes and chunks. When the CACTUS_NODE_CACHE_DIR
+environment variable is set (cactus sets it from --nodeCacheDir), files
+read through readGlobalFile are kept in that directory, keyed by the job
+store and file ID, and handed out as hard links into the job's temp dir.
+Files are never updated in the job store once written, so an entry never
+goes stale.
+
+The cache is shared by all the workers on the node. Entries are written
+under a temporary name and renamed into place, so a reader sees a whole
+file or none. Entries are made read-only, as they share their data with
+every link handed out: a job must not change a cached input in place. Once
+the entries total more than CACTUS_NODE_CACHE_SIZE bytes the least recently
+used ones are removed, under a lock so that only one worker evicts at a
+time. Removing an entry doesn't affect the links already handed out.
+"""
+import os
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import threading
+import uuid
+
+NODE_CACHE_DIR_ENV = "CACTUS_NODE_CACHE_DIR"
+NODE_CACHE_SIZE_ENV = "CACTUS_NODE_CACHE_SIZE"
+DEFAULT_NODE_CACHE_SIZE = 50 * 1024**3
+
+# Temporary files older than this were left by a worker that died
+STALE_TEMP_AGE = 3600
+
+class NodeCache(object):
+    def __init__(self, cacheDir, budget=DEFAULT_NODE_CACHE_SIZE):
+        self.cacheDir = cacheDir
+        self.budget = budget
+        self.lockPath = os.path.join(cacheDir, ".lock")
+        try:
+            os.makedirs(cacheDir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.statsLock = threading.Lock()
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        with self.statsLock:
+            self.hits = 0
+            self.misses = 0
+            self.hitBytes = 0
+            self.missBytes = 0
+
+    def statistics(self):
+        with self.statsLock:
+            return { "hits": self.hits, "misses": self.misses,
+                     "hitBytes": self.hitBytes, "missBytes": self.missBytes }
+
+    def _count(self, hit, size):
+        with self.statsLock:
+            if hit:
+                self.hits += 1
+                self.hitBytes += size
+            else:
+                self.misses += 1
+                self.missBytes += size
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheDir, hashlib.sha1(key).hexdigest())
+
+    def get(self, key, localPath):
+        """Hand out the entry for key at localPath, returning False if there
+        is none.
+        """
+        entryPath = self.entryPath(key)
+        try:
+            try:
+                os.link(entryPath, localPath)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                # Not on the same filesystem as the temp dir
+                shutil.copyfile(entryPath, localPath)
+            # Mark it as recently used
+            os.utime(entryPath, None)
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        self._count(True, os.path.getsize(localPath))
+        return True
+
+    def put(self, key, localPath):
+        """Add a copy of the file at localPath as the entry for key, evicting
+        old entries if the cache is then over budget.
+        """
+        size = os.path.getsize(localPath)
+        self._count(False, size)
+        if size > self.budget:
+            return
+        tempPath = os.path.join(self.cacheDir, ".tmp-%s" % uuid.uuid4())
+        try:
+            # A copy, not a link, so the job can't change the entry
+            shutil.copyfile(localPath, tempPath)
+            os.chmod(tempPath, 0o444)
+            os.rename(tempPath, self.entryPath(key))
+        except:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within
+        its budget.
+        """
+        with open(self.lockPath, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                entries = []
+                total = 0
+                now = time.time()
+                for name in os.listdir(self.cacheDir):
+                    path = os.path.join(self.cacheDir, name)
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.startswith(".tmp-"):
+                        if now - info.st_mtime > STALE_TEMP_AGE:
+                            _removeQuietly(path)
+                        continue
+                    if name.startswith("."):
+                        continue
+                    entries.append((info.st_mtime, info.st_size, path))
+                    total += info.st_size
+                entries.sort()
+                for mtime, size, path in entries:
+                    if total <= self.budget:
+                        break
+                    _removeQuietly(path)
+                    total -= size
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+def _removeQuietly(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+_nodeCaches = {}
+
+def getNodeCache():
+    """The node cache configured by the environment, or None."""
+    cacheDir = os.environ.get(NODE_CACHE_DIR_ENV)
+    if cacheDir is None:
+        return None
+    budget = int(os.environ.get(NODE_CACHE_SIZE_ENV, DEFAULT_NODE_CACHE_SIZE))
+    if (cacheDir, budget) not in _nodeCaches:
+        _nodeCaches[(cacheDir, budget)] = NodeCache(cacheDir, budget)
+    return _nodeCaches[(cacheDir, budget)]
+
+def readGlobalFile(fileStore, fileID):
+    """Read a file from the job store through the node cache, if there is
+    one, returning its local path. The file must not be changed in place.
+    """
+    cache = getNodeCache()
+    if cache is None:
+        return fileStore.readGlobalFile(fileID)
+    key = "%s:%s" % (fileStore.jobStore.config.jobStore, fileID)
+    localPath = fileStore.getLocalTempFileName()
+    if cache.get(key, localPath):
+        return localPath
+    localPath = fileStore.readGlobalFile(fileID)
+    cache.put(key, localPath)
+    return localPath
+
+def logStatistics(fileStore):
+    """Log the hits and misses of the node cache since the last call to the
+    job's log, if it was used.
+    """
+    cache = getNodeCache()
+    if cache is None:
+        return None
+    stats = cache.statistics()
+    cache.resetStatistics()
+    if stats["hits"] + stats["misses"] > 0:
+        fileStore.logToMaster("Node cache: %i hits (%i bytes), %i misses (%i bytes)" %
+                              (stats["hits"], stats["hitBytes"], stats["misses"], stats["missBytes"]))
+    return stats
@@ -0,0 +1,113 @@
+import os
+import time
+import shutil
+import unittest
+from threading import Thread
+
+from sonLib.bioio import getTempDirectory
+from toil.job import Job
+from toil.common import Toil
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.nodeCache import NodeCache, NODE_CACHE_DIR_ENV, NODE_CACHE_SIZE_ENV
+from cactus.shared import nodeCache
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tempDir = getTempDirectory()
+        self.cacheDir = os.path.join(self.tempDir, "cache")
+        self.oldEnv = dict(os.environ)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+        shutil.rmtree(self.tempDir)
+
+    def makeFile(self, name, size):
+        path = os.path.join(self.tempDir, name)
+        with open(path, 'w') as f:
+            f.write(name[0] * size)
+        return path
+
+    @silentOnSuccess
+    def testGetAndPut(self):
+        cache = NodeCache(self.cacheDir, 1000)
+        out = os.path.join(self.tempDir, "out")
+        self.assertFalse(cache.get("a", out))
+        cache.put("a", self.makeFile("a", 100))
+        self.assertTrue(cache.get("a", out))
+        self.assertEquals(open(out).read(), "a" * 100)
+        # Handed out as a link to the read-only entry
+        self.assertEquals(os.stat(out).st_ino, os.stat(cache.entryPath("a")).st_ino)
+        self.assertEquals(os.stat(cache.entryPath("a")).st_mode & 0o777, 0o444)
+        self.assertEquals(cache.statistics(), { "hits": 1, "misses": 1, "hitBytes": 100, "missBytes": 100 })
+        # Files bigger than the whole cache aren't kept
+        cache.put("b", self.makeFile("b", 2000))
+        self.assertFalse(os.path.exists(cache.entryPath("b")))
+
+    @silentOnSuccess
+    def testEviction(self):
+        cache = NodeCache(self.cacheDir, 250)
+        for i, name in enumerate(["a", "b"]):
+            cache.put(name, self.makeFile(name, 100))
+            os.utime(cache.entryPath(name), (i, i))
+        # Using a makes b the least recently used
+        self.assertTrue(cache.get("a", os.path.join(self.tempDir, "out")))
+        cache.put("c", self.makeFile("c", 100))
+        self.assertTrue(os.path.exists(cache.entryPath("a")))
+        self.assertFalse(os.path.exists(cache.entryPath("b")))
+        self.assertTrue(os.path.exists(cache.entryPath("c")))
+        # Handed out files outlive their entries
+        cache.put("d", self.makeFile("d", 200))
+        self.assertFalse(os.path.exists(cache.entryPath("a")))
+        self.assertEquals(open(os.path.join(self.tempDir, "out")).read(), "a" * 100)
+        # Temp files left by dead workers are cleared
+        stale = os.path.join(self.cacheDir, ".tmp-stale")
+        open(stale, 'w').close()
+        os.utime(stale, (0, 0))
+        cache.evict()
+        self.assertFalse(os.path.exists(stale))
+
+    @silentOnSuccess
+    def testConcurrentPuts(self):
+        cache = NodeCache(self.cacheDir, 10**6)
+        paths = [self.makeFile("x%i" % i, 10000) for i in xrange(8)]
+        threads = [Thread(target=cache.put, args=("x", path)) for path in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(open(cache.entryPath("x")).read(), "x" * 10000)
+        self.assertEquals([name for name in os.listdir(self.cacheDir) if name.startswith(".tmp-")], [])
+
+    @silentOnSuccess
+    def testJobsShareCache(self):
+        os.environ[NODE_CACHE_DIR_ENV] = self.cacheDir
+        os.environ[NODE_CACHE_SIZE_ENV] = str(10**6)
+        options = Job.Runner.getDefaultOptions(os.path.join(self.tempDir, "jobStore"))
+        options.disableCaching = True
+        options.logLevel = "CRITICAL"
+        with Toil(options) as toil:
+            stats = toil.start(Job.wrapJobFn(cacheParentJob))
+        self.assertEquals(stats, [(0, 1), (1, 0), (1, 0)])
+
+def cacheParentJob(job):
+    path = job.fileStore.getLocalTempFile()
+    with open(path, 'w') as f:
+        f.write("ACGT" * 1000)
+    fileID = job.fileStore.writeGlobalFile(path)
+    first = job.addChildJobFn(cacheReadJob, fileID)
+    second = first.addFollowOnJobFn(cacheReadJob, fileID)
+    third = second.addFollowOnJobFn(cacheReadJob, fileID)
+    return [first.rv(), second.rv(), third.rv()]
+
+def cacheReadJob(job, fileID):
+    nodeCache.getNodeCache().resetStatistics()
+    path = nodeCache.readGlobalFile(job.fileStore, fileID)
+    assert open(path).read() == "ACGT" * 1000
+    stats = nodeCache.logStatistics(job.fileStore)
+    return (stats["hits"], stats["misses"])
+
+if __name__ == '__main__':
+    unittest.main()
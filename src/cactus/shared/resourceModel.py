@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Memory and disk models for jobs, fitted to the metrics of earlier runs.
+
+Each job class that sizes itself from a feature of its input (the
+memoryPoly classes of the workflow and the lastz and collation jobs of the
+blast phase) records that feature and its value in the job context, so it
+is attached to the metrics records of the job (see cactus.shared.metrics).
+Its peak memory is the largest of those of its calls and of the worker
+process itself, and its disk use is what was left in its temp dir when it
+finished, which is a lower bound. A job that ran out of memory needed more
+than it was given, so its request is taken as a lower bound on its peak.
+
+For each job class with enough samples, a line is fitted to the
+(feature, peak) points by least squares and then raised until the given
+quantile of the samples lies under it. The models are written to a JSON
+profile. Given --resourceProfile, cactus loads the profile and
+the jobs use its models in place of their static polynomials, still
+subject to their memoryCap.
+"""
+import os
+import json
+import math
+from collections import defaultdict
+from argparse import ArgumentParser
+
+from cactus.shared.metrics import readRecords
+
+PROFILE_ENV = "CACTUS_RESOURCE_PROFILE"
+PROFILE_VERSION = 1
+
+class ResourceModel(object):
+    """The fitted memory and disk polynomials (highest degree first, as for
+    memoryPoly) of a job class, in terms of one of its features. Either
+    polynomial may be None if it couldn't be fitted.
+    """
+    def __init__(self, feature, memoryPoly=None, diskPoly=None, samples=0):
+        self.feature = feature
+        self.memoryPoly = memoryPoly
+        self.diskPoly = diskPoly
+        self.samples = samples
+
+    @staticmethod
+    def evaluate(poly, x):
+        resource = 0
+        for degree, coefficient in enumerate(reversed(poly)):
+            resource += coefficient * (x**degree)
+        return int(resource)
+
+    def memory(self, features):
+        if self.memoryPoly is None or self.feature not in features:
+            return None
+        return self.evaluate(self.memoryPoly, features[self.feature])
+
+    def disk(self, features):
+        if self.diskPoly is None or self.feature not in features:
+            return None
+        return self.evaluate(self.diskPoly, features[self.feature])
+
+    def asDict(self):
+        return { "feature": self.feature, "memoryPoly": self.memoryPoly,
+                 "diskPoly": self.diskPoly, "samples": self.samples }
+
+def _quantile(values, fraction):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(math.ceil(fraction * len(values))) - 1))]
+
+def fitLine(points, quantile=0.95, minimum=0):
+    """Fit y = a*x + b to the (x, y) points by least squares, then raise b
+    so that the given quantile of the points lie on or under the line.
+    Returns [a, b], with a >= 0 and the line no lower than minimum at x=0.
+    """
+    n = float(len(points))
+    meanX = sum(x for x, y in points) / n
+    meanY = sum(y for x, y in points) / n
+    varianceX = sum((x - meanX)**2 for x, y in points)
+    if varianceX == 0:
+        slope = 0.0
+    else:
+        slope = max(0.0, sum((x - meanX) * (y - meanY) for x, y in points) / varianceX)
+    intercept = meanY - slope * meanX
+    intercept += _quantile([y - (slope * x + intercept) for x, y in points], quantile)
+    return [slope, max(float(minimum), intercept)]
+
+def jobSamples(records):
+    """Group metrics records into jobs, returning a dict of job class ->
+    list of (features, sizing feature, peak memory, disk) for the jobs that
+    recorded a sizing feature.
+    """
+    jobs = defaultdict(list)
+    for record in records:
+        if record.get("jobInstance") is not None:
+            jobs[record["jobInstance"]].append(record)
+    samples = defaultdict(list)
+    for jobRecords in jobs.itervalues():
+        first = jobRecords[0]
+        if first.get("jobFeatures") is None or first.get("sizingFeature") is None:
+            continue
+        memories = [r["maxMemory"] for r in jobRecords if r.get("maxMemory") is not None]
+        # A job that ran out of memory needed more than it was given
+        memories += [r["requestedMemory"] for r in jobRecords if r.get("type") == "outOfMemory"]
+        disks = [r["disk"] for r in jobRecords if r.get("disk") is not None]
+        samples[first["jobClass"]].append((first["jobFeatures"], first["sizingFeature"],
+                                           max(memories) if memories else None,
+                                           max(disks) if disks else None))
+    return samples
+
+def fitResourceModels(records, quantile=0.95, minSamples=5, minimumMemory=0):
+    """Fit a ResourceModel to each job class with at least minSamples
+    sampled jobs, returning a dict of job class -> model.
+    """
+    models = {}
+    for jobClass, samples in jobSamples(records).iteritems():
+        feature = samples[0][1]
+        memoryPoints = [(features[feature], memory) for features, _, memory, disk in samples
+                        if memory is not None and feature in features]
+        diskPoints = [(features[feature], disk) for features, _, memory, disk in samples
+                      if disk is not None and feature in features]
+        memoryPoly = fitLine(memoryPoints, quantile, minimumMemory) if len(memoryPoints) >= minSamples else None
+        diskPoly = fitLine(diskPoints, quantile) if len(diskPoints) >= minSamples else None
+        if memoryPoly is not None or diskPoly is not None:
+            models[jobClass] = ResourceModel(feature, memoryPoly, diskPoly, len(samples))
+    return models
+
+def writeProfile(models, profilePath, quantile):
+    with open(profilePath, 'w') as profileFile:
+        json.dump({ "version": PROFILE_VERSION, "quantile": quantile,
+                    "models": dict((jobClass, model.asDict()) for jobClass, model in models.iteritems()) },
+                  profileFile, indent=2, sort_keys=True)
+
+def parseProfile(profileString):
+    profile = json.loads(profileString)
+    if profile.get("version") != PROFILE_VERSION:
+        raise RuntimeError("Unsupported resource profile version %s" % profile.get("version"))
+    return dict((jobClass, ResourceModel(**model)) for jobClass, model in profile["models"].iteritems())
+
+def loadProfile(profilePath):
+    with open(profilePath) as profileFile:
+        return parseProfile(profileFile.read())
+
+_models = {}
+
+def getResourceModel(jobClass):
+    """The fitted model for a job class from the profile in use (which is
+    carried to the workers as JSON in the CACTUS_RESOURCE_PROFILE
+    environment variable), or None.
+    """
+    profileString = os.environ.get(PROFILE_ENV)
+    if profileString is None:
+        return None
+    if profileString not in _models:
+        _models.clear()
+        _models[profileString] = parseProfile(profileString)
+    return _models[profileString].get(jobClass)
+
+def main():
+    parser = ArgumentParser(description="Fit per-job-class memory and disk models to cactus "
+                            "metrics files, writing a profile for cactus --resourceProfile")
+    parser.add_argument("profile", help="Output profile (JSON)")
+    parser.add_argument("metricsFiles", nargs="+")
+    parser.add_argument("--quantile", type=float, default=0.95,
+                        help="Fraction of the recorded jobs that must fit within the model [default: %(default)s]")
+    parser.add_argument("--minSamples", type=int, default=5,
+                        help="Fewest jobs of a class to fit a model to [default: %(default)s]")
+    parser.add_argument("--minimumMemory", type=int, default=100*1024*1024,
+                        help="Least memory a model may give a job [default: %(default)s]")
+    opts = parser.parse_args()
+    models = fitResourceModels(readRecords(opts.metricsFiles), opts.quantile, opts.minSamples, opts.minimumMemory)
+    writeProfile(models, opts.profile, opts.quantile)
+    for jobClass in sorted(models.keys()):
+        model = models[jobClass]
+        print "%s\t%s\tsamples=%i\tmemoryPoly=%s\tdiskPoly=%s" % (jobClass, model.feature, model.samples,
+                                                                 model.memoryPoly, model.diskPoly)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.resourceModel import fitLine, fitResourceModels, writeProfile, loadProfile, \
+                                        parseProfile, getResourceModel, PROFILE_ENV
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.profilePath = getTempFile()
+        self.oldEnv = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.oldEnv)
+        if os.path.exists(self.profilePath):
+            os.remove(self.profilePath)
+
+    def jobRecords(self, jobClass, jobInstance, size, memories, disk):
+        """The records of one job: a call record per memory and the job record.
+        """
+        context = { "jobClass": jobClass, "jobInstance": jobInstance,
+                    "jobFeatures": { "totalSequenceSize": size }, "sizingFeature": "totalSequenceSize" }
+        records = [dict(context, tool="cactus_caf", maxMemory=memory) for memory in memories]
+        records.append(dict(context, type="job", maxMemory=50, disk=disk))
+        return records
+
+    @silentOnSuccess
+    def testFitLine(self):
+        points = [(x, 2 * x + 10) for x in xrange(10)]
+        slope, intercept = fitLine(points, quantile=1.0)
+        self.assertAlmostEquals(slope, 2.0)
+        self.assertAlmostEquals(intercept, 10.0)
+        # The line is raised to cover the given fraction of the points
+        points += [(5, 100)]
+        slope, intercept = fitLine(points, quantile=1.0)
+        self.assertTrue(all(slope * x + intercept >= y - 1e-9 for x, y in points))
+        # It never slopes down, and is kept above the minimum
+        self.assertEquals(fitLine([(1, 10), (2, 5)], quantile=1.0, minimum=20), [0.0, 20.0])
+        self.assertEquals(fitLine([(3, 7), (3, 9)], quantile=0.5), [0.0, 7.0])
+
+    @silentOnSuccess
+    def testFitResourceModels(self):
+        records = []
+        for i in xrange(6):
+            records += self.jobRecords("CactusCafWrapper", "caf%i" % i, 1000 * i, [10 * i, 20 * i + 100], 3 * i)
+        # Too few samples to fit
+        records += self.jobRecords("CactusBarWrapper", "bar0", 1000, [100], 10)
+        # No sizing feature
+        records.append({ "jobClass": "CactusSetupPhase", "jobInstance": "setup", "maxMemory": 100 })
+        models = fitResourceModels(records, quantile=1.0, minSamples=5)
+        self.assertEquals(models.keys(), ["CactusCafWrapper"])
+        model = models["CactusCafWrapper"]
+        self.assertEquals(model.samples, 6)
+        self.assertEquals(model.feature, "totalSequenceSize")
+        # Peak memory is the largest of those of the job's calls
+        self.assertEquals(model.memory({ "totalSequenceSize": 5000 }), 200)
+        self.assertEquals(model.disk({ "totalSequenceSize": 5000 }), 15)
+        self.assertEquals(model.memory({ "inputSize": 5000 }), None)
+
+        writeProfile(models, self.profilePath, 1.0)
+        loaded = loadProfile(self.profilePath)
+        self.assertEquals(loaded["CactusCafWrapper"].asDict(), model.asDict())
+        self.assertRaises(RuntimeError, parseProfile, '{"version": 0, "models": {}}')
+
+        self.assertEquals(getResourceModel("CactusCafWrapper"), None)
+        os.environ[PROFILE_ENV] = open(self.profilePath).read()
+        self.assertEquals(getResourceModel("CactusCafWrapper").asDict(), model.asDict())
+        self.assertEquals(getResourceModel("CactusBarWrapper"), None)
+
+    @silentOnSuccess
+    def testOutOfMemoryLowerBound(self):
+        records = []
+        for i in xrange(5):
+            records += self.jobRecords("CactusCafWrapper", "caf%i" % i, 1000, [100], 10)
+        # A job killed at 400 bytes needed at least that much
+        records += self.jobRecords("CactusCafWrapper", "caf5", 1000, [300], 10)
+        records.append(dict(records[-1], type="outOfMemory", requestedMemory=400))
+        model = fitResourceModels(records, quantile=1.0, minSamples=5)["CactusCafWrapper"]
+        self.assertEquals(model.memory({ "totalSequenceSize": 1000 }), 400)
+
+if __name__ == '__main__':
+    unittest.main()
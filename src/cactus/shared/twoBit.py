@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+#Released under the MIT license, see LICENSE.txt
+
+"""Conversion between fasta and the UCSC 2bit format.
+
+2bit files pack four bases into each byte and record runs of N and of
+soft-masked (lower case) bases separately, so they are about a quarter
+of the size of the equivalent fasta and can be read directly by lastz
+without any parsing. Any base that is not one of ACGT (in either case)
+is stored as an N.
+"""
+import re
+import struct
+import binascii
+
+TWO_BIT_SIGNATURE = 0x1A412743
+MAX_NAME_LENGTH = 255
+
+# 2bit codes: T=0, C=1, A=2, G=3. N's are stored as T's.
+_packTable = ['0'] * 256
+for _base, _code in zip("TCAG", "0123"):
+    _packTable[ord(_base)] = _code
+    _packTable[ord(_base.lower())] = _code
+_packTable = "".join(_packTable)
+
+_unpackTable = ["".join("TCAG"[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in xrange(256)]
+
+_nBlockRegex = re.compile("[^ACGTacgt]+")
+_maskBlockRegex = re.compile("[a-z]+")
+
+def isTwoBitFile(path):
+    """Returns true if the file starts with the 2bit signature (in either byte order).
+    """
+    with open(path, 'rb') as fileHandle:
+        header = fileHandle.read(4)
+    return len(header) == 4 and TWO_BIT_SIGNATURE in (struct.unpack("<I", header)[0],
+                                                       struct.unpack(">I", header)[0])
+
+def _fastaRecords(fileHandle):
+    """Yields (header, sequence) tuples from a fasta file handle.
+    """
+    header = None
+    sequence = []
+    for line in fileHandle:
+        line = line.rstrip("\r\n")
+        if line.startswith(">"):
+            if header is not None:
+                yield header, "".join(sequence)
+            header = line[1:]
+            sequence = []
+        elif header is not None:
+            sequence.append(line.strip())
+    if header is not None:
+        yield header, "".join(sequence)
+
+def _blocks(regex, sequence):
+    starts = []
+    sizes = []
+    for match in regex.finditer(sequence):
+        starts.append(match.start())
+        sizes.append(match.end() - match.start())
+    return starts, sizes
+
+def _packDna(sequence):
+    """Packs a sequence four bases per byte, padding the last byte with T's.
+    """
+    if len(sequence) == 0:
+        return ""
+    digits = sequence.translate(_packTable)
+    digits += "0" * (-len(digits) % 4)
+    # Base 4 and base 16 are both powers of two, so these conversions are linear.
+    hexDigits = "%x" % int(digits, 4)
+    return binascii.unhexlify(hexDigits.zfill(len(digits) / 2))
+
+def _unpackDna(packed, length):
+    return "".join([_unpackTable[ord(byte)] for byte in packed])[:length]
+
+def _encodeRecord(sequence):
+    nStarts, nSizes = _blocks(_nBlockRegex, sequence)
+    maskStarts, maskSizes = _blocks(_maskBlockRegex, sequence)
+    fields = [struct.pack("<II", len(sequence), len(nStarts))]
+    fields.append(struct.pack("<%iI" % len(nStarts), *nStarts))
+    fields.append(struct.pack("<%iI" % len(nSizes), *nSizes))
+    fields.append(struct.pack("<I", len(maskStarts)))
+    fields.append(struct.pack("<%iI" % len(maskStarts), *maskStarts))
+    fields.append(struct.pack("<%iI" % len(maskSizes), *maskSizes))
+    fields.append(struct.pack("<I", 0))
+    fields.append(_packDna(sequence))
+    return "".join(fields)
+
+def fastaToTwoBit(fastaPaths, twoBitPath):
+    """Writes the sequences of one or more fasta files to a single 2bit file.
+
+    The full header line is kept as the sequence name, so headers must be
+    unique and no longer than 255 characters.
+    """
+    if isinstance(fastaPaths, basestring):
+        fastaPaths = [fastaPaths]
+    names = []
+    records = []
+    for fastaPath in fastaPaths:
+        with open(fastaPath) as fastaFile:
+            for header, sequence in _fastaRecords(fastaFile):
+                if len(header) > MAX_NAME_LENGTH:
+                    raise RuntimeError("Fasta header %s is too long to be stored in 2bit format" % header)
+                names.append(header)
+                records.append(_encodeRecord(sequence))
+    writeTwoBitRecords(twoBitPath, names, records)
+
+def writeTwoBitRecords(twoBitPath, names, records):
+    """Writes already encoded 2bit records under the given names.
+    """
+    indexSize = sum(5 + len(name) for name in names)
+    offset = 16 + indexSize
+    with open(twoBitPath, 'wb') as twoBitFile:
+        twoBitFile.write(struct.pack("<IIII", TWO_BIT_SIGNATURE, 0, len(names), 0))
+        for name, record in zip(names, records):
+            if offset > 0xFFFFFFFF:
+                raise RuntimeError("Sequences are too large to be stored in a 2bit file")
+            twoBitFile.write(struct.pack("<B", len(name)) + name + struct.pack("<I", offset))
+            offset += len(record)
+        for record in records:
+            twoBitFile.write(record)
+
+def _readIndex(data):
+    signature = struct.unpack("<I", data[:4])[0]
+    byteOrder = "<"
+    if signature != TWO_BIT_SIGNATURE:
+        byteOrder = ">"
+        if struct.unpack(">I", data[:4])[0] != TWO_BIT_SIGNATURE:
+            raise RuntimeError("Not a 2bit file")
+    version, sequenceCount = struct.unpack(byteOrder + "II", data[4:12])
+    if version != 0:
+        raise RuntimeError("Unsupported 2bit version %i" % version)
+    index = []
+    position = 16
+    for i in xrange(sequenceCount):
+        nameLength = ord(data[position])
+        name = data[position + 1:position + 1 + nameLength]
+        offset = struct.unpack(byteOrder + "I", data[position + 1 + nameLength:position + 5 + nameLength])[0]
+        index.append((name, offset))
+        position += 5 + nameLength
+    return byteOrder, index
+
+def _recordSpan(data, byteOrder, offset):
+    """Returns the end of the record starting at offset and its decoded fields.
+    """
+    def readInts(count):
+        values = struct.unpack(byteOrder + "%iI" % count, data[position[0]:position[0] + 4*count])
+        position[0] += 4*count
+        return values
+    position = [offset]
+    length, nBlockCount = readInts(2)
+    nStarts = readInts(nBlockCount)
+    nSizes = readInts(nBlockCount)
+    maskBlockCount = readInts(1)[0]
+    maskStarts = readInts(maskBlockCount)
+    maskSizes = readInts(maskBlockCount)
+    readInts(1)
+    packedStart = position[0]
+    packedEnd = packedStart + (length + 3) / 4
+    return packedEnd, (length, nStarts, nSizes, maskStarts, maskSizes, packedStart)
+
+def readTwoBit(twoBitPath):
+    """Yields (name, sequence) tuples from a 2bit file.
+    """
+    with open(twoBitPath, 'rb') as twoBitFile:
+        data = twoBitFile.read()
+    byteOrder, index = _readIndex(data)
+    for name, offset in index:
+        packedEnd, (length, nStarts, nSizes, maskStarts, maskSizes, packedStart) = _recordSpan(data, byteOrder, offset)
+        sequence = bytearray(_unpackDna(data[packedStart:packedEnd], length))
+        for start, size in zip(nStarts, nSizes):
+            sequence[start:start + size] = "N" * size
+        for start, size in zip(maskStarts, maskSizes):
+            sequence[start:start + size] = str(sequence[start:start + size]).lower()
+        yield name, str(sequence)
+
+def catTwoBitFiles(twoBitPaths, catPath):
+    """Merges several 2bit files into one without unpacking the sequences.
+    """
+    names = []
+    records = []
+    for twoBitPath in twoBitPaths:
+        with open(twoBitPath, 'rb') as twoBitFile:
+            data = twoBitFile.read()
+        byteOrder, index = _readIndex(data)
+        if byteOrder != "<":
+            raise RuntimeError("Can only merge little-endian 2bit files")
+        for name, offset in index:
+            names.append(name)
+            records.append(data[offset:_recordSpan(data, byteOrder, offset)[0]])
+    writeTwoBitRecords(catPath, names, records)
+
+def twoBitToFasta(twoBitPath, fastaPath, lineLength=80):
+    """Writes the sequences of a 2bit file out as fasta.
+    """
+    with open(fastaPath, 'w') as fastaFile:
+        for name, sequence in readTwoBit(twoBitPath):
+            fastaFile.write(">%s\n" % name)
+            for i in xrange(0, len(sequence), lineLength):
+                fastaFile.write(sequence[i:i + lineLength])
+                fastaFile.write("\n")
@@ -0,0 +1,76 @@
+import unittest
+import os
+from textwrap import dedent
+
+from sonLib.bioio import getTempFile
+from cactus.shared.test import silentOnSuccess
+from cactus.shared.twoBit import fastaToTwoBit, twoBitToFasta, readTwoBit, catTwoBitFiles, isTwoBitFile
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.faPath = getTempFile()
+        open(self.faPath, 'w').write(dedent('''\
+        >seq1
+        CATGCATGCATGcatgcaTGCATGNNNNNNNNNNACG
+        >seq2 with a description
+        acgtRYnnNACGTA
+        >seq3
+        '''))
+        self.tempFiles = [self.faPath]
+
+    def tearDown(self):
+        for tempFile in self.tempFiles:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    def getTempFile(self):
+        tempFile = getTempFile()
+        self.tempFiles.append(tempFile)
+        return tempFile
+
+    @silentOnSuccess
+    def testRoundTrip(self):
+        twoBitPath = self.getTempFile()
+        fastaToTwoBit(self.faPath, twoBitPath)
+        self.assertTrue(isTwoBitFile(twoBitPath))
+        self.assertFalse(isTwoBitFile(self.faPath))
+        # Ambiguity codes become N's, keeping their case
+        self.assertEquals(list(readTwoBit(twoBitPath)),
+                          [("seq1", "CATGCATGCATGcatgcaTGCATGNNNNNNNNNNACG"),
+                           ("seq2 with a description", "acgtNNnnNACGTA"),
+                           ("seq3", "")])
+        fastaPath = self.getTempFile()
+        twoBitToFasta(twoBitPath, fastaPath, lineLength=10)
+        self.assertEquals(open(fastaPath).read(), dedent('''\
+        >seq1
+        CATGCATGCA
+        TGcatgcaTG
+        CATGNNNNNN
+        NNNNACG
+        >seq2 with a description
+        acgtNNnnNA
+        CGTA
+        >seq3
+        '''))
+
+    @silentOnSuccess
+    def testCatTwoBitFiles(self):
+        twoBitPath = self.getTempFile()
+        fastaToTwoBit(self.faPath, twoBitPath)
+        otherFaPath = self.getTempFile()
+        open(otherFaPath, 'w').write(">seq4\nGATTACA\n")
+        otherTwoBitPath = self.getTempFile()
+        fastaToTwoBit(otherFaPath, otherTwoBitPath)
+        catPath = self.getTempFile()
+        catTwoBitFiles([twoBitPath, otherTwoBitPath], catPath)
+        self.assertEquals(list(readTwoBit(catPath)),
+                          list(readTwoBit(twoBitPath)) + [("seq4", "GATTACA")])
+
+    @silentOnSuccess
+    def testLongHeader(self):
+        open(self.faPath, 'w').write(">%s\nACGT\n" % ("x" * 256))
+        self.assertRaises(RuntimeError, fastaToTwoBit, self.faPath, self.getTempFile())
+
+if __name__ == '__main__':
+    unittest.main()